@@ -2,13 +2,12 @@ import argparse
 import os
 import re
 
-from src.funciones import *
-from src.PPPsolution import ParametrosPPP, pppModule
-from src.RTKsolution import ParametrosRTK, rtkModule
-from src.plot import *
-from src.ubx_parser import *
+from src.streams import strip_compression, pattern_crx
+
+# NOTE: the engines (cssrlib, scipy), the plots (matplotlib, pandas, seaborn), the receiver tools (serial, pyubx2)
+#       and the services are imported by the branches of process_input that use them, -printhelp and the
+#       argument errors don't load them (see test/test_startup.py)
 
-from cssrlib.plot import skyplot
 
 
 ## Posibles inputs para test:
@@ -31,6 +30,9 @@ def parse_arguments():
     parser.add_argument('-orb', '--orbfile', type=str, default=None, help='.SP3 file.')
     parser.add_argument('-clk', '--clkfile', type=str, default=None, help='.CLK file.')
     parser.add_argument('-bsx', '--bsxfile', type=str, default=None, help='.BIA file.')
+    parser.add_argument('-cs', '--csfile', type=str, default=None, help='SSR corrections file (RTCM3 SSR, .rtcm3 or .gz).')
+    parser.add_argument('-inx', '--ionexfile', type=str, default=None, help='IONEX file (global ionosphere maps, .INX).')
+    parser.add_argument('-tro', '--trofile', type=str, default=None, help='Troposphere SINEX file (.TRO), ZTD prior and validation for PPP.')
     parser.add_argument('-atx', '--atxfile', type=str, default='data/rinex/file_creator/I20.ATX', help='ATX file.')
 
     parser.add_argument('-folder', '--folder', type=str, default=None, help='Folder path.')
@@ -40,23 +42,56 @@ def parse_arguments():
 
     parser.add_argument('-b', '--basefile', type=str, default=None, help='Base station observation file for RTK solution.')
     parser.add_argument('-y', '--xyz_ref_base', type=float, nargs=3, default=None, help='Base station XYZ reference for RTK solution.')
+    parser.add_argument('-rovers', '--rovers', type=str, nargs='+', default=None, help='Rover observation files for multi-rover RTK (same base).')
+    parser.add_argument('-workers', '--workers', type=int, default=None, help='Number of processes for multi-rover RTK. [default: number of CPUs]')
     parser.add_argument('-g', '--armode', type=int, default=3, help='AR mode for RTK solution.')
 
     parser.add_argument('-f', '--freq', type=int, default=None, help='System frequency.')
     parser.add_argument('-e', '--ep', type=str, default=None, help='Epoch. [YYYY, MM, DD, HH, mm, ss]')
     parser.add_argument('-t', '--time', type=int, default=15, help='Time in minuts for processing GNSS data.')
     parser.add_argument('-xyz', '--xyz_ref', type=float, nargs=3, help='XYZ reference. ENU: X Y Z')
+    parser.add_argument('-kinematic', '--kinematic', action='store_true', help='Kinematic positioning mode (moving receiver).')
+    parser.add_argument('-ref', '--reftrajectory', type=str, default=None, help='Reference trajectory (RTKLIB .pos or engine log), the solution errors are evaluated against it.')
     
-    parser.add_argument('-port', '--port', type=str, default='COM10', help='Port for the GNSS receiver (to handle errors, run test/test_port.py).')
+    parser.add_argument('-port', '--port', type=str, default='COM10', help="Port for the GNSS receiver, 'auto' to find the u-blox (to handle errors, run python -m src.discover).")
     parser.add_argument('-model', '--model', type=str, default=None, help='Model of the GNSS receiver.')
 
     parser.add_argument('-getdata', '--getdata', action='store_true', help='Get data form UBLOX reciever. Must input too: -t <int> -port <str>')
+    parser.add_argument('-configure', '--configure', action='store_true', help='Configure the u-blox for -getdata: only RXM-RAWX/RXM-SFRBX at -rate, baud rate stepped up for the traffic.')
+    parser.add_argument('-rate', '--rate', type=float, default=1.0, help='Measurement rate of -configure [Hz]. [default: %(default)s]')
+    parser.add_argument('-baud', '--baud', type=int, default=115200, help='Baud rate of the receiver. [default: %(default)s]')
+    parser.add_argument('-keep', '--keep', type=str, nargs='+', default=None, help='Save only these UBX messages with -getdata (e.g. RXM-RAWX RXM-SFRBX). [default: all]')
+
+    parser.add_argument('-ntrip', '--ntrip', type=str, default=None, help="NTRIP mountpoint 'user:password@host:port/MOUNTPOINT'. Must input too: -t <int>")
+    parser.add_argument('-ntripout', '--ntripout', type=str, default=None, help='Save the RTCM3 stream of -ntrip to a file.')
 
     parser.add_argument('-plot', '--plot', action='store_true', help='Plot all the data computed by the rtk or ppp module.')
     parser.add_argument('-kml', '--kml', action='store_true', help='Plot kml map.')
+    parser.add_argument('-dashboard', '--dashboard', type=int, nargs='?', const=8760, default=None, help='Live web dashboard of the PPP/RTK run on this port. [default port: %(const)s]')
+    parser.add_argument('-sigmon', '--sigmon', type=float, nargs='?', const=5.0, default=None, help='Monitor the C/N0, lock time and cycle slips of the signals (-getdata, PPP/RTK), a summary every N seconds. [default: %(const)s]')
+    parser.add_argument('-converge', '--converge', type=float, nargs='?', const=0.05, default=None, help='Stop the static PPP once converged: formal 3D sigma under N metres (see -spread, -dwell, -convwindow, -fixonly). [default: %(const)s]')
+    parser.add_argument('-spread', '--spread', type=float, default=0.02, help='Maximum distance of the -convwindow positions to their mean for -converge [m]. [default: %(default)s]')
+    parser.add_argument('-convwindow', '--convwindow', type=float, default=300.0, help='Seconds of positions checked by -spread. [default: %(default)s]')
+    parser.add_argument('-dwell', '--dwell', type=float, default=120.0, help='Seconds the -converge criteria must hold before stopping. [default: %(default)s]')
+    parser.add_argument('-fixonly', '--fixonly', action='store_true', help='-converge only with fixed ambiguities.')
+    parser.add_argument('-console', '--console', type=float, default=1.0, help='Seconds between the console summaries of the PPP/RTK run (0: no console output). [default: %(default)s]')
 
     parser.add_argument('-nocheck', '--nocheck', action='store_false', help='No check if the model is a U-blox.')
 
+    parser.add_argument('-ckpt', '--checkpoint', type=int, default=0, help='Save the filter state every N epochs (0: disabled).')
+    parser.add_argument('-ckptfile', '--ckptfile', type=str, default=None, help='Checkpoint file (.npz). [default: data/log/<ppp|rtk>-igs.ckpt.npz]')
+    parser.add_argument('-resume', '--resume', action='store_true', help='Resume PPP/RTK processing from the last checkpoint.')
+
+    parser.add_argument('-catalog', '--catalog', type=str, default=None, help='Product catalog (SQLite), the best products for the observation span are used.')
+    parser.add_argument('-archive', '--archive', type=str, default=None, help='Product archive folder to scan into -catalog (only new/modified files).')
+    parser.add_argument('-prefetch', '--prefetch', type=str, default=None, help='Mirror folder, the missing SP3/CLK/BIA of the observation span are downloaded into it.')
+    parser.add_argument('-serve', '--serve', action='store_true', help='Run the processing service (warm workers, see -daemon and -workers).')
+    parser.add_argument('-submit', '--submit', action='store_true', help='Submit the -ppp/-rtk job to the processing service instead of running it.')
+    parser.add_argument('-daemon', '--daemon', type=str, default=None, help="Processing service URL ('http://host:port' or 'unix:///path'). [default: src.service DEFAULT_URL]")
+    parser.add_argument('-server', '--server', type=str, default=None, help='Product archive URL for -prefetch. [default: CDDIS]')
+    parser.add_argument('-user', '--user', type=str, default=None, help='User of the product archive (-prefetch). [default: ~/.netrc entry]')
+    parser.add_argument('-password', '--password', type=str, default=None, help='Password of the product archive (-prefetch).')
+
 
 
     return parser.parse_args() 
@@ -84,60 +119,75 @@ def get_files(args, folder):
     """
     Assign the names of specific file types found in the 'folder' to their corresponding attributes in 'args'.
 
+    Compressed files (.gz, .Z) and Hatanaka files (.crx, .YYd) are recognised too, they are decoded on the fly.
+
     :param args: An object (typically argparse.Namespace) that contains attributes to store file names.
     :param folder: A list of file names (strings) to be searched for specific file types.
     """
     pattern_obs = re.compile(r'.*\.\d{2}O$')  
     pattern_nav = re.compile(r'.*\.\d{2}P$') 
+    pattern_obs_long = re.compile(r'.*_[A-Z]O\.rnx$') # NOTE: RINEX 3 long names, ..._MO.rnx
+    pattern_inx = re.compile(r'.*\.\d{2}I$')  # NOTE: IONEX short names, codg2230.23I
+    pattern_tro = re.compile(r'.*(\.TRO|\.\d{2}zpd)$', re.IGNORECASE)
 
     pattern_basefile = re.compile(r'base')
 
     if args.ppp and args.folder and folder is not None:
-        for file in folder:
-            if '.obs' in file or pattern_obs.match(file):
-                args.obsfile = file
+        for file_ in folder:
+            file = strip_compression(file_) # NOTE: match the name without .gz/.Z but keep the real one
+            if '.obs' in file or pattern_obs.match(file) or pattern_obs_long.match(file) or pattern_crx.match(file):
+                args.obsfile = file_
             elif '.nav' in file or pattern_nav.match(file):
-                args.navfile = file
+                args.navfile = file_
             elif '.rnx' in file:
-                args.navfile = file
+                args.navfile = file_
             elif '.SP3' in file:
-                args.orbfile = file
+                args.orbfile = file_
             elif '.CLK' in file:
-                args.clkfile = file
+                args.clkfile = file_
             elif '.BIA' in file:
-                args.bsxfile = file
+                args.bsxfile = file_
+            elif '.INX' in file or pattern_inx.match(file):
+                args.ionexfile = file_
+            elif pattern_tro.match(file):
+                args.trofile = file_
             elif '.atx' in file:
-                args.atxfile = file
+                args.atxfile = file_
 
     if args.rtk and args.folder and folder is not None:
-        for file in folder:
-            if ('.obs' in file and not 'base' in file) or (pattern_obs.match(file) and not 'base' in file): 
-                args.obsfile = file
-            elif 'base' in file and (pattern_obs.match(file) or '.obs' in file):
-                args.basefile = file
+        for file_ in folder:
+            file = strip_compression(file_) # NOTE: match the name without .gz/.Z but keep the real one
+            is_obs = '.obs' in file or pattern_obs.match(file) or pattern_obs_long.match(file) or pattern_crx.match(file)
+            if is_obs and not 'base' in file: 
+                args.obsfile = file_
+            elif 'base' in file and is_obs:
+                args.basefile = file_
             elif '.nav' in file or pattern_nav.match(file):
-                args.navfile = file
+                args.navfile = file_
             elif '.rnx' in file:
-                args.navfile = file
+                args.navfile = file_
             elif '.SP3' in file:
-                args.orbfile = file
+                args.orbfile = file_
             elif '.CLK' in file:
-                args.clkfile = file
+                args.clkfile = file_
             elif '.BIA' in file:
-                args.bsxfile = file
+                args.bsxfile = file_
+            elif '.INX' in file or pattern_inx.match(file):
+                args.ionexfile = file_
             elif '.atx' in file:
-                args.atxfile = file
+                args.atxfile = file_
 
 def print_help():
     print( 
     """ 
     HELP MENU
     
-    Module divided into three main tools:
+    Module divided into four main tools:
 
         - Get data from UBX and parse to RINEX 3.04 [command: -getdata]
         - Compute PVT with PPP                      [command: -ppp]
         - Compute PVT with RTK                      [command: -rtk]
+        - Monitor/record a NTRIP stream (RTCM3)     [command: -ntrip]
     
     Usage examples:
     
@@ -145,6 +195,7 @@ def print_help():
         ppp: python .\Commands.py -ppp -model 'FP9' -folder 'C:/Users/ivanr/Desktop/TFG - Updated/data/rinex/COM3___115200_202432_103932'
         rtk: python .\Commands.py -rtk -folder 'D:\Programacion\TFG\TFG---Updated\data\rinex\RTK' -f 2 -t 10 
              (warning! The basefile must have 'base' in their name in order to get the file with -folder)
+        ntrip: python .\Commands.py -ntrip 'user:password@caster.example.com:2101/MOUNT00ESP0' -t 5 -ntripout base.rtcm3
     
 Occasionally, warnings such as "Missing parameters" may appear. In these cases, the program can run without problems but for optimal user experience, the input provided can be further customized.
 
@@ -213,6 +264,7 @@ def check_parameters(args):
         args.freq = 1
     else:
         if not args.freq and args.model:  # NOTE: get frequency with model
+            from src.funciones import freqModel
             args.freq = freqModel(args.model)
             print(f"Frequency set to: {args.freq}, with model: {args.model}.")
         elif args.freq: 
@@ -236,20 +288,178 @@ def construct_file_paths(folder, navfile, obsfile, orbfile, clkfile, bsxfile):
     return navfile_path, obsfile_path, orbfile_path, clkfile_path, bsxfile_path
 
 
+def catalog_products(args, obsfile, products):
+    """
+    Replace the products by the best ones of the catalog (-catalog) for the span of the observation file.
+    The products that are not in the catalog are kept (folder or command line).
+
+    :param args: An object that contains the catalog and archive paths.
+    :param obsfile: Observation file path.
+    :param products: dict type -> path (orb, clk, bsx, ionex, tro, atx).
+    :return products: dict type -> path.
+    """
+    if not args.catalog:
+        return products
+
+    from src.catalog import Catalog, obs_span
+
+    catalog = Catalog(args.catalog)
+    try:
+        if args.archive:
+            print("Catalog: {} products added/updated from {}".format(catalog.scan(args.archive), args.archive))
+        span = obs_span(obsfile)
+        if span is None:
+            print("Warning: no TIME OF FIRST OBS in {}, products not searched in the catalog".format(obsfile))
+            return products
+        for typ, path in catalog.session(*span, types=list(products)).items():
+            if path is not None:
+                products[typ] = path
+    finally:
+        catalog.close()
+    return products
+
+
+def prefetch_products(args, obsfile, products):
+    """
+    Download into the mirror (-prefetch) the orbits, clocks and biases that are missing for the span of the observation file.
+
+    :param args: An object that contains the mirror folder, the server URL and the credentials.
+    :param obsfile: Observation file path.
+    :param products: dict type -> path (None: missing).
+    :return products: dict type -> path.
+    """
+    types = [typ for typ in ('orb', 'clk', 'bsx') if typ in products and products[typ] is None]
+    if not args.prefetch or not types:
+        return products
+
+    from src.catalog import obs_span, classify
+    from src.prefetch import prefetch, HttpBackend, CDDIS
+
+    span = obs_span(obsfile)
+    if span is None:
+        print("Warning: no TIME OF FIRST OBS in {}, products not downloaded".format(obsfile))
+        return products
+    backend = HttpBackend(args.server or CDDIS, user=args.user, password=args.password)
+    paths, fetcher = prefetch([span], args.prefetch, backend, types=types)
+    print("Prefetch: {}".format(fetcher.stats))
+    # NOTE: the engines load one file per type, the first day of the session
+    for name, path in paths.items():
+        typ = classify(name)['type']
+        if path is not None and products.get(typ, 0) is None:
+            products[typ] = path
+    return products
+
+
+def job_params(args, parameters):
+    """
+    Parameters of a job for the processing service (the service names the log and checkpoint of each job).
+
+    :param args: An object that contains the checkpoint file.
+    :param parameters: ParametrosPPP or ParametrosRTK.
+    :return params: dict with the attributes of parameters.
+    """
+    excluded = ['base', 'logfile', 'live', 'sigmon'] + ([] if args.ckptfile else ['ckptfile'])
+    return {k: v for k, v in vars(parameters).items() if k not in excluded}
+
+
+def signal_monitor(args):
+    """
+    Signal monitor (-sigmon) of the capture or of a PPP/RTK run.
+
+    :param args: An object that contains the sigmon interval.
+    :return monitor: SignalMonitor, None without -sigmon.
+    """
+    if args.sigmon is None:
+        return None
+    from src.sigmon import SignalMonitor
+    return SignalMonitor(interval=args.sigmon)
+
+
+def convergence_criteria(args):
+    """
+    Convergence criteria (-converge) of a static PPP run.
+
+    :param args: An object that contains the converge, spread, convwindow, dwell and fixonly arguments.
+    :return criteria: dict of src.convergence.ConvergenceMonitor, None without -converge.
+    """
+    if args.converge is None:
+        return None
+    return {'sigma': args.converge, 'spread': args.spread, 'window': args.convwindow,
+            'dwell': args.dwell, 'fix': args.fixonly}
+
+
+def start_dashboard(args, xyz_ref=None):
+    """
+    Start the live dashboard (-dashboard) of a PPP/RTK run.
+
+    :param args: An object that contains the dashboard port.
+    :param xyz_ref: Reference position, origin of the ENU of the kinematic runs.
+    :return live: ResultRing where the engine publishes the results, None without -dashboard.
+    """
+    if args.dashboard is None:
+        return None
+
+    from src.live import ResultRing, Dashboard
+
+    live = ResultRing()
+    print("Dashboard: {}".format(Dashboard(live, port=args.dashboard, xyz_ref=xyz_ref).start()))
+    return live
+
+
 def process_input(args): 
 
     name = ''
     ret = -1
 
     if args.time and args.time > 0 and args.port and args.getdata:
-        name, args.model = rawData2ubx(args.time, PORT=args.port, UBX=args.nocheck) 
+        from src.ubx_parser import rawData2ubx, runconvbin
+
+        if args.port == 'auto':
+            from src.discover import find_ublox
+            args.port, _ = find_ublox()
+            if args.port is None:
+                raise ValueError("No u-blox receiver found in the serial ports, try python -m src.discover!")
+            print("u-blox receiver in {}".format(args.port))
+
+        baud = args.baud
+        if args.configure:
+            from src.discover import discover
+            from src.ubxconfig import configure_port
+            model = args.model or discover([args.port], args.baud)[args.port]['model']
+            baud = configure_port(args.port, model, args.rate, args.baud)
+
+        name, args.model = rawData2ubx(args.time, PORT=args.port, BAUD_RATE=baud, UBX=args.nocheck, keep=args.keep,
+                                       monitor=signal_monitor(args)) 
         runconvbin(name, args.model, True) 
         if not args.ppp and not args.rtk:
             ret = 0
             return ret 
 
 
+    if args.serve or args.submit:
+        from src.service import Service, ServiceClient, serve, DEFAULT_URL
+        args.daemon = args.daemon or DEFAULT_URL
+
+    if args.serve:
+        service = Service(args.workers, atxfile=args.atxfile)
+        print("Service: {} workers ready, listening on {}".format(len(service.warm()), args.daemon))
+        serve(service, args.daemon)
+        return 0
+
+    if args.ntrip:
+        import asyncio
+        from src.ntrip import ntrip_monitor
+
+        stats = asyncio.run(ntrip_monitor(args.ntrip, duration=60 * args.time, outfile=args.ntripout))
+        print("NTRIP: {}".format(stats.summary()))
+        if not args.ppp and not args.rtk:
+            ret = 0
+            return ret
+
     if args.ppp:
+        from src.funciones import freqModel
+        from src.PPPsolution import ParametrosPPP, pppModule
+
         parameters_ppp = ParametrosPPP()
         
         # NOTE: if user selected -getdata and -ppp post processing mode
@@ -261,12 +471,16 @@ def process_input(args):
             clkfile= None,
             bsxfile= None,
             atxfile=args.atxfile, 
-            csfile=None,
+            csfile=args.csfile,
+            ionexfile=args.ionexfile,
+            trofile=args.trofile,
             xyz_ref=args.xyz_ref,
             ep=None,
-            pmode=0,
+            pmode=1 if args.kinematic else 0,
             freq=freqModel(args.model),
-            nep=int(args.time)
+            nep=int(args.time),
+            ckpt=args.checkpoint,
+            resume=args.resume
         )
         else: # NOTE: if user did not set -getdata and wants to compute existing files 
 
@@ -279,6 +493,15 @@ def process_input(args):
                 return ret
 
             navfile, obsfile, orbfile, clkfile, bsxfile = construct_file_paths(args.folder, args.navfile, args.obsfile, args.orbfile, args.clkfile, args.bsxfile)
+            ionexfile = f"{args.folder}\\{args.ionexfile}" if args.folder and args.ionexfile else args.ionexfile
+            trofile = f"{args.folder}\\{args.trofile}" if args.folder and args.trofile else args.trofile
+            atxfile = args.atxfile
+
+            products = catalog_products(args, obsfile, {'orb': orbfile, 'clk': clkfile, 'bsx': bsxfile,
+                                                        'ionex': ionexfile, 'tro': trofile, 'atx': atxfile})
+            products = prefetch_products(args, obsfile, products)
+            orbfile, clkfile, bsxfile = products['orb'], products['clk'], products['bsx']
+            ionexfile, trofile, atxfile = products['ionex'], products['tro'], products['atx']
 
             if not check_parameters(args):
                 return ret
@@ -289,24 +512,43 @@ def process_input(args):
                 orbfile=orbfile,
                 clkfile=clkfile,
                 bsxfile=bsxfile,
-                atxfile=args.atxfile, 
-                csfile=None,
+                atxfile=atxfile, 
+                csfile=args.csfile,
+                ionexfile=ionexfile,
+                trofile=trofile,
                 xyz_ref=args.xyz_ref,
                 ep=None,
-                pmode=0,
+                pmode=1 if args.kinematic else 0,
                 freq=args.freq,
-                nep=int(args.time)
+                nep=int(args.time),
+                ckpt=args.checkpoint,
+                resume=args.resume
             )
         
-        t, enu, sol_, ztd, smode, azm, elv, xyz_ref = pppModule(parameters_ppp)
+        if args.ckptfile:
+            parameters_ppp.setParametersPPP(ckptfile=args.ckptfile)
+        parameters_ppp.setParametersPPP(console=args.console, sigmon=signal_monitor(args), converge=convergence_criteria(args))
+
+        if args.submit:
+            print("Job: {}".format(ServiceClient(args.daemon).submit('ppp', job_params(args, parameters_ppp))))
+            return 0
+
+        parameters_ppp.setParametersPPP(live=start_dashboard(args, parameters_ppp.xyz_ref))
+        t, enu, sol_, ztd, smode, sky, xyz_ref = pppModule(parameters_ppp)
+        logfile = parameters_ppp.logfile
         ret = 0
 
     elif args.rtk:
+        from src.RTKsolution import ParametrosRTK, rtkModule, multiRtkModule
+
         parameters_rtk = ParametrosRTK()
 
         if args.folder and args.folder != '':
             get_files(args, get_name_file(args.folder))
 
+        if args.rovers and not args.obsfile:
+            args.obsfile = args.rovers[0]
+
         if not args.navfile or args.navfile == '' or not args.obsfile or args.obsfile == '' or not args.basefile or args.basefile == '':
             print("Missing parameters (nav, obs or base files)!")
             print_missing_parameters(args)
@@ -314,12 +556,19 @@ def process_input(args):
 
         navfile, obsfile, orbfile, clkfile, bsxfile = construct_file_paths(args.folder, args.navfile, args.obsfile, args.orbfile, args.clkfile, args.bsxfile)
         basefile = f"{args.folder}\\{args.basefile}" if args.basefile else None
+        ionexfile = f"{args.folder}\\{args.ionexfile}" if args.folder and args.ionexfile else args.ionexfile
 
         if args.atxfile != 'data/rinex/file_creator/I20.ATX':
             atxfile = f"{args.folder}\\{args.atxfile}"
         else:
             atxfile = args.atxfile
 
+        products = catalog_products(args, obsfile, {'orb': orbfile, 'clk': clkfile, 'bsx': bsxfile,
+                                                    'ionex': ionexfile, 'atx': atxfile})
+        products = prefetch_products(args, obsfile, products)
+        orbfile, clkfile, bsxfile = products['orb'], products['clk'], products['bsx']
+        ionexfile, atxfile = products['ionex'], products['atx']
+
         if not check_parameters(args):
             return ret
 
@@ -331,29 +580,70 @@ def process_input(args):
             clkfile=clkfile,
             bsxfile=bsxfile,
             atxfile=atxfile,  
-            csfile=None,
+            csfile=args.csfile,
+            ionexfile=ionexfile,
             xyz_ref=args.xyz_ref,
             xyz_ref_base=args.xyz_ref_base,
             ep=args.ep,
-            pmode=0,
+            pmode=1 if args.kinematic else 0,
             armode=args.armode,
             freq=args.freq,
-            nep=int(args.time)
+            nep=int(args.time),
+            ckpt=args.checkpoint,
+            resume=args.resume
         )
-
-        t, enu, sol_, ztd, smode, azm, elv, xyz_ref = rtkModule(parameters_rtk)
+        if args.ckptfile:
+            parameters_rtk.setParametersRTK(ckptfile=args.ckptfile)
+        parameters_rtk.setParametersRTK(console=args.console, sigmon=signal_monitor(args))
+
+        if args.submit:
+            # NOTE: one job per rover, the service workers run them in parallel
+            client = ServiceClient(args.daemon)
+            params = job_params(args, parameters_rtk)
+            for rover in ([f"{args.folder}\\{rover}" if args.folder else rover for rover in args.rovers] if args.rovers else [obsfile]):
+                name = os.path.splitext(os.path.basename(rover))[0]
+                print("Job {}: {}".format(name, client.submit('rtk', dict(params, obsfile=rover))))
+            return 0
+
+        if args.rovers:
+            # NOTE: multi-rover, the base is decoded once and every rover runs in its own process
+            import numpy as np
+
+            rovers = [f"{args.folder}\\{rover}" if args.folder else rover for rover in args.rovers]
+            parameters_rtk.setParametersRTK(xyz_ref=None)
+            results = multiRtkModule(parameters_rtk, rovers, workers=args.workers)
+            for rover, (t, enu, sol_, ztd, smode, sky, xyz_ref) in results.items():
+                print("{}: {} epochs, fix {:.1f}%, last ENU: {:7.3f} {:7.3f} {:7.3f}".format(
+                    rover, np.count_nonzero(~np.isnan(sol_[:, 0])), 100*np.mean(smode == 4), *enu[-1]))
+            return 0
+
+        parameters_rtk.setParametersRTK(live=start_dashboard(args, parameters_rtk.xyz_ref))
+        t, enu, sol_, ztd, smode, sky, xyz_ref = rtkModule(parameters_rtk)
+        logfile = parameters_rtk.logfile
         ret = 0
     else:
         print("No PPP or RTK selected ...")
         ret = 0
         return ret
 
+    if args.reftrajectory:
+        from src.trajectory import evaluate
+
+        ev = evaluate(logfile, args.reftrajectory)
+        print(ev.summary())
+        if len(ev.enu) == len(enu): # NOTE: one log line per epoch, the plots show the errors against the reference
+            enu = ev.enu
+
     if args.plot == True:
+        import matplotlib.pyplot as plt
+        from src.plot import plt_northEast, plt_error, plt_skyplot, cdf_horizontal_error, histogram_horizontal_error, \
+            horizontal_error_over_time, scatter_plot_reference_center
+
         plt_northEast(enu, smode)
         plt_error(t, enu, 1)
         # plt.show()
         plt.show()
-        _ = skyplot(azm, elv)
+        _ = plt_skyplot(sky)
         # plt_NorthEastUp(t,enu,ztd,smode)
         
         cdf_horizontal_error([enu], ['solution'])
@@ -363,6 +653,8 @@ def process_input(args):
         scatter_plot_reference_center([enu], ['solution'])
     
     if args.kml == True:
+        from src.funciones import createKML, show_kml
+
         if name or (args.getdata and args.ppp): 
             createKML(sol_, name) 
         else:
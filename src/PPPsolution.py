@@ -5,34 +5,37 @@ Corrections: https://cddis.nasa.gov/archive/gnss/products/
 """
 
 import sys
-from sys import stdout
 import os
 
-import pandas as pd
-
-from cssrlib.plot import *
-
-
 from copy import deepcopy
-import matplotlib.pyplot as plt
-import matplotlib.dates as md
 import numpy as np
 
-from cssrlib.ephemeris import findeph, eph2pos
+from cssrlib.ephemeris import eph2pos
 import cssrlib.gnss as gn
 from cssrlib.gnss import ecef2pos, Nav, Obs
-from cssrlib.gnss import time2doy, time2str, timediff, epoch2time, time2epoch, satazel, geodist
+from cssrlib.gnss import time2doy, time2str, timediff, epoch2time, time2epoch, satazel, geodist, tropmodel
 from cssrlib.gnss import rSigRnx
 from cssrlib.gnss import sys2str
-from cssrlib.peph import atxdec, searchpcv
-from cssrlib.peph import peph, biasdec
+from cssrlib.peph import searchpcv
 
 
 from cssrlib.rinex import rnxdec
 from cssrlib.pppssr import pppos
 
 from src.funciones import *
-from src.plot import *
+from src.checkpoint import save_checkpoint, load_checkpoint
+from src.streams import open_product, decode_nav, decode_obsh
+from src.sparse import SatTrack
+from src.live import ConsoleSummary
+from src.trajectory import log_time
+from src.convergence import ConvergenceMonitor
+from src.ssr import SsrReader
+from src.precise import PephPoly
+from src.biastable import BiasTable
+from src.antex import AntexTable
+from src.ephindex import EphIndex
+from src.ionex import Ionex
+from src.tropo import TroSinex, ztd_prior
 
 class ParametrosPPP():
     """
@@ -46,6 +49,8 @@ class ParametrosPPP():
         self.bsxfile = None
         self.atxfile = None
         self.csfile = None
+        self.ionexfile = None
+        self.trofile = None
 
         self.xyz_ref = None
         self.ep = None
@@ -56,6 +61,15 @@ class ParametrosPPP():
         self.armode = 3         # 0:float-ppp,1:continuous,2:instantaneous,3:fix-and-hold
         self.ephopt = 4         # ephemeris option 0: BRDC, 1: SBAS, 2: SSR-APC, 3: SSR-CG, 4: PREC (4)
 
+        self.ckpt = 0           # checkpoint interval [epochs] (0: disabled)
+        self.ckptfile = 'data\\log\\ppp-igs.ckpt.npz'
+        self.resume = False     # restart from the last checkpoint
+        self.logfile = 'data\\log\\ppp-igs.log'
+        self.console = 1.0      # seconds between the console summaries (0: no console output)
+        self.live = None        # ResultRing where the results of every epoch are published (dashboard)
+        self.sigmon = None      # SignalMonitor of the C/N0 and cycle slips of the observations
+        self.converge = None    # convergence criteria of src.convergence (dict), stop when converged (static)
+
     
     def setParametersPPP(self, **kwargs):
         """
@@ -69,11 +83,21 @@ class ParametrosPPP():
         :bsxfile:   [str] Bias-SINEX file
         :atxfile:   [str] Antenna file
         :csfile:    [str] Code-space file
+        :ionexfile: [str] IONEX file (GIM)
+        :trofile:   [str] Troposphere SINEX file (ZTD prior and validation)
         :xyz_ref:   [list of int] Reference coordinates [x, y, z]
         :ep:        [list of float] Epochs
         :pmode:     [int] Processing mode
         :freq:      [int] Frequency
         :nep:       [int] Number of epochs
+        :ckpt:      [int] Checkpoint interval in epochs (0: disabled)
+        :ckptfile:  [str] Checkpoint file
+        :resume:    [bool] Restart from the last checkpoint
+        :logfile:   [str] Log file
+        :console:   [float] Seconds between the console summaries (0: no console output)
+        :live:      [ResultRing] Publish the results of every epoch (live dashboard), None to disable
+        :sigmon:    [SignalMonitor] C/N0, lock and cycle slips of the observations (src/sigmon.py), None to disable
+        :converge:  [dict] Stop once converged, ConvergenceMonitor criteria (sigma, spread, window, dwell, fix), None to disable
         """
         for key, value in kwargs.items():
             if hasattr(self, key):
@@ -85,7 +109,7 @@ class ParametrosPPP():
         # TODO: update this function
         flag = True
         # Verifica que los archivos sean arrays o None
-        for attr in ['navfile', 'obsfile', 'orbfile', 'clkfile', 'bsxfile', 'atxfile', 'csfile']:
+        for attr in ['navfile', 'obsfile', 'orbfile', 'clkfile', 'bsxfile', 'atxfile', 'csfile', 'ionexfile', 'trofile']:
             if getattr(self, attr) is not None and not isinstance(getattr(self, attr), str):
                 flag =  False
         
@@ -110,6 +134,8 @@ class ParametrosPPP():
                 :bsxfile:   [str]
                 :atxfile:   [str]
                 :csfile:    [str]
+                :ionexfile: [str]
+                :trofile:   [str]
                 :xyz_ref:   [int array [3]]
                 :ep:        [float array [6]]
                 :pmode:     [int]
@@ -134,6 +160,8 @@ def pppModule(parameters: ParametrosPPP):
 
     atxfile = parameters.atxfile
     csfile = parameters.csfile
+    ionexfile = parameters.ionexfile
+    trofile = parameters.trofile
 
     rnx = rnxdec() # RINEX decoder
 
@@ -176,42 +204,55 @@ def pppModule(parameters: ParametrosPPP):
 
 
     # Decode RINEX NAV data
-    nav = rnx.decode_nav(navfile, nav)
+    nav = decode_nav(rnx, navfile, nav)
+    ephidx = EphIndex(nav.eph) # NOTE: broadcast ephemeris by satellite (findeph without scans)
 
     # Load precise orbits and clock offsets
     if orbfile is not None:
-        orb = peph()
-        nav = orb.parse_sp3(orbfile, nav)
+        orb = PephPoly()     # NOTE: peph with the interpolation polynomials precomputed
+        nav = orb.parse_sp3(open_product(orbfile), nav)
     else: orb = None 
 
     # Load CLK file
     if clkfile is not None:
-        nav = rnx.decode_clk(clkfile, nav)    
+        nav = rnx.decode_clk(open_product(clkfile), nav)    
+
+    # Precompute the orbit/clock polynomials (after the SP3 and CLK are loaded)
+    if orb is not None:
+        orb.fit(nav)
 
     # Load code and phase biases from Bias-SINEX
     if bsxfile is not None:
-        bsx = biasdec()
-        bsx.parse(bsxfile)
+        bsx = BiasTable.load(bsxfile) # NOTE: dense OSB table, cached next to the file
     else: bsx = None
 
     # Load ANTEX data for satellites and stations
-    if atxfile is not None:
-        atx = atxdec()
-        atx.readpcv(atxfile)
-    else:
+    # NOTE: the antennas of the session are loaded after the RINEX header (AntexTable)
+    if atxfile is None:
         raise ValueError("Missing ATX file!!!")
     #TODO: hacer una funcion que cree un archivo .atx y meta los parametros .atx, quizas meto en data permanentemente el archivo no? 
 
-    #TODO: añadir el modulo de carga de los archivos cssr, el csfile. 
+    # Load SSR corrections (RTCM3 SSR), decoded on demand in the epoch loop
     if csfile is not None:
-        pass
-    else: cs = None
+        ssr = SsrReader(csfile)
+    else: ssr = None
+    cs = None
+
+    # Load the global ionosphere maps, the delay is removed from the observations
+    if ionexfile is not None:
+        gim = Ionex(ionexfile)
+    else: gim = None
+
+    # Load the IGS troposphere solutions (ZTD)
+    if trofile is not None:
+        tro = TroSinex(trofile)
+    else: tro = None
 
 
     nav.monlevel = 1  # Logging level
 
     # Load RINEX OBS file header
-    if rnx.decode_obsh(obsfile) >= 0:
+    if decode_obsh(rnx, obsfile) >= 0:
 
         # Set user reference position
         if parameters.xyz_ref is not None:
@@ -219,7 +260,7 @@ def pppModule(parameters: ParametrosPPP):
         else:
             try:
                 if obsfile is not None:
-                    rnx.decode_obsh(obsfile)
+                    decode_obsh(rnx, obsfile)
                     xyz_ref = rnx.pos
 
                 else:
@@ -236,7 +277,7 @@ def pppModule(parameters: ParametrosPPP):
         else: 
             try:
                 if obsfile is not None:
-                    rnx.decode_obsh(obsfile)
+                    decode_obsh(rnx, obsfile)
                     ep = time2epoch(rnx.ts)
                 
             except Exception as error:
@@ -251,7 +292,7 @@ def pppModule(parameters: ParametrosPPP):
         rnx.autoSubstituteSignals()
 
         # Initialize position
-        pppPosition = pppos(nav, rnx.pos, 'data\\log\\ppp-igs.log')
+        pppPosition = pppos(nav, rnx.pos, parameters.logfile)
 
 
         # change default settings
@@ -275,12 +316,19 @@ def pppModule(parameters: ParametrosPPP):
             nav.nf = 1     # Numero de frecuencias (default == 2)
             nav.niono = 0  # NOTE: Este parametro es importante para el calculo de ionofree utilizando dual-frequency
 
-        if csfile is None or csfile == '': # Missing cssr file 
-            nav.trop_opt = 0         # 0: use trop-model, 1: estimate, 2: use cssr correction
-            nav.iono_opt = 0         # 0: use iono-model, 1: estimate, 2: use cssr correction
-        else:
-            nav.trop_opt = 2         # 0: use trop-model, 1: estimate, 2: use cssr correction
-            nav.iono_opt = 2         # 0: use iono-model, 1: estimate, 2: use cssr correction
+        if csfile is not None and orbfile is None:
+            nav.ephopt = 2           # SSR-APC (broadcast + SSR corrections)
+
+        # NOTE: only RTCM3 SSR (orbit/clock/bias) is supported, it has no atmospheric corrections,
+        #       trop/iono stay on the model (see src/ssr.py)
+        nav.trop_opt = 0             # 0: use trop-model, 1: estimate, 2: use cssr correction
+        nav.iono_opt = 0             # 0: use iono-model, 1: estimate, 2: use cssr correction
+        # NOTE: with a GIM (ionexfile) the observations are corrected before process(), iono_opt = 2 needs a CSSR grid
+
+        # Station of the TRO file at the receiver position (ZTD prior and validation)
+        trosite = tro.nearest(xyz_ref) if tro is not None else None
+        if tro is not None and trosite is None:
+            print("Warning: no station of {} near the receiver, ZTD not used".format(trofile))
 
 
         # Set PCO/PCV information 
@@ -289,11 +337,9 @@ def pppModule(parameters: ParametrosPPP):
                            .format(rnx.ant))
             rnx.ant = 'ANTENA_INVENTADA    '
 
-            nav.sat_ant = atx.pcvs
-            nav.rcv_ant = searchpcv(atx.pcvr, rnx.ant,  rnx.ts)
-        else:
-            nav.sat_ant = atx.pcvs
-            nav.rcv_ant = searchpcv(atx.pcvr, rnx.ant,  rnx.ts)
+        atx = AntexTable.load(atxfile, [rnx.ant], rnx.ts, rnx.te) # NOTE: cached next to the file
+        nav.sat_ant = atx.pcvs
+        nav.rcv_ant = searchpcv(atx.pcvr, rnx.ant,  rnx.ts)
 
 
 
@@ -322,6 +368,10 @@ def pppModule(parameters: ParametrosPPP):
     nav.fout.write("Ephemeris: {} (0: BRDC, 1: SBAS, 2: SSR-APC, 3: SSR-CG, 4: PREC)\n".format(nav.ephopt))
     nav.fout.write("Position mode: {} (0:static, 1:kinematic)\n".format(nav.pmode))
     nav.fout.write("Frequency: {}\n".format(system_freq))
+    if gim is not None:
+        nav.fout.write("Ionosphere: {} (GIM)\n".format(ionexfile))
+    if tro is not None:
+        nav.fout.write("Troposphere: {} (station {})\n".format(trofile, trosite))
     nav.fout.write("\n")
 
 
@@ -362,16 +412,31 @@ def pppModule(parameters: ParametrosPPP):
 
     sol_ = np.ones((nep, 3))*np.nan # Variable de prueba para comprobar "sol"
 
-    azm = np.ones((nep, uGNSS.MAXSAT))*np.nan # Needed to skyplot 
-    elv = np.ones((nep, uGNSS.MAXSAT))*np.nan
-    snr_plt = np.ones((nep, uGNSS.MAXSAT))*np.nan
+    sky = SatTrack(nep, ('azm', 'elv', 'snr')) # Needed to skyplot (only tracked satellites are stored)
 
     # Skip epochs until start time
     obs = rnx.decode_obs() # NOTE: Aqui se hace un update al obs.lli
     while time > obs.t and obs.t.time != 0:
         obs = rnx.decode_obs()
 
-    ionosfera_ = np.empty(nep, dtype=object)
+    ionosfera_ = SatTrack(nep, ('iono',))
+
+    # Total ZTD (model + estimated residual) to compare with the TRO file
+    tsec = np.full(nep, np.nan)
+    ztd_tot = np.full(nep, np.nan)
+
+    # Restore the filter state from the last checkpoint
+    results = {'t': t, 'enu': enu, 'sol_': sol_, 'ztd': ztd, 'smode': smode}
+    ne0 = 0
+    if parameters.resume:
+        ne_ckpt, t_ckpt, t0_ckpt = load_checkpoint(parameters.ckptfile, nav, obsfile, results)
+        if ne_ckpt >= 0: # NOTE: same file, skip the epochs already processed
+            ne0 = ne_ckpt + 1
+            t0 = t0_ckpt
+            while timediff(obs.t, t_ckpt) <= 0 and obs.t.time != 0:
+                obs = rnx.decode_obs()
+        print("Resuming from checkpoint {} at {} (epoch {})".format(parameters.ckptfile, time2str(t_ckpt), ne0))
+        nav.fout.write("Resuming from checkpoint {} at {}\n".format(parameters.ckptfile, time2str(t_ckpt)))
 
     #NOTE: La funcion "process" calcula "nav.xa" && "nav.x" y segun el modo que estemos ejecutando "smode", 
     #      escogemos una u otra como solucion. 
@@ -388,8 +453,23 @@ def pppModule(parameters: ParametrosPPP):
     #       Aqui hay un ejemoplo de como utilizar el cs --> (https://github.com/hirokawa/cssrlib-data/blob/main/samples/test_ppprtcm.py)
     # TODO: Comprobar que hacen los paramtros de na. relacionados con la iono y tropo.  
 
+    # ZTD of the IGS station as prior of the troposphere state
+    if trosite is not None and ne0 == 0:
+        ztd0 = ztd_prior(pppPosition, tro, trosite, obs.t, pos_ref)
+        nav.fout.write("ZTD prior ({}): {:.4f} m\n".format(trosite, ztd0))
+
+    console = ConsoleSummary(parameters.console) if parameters.console else None
+
+    # Early stop of the static sessions once converged
+    monitor = None
+    if parameters.converge is not None:
+        if nav.pmode == 0:
+            monitor = ConvergenceMonitor(**parameters.converge)
+        else:
+            print("Warning: convergence stop only in static mode, ignored")
+
     # Loop over number of epoch from file start
-    for ne in range(nep):
+    for ne in range(ne0, nep):
 
         # Set initial epoch
         if ne == 0:
@@ -397,7 +477,30 @@ def pppModule(parameters: ParametrosPPP):
             t0 = deepcopy(obs.t)
 
 
+        # NOTE: skyplot module (el SNR = obs.S, first signal), az/el also used for the GIM
+        sky_sat, sky_azm, sky_elv, sky_snr = [], [], [], []
+        for k, sat in enumerate(obs.sat):
+            eph = ephidx.find(obs.t, sat)
+            if eph is None:
+                continue
+            rs, dts = eph2pos(obs.t, eph)
+            r, e = geodist(rs, xyz_ref)
+            az, el = satazel(pos_ref, e)
+            sky_sat.append(sat)
+            sky_azm.append(az)
+            sky_elv.append(el)
+            sky_snr.append(obs.S[k, 0] if obs.S.shape[1] > 0 else np.nan)
+        sky.append(ne, sky_sat, azm=sky_azm, elv=sky_elv, snr=sky_snr)
+
+        # Remove the GIM ionospheric delay
+        if gim is not None:
+            gim.correct(obs, pos_ref, sky_sat, sky_azm, sky_elv)
+
         # Call PPP module with IGS products
+        # SSR corrections valid at this epoch (None until the first orbit and clock)
+        if ssr is not None:
+            cs = ssr.at(obs.t)
+
         pppPosition.process(obs, cs=cs, orb=orb, bsx=bsx, obsb=None)   
         # Save output
         t[ne] = timediff(nav.t, t0) / 86400.0
@@ -414,41 +517,37 @@ def pppModule(parameters: ParametrosPPP):
 
         indice_IT = pppPosition.IT(nav.na)
         ztd[ne] = nav.xa[indice_IT] if nav.smode == 4 else nav.x[indice_IT]
+        if trosite is not None:
+            trop_hs, trop_wet, _ = tropmodel(obs.t, pos_ref, model=nav.trpModel)
+            tsec[ne] = obs.t.time + obs.t.sec
+            ztd_tot[ne] = trop_hs + trop_wet + ztd[ne].item()
         # TODO: implementar tambien "II(self, s, na)" --> (nav.x[pppPosition.II(obs.sat,nav.na)])
 
         smode[ne] = nav.smode
 
         if freq > 1: # No disponible para Single-frequency
-            ionosfera_[ne] = nav.xa[pppPosition.II(obs.sat,nav.na)] if nav.smode == 4 else nav.x[pppPosition.II(obs.sat,nav.na)]
-    
-        
-        ## NOTE: el SNR = obs.S
-        #for sat, snr in enumerate(obs.S):
-        #    snr_plt[ne, sat-1] = snr
-
-        # NOTE: skyplot module 
-        for k, sat in enumerate(obs.sat):
-            eph = findeph(nav.eph, obs.t, sat)
-            if eph is None:
-                continue
-            rs, dts = eph2pos(obs.t, eph)
-            r, e = geodist(rs, xyz_ref)
-            azm[ne, sat-1], elv[ne, sat-1] = satazel(pos_ref, e)
-
-
-        # Log to standard output #TODO: add "sol" in the output
-        stdout.write('\r {} ENU: {:7.3f} {:7.3f} {:7.3f}, 2D {:6.3f}, mode {:1d} \n'
-                     .format(time2str(obs.t),
-                             enu[ne, 0], enu[ne, 1], enu[ne, 2],
-                             np.sqrt(enu[ne, 0]**2+enu[ne, 1]**2),
-                             smode[ne]))
+            iono = nav.xa[pppPosition.II(obs.sat,nav.na)] if nav.smode == 4 else nav.x[pppPosition.II(obs.sat,nav.na)]
+            ionosfera_.append(ne, obs.sat, iono=iono)
+        # NOTE: covariance of the solution used, nav.Pa with fixed ambiguities
+        converged = False
+        if monitor is not None:
+            P = nav.Pa if nav.smode == 4 else nav.P
+            converged = monitor.update(obs.t.time + obs.t.sec, sol, P[0:3, 0:3], nav.smode)
+
+        # Rate-limited console summary and live results, never per epoch output (slow at 10 Hz)
+        if console is not None:
+            console.update(obs.t, enu[ne], smode[ne], len(sky_sat))
+        if parameters.sigmon is not None:
+            parameters.sigmon.update_obs(obs)
+        if parameters.live is not None:
+            parameters.live.publish(obs.t.time + obs.t.sec, sol, enu[ne], smode[ne], len(sky_sat), ztd[ne].item())
     
         ################################################### All in ECEF
         nav.fout.write("{}Sol: [{:14.4f}, {:14.4f}, {:14.4f}] "
                        "ENU: [{:7.3f}, {:7.3f}, {:7.3f}] "
                        "ZTD: [{:9.7f}] "  
                        "mode [{:1d}]\n"
-                       .format(time2str(obs.t) + " ",  
+                       .format(log_time(obs.t) + " ",  
                                sol[0], sol[1], sol[2],
                                enu[ne, 0], enu[ne, 1], enu[ne, 2],    
                                ztd[ne].item(),  
@@ -456,6 +555,13 @@ def pppModule(parameters: ParametrosPPP):
 
         ###################################################
 
+        # Save the filter state periodically
+        if parameters.ckpt > 0 and (ne + 1) % parameters.ckpt == 0:
+            save_checkpoint(parameters.ckptfile, nav, ne, t0, obsfile, results)
+
+        if converged:
+            break
+
         # Get new epoch, exit after last epoch
         obs = rnx.decode_obs()
         if obs.t.time == 0:
@@ -463,11 +569,31 @@ def pppModule(parameters: ParametrosPPP):
 
     # Close RINEX observation file
     rnx.fobs.close() 
+
+    if monitor is not None:
+        print(monitor.report())
+        nav.fout.write(monitor.report() + "\n")
+
+    if parameters.sigmon is not None:
+        print(parameters.sigmon.table())
     
+    if ssr is not None:
+        ssr.close()
+
+    # Validation of the estimated ZTD with the IGS solution
+    if trosite is not None:
+        stats = tro.validate(trosite, tsec, ztd_tot)
+        txt = "ZTD - {} ({}): n {} bias {:.4f} m std {:.4f} m rms {:.4f} m".format(
+            trosite, trofile, stats['n'], stats['bias'], stats['std'], stats['rms'])
+        print(txt)
+        nav.fout.write(txt + "\n")
+
     if nav.fout is not None:
         nav.fout.close()
     
 
 
 
-    return t, enu, sol_, ztd, smode, azm, elv, xyz_ref
\ No newline at end of file
+    sky.trim()
+
+    return t, enu, sol_, ztd, smode, sky, xyz_ref
\ No newline at end of file
@@ -3,28 +3,48 @@ Module to compute RTK solution
 """
 
 import sys
-from sys import stdout
 import os
 
 
 from src.funciones import *
+from src.checkpoint import save_checkpoint, load_checkpoint
+from src.streams import open_product, decode_nav, decode_obsh
+from src.sparse import SatTrack
+from src.live import ConsoleSummary
+from src.trajectory import log_time
+from src.ssr import SsrReader
+from src.precise import PephPoly
+from src.biastable import BiasTable
+from src.antex import AntexTable
+from src.ephindex import EphIndex
+from src.ionex import Ionex, obs_azel
+from src.basebuffer import BaseBuffer, sync_base
 
 
 from copy import deepcopy
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
 
 from cssrlib.rinex import rnxdec, sync_obs
-from cssrlib.ephemeris import findeph, eph2pos
+from cssrlib.ephemeris import eph2pos
 from cssrlib.rtk import rtkpos
-from cssrlib.gnss import Nav, Obs, uGNSS
+from cssrlib.gnss import Nav, Obs
 from cssrlib.gnss import time2doy, time2str, timediff, epoch2time, time2epoch, ecef2enu, ecef2pos, sys2str, satazel, geodist
 from cssrlib.gnss import rSigRnx
-from cssrlib.peph import atxdec, searchpcv
-from cssrlib.peph import peph, biasdec
+from cssrlib.peph import searchpcv
 
-from cssrlib.plot import skyplot
+
+##base signals
+#
+SIGSB_STR = [
+    "GC1C", "GC5X",
+    "GL1C", "GL5X",
+    "GS1C", "GS5X",
+    "EC1X", "EC5X",
+    "EL1X", "EL5X",
+    "ES1X", "ES5X",
+]
 
 class ParametrosRTK():
     """
@@ -40,6 +60,7 @@ class ParametrosRTK():
         self.bsxfile = None
         self.atxfile = None
         self.csfile = None
+        self.ionexfile = None
 
         self.xyz_ref = None         # rov
         self.xyz_ref_base = None    # base
@@ -51,6 +72,16 @@ class ParametrosRTK():
         self.armode = 3         # 0:float-ppp,1:continuous,2:instantaneous,3:fix-and-hold
         self.ephopt = 4         # ephemeris option 0: BRDC, 1: SBAS, 2: SSR-APC, 3: SSR-CG, 4: PREC (4)
 
+        self.ckpt = 0           # checkpoint interval [epochs] (0: disabled)
+        self.ckptfile = 'data/log/rtk-igs.ckpt.npz'
+        self.resume = False     # restart from the last checkpoint
+
+        self.base = None        # BaseBuffer with the decoded base observations (multi-rover)
+        self.logfile = 'data/log/rtk-igs.log'
+        self.console = 1.0      # seconds between the console summaries (0: no console output)
+        self.live = None        # ResultRing where the results of every epoch are published (dashboard)
+        self.sigmon = None      # SignalMonitor of the C/N0 and cycle slips of the observations
+
     
     def setParametersRTK(self, **kwargs):
         """
@@ -65,11 +96,20 @@ class ParametrosRTK():
         :bsxfile:   [str] Bias-SINEX file
         :atxfile:   [str] Antenna file
         :csfile:    [str] Code-space file
+        :ionexfile: [str] IONEX file (GIM)
         :xyz_ref:   [list of int] Reference coordinates [x, y, z]
         :ep:        [list of float] Epochs
         :pmode:     [int] Processing mode
         :freq:      [int] Frequency
         :nep:       [int] Number of epochs
+        :ckpt:      [int] Checkpoint interval in epochs (0: disabled)
+        :ckptfile:  [str] Checkpoint file
+        :resume:    [bool] Restart from the last checkpoint
+        :base:      [BaseBuffer] Base observations already decoded (the basefile header is still read)
+        :logfile:   [str] Log file
+        :console:   [float] Seconds between the console summaries (0: no console output)
+        :live:      [ResultRing] Publish the results of every epoch (live dashboard), None to disable
+        :sigmon:    [SignalMonitor] C/N0, lock and cycle slips of the observations (src/sigmon.py), None to disable
         """
         for key, value in kwargs.items():
             if hasattr(self, key):
@@ -77,6 +117,72 @@ class ParametrosRTK():
             else:
                 print(f"Warning: {key} is not a valid parameter of ParametrosRTK")
 
+def decodeBase(basefile, ts=None):
+    """
+    Decode the base observations once, to be shared between several rovers.
+
+    :param basefile: [str] Observation base file
+    :param ts:       [gtime_t] Skip epochs before ts [default: None]
+    :return: BaseBuffer
+    """
+    base = rnxdec()
+    base.setSignals([rSigRnx(sig) for sig in SIGSB_STR])
+
+    if decode_obsh(base, basefile) < 0:
+        raise ValueError("Error reading the base file header!")
+    base.autoSubstituteSignals()
+
+    buf = BaseBuffer.decode(base, ts)
+    base.fobs.close()
+    return buf
+
+def _rtkWorker(parameters):
+    """
+    Run one rover of multiRtkModule (in a worker process).
+    """
+    try:
+        return rtkModule(parameters)
+    finally:
+        if parameters.base is not None:
+            parameters.base.close()
+
+def multiRtkModule(parameters: ParametrosRTK, obsfiles, workers=None):
+    """
+    RTK solution of several rovers against the same base station. The base observations
+    are decoded once, moved to shared memory and every rover runs in its own process.
+
+    :param parameters: [ParametrosRTK] Common parameters (obsfile is ignored)
+    :param obsfiles:   [list of str] Rover observation files
+    :param workers:    [int] Number of processes [default: number of CPUs]
+    :return: dict {obsfile: rtkModule result}
+    """
+    if parameters.basefile is None:
+        raise ValueError("Base file missing!!!")
+
+    ts = epoch2time(parameters.ep) if parameters.ep is not None else None
+    buf = decodeBase(parameters.basefile, ts).share()
+    print("Base decoded: {} epochs, {} rovers".format(len(buf), len(obsfiles)))
+
+    jobs = []
+    for obsfile in obsfiles:
+        name = os.path.splitext(os.path.basename(obsfile))[0]
+        param = deepcopy(parameters)
+        # NOTE: the result ring of the dashboard and the signal monitor are not shared with the worker processes
+        param.setParametersRTK(obsfile=obsfile, base=buf, live=None, sigmon=None,
+                               logfile=os.path.join(os.path.dirname(parameters.logfile), 'rtk-{}.log'.format(name)),
+                               ckptfile=os.path.join(os.path.dirname(parameters.ckptfile), 'rtk-{}.ckpt.npz'.format(name)))
+        jobs.append(param)
+
+    results = {}
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for obsfile, result in zip(obsfiles, executor.map(_rtkWorker, jobs)):
+                results[obsfile] = result
+    finally:
+        buf.unlink()
+
+    return results
+
 def rtkModule(parameters: ParametrosRTK):
 
     navfile = parameters.navfile
@@ -87,6 +193,7 @@ def rtkModule(parameters: ParametrosRTK):
     orbfile = parameters.orbfile
     bsxfile = parameters.bsxfile
     csfile = parameters.csfile
+    ionexfile = parameters.ionexfile
     clkfile = parameters.clkfile
 
 
@@ -110,16 +217,8 @@ def rtkModule(parameters: ParametrosRTK):
 
     ##base
     #
-    sigsb_str = [
-        "GC1C", "GC5X",
-        "GL1C", "GL5X",
-        "GS1C", "GS5X",
-        "EC1X", "EC5X",
-        "EL1X", "EL5X",
-        "ES1X", "ES5X",
-    ]
     sigsb = []
-    for sig in sigsb_str:
+    for sig in SIGSB_STR:
         sigsb.append(rSigRnx(sig))          
 
     ##rov
@@ -128,56 +227,63 @@ def rtkModule(parameters: ParametrosRTK):
     rov.setSignals(sigs)
 
     nav = Nav()
-    rov.decode_nav(navfile, nav)
+    decode_nav(rov, navfile, nav)
+    ephidx = EphIndex(nav.eph) # NOTE: broadcast ephemeris by satellite (findeph without scans)
 
     ##base
     #
     base = rnxdec()
     base.setSignals(sigsb)
 
-    base.decode_obsh(basefile)
-    rov.decode_obsh(obsfile)
+    decode_obsh(base, basefile)
+    decode_obsh(rov, obsfile)
 
     # Load precise orbits and clock offsets
     if orbfile is not None:
-        orb = peph()
-        nav = orb.parse_sp3(orbfile, nav)
+        orb = PephPoly()     # NOTE: peph with the interpolation polynomials precomputed
+        nav = orb.parse_sp3(open_product(orbfile), nav)
     else: orb = None 
 
     # Load CLK file
     if clkfile is not None:
-        nav = rov.decode_clk(clkfile, nav)
+        nav = rov.decode_clk(open_product(clkfile), nav)
     
     # Load code and phase biases from Bias-SINEX
     if bsxfile is not None:
-        bsx = biasdec()
-        bsx.parse(bsxfile)
+        bsx = BiasTable.load(bsxfile) # NOTE: dense OSB table, cached next to the file
     else: bsx = None
 
-    # Load ANTEX data for satellites and stations
-    if atxfile is not None:
-        atx = atxdec()
-        atx.readpcv(atxfile)
-    else:
+    # Precompute the orbit/clock polynomials (after the SP3 and CLK are loaded)
+    if orb is not None:
+        orb.fit(nav)
+
+    # ANTEX data for satellites and stations, loaded with the antennas of the session (PCO/PCV below)
+    if atxfile is None:
         raise ValueError("Missing ATX file!!!")
 
-    #TODO: añadir el modulo de carga de los archivos cssr, el csfile. 
+    # Load SSR corrections (RTCM3 SSR), decoded on demand in the epoch loop
     if csfile is not None:
-        pass
-    else: cs = None
+        ssr = SsrReader(csfile)
+    else: ssr = None
+    cs = None
+
+    # Load the global ionosphere maps, the delay is removed from the observations
+    if ionexfile is not None:
+        gim = Ionex(ionexfile)
+    else: gim = None
 
 
     nav.monlevel = 1
 
 
-    if rov.decode_obsh(obsfile) >= 0 or base.decode_obsh(basefile):
+    if decode_obsh(rov, obsfile) >= 0 or decode_obsh(base, basefile):
         #Meter el approx del rover
         if parameters.xyz_ref is not None:
             xyz_ref = parameters.xyz_ref 
         else:
             try:
                 if obsfile is not None:
-                    rov.decode_obsh(obsfile)
+                    decode_obsh(rov, obsfile)
                     xyz_ref = rov.pos
 
                 else:
@@ -193,7 +299,7 @@ def rtkModule(parameters: ParametrosRTK):
         else: 
             try:
                 if obsfile is not None:
-                    rov.decode_obsh(obsfile)
+                    decode_obsh(rov, obsfile)
                     ep = time2epoch(rov.ts)
                 
             except Exception as error:
@@ -207,7 +313,7 @@ def rtkModule(parameters: ParametrosRTK):
         rov.autoSubstituteSignals()
         base.autoSubstituteSignals()
 
-        rtkPosition = rtkpos(nav, rov.pos, 'data/log/rtk-igs.log')
+        rtkPosition = rtkpos(nav, rov.pos, parameters.logfile)
 
         # change default settings
         nav.elmin = np.deg2rad(5.0)  # min sat elevation (5.0)
@@ -233,12 +339,14 @@ def rtkModule(parameters: ParametrosRTK):
             nav.nf = 1     # Number of frequencies (default == 2)
             nav.niono = 0  
         
-        if csfile is None or csfile == '': # Missing cssr file 
-            nav.trop_opt = 0         # 0: use trop-model, 1: estimate, 2: use cssr correction
-            nav.iono_opt = 0         # 0: use iono-model, 1: estimate, 2: use cssr correction
-        else:
-            nav.trop_opt = 2         # 0: use trop-model, 1: estimate, 2: use cssr correction
-            nav.iono_opt = 2         # 0: use iono-model, 1: estimate, 2: use cssr correction
+        if csfile is not None and orbfile is None:
+            nav.ephopt = 2           # SSR-APC (broadcast + SSR corrections)
+
+        # NOTE: only RTCM3 SSR (orbit/clock/bias) is supported, it has no atmospheric corrections,
+        #       trop/iono stay on the model (see src/ssr.py)
+        nav.trop_opt = 0             # 0: use trop-model, 1: estimate, 2: use cssr correction
+        nav.iono_opt = 0             # 0: use iono-model, 1: estimate, 2: use cssr correction
+        # NOTE: with a GIM (ionexfile) the observations are corrected before process(), iono_opt = 2 needs a CSSR grid
 
         # Set PCO/PCV information 
         #rover
@@ -249,20 +357,17 @@ def rtkModule(parameters: ParametrosRTK):
             nav.fout.write("ERROR: missing antenna type <{}> in ANTEX file! Changing to ANTENA_INVENTADA...\n"
                         .format(rov.ant))
             rov.ant = 'ANTENA_INVENTADA    '    
-            nav.rcv_ant = searchpcv(atx.pcvr, rov.ant,  rov.ts)
-
-        else:
-            nav.rcv_ant = searchpcv(atx.pcvr, rov.ant,  rov.ts)
         #base
         #
         if base.ant is None or base.ant.strip() == "":
             nav.fout.write("ERROR: missing antenna type <{}> in ANTEX file! Changing to ANTENA_INVENTADA...\n"
                             .format(base.ant))
             base.ant = 'ANTENA_INVENTADA    '
-            nav.rcv_ant_b = searchpcv(atx.pcvr, base.ant,  base.ts)
 
-        else:
-            nav.rcv_ant_b = searchpcv(atx.pcvr, base.ant,  base.ts)
+        # NOTE: only the antennas of the session (rover, base, after the substitution), cached next to the file
+        atx = AntexTable.load(atxfile, [rov.ant, base.ant], rov.ts, rov.te)
+        nav.rcv_ant = searchpcv(atx.pcvr, rov.ant,  rov.ts)
+        nav.rcv_ant_b = searchpcv(atx.pcvr, base.ant,  base.ts)
 
 
         #base
@@ -305,6 +410,8 @@ def rtkModule(parameters: ParametrosRTK):
     nav.fout.write("Ephemeris: {} (0: BRDC, 1: SBAS, 2: SSR-APC, 3: SSR-CG, 4: PREC)\n".format(nav.ephopt))
     nav.fout.write("Position mode: {} (0:static, 1:kinematic)\n".format(nav.pmode))
     nav.fout.write("Frequency: {}\n".format(system_freq))
+    if gim is not None:
+        nav.fout.write("Ionosphere: {} (GIM)\n".format(ionexfile))
     nav.fout.write("\n")
 
 
@@ -368,28 +475,73 @@ def rtkModule(parameters: ParametrosRTK):
 
     sol_ = np.ones((nep, 3))*np.nan 
 
-    azm = np.ones((nep, uGNSS.MAXSAT))*np.nan # Needed to skyplot 
-    elv = np.ones((nep, uGNSS.MAXSAT))*np.nan
-    snr_plt = np.ones((nep, uGNSS.MAXSAT))*np.nan
+    sky = SatTrack(nep, ('azm', 'elv', 'snr')) # Needed to skyplot (only tracked satellites are stored)
 
     # Skip epochs until start time
     rov_obs = rov.decode_obs() 
     while time > rov_obs.t and rov_obs.t.time != 0:
         rov_obs = rov.decode_obs()
 
-    base_obs = base.decode_obs() 
-    while time > base_obs.t and base_obs.t.time != 0:
-        base_obs = base.decode_obs()
-
-
-
-    for ne in range(nep):
-        rov_obs, base_obs = sync_obs(rov, base)
+    # NOTE: with a shared BaseBuffer the base epochs are searched by time (sync_base)
+    if parameters.base is None:
+        base_obs = base.decode_obs() 
+        while time > base_obs.t and base_obs.t.time != 0:
+            base_obs = base.decode_obs()
+
+    # Restore the filter state from the last checkpoint
+    results = {'t': t, 'enu': enu, 'sol_': sol_, 'ztd': ztd, 'smode': smode}
+    ne0 = 0
+    if parameters.resume:
+        ne_ckpt, t_ckpt, t0_ckpt = load_checkpoint(parameters.ckptfile, nav, obsfile, results)
+        if ne_ckpt >= 0: # NOTE: same file, skip the epochs already processed
+            ne0 = ne_ckpt + 1
+            t0 = t0_ckpt
+            while timediff(rov_obs.t, t_ckpt) <= 0 and rov_obs.t.time != 0:
+                rov_obs = rov.decode_obs()
+            while parameters.base is None and timediff(base_obs.t, t_ckpt) <= 0 and base_obs.t.time != 0:
+                base_obs = base.decode_obs()
+        print("Resuming from checkpoint {} at {} (epoch {})".format(parameters.ckptfile, time2str(t_ckpt), ne0))
+        nav.fout.write("Resuming from checkpoint {} at {}\n".format(parameters.ckptfile, time2str(t_ckpt)))
+
+
+    console = ConsoleSummary(parameters.console) if parameters.console else None
+    for ne in range(ne0, nep):
+        if parameters.base is None:
+            rov_obs, base_obs = sync_obs(rov, base)
+        else:
+            rov_obs, base_obs = sync_base(rov, parameters.base)
+            if rov_obs.t.time == 0:
+                break
 
         if ne == 0:
             t0 = nav.t = rov_obs.t
         
+        # NOTE: skyplot module (SNR = rov_obs.S, first signal), az/el also used for the GIM
+        sky_sat, sky_azm, sky_elv, sky_snr = [], [], [], []
+        for k, sat in enumerate(rov_obs.sat):
+            eph = ephidx.find(rov_obs.t, sat)
+            if eph is None:
+                continue
+            rs, dts = eph2pos(rov_obs.t, eph)
+            r, e = geodist(rs, xyz_ref)
+            az, el = satazel(pos_ref, e)
+            sky_sat.append(sat)
+            sky_azm.append(az)
+            sky_elv.append(el)
+            sky_snr.append(rov_obs.S[k, 0] if rov_obs.S.shape[1] > 0 else np.nan)
+        sky.append(ne, sky_sat, azm=sky_azm, elv=sky_elv, snr=sky_snr)
+
+        # Remove the GIM ionospheric delay (rover and base)
+        if gim is not None:
+            gim.correct(rov_obs, pos_ref, sky_sat, sky_azm, sky_elv)
+            base_sat, base_azm, base_elv = obs_azel(base_obs, nav, nav.rb, ephidx)
+            gim.correct(base_obs, ecef2pos(nav.rb), base_sat, base_azm, base_elv)
+
         rtkPosition.process(rov_obs, obsb=base_obs)
+        # SSR corrections valid at this epoch (None until the first orbit and clock)
+        if ssr is not None:
+            cs = ssr.at(rov_obs.t)
+
         rtkPosition.process(obs = rov_obs, cs = cs , orb = orb, bsx = bsx, obsb=base_obs)
         t[ne] = timediff(nav.t, t0)
 
@@ -402,30 +554,20 @@ def rtkModule(parameters: ParametrosRTK):
                                                             # ECEF --> Earth-Centered, Earth-Fixed
 
         smode[ne] = nav.smode
-
-        # NOTE: skyplot module 
-        for k, sat in enumerate(rov_obs.sat):
-            eph = findeph(nav.eph, rov_obs.t, sat)
-            if eph is None:
-                continue
-            rs, dts = eph2pos(rov_obs.t, eph)
-            r, e = geodist(rs, xyz_ref)
-            azm[ne, sat-1], elv[ne, sat-1] = satazel(pos_ref, e)
-
-
-
-        stdout.write('\r {} ENU: {:7.3f} {:7.3f} {:7.3f}, 2D {:6.3f}, mode {:1d} \n'
-                .format(time2str(rov_obs.t),
-                        enu[ne, 0], enu[ne, 1], enu[ne, 2],
-                        np.sqrt(enu[ne, 0]**2+enu[ne, 1]**2),
-                        smode[ne]))
+        # Rate-limited console summary and live results, never per epoch output (slow at 10 Hz)
+        if console is not None:
+            console.update(rov_obs.t, enu[ne], smode[ne], len(sky_sat))
+        if parameters.sigmon is not None:
+            parameters.sigmon.update_obs(rov_obs)
+        if parameters.live is not None:
+            parameters.live.publish(rov_obs.t.time + rov_obs.t.sec, sol, enu[ne], smode[ne], len(sky_sat), np.nan)
         
         ################################################### All in ECEF
         nav.fout.write("{}Sol: [{:14.4f}, {:14.4f}, {:14.4f}] "
                        "ENU: [{:7.3f}, {:7.3f}, {:7.3f}] "
                        "ZTD: [{:9.7f}] "  
                        "mode [{:1d}]\n"
-                       .format(time2str(rov_obs.t) + " ",  
+                       .format(log_time(rov_obs.t) + " ",  
                                sol[0], sol[1], sol[2],
                                enu[ne, 0], enu[ne, 1], enu[ne, 2],    
                                ztd[ne].item(),  
@@ -433,6 +575,10 @@ def rtkModule(parameters: ParametrosRTK):
 
         ###################################################
 
+        # Save the filter state periodically
+        if parameters.ckpt > 0 and (ne + 1) % parameters.ckpt == 0:
+            save_checkpoint(parameters.ckptfile, nav, ne, t0, obsfile, results)
+
         rov_obs = rov.decode_obs()
         if rov_obs.t.time == 0:
             break
@@ -441,7 +587,15 @@ def rtkModule(parameters: ParametrosRTK):
     rov.fobs.close() 
     base.fobs.close() 
 
+    if parameters.sigmon is not None:
+        print(parameters.sigmon.table())
+
+    if ssr is not None:
+        ssr.close()
+
     if nav.fout is not None:
         nav.fout.close()
     
-    return t, enu, sol_, ztd, smode, azm, elv, xyz_ref
\ No newline at end of file
+    sky.trim()
+
+    return t, enu, sol_, ztd, smode, sky, xyz_ref
\ No newline at end of file
@@ -0,0 +1,330 @@
+"""
+Module to load the antenna models (PCO/PCV) of an ANTEX file for one session
+
+cssrlib atxdec.readpcv parses every antenna of the file (thousands in the IGS ANTEX) at
+every run, and searchpcv scans the whole list. AntexTable only keeps:
+    - the satellite antennas valid in the time span of the session
+    - the receiver antennas of the session (types of the RINEX headers)
+and the PCV of each frequency as a regular grid (azimuth x zenith) for vectorized lookups:
+    grid[sig][naz, nzen]        PCV [mm], one row (NOAZI) if the antenna has no DAZI
+The antennas are saved next to the ANTEX (<file>.pcv.npz) with the header of the file as
+key (ANTEX version, PCV type, comments with the release), and loaded from there while the
+requested antennas and span are in the cache.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+from cssrlib.gnss import uGNSS, uTYP, uSIG, rSigRnx, gtime_t, timediff, timeadd, id2sat, \
+    char2sys, str2time, xyz2enu
+from cssrlib.peph import pcv_t, searchpcv, substSigRx
+
+from src.streams import open_text
+
+
+CACHE_EXT = '.pcv.npz'
+CACHE_VERSION = 1
+SPAN = 86400.0      # span of the session if the end is unknown [s]
+
+_loaded = None      # (path, key) -> table read in this process, see keep_loaded
+
+
+def keep_loaded():
+    """
+    Keep the antenna tables read in memory for the next loads of this process (service workers).
+    """
+    global _loaded
+    if _loaded is None:
+        _loaded = {}
+
+
+def _sec(t):
+    return t.time + t.sec
+
+
+def _key(path):
+    """
+    Key of the ANTEX release: hash of the header lines and size of the file.
+    """
+    sha = hashlib.sha1(str(CACHE_VERSION).encode())
+    with open_text(path) as fh:
+        for line in fh:
+            sha.update(line.encode())
+            if "END OF HEADER" in line[60:]:
+                break
+    sha.update(str(os.path.getsize(path)).encode())
+    return sha.hexdigest()
+
+
+class Pcv(pcv_t):
+    """
+    pcv_t with the azimuth-dependent PCV. var[sig] is the NOAZI pattern (as in cssrlib).
+    """
+    def __init__(self):
+        super().__init__()
+        self.dazi = 0.0
+        self.grid = {}          # sig -> (naz, nzen) PCV [mm]
+
+    def interp(self, sig, az, za):
+        """
+        PCV of a frequency, bilinear in azimuth and zenith angle, vectorized.
+
+        :param sig: [rSigRnx] Phase signal of the antenna (see substSigTx/substSigRx)
+        :param az:  [array] Azimuth [deg]
+        :param za:  [array] Zenith (receiver) or nadir (satellite) angle [deg]
+        :return: PCV [mm], nan if the frequency is not in the antenna
+        """
+        az, za = np.broadcast_arrays(np.asarray(az, dtype=np.float64), np.asarray(za, dtype=np.float64))
+        grid = self.grid.get(sig)
+        if grid is None:
+            return np.full(za.shape, np.nan)
+
+        nzen = grid.shape[1]
+        fz = np.clip((za - self.zen[0]) / self.zen[2], 0.0, nzen - 1) if nzen > 1 else np.zeros(za.shape)
+        i = np.minimum(fz.astype(int), max(nzen - 2, 0))
+        wz = fz - i
+        i1 = np.minimum(i + 1, nzen - 1)
+        if grid.shape[0] == 1:
+            return (1.0 - wz) * grid[0, i] + wz * grid[0, i1]
+
+        fa = np.mod(az, 360.0) / self.dazi
+        j = np.minimum(fa.astype(int), grid.shape[0] - 2)
+        wa = fa - j
+        row0 = (1.0 - wz) * grid[j, i] + wz * grid[j, i1]
+        row1 = (1.0 - wz) * grid[j + 1, i] + wz * grid[j + 1, i1]
+        return (1.0 - wa) * row0 + wa * row1
+
+
+class AntexTable():
+    """
+    Antennas of an ANTEX file needed by a session (same lists as cssrlib atxdec, nav.sat_ant=atx.pcvs).
+
+    :param types: [list of str] Receiver antenna types (RINEX ANT # / TYPE)
+    :param ts:    [gtime_t] Start of the session
+    :param te:    [gtime_t] End of the session (ts + 1 day if None)
+    """
+    def __init__(self, types=(), ts=None, te=None):
+        self.pcvs = []
+        self.pcvr = []
+        self.types = sorted(set(t.strip() for t in types if t is not None))
+        self.ts = ts if ts is not None else gtime_t()
+        self.te = te if te is not None else timeadd(self.ts, SPAN)
+        self.cached = False     # loaded from the cache
+
+    @classmethod
+    def load(cls, path, types=(), ts=None, te=None, cache=True):
+        """
+        Load the antennas of a session, from the cache next to the file if it has them.
+
+        :param path:  [str] ANTEX file (.atx, also .gz/.Z)
+        :param types: [list of str] Receiver antenna types
+        :param ts:    [gtime_t] Start of the session
+        :param te:    [gtime_t] End of the session
+        :param cache: [bool] Use/write the cache file
+        :return: AntexTable
+        """
+        tab = cls(types, ts, te)
+        key = _key(path)
+        memo = _loaded.get((os.path.abspath(path), key)) if _loaded is not None else None
+        if memo is not None and memo.covers(tab):
+            return memo.select(tab)
+        if memo is not None:
+            tab = cls(tab.types + memo.types, min(tab.ts, memo.ts, key=_sec), max(tab.te, memo.te, key=_sec))
+
+        cachefile = str(path) + CACHE_EXT
+        if cache and os.path.isfile(cachefile):
+            try:
+                with np.load(cachefile) as npz:
+                    if str(npz['key']) == key:
+                        old = cls._restore(npz)
+                        if old.covers(tab):
+                            if _loaded is not None:
+                                _loaded[(os.path.abspath(path), key)] = old
+                            return old.select(cls(types, ts, te))
+                        # NOTE: the new antennas/span are added to the ones of the cache
+                        tab = cls(tab.types + old.types, min(tab.ts, old.ts, key=_sec),
+                                  max(tab.te, old.te, key=_sec))
+            except (OSError, KeyError, ValueError) as error:
+                print("Warning: ignoring the antenna cache {} ({})".format(cachefile, error))
+
+        tab.readpcv(path)
+        if cache:
+            try:
+                tab.save(cachefile, key)
+            except OSError as error:
+                print("Warning: antenna cache not saved {} ({})".format(cachefile, error))
+        if _loaded is not None:
+            _loaded[(os.path.abspath(path), key)] = tab
+        return tab.select(cls(types, ts, te))
+
+    def _valid(self, pcv):
+        if pcv.ts.time != 0 and timediff(pcv.ts, self.te) > 0.0:
+            return False
+        if pcv.te.time != 0 and timediff(pcv.te, self.ts) < 0.0:
+            return False
+        return True
+
+    def readpcv(self, path):
+        """
+        Read the antennas of the session (same parsing as cssrlib atxdec.readpcv).
+        """
+        types = set(self.types)
+        state = skip = False
+        sig = rSigRnx()
+        pcv = Pcv()
+        grid = []
+
+        with open_text(path) as fh:
+            for line in fh:
+                label = line[60:]   # NOTE: azimuth rows of few zenith angles can be shorter
+                if "COMMENT" in label:
+                    continue
+                if "START OF ANTENNA" in label:
+                    pcv = Pcv()
+                    state, skip = True, False
+                    continue
+                if "END OF ANTENNA" in label:
+                    if state and not skip and self._valid(pcv):
+                        (self.pcvr if pcv.sat is None else self.pcvs).append(pcv)
+                    state = False
+                    continue
+                if not state or skip:
+                    continue
+
+                if "TYPE / SERIAL NO" in label:
+                    pcv.type = line[0:20]
+                    pcv.code = line[20:40].strip()
+                    pcv.sat = id2sat(pcv.code) if pcv.code else None
+                    # NOTE: the receiver antennas of other types are not parsed
+                    skip = not pcv.sat and pcv.type.strip() not in types
+                elif "VALID FROM" in label:
+                    pcv.ts = str2time(line, 2, 40)
+                elif "VALID UNTIL" in label:
+                    pcv.te = str2time(line, 2, 40)
+                elif "DAZI" in label:
+                    pcv.dazi = float(line[2:8])
+                elif "ZEN1 / ZEN2 / DZEN" in label:
+                    pcv.zen = [float(x) for x in line[3:20].split()]
+                    pcv.nv = int((pcv.zen[1] - pcv.zen[0]) / pcv.zen[2]) + 1
+                elif "START OF FREQUENCY" in label:
+                    sig = rSigRnx(char2sys(line[3]), 'L' + line[5])
+                    grid = []
+                elif "END OF FREQUENCY" in label:
+                    if sig in pcv.var:
+                        pcv.grid[sig] = np.array(grid) if len(grid) > 1 else pcv.var[sig][None, :]
+                    sig = rSigRnx()
+                elif sig.sys == uGNSS.NONE:         # NOTE: FREQ RMS blocks
+                    continue
+                elif "NORTH / EAST / UP" in label:   # unit [mm]
+                    neu = [float(x) for x in line[3:30].split()]
+                    # NOTE: for satellites XYZ, for receivers ENU
+                    pcv.off[sig] = np.array([neu[0], neu[1], neu[2]]) if pcv.sat is not None \
+                        else np.array([neu[1], neu[0], neu[2]])
+                elif "NOAZI" in line[3:8]:           # unit [mm]
+                    pcv.var[sig] = np.array([float(x) for x in line[8:].split()][0:pcv.nv])
+                elif pcv.dazi > 0.0 and sig in pcv.var:
+                    grid.append([float(x) for x in line[8:].split()][0:pcv.nv])
+        return self
+
+    def covers(self, other):
+        """
+        The antennas and span of other are in this table.
+        """
+        return set(other.types) <= set(self.types) and \
+            timediff(self.ts, other.ts) <= 0.0 and timediff(self.te, other.te) >= 0.0
+
+    def select(self, other):
+        """
+        Antennas of this table for the receivers and span of other.
+        """
+        other.pcvs = [pcv for pcv in self.pcvs if other._valid(pcv)]
+        other.pcvr = [pcv for pcv in self.pcvr if other._valid(pcv) and pcv.type.strip() in other.types]
+        other.cached = self.cached
+        return other
+
+    def save(self, path, key):
+        pcvs = self.pcvs + self.pcvr
+        freqs = [(k, sig, pcv) for k, pcv in enumerate(pcvs) for sig in pcv.var if sig in pcv.off]
+        # NOTE: row 0 of each block is the NOAZI pattern, then the azimuth rows (if any)
+        grids = [pcv.grid[sig] if pcv.grid[sig].shape[0] == 1 else np.vstack((pcv.var[sig], pcv.grid[sig]))
+                 for _, sig, pcv in freqs]
+        size = np.array([g.size for g in grids], dtype=np.int64)
+        with open(path, 'wb') as fh: # NOTE: np.savez adds .npz to names without it
+            np.savez(fh, key=key, types=np.array(self.types, dtype='U20'),
+                     span=np.array([[self.ts.time, self.ts.sec], [self.te.time, self.te.sec]]),
+                     name=np.array([[pcv.type, pcv.code] for pcv in pcvs], dtype='U20').reshape(-1, 2),
+                     sat=np.array([-1 if pcv.sat is None else pcv.sat for pcv in pcvs], dtype=np.int64),
+                     valid=np.array([[pcv.ts.time, pcv.ts.sec, pcv.te.time, pcv.te.sec] for pcv in pcvs]).reshape(-1, 4),
+                     zen=np.array([list(pcv.zen) + [pcv.dazi] for pcv in pcvs]).reshape(-1, 4),
+                     fant=np.array([k for k, _, _ in freqs], dtype=np.int64),
+                     fsig=np.array([[int(s.sys), int(s.typ), int(s.sig)] for _, s, _ in freqs], dtype=np.int64).reshape(-1, 3),
+                     foff=np.array([pcv.off[s] for _, s, pcv in freqs]).reshape(-1, 3),
+                     fshape=np.array([g.shape for g in grids], dtype=np.int64).reshape(-1, 2),
+                     fstart=np.concatenate(([0], np.cumsum(size))),
+                     data=np.concatenate([g.ravel() for g in grids]) if grids else np.zeros(0))
+
+    @classmethod
+    def _restore(cls, npz):
+        span = npz['span']
+        tab = cls([str(t) for t in npz['types']], gtime_t(int(span[0, 0]), float(span[0, 1])),
+                  gtime_t(int(span[1, 0]), float(span[1, 1])))
+        pcvs = []
+        for (typ, code), sat, valid, zen in zip(npz['name'], npz['sat'], npz['valid'], npz['zen']):
+            pcv = Pcv()
+            pcv.type, pcv.code = str(typ).ljust(20), str(code)
+            pcv.sat = None if sat < 0 else int(sat)
+            pcv.ts = gtime_t(int(valid[0]), float(valid[1]))
+            pcv.te = gtime_t(int(valid[2]), float(valid[3]))
+            pcv.zen = [float(z) for z in zen[0:3]]
+            pcv.nv = int((pcv.zen[1] - pcv.zen[0]) / pcv.zen[2]) + 1
+            pcv.dazi = float(zen[3])
+            pcvs.append(pcv)
+
+        data, start = npz['data'], npz['fstart']
+        for k, (ant, s, off, shape) in enumerate(zip(npz['fant'], npz['fsig'], npz['foff'], npz['fshape'])):
+            pcv = pcvs[ant]
+            sig = rSigRnx(uGNSS(int(s[0])), uTYP(int(s[1])), uSIG(int(s[2])))
+            block = data[start[k]:start[k + 1]].reshape(shape)
+            pcv.off[sig] = off.copy()
+            pcv.var[sig] = block[0].copy()
+            pcv.grid[sig] = block if shape[0] == 1 else block[1:]
+
+        for pcv in pcvs:
+            (tab.pcvr if pcv.sat is None else tab.pcvs).append(pcv)
+        tab.cached = True
+        return tab
+
+    def searchpcv(self, name, time):
+        """
+        Satellite (sat) or receiver (type) antenna at time, see cssrlib searchpcv.
+        """
+        return searchpcv(self.pcvs if not isinstance(name, str) else self.pcvr, name, time)
+
+
+def rx_correction(ant, pos, e, sigs):
+    """
+    Range correction of the receiver antenna (PCO and azimuth-dependent PCV) for several
+    line-of-sight vectors, vectorized version of cssrlib antModelRx.
+
+    :param ant:  [Pcv] Receiver antenna (nav.rcv_ant)
+    :param pos:  [array] Geodetic position [lat, lon, h] [rad, m]
+    :param e:    [array] (n, 3) Line-of-sight vectors receiver -> satellite [ECEF]
+    :param sigs: [list of rSigRnx] Signals
+    :return: (n, len(sigs)) correction [m], nan for the signals without model
+    """
+    e = np.atleast_2d(np.asarray(e, dtype=np.float64))
+    enu = e @ xyz2enu(pos).T
+    za = np.rad2deg(np.arccos(np.clip(enu[:, 2], -1.0, 1.0)))
+    az = np.rad2deg(np.arctan2(enu[:, 0], enu[:, 1]))
+
+    dant = np.full((len(e), len(sigs)), np.nan)
+    for i, sig_ in enumerate(sigs):
+        sig = substSigRx(ant, sig_)
+        if sig not in ant.off:
+            continue
+        pcv = ant.interp(sig, az, za) if isinstance(ant, Pcv) \
+            else np.interp(za, np.arange(ant.zen[0], ant.zen[1] + ant.zen[2], ant.zen[2]), ant.var[sig])
+        dant[:, i] = (-enu @ ant.off[sig] + pcv) * 1e-3
+    return dant
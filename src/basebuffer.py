@@ -0,0 +1,195 @@
+"""
+Module to decode the base station observations once and share them between RTK rovers
+
+The epochs of the base RINEX are stored in flat arrays (one row per satellite):
+    time[ne], sec[ne]           epoch time (gtime_t)
+    offsets[ne]:offsets[ne+1]   rows of epoch ne
+    sat, P, L, D, S, lli        observations of each row
+
+The arrays can be moved to shared memory (multiprocessing.shared_memory), then the
+buffer is pickled as the name of the blocks and the worker processes attach to them
+without copying the observations.
+"""
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from cssrlib.gnss import Obs, gtime_t
+
+
+FIELDS = ('time', 'sec', 'offsets', 'sat', 'P', 'L', 'D', 'S', 'lli')
+
+
+class BaseBuffer():
+    """
+    Time-indexed buffer with the decoded base observations.
+
+    :param arrays: [dict] Arrays of the buffer (see FIELDS)
+    :param sig:    [dict] Signal table of the base decoder (obs.sig)
+    """
+    def __init__(self, arrays, sig=None):
+        self.arrays = arrays
+        self.sig = sig
+        self.shm = []           # shared memory blocks (if shared)
+        self.owner = False      # True: the blocks were created by this process
+
+        self.tsec = arrays['time'] + arrays['sec'] # NOTE: float time for the search
+
+    @classmethod
+    def decode(cls, dec, ts=None):
+        """
+        Decode all the epochs of a RINEX observation file. The header must be already
+        decoded (decode_obsh) and the signals selected.
+
+        :param dec: [rnxdec] Base decoder
+        :param ts:  [gtime_t] Skip epochs before ts [default: None]
+        :return: BaseBuffer
+        """
+        time, sec, nsat = [], [], []
+        sat, P, L, D, S, lli = [], [], [], [], [], []
+
+        obs = dec.decode_obs()
+        while obs.t.time != 0:
+            if ts is None or obs.t.time + obs.t.sec >= ts.time + ts.sec:
+                time.append(obs.t.time)
+                sec.append(obs.t.sec)
+                nsat.append(len(obs.sat))
+                sat.append(obs.sat)
+                P.append(obs.P)
+                L.append(obs.L)
+                D.append(obs.D)
+                S.append(obs.S)
+                lli.append(obs.lli)
+            last = obs
+            obs = dec.decode_obs()
+
+        if len(time) == 0:
+            raise ValueError("Base observation file without epochs!")
+
+        arrays = {
+            'time': np.array(time, dtype=np.int64),
+            'sec': np.array(sec, dtype=np.float64),
+            'offsets': np.concatenate(([0], np.cumsum(nsat))).astype(np.int64),
+            'sat': np.concatenate(sat).astype(np.int32),
+            'P': np.concatenate(P).astype(np.float64),
+            'L': np.concatenate(L).astype(np.float64),
+            'D': np.concatenate(D).astype(np.float64),
+            'S': np.concatenate(S).astype(np.float64),
+            'lli': np.concatenate(lli).astype(np.int32),
+        }
+        return cls(arrays, last.sig)
+
+    def share(self):
+        """
+        Move the arrays to shared memory (call unlink() when all the workers finished).
+        """
+        if self.shm:
+            return self
+        for field in FIELDS:
+            array = self.arrays[field]
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+            shared[...] = array
+            self.arrays[field] = shared
+            self.shm.append(shm)
+        self.owner = True
+        self.tsec = self.arrays['time'] + self.arrays['sec']
+        return self
+
+    def __getstate__(self):
+        if not self.shm:
+            return {'arrays': self.arrays, 'sig': self.sig, 'shm': None}
+        desc = {field: (shm.name, self.arrays[field].shape, self.arrays[field].dtype.str)
+                for field, shm in zip(FIELDS, self.shm)}
+        return {'arrays': None, 'sig': self.sig, 'shm': desc}
+
+    def __setstate__(self, state):
+        self.sig = state['sig']
+        self.shm = []
+        self.owner = False
+        if state['shm'] is None:
+            self.arrays = state['arrays']
+        else:
+            self.arrays = {}
+            for field in FIELDS:
+                name, shape, dtype = state['shm'][field]
+                shm = shared_memory.SharedMemory(name=name)
+                self.arrays[field] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+                self.shm.append(shm)
+        self.tsec = self.arrays['time'] + self.arrays['sec']
+
+    def close(self):
+        """
+        Detach from the shared memory blocks.
+        """
+        self.arrays = {}
+        self.tsec = None
+        for shm in self.shm:
+            shm.close()
+
+    def unlink(self):
+        """
+        Detach and release the shared memory blocks (only the creator).
+        """
+        shms = self.shm if self.owner else []
+        self.close()
+        for shm in shms:
+            shm.unlink()
+        self.shm = []
+
+    def __len__(self):
+        return len(self.arrays['time'])
+
+    def find(self, t, dt_th=0.1):
+        """
+        Index of the base epoch closest to t.
+
+        :param t:     [gtime_t] Epoch time
+        :param dt_th: [float] Maximum time difference [s]
+        :return: epoch index, -1 if there isn't a base epoch within dt_th
+        """
+        ts = t.time + t.sec
+        i = int(np.searchsorted(self.tsec, ts))
+        best = -1
+        for j in (i - 1, i):
+            if 0 <= j < len(self.tsec) and abs(self.tsec[j] - ts) <= dt_th:
+                if best < 0 or abs(self.tsec[j] - ts) < abs(self.tsec[best] - ts):
+                    best = j
+        return best
+
+    def epoch(self, ne):
+        """
+        Get the base observations of epoch ne.
+
+        :return: Obs
+        """
+        i, j = self.arrays['offsets'][ne], self.arrays['offsets'][ne + 1]
+        obs = Obs()
+        obs.t = gtime_t(int(self.arrays['time'][ne]), float(self.arrays['sec'][ne]))
+        obs.sat = self.arrays['sat'][i:j].copy()
+        obs.P = self.arrays['P'][i:j].copy()
+        obs.L = self.arrays['L'][i:j].copy()
+        obs.D = self.arrays['D'][i:j].copy()
+        obs.S = self.arrays['S'][i:j].copy()
+        obs.lli = self.arrays['lli'][i:j].copy()
+        obs.sig = self.sig
+        return obs
+
+
+def sync_base(dec, buf, dt_th=0.1):
+    """
+    Same as cssrlib.rinex.sync_obs, but the base observations are taken from a BaseBuffer.
+
+    :param dec:   [rnxdec] Rover decoder
+    :param buf:   [BaseBuffer] Base observations
+    :param dt_th: [float] Maximum time difference [s]
+    :return: (rover obs, base obs), the rover obs time is 0 at the end of the file
+    """
+    obs = dec.decode_obs()
+    while obs.t.time != 0:
+        ne = buf.find(obs.t, dt_th)
+        if ne >= 0:
+            return obs, buf.epoch(ne)
+        obs = dec.decode_obs()
+    return obs, Obs()
@@ -0,0 +1,173 @@
+"""
+Module to store the Bias-SINEX observable-specific biases (OSB) in a dense table
+
+cssrlib biasdec.getosb scans all the OSB records at every call (every satellite, signal and
+epoch in pppos). BiasTable builds after parsing:
+    edges[nbin+1]               limits of the validity intervals of the records [s]
+    bias[nbin, MAXSAT, nsig]    OSB (nan: no record) [ns or cycles]
+    std[nbin, MAXSAT, nsig]     sigma of the OSB
+    sigidx                      signal (rSigRnx) -> column
+so getosb is an array access. The table is saved next to the product (<file>.osb.npz) and
+loaded instead of the text file while the product doesn't change.
+"""
+
+import os
+from bisect import bisect_right
+
+import numpy as np
+
+from cssrlib.gnss import uGNSS, uTYP, uSIG, rSigRnx
+from cssrlib.peph import biasdec
+
+from src.streams import open_product
+
+
+CACHE_EXT = '.osb.npz'
+CACHE_VERSION = 1
+
+_loaded = None      # (path, stamp, site) -> table read in this process, see keep_loaded
+
+
+def keep_loaded():
+    """
+    Keep the bias tables read in memory for the next loads of this process (service workers).
+    """
+    global _loaded
+    if _loaded is None:
+        _loaded = {}
+
+
+def _sec(t):
+    return t.time + t.sec
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return np.array([CACHE_VERSION, st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+class BiasTable(biasdec):
+    """
+    biasdec with the OSB in a dense table (drop-in replacement for pppos, bsx=BiasTable.load(file)).
+    The DSB records (getdcb) are kept as in biasdec.
+    """
+    def __init__(self):
+        super().__init__()
+        self.edges = np.zeros(1)
+        self.bias = np.full((0, uGNSS.MAXSAT, 0), np.nan)
+        self.std = np.full((0, uGNSS.MAXSAT, 0), np.nan)
+        self.sigidx = {}
+        self.bin = (np.inf, -np.inf, -1)    # last time bin (tmin, tmax, index)
+
+    @classmethod
+    def load(cls, path, siteID=None, cache=True):
+        """
+        Load a Bias-SINEX file, from the cache next to it if it is up to date.
+
+        :param path:   [str] Bias-SINEX file (.BIA, also .gz/.Z)
+        :param siteID: [str] Station for the GLONASS biases (see biasdec.parse)
+        :param cache:  [bool] Use/write the cache file
+        :return: BiasTable
+        """
+        tab = cls()
+        memokey = (os.path.abspath(path), _stamp(path).tobytes(), str(siteID))
+        if _loaded is not None and memokey in _loaded:
+            return _loaded[memokey]
+
+        cachefile = str(path) + CACHE_EXT
+        if cache and os.path.isfile(cachefile):
+            try:
+                with np.load(cachefile) as npz:
+                    if np.array_equal(npz['stamp'], _stamp(path)) and str(npz['site']) == str(siteID):
+                        tab._restore(npz)
+                        if _loaded is not None:
+                            _loaded[memokey] = tab
+                        return tab
+            except (OSError, KeyError, ValueError) as error:
+                print("Warning: ignoring the bias cache {} ({})".format(cachefile, error))
+
+        if tab.parse(open_product(path), siteID) == -1:
+            raise ValueError("Error reading the Bias-SINEX file {}!".format(path))
+
+        # NOTE: only the OSB are cached, files with DSB are always parsed
+        if cache and not tab.dcb:
+            try:
+                tab.save(cachefile, _stamp(path), siteID)
+            except OSError as error:
+                print("Warning: bias cache not saved {} ({})".format(cachefile, error))
+        if _loaded is not None:
+            _loaded[memokey] = tab
+        return tab
+
+    def parse(self, fname, siteID=None):
+        ret = super().parse(fname, siteID)
+        self.build()
+        return ret
+
+    def build(self):
+        """
+        Build the dense table from the OSB records (the first record wins, as in getosb).
+        """
+        sigs = []
+        for osb in self.osb:
+            if osb.sig1 not in self.sigidx:
+                self.sigidx[osb.sig1] = len(sigs)
+                sigs.append(osb.sig1)
+
+        edges = sorted(set(_sec(osb.tst) for osb in self.osb) | set(_sec(osb.ted) for osb in self.osb))
+        self.edges = np.array(edges if edges else [0.0], dtype=np.float64)
+        nbin = max(len(self.edges) - 1, 0)
+        self.bias = np.full((nbin, uGNSS.MAXSAT, len(sigs)), np.nan)
+        self.std = np.full((nbin, uGNSS.MAXSAT, len(sigs)), np.nan)
+
+        for osb in self.osb:
+            i = int(np.searchsorted(self.edges, _sec(osb.tst)))
+            j = int(np.searchsorted(self.edges, _sec(osb.ted)))
+            k = self.sigidx[osb.sig1]
+            empty = np.isnan(self.bias[i:j, osb.sat - 1, k])
+            self.bias[i:j, osb.sat - 1, k][empty] = osb.bias
+            self.std[i:j, osb.sat - 1, k][empty] = osb.std
+        self.bin = (np.inf, -np.inf, -1)
+        return self
+
+    def save(self, path, stamp, siteID=None):
+        sigs = np.array([[int(s.sys), int(s.typ), int(s.sig)] for s in self.sigidx], dtype=np.int64).reshape(-1, 3)
+        with open(path, 'wb') as fh: # NOTE: np.savez adds .npz to names without it
+            np.savez(fh, stamp=stamp, site=str(siteID), edges=self.edges, bias=self.bias,
+                     std=self.std, sigs=sigs)
+
+    def _restore(self, npz):
+        self.edges = npz['edges']
+        self.bias = npz['bias']
+        self.std = npz['std']
+        self.sigidx = {rSigRnx(uGNSS(int(sys)), uTYP(int(typ)), uSIG(int(sig))): k
+                       for k, (sys, typ, sig) in enumerate(npz['sigs'])}
+        self.bin = (np.inf, -np.inf, -1)
+        return self
+
+    def _bin(self, time):
+        ts = _sec(time)
+        tmin, tmax, k = self.bin
+        if tmin <= ts < tmax:
+            return k
+        k = bisect_right(self.edges, ts) - 1
+        if k < 0 or k >= len(self.edges) - 1:
+            return -1
+        self.bin = (self.edges[k], self.edges[k + 1], k)
+        return k
+
+    def getosb(self, sat, time, sig):
+        """ retrieve OSB value based on satellite, epoch and signal code """
+        k = self._bin(time)
+        col = self.sigidx.get(sig)
+        if k < 0 or col is None:
+            return np.nan
+        return self.bias[k, sat - 1, col]
+
+    def getosbstd(self, sat, time, sig):
+        """ retrieve OSB sigma based on satellite, epoch and signal code """
+        k = self._bin(time)
+        col = self.sigidx.get(sig)
+        if k < 0 or col is None:
+            return np.nan
+        return self.std[k, sat - 1, col]
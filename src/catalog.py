@@ -0,0 +1,220 @@
+"""
+Module to index the GNSS products of a local archive in a SQLite catalog
+
+The archive (any tree of folders) is scanned once and every product is recorded with:
+    type        orb (SP3), clk (Clock-RINEX), bsx (Bias-SINEX), ionex, tro, atx, nav
+    center      analysis center (COD, IGS, ...), solution (FIN, RAP, ULT, ...)
+    ts, te      time span [s] (gtime_t.time, GPST), NULL for products without span (ANTEX)
+    sampling    [s], NULL if the name doesn't have it
+    path        (size and mtime to rescan only the files that changed)
+The type, center, span and sampling come from the file name: IGS long names
+(COD0MGXFIN_20232230000_01D_05M_ORB.SP3, BRDC00IGS_R_20232230000_01D_MN.rnx) and the
+legacy short names (igs22700.sp3, codg2230.23i, aira2230.23zpd, igs20.atx).
+
+best() returns the product of a type that covers a time span: final solutions first, then
+the preferred centers, the finer sampling and the shorter span.
+"""
+
+import os
+import re
+import sqlite3
+
+from cssrlib.gnss import epoch2time, gpst2time
+
+from src.streams import strip_compression, open_text
+
+
+UNITS = {'S': 1, 'M': 60, 'H': 3600, 'D': 86400, 'W': 604800, 'L': 2629800, 'Y': 31557600}
+
+CONTENTS = {('ORB', 'SP3'): 'orb', ('CLK', 'CLK'): 'clk', ('OSB', 'BIA'): 'bsx', ('DCB', 'BIA'): 'dcb',
+            ('GIM', 'INX'): 'ionex', ('TRO', 'TRO'): 'tro'}
+
+SOLUTIONS = ['FIN', 'RAP', 'RTS', 'ULT', 'NRT', 'PRD']   # rank of the solutions (best first)
+
+pattern_long = re.compile(r'^(?P<ac>[A-Z0-9]{3})\d[A-Z0-9]{3}(?P<sol>[A-Z]{3})_(?P<start>\d{11})_(?P<len>\d{2}[SMHDWLY])_'
+                          r'(?P<smp>\d{2}[SMHDWLY])(?:_[A-Z0-9]{9})?_(?P<cnt>[A-Z0-9]{3})\.(?P<fmt>[A-Z0-9]{3})$', re.IGNORECASE)
+pattern_nav = re.compile(r'^(?P<ac>[A-Z0-9]{4})\d{2}[A-Z]{3}_[RSU]_(?P<start>\d{11})_(?P<len>\d{2}[SMHDWLY])'
+                         r'(?:_\d{2}[SMHDWLY])?_[A-Z]N\.rnx$', re.IGNORECASE)
+pattern_legacy = re.compile(r'^(?P<ac>[a-z]{3})(?P<week>\d{4})(?P<dow>\d)\.(?P<ext>sp3|clk|clk_30s|bia)$', re.IGNORECASE)
+pattern_ionex = re.compile(r'^(?P<ac>[a-z]{3})g(?P<doy>\d{3})0\.(?P<yy>\d{2})i$', re.IGNORECASE)
+pattern_zpd = re.compile(r'^(?P<ac>[a-z0-9]{4})(?P<doy>\d{3})0\.(?P<yy>\d{2})zpd$', re.IGNORECASE)
+pattern_atx = re.compile(r'^(?P<ac>.+)\.atx$', re.IGNORECASE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    path TEXT PRIMARY KEY, name TEXT, type TEXT, center TEXT, solution TEXT,
+    ts REAL, te REAL, sampling REAL, size INTEGER, mtime INTEGER);
+CREATE INDEX IF NOT EXISTS products_span ON products (type, ts, te);
+"""
+
+
+def _span(start, length):
+    """
+    Start YYYYDDDHHMM and length (01D, 15M, ...) of a long name to [ts, te] [s].
+    """
+    year, doy, hh, mm = int(start[0:4]), int(start[4:7]), int(start[7:9]), int(start[9:11])
+    ts = epoch2time([year, 1, 1, hh, mm, 0]).time + (doy - 1) * 86400
+    return ts, ts + int(length[0:2]) * UNITS[length[2].upper()]
+
+
+def _doy(yy, doy):
+    year = int(yy) + (2000 if int(yy) < 80 else 1900)
+    ts = epoch2time([year, 1, 1, 0, 0, 0]).time + (int(doy) - 1) * 86400
+    return ts, ts + 86400
+
+
+def classify(name):
+    """
+    Type, center, solution, span and sampling of a product from its file name.
+
+    :param name: [str] File name (compressed names too)
+    :return: dict, None if the file is not a known product
+    """
+    name = strip_compression(os.path.basename(name))
+
+    m = pattern_long.match(name)
+    if m:
+        typ = CONTENTS.get((m['cnt'].upper(), m['fmt'].upper()))
+        if typ is None:
+            return None
+        ts, te = _span(m['start'], m['len'])
+        smp = int(m['smp'][0:2]) * UNITS[m['smp'][2].upper()]
+        return {'type': typ, 'center': m['ac'].upper(), 'solution': m['sol'].upper(), 'ts': ts, 'te': te, 'sampling': smp}
+
+    m = pattern_nav.match(name)
+    if m:
+        ts, te = _span(m['start'], m['len'])
+        return {'type': 'nav', 'center': m['ac'].upper(), 'solution': None, 'ts': ts, 'te': te, 'sampling': None}
+
+    m = pattern_legacy.match(name)
+    if m:
+        ts = gpst2time(int(m['week']), int(m['dow']) * 86400).time
+        typ = {'sp3': 'orb', 'clk': 'clk', 'clk_30s': 'clk', 'bia': 'bsx'}[m['ext'].lower()]
+        return {'type': typ, 'center': m['ac'].upper(), 'solution': None, 'ts': ts, 'te': ts + 86400,
+                'sampling': 30 if m['ext'].lower() == 'clk_30s' else None}
+
+    m = pattern_ionex.match(name)
+    if m:
+        ts, te = _doy(m['yy'], m['doy'])
+        return {'type': 'ionex', 'center': m['ac'].upper(), 'solution': None, 'ts': ts, 'te': te, 'sampling': None}
+
+    m = pattern_zpd.match(name)
+    if m:
+        ts, te = _doy(m['yy'], m['doy'])
+        return {'type': 'tro', 'center': m['ac'].upper(), 'solution': None, 'ts': ts, 'te': te, 'sampling': None}
+
+    m = pattern_atx.match(name)
+    if m:
+        return {'type': 'atx', 'center': m['ac'].upper(), 'solution': None, 'ts': None, 'te': None, 'sampling': None}
+    return None
+
+
+def obs_span(path):
+    """
+    Time span of a RINEX observation file from its header (TIME OF FIRST/LAST OBS).
+
+    :param path: [str] Observation file (also compressed/Hatanaka)
+    :return: (ts, te) [s], te is ts + 1 day if the header doesn't have it, None if no header
+    """
+    ts = te = None
+    with open_text(path) as fh:
+        for line in fh:
+            label = line[60:]
+            if "TIME OF FIRST OBS" in label:
+                ts = epoch2time([float(v) for v in line[0:43].split()]).time
+            elif "TIME OF LAST OBS" in label:
+                te = epoch2time([float(v) for v in line[0:43].split()]).time
+            elif "END OF HEADER" in label:
+                break
+    if ts is None:
+        return None
+    return ts, te if te is not None else ts + 86400
+
+
+class Catalog():
+    """
+    SQLite index of a product archive.
+
+    :param dbfile: [str] Catalog file (':memory:' for a temporary one)
+    """
+    def __init__(self, dbfile):
+        self.dbfile = dbfile
+        self.db = sqlite3.connect(dbfile)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def scan(self, root):
+        """
+        Add the products of a folder (recursive), only the new or modified files are classified.
+        The files of the folder that no longer exist are removed from the catalog.
+
+        :param root: [str] Archive folder
+        :return: [int] Number of products added or updated
+        """
+        root = os.path.abspath(root)
+        known = {path: (size, mtime) for path, size, mtime in self.db.execute(
+            "SELECT path, size, mtime FROM products WHERE substr(path, 1, ?) = ?",
+            (len(os.path.join(root, '')), os.path.join(root, '')))}
+
+        rows = []
+        for folder, _, files in os.walk(root):
+            for name in files:
+                path = os.path.join(folder, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if known.pop(path, None) == (st.st_size, st.st_mtime_ns):
+                    continue
+                info = classify(name)
+                if info is None:
+                    continue
+                rows.append((path, name, info['type'], info['center'], info['solution'], info['ts'], info['te'],
+                             info['sampling'], st.st_size, st.st_mtime_ns))
+
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.executemany("DELETE FROM products WHERE path = ?", [(path,) for path in known])
+        return len(rows)
+
+    def find(self, typ, ts, te, centers=None):
+        """
+        Products of a type that cover a time span, the best one first.
+
+        :param typ:     [str] Product type (orb, clk, bsx, ionex, tro, atx, nav)
+        :param ts:      [float] Start of the span [s] (gtime_t.time)
+        :param te:      [float] End of the span [s]
+        :param centers: [list of str] Preferred analysis centers (in order)
+        :return: list of dict (path, name, center, solution, ts, te, sampling)
+        """
+        cur = self.db.execute(
+            "SELECT path, name, center, solution, ts, te, sampling, mtime FROM products "
+            "WHERE type = ? AND (ts IS NULL OR ts <= ?) AND (te IS NULL OR te >= ?)", (typ, ts, te))
+        keys = ['path', 'name', 'center', 'solution', 'ts', 'te', 'sampling', 'mtime']
+        found = [dict(zip(keys, row)) for row in cur]
+        centers = [c.upper() for c in centers] if centers else []
+
+        def rank(p):
+            return (SOLUTIONS.index(p['solution']) if p['solution'] in SOLUTIONS else len(SOLUTIONS),
+                    centers.index(p['center']) if p['center'] in centers else len(centers),
+                    p['sampling'] if p['sampling'] is not None else float('inf'),
+                    p['te'] - p['ts'] if p['ts'] is not None else float('inf'),
+                    -p['mtime'])
+        return sorted(found, key=rank)
+
+    def best(self, typ, ts, te, centers=None):
+        """
+        Path of the best product of a type for a time span, None if there isn't one.
+        """
+        found = self.find(typ, ts, te, centers)
+        return found[0]['path'] if found else None
+
+    def session(self, ts, te, types=('orb', 'clk', 'bsx', 'ionex', 'tro', 'atx'), centers=None):
+        """
+        Best products of several types for a time span.
+
+        :return: dict type -> path (None if not in the catalog)
+        """
+        return {typ: self.best(typ, ts, te, centers) for typ in types}
@@ -0,0 +1,100 @@
+"""
+Module to save and restore the filter state of the PPP/RTK modules (checkpoint/resume)
+"""
+
+import os
+
+import numpy as np
+
+from cssrlib.gnss import gtime_t
+
+
+# Filter state kept by pppos/rtkpos inside the Nav object
+# NOTE: x/P (float), xa/Pa (fixed) and the ambiguity bookkeeping (fix, edt, outc, vsat, gf, gf_r, el, phw)
+NAV_STATE = ['x', 'P', 'xa', 'Pa', 'fix', 'edt', 'outc', 'vsat', 'gf', 'gf_r', 'el', 'phw', 'smode', 'ns', 'sat']
+
+
+def save_checkpoint(path, nav, ne, t0, obsfile, results):
+    """
+    Save the full estimator state and the results computed so far in a compressed .npz file.
+
+    The file is written first with a temporary name and then renamed, so a crash in the middle
+    of the write never corrupts the last valid checkpoint.
+
+    :param path:    [str] Checkpoint file (.npz)
+    :param nav:     [Nav] Navigation object with the filter state
+    :param ne:      [int] Index of the last processed epoch
+    :param t0:      [gtime_t] First epoch of the session
+    :param obsfile: [str] Observation file being processed
+    :param results: [dict] Result arrays of the module {name: array}
+    """
+    state = {}
+    for key in NAV_STATE:
+        if hasattr(nav, key) and getattr(nav, key) is not None:
+            state['nav_' + key] = np.asarray(getattr(nav, key))
+
+    state['t'] = np.array([nav.t.time, nav.t.sec])
+    state['t0'] = np.array([t0.time, t0.sec])
+    state['ne'] = np.array(ne)
+    state['obsfile'] = np.array(os.path.basename(obsfile) if obsfile else '')
+
+    for key, value in results.items():
+        state['res_' + key] = value[:ne + 1]
+
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f, **state)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path, nav, obsfile, results):
+    """
+    Restore the estimator state saved with save_checkpoint().
+
+    The results computed before the checkpoint are only restored if the checkpoint belongs to the same
+    observation file (e.g. a run that died). With another file (e.g. the next day) only the converged
+    filter state is restored and the session starts from the first epoch of the new file.
+
+    :param path:    [str] Checkpoint file (.npz)
+    :param nav:     [Nav] Navigation object where the filter state is restored
+    :param obsfile: [str] Observation file being processed
+    :param results: [dict] Result arrays of the module {name: array}, filled in place
+
+    :return: (ne, t, t0) Index of the last processed epoch (-1 if other file), time of the last
+             processed epoch and first epoch of the session (None if other file)
+    """
+    if not os.path.exists(path):
+        raise ValueError(f"Checkpoint file: {path} not found!")
+
+    with np.load(path) as data:
+        for key in NAV_STATE:
+            if 'nav_' + key not in data:
+                continue
+            value = data['nav_' + key]
+            setattr(nav, key, value.item() if value.ndim == 0 else value.copy())
+
+        t = gtime_t(int(data['t'][0]), float(data['t'][1]))
+        nav.t = t
+
+        same_file = str(data['obsfile']) == (os.path.basename(obsfile) if obsfile else '')
+        if not same_file:
+            # NOTE: carrier phase is not continuous between files, expire the outage counters so
+            #       pppos/rtkpos reset all the ambiguities in the first epoch (udstate)
+            nav.outc[:] = nav.maxout + 1
+            return -1, t, None
+
+        ne = int(data['ne'])
+        for key, value in results.items():
+            if 'res_' + key not in data:
+                continue
+            saved = data['res_' + key]
+            n = min(len(saved), len(value))
+            value[:n] = saved[:n]
+
+        t0 = gtime_t(int(data['t0'][0]), float(data['t0'][1]))
+
+    return ne, t, t0
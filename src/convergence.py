@@ -0,0 +1,122 @@
+"""
+Module to detect the convergence of a static PPP session and stop the processing early
+
+A control-point survey only needs the epochs until the filter has converged, the rest of the
+session (-t minutes) doesn't change the coordinate. The monitor follows every epoch of the engine
+and the session is converged when, during dwell seconds without interruption:
+    sigma   the formal 3D standard deviation of the position (nav.P, nav.Pa with fixed ambiguities)
+            is under sigma metres
+    spread  the positions of the last window seconds are within spread metres of their mean
+            (ENU, the filter doesn't walk any more)
+    fix     the solution is fixed (smode 4), only if fix=True
+
+The converged coordinate is the mean of the window (ECEF), with the formal ENU sigmas of the last
+epoch and the ENU scatter of the window. Static mode only.
+"""
+
+from collections import deque
+
+import numpy as np
+
+from cssrlib.gnss import ecef2pos, xyz2enu, time2str, gtime_t
+
+
+class ConvergenceMonitor():
+    """
+    Convergence of a static session.
+
+    :param sigma:  [float] Maximum formal 3D standard deviation of the position [m]
+    :param spread: [float] Maximum distance of the window positions to their mean [m]
+    :param window: [float] Seconds of positions to check the spread
+    :param dwell:  [float] Seconds the criteria must hold before stopping
+    :param fix:    [bool] Only fixed solutions (smode 4)
+    """
+    def __init__(self, sigma=0.05, spread=0.02, window=300.0, dwell=120.0, fix=False):
+        if sigma <= 0 or spread <= 0 or window <= 0 or dwell < 0:
+            raise ValueError("Convergence criteria must be positive!")
+        self.sigma = sigma
+        self.spread = spread
+        self.window = window
+        self.dwell = dwell
+        self.fix = fix
+
+        self.origin = None          # ECEF of the first position, origin of the ENU
+        self.E = None               # ECEF -> ENU rotation
+        self.hist = deque()         # (t, enu) of the window
+        self.t0 = None              # first epoch
+        self.since = None           # first epoch of the current run meeting the criteria
+        self.n = 0
+        self.state = {'sigma': np.nan, 'spread': np.nan, 'fix': False}
+        self.result = None
+
+    @property
+    def converged(self):
+        return self.result is not None
+
+    def update(self, t, xyz, P, smode):
+        """
+        Add an epoch of the engine.
+
+        :param t:     [float] Epoch [s] (gtime_t.time + sec)
+        :param xyz:   [array] Position ECEF [m]
+        :param P:     [array (3, 3)] Covariance of the position ECEF [m^2]
+        :param smode: [int] Solution mode (4: fix, 5: float, ...)
+        :return: [bool] True once the session is converged
+        """
+        if self.result is not None:
+            return True
+        self.n += 1
+        xyz = np.asarray(xyz, dtype=float)
+        if not np.all(np.isfinite(xyz)) or not np.any(xyz):
+            # NOTE: no solution at this epoch, the criteria start again
+            self.since = None
+            return False
+        if self.origin is None:
+            self.origin = xyz.copy()
+            self.E = xyz2enu(ecef2pos(xyz))
+            self.t0 = t
+
+        enu = self.E @ (xyz - self.origin)
+        sig = np.sqrt(np.maximum(np.diag(self.E @ np.asarray(P)[0:3, 0:3] @ self.E.T), 0.0))
+        self.hist.append((t, enu))
+        while t - self.hist[0][0] > self.window:
+            self.hist.popleft()
+
+        pts = np.array([p for _, p in self.hist])
+        mean = pts.mean(axis=0)
+        spread = np.sqrt(((pts - mean)**2).sum(axis=1)).max()
+        sigma = np.sqrt((sig**2).sum())
+        self.state = {'sigma': sigma, 'spread': spread, 'fix': smode == 4}
+
+        # NOTE: the spread of a window not yet full says nothing about the stability
+        ok = (t - self.t0 >= self.window and sigma <= self.sigma and spread <= self.spread
+              and (smode == 4 or not self.fix))
+        if not ok:
+            self.since = None
+            return False
+        if self.since is None:
+            self.since = t
+        if t - self.since < self.dwell:
+            return False
+
+        self.result = {'t': t, 'elapsed': t - self.t0, 'epochs': self.n,
+                       'xyz': self.origin + self.E.T @ mean, 'sigma': sig,
+                       'scatter': pts.std(axis=0), 'spread': spread, 'smode': int(smode)}
+        return True
+
+    def report(self):
+        """
+        Converged coordinate and its uncertainty (text).
+        """
+        if self.result is None:
+            s = self.state
+            return "Not converged after {} epochs (sigma {:.3f} m, spread {:.3f} m)".format(self.n, s['sigma'], s['spread'])
+        r = self.result
+        t = gtime_t(int(r['t']), r['t'] - int(r['t']))
+        return ("Converged at {} after {:.0f} s ({} epochs), mode {}\n"
+                " XYZ: [{:14.4f}, {:14.4f}, {:14.4f}]\n"
+                " sigma ENU: [{:6.3f}, {:6.3f}, {:6.3f}] m, scatter ENU: [{:6.3f}, {:6.3f}, {:6.3f}] m ({:.0f} s window)"
+                .format(time2str(t), r['elapsed'], r['epochs'], r['smode'],
+                        r['xyz'][0], r['xyz'][1], r['xyz'][2],
+                        r['sigma'][0], r['sigma'][1], r['sigma'][2],
+                        r['scatter'][0], r['scatter'][1], r['scatter'][2], self.window))
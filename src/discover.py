@@ -0,0 +1,240 @@
+"""
+Module to find the u-blox receivers connected to the serial ports
+
+All the candidate ports are probed at the same time (one thread per port) and the discovery returns
+within one timeout window, whatever the number of ports. Each probe sends MON-VER polls and frames the
+answer (src.ubxfilter.Framer, checksums verified): a port is a u-blox when valid UBX frames arrive,
+and the model comes from the MON-VER answer (extension MOD=ZED-F9P -> F9P, or the hardware version).
+
+The results are cached (data/ports.json) by port and USB identity (VID:PID and serial number): a port
+whose device didn't change is not probed again. Ports without USB identity are always probed.
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.ubxfilter import Framer
+
+
+CACHE = os.path.join('data', 'ports.json')
+MON_VER_POLL = b'\xb5\x62\x0a\x04\x00\x00\x0e\x34'
+HW_MODELS = {'00070000': 'M7', '00080000': 'M8', '00190000': 'F9', '000A0000': 'M10'}
+
+
+def frame(cls, mid, payload=b''):
+    """
+    UBX frame of a message (sync, class, id, length, payload and checksum).
+    """
+    body = bytes([cls, mid]) + len(payload).to_bytes(2, 'little') + bytes(payload)
+    a = b = 0
+    for c in body:
+        a = (a + c) & 0xFF
+        b = (b + a) & 0xFF
+    return b'\xb5\x62' + body + bytes([a, b])
+
+
+def parse_monver(payload):
+    """
+    Software, hardware version, extensions and model of a MON-VER payload.
+
+    :return: dict with sw, hw, ext [list of str] and model [str or None]
+    """
+    def text(b):
+        return bytes(b).split(b'\x00')[0].decode('ascii', 'replace').strip()
+
+    sw, hw = text(payload[0:30]), text(payload[30:40])
+    ext = [text(payload[k:k + 30]) for k in range(40, len(payload) - 29, 30)]
+    model = None
+    for e in ext:
+        if e.startswith('MOD='):
+            # NOTE: ZED-F9P, NEO-M8T-0, MAX-M10S
+            parts = [p for p in e[4:].split('-') if re.fullmatch(r'[A-Z]\d+[A-Z]*', p)]
+            model = parts[0] if parts else e[4:].split('-')[-1]
+            break
+    if model is None:
+        model = HW_MODELS.get(hw)
+    return {'sw': sw, 'hw': hw, 'ext': ext, 'model': model}
+
+
+def query(ser, timeout=3.0, poll=1.0):
+    """
+    Poll MON-VER on an open port and wait for the answer.
+
+    :param ser:     [serial.Serial] Port (read timeout much shorter than timeout)
+    :param timeout: [float] Seconds to wait
+    :param poll:    [float] Seconds between two polls (the first one can be lost while the port wakes up)
+    :return: dict with ublox [bool] (valid UBX frames received), model, sw, hw, ext
+    """
+    info = {'ublox': False, 'model': None, 'sw': None, 'hw': None, 'ext': []}
+    framer = Framer()
+    deadline = time.monotonic() + timeout
+    next_poll = 0.0
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            return info
+        if now >= next_poll:
+            ser.write(MON_VER_POLL)
+            next_poll = now + poll
+        data = ser.read(4096)
+        if not data:
+            continue
+        # NOTE: u-blox NMEA TXT at power on
+        if b'u-blox' in data:
+            info['ublox'] = True
+        buf, offs, lens, cls, mid = framer.feed(data)
+        if len(offs):
+            info['ublox'] = True
+        k = np.nonzero((cls == 0x0A) & (mid == 0x04))[0]
+        if len(k):
+            o, n = int(offs[k[0]]), int(lens[k[0]])
+            info.update(parse_monver(buf[o + 6:o + 6 + n]))
+            return info
+
+
+def _open(port, baud):
+    import serial
+    return serial.Serial(port, baud, timeout=0.05, write_timeout=0.5)
+
+
+def probe(port, baud=115200, timeout=3.0, opener=None):
+    """
+    Probe a port (see query).
+
+    :param port:    [str] Port (COM4, /dev/ttyACM0)
+    :param baud:    [int] Baud rate
+    :param timeout: [float] Seconds
+    :param opener:  [function] opener(port, baud) -> open port [default: serial.Serial]
+    :return: dict with port, baud, ublox, model, sw, hw, ext and error (None or the message)
+    """
+    result = {'port': port, 'baud': baud, 'ublox': False, 'model': None, 'sw': None, 'hw': None, 'ext': [], 'error': None}
+    try:
+        with (opener or _open)(port, baud) as ser:
+            result.update(query(ser, timeout))
+    except Exception as e:
+        # NOTE: busy port, no permission, device unplugged ...
+        result['error'] = str(e)
+    return result
+
+
+def list_ports():
+    """
+    Serial ports of the host.
+
+    :return: [list of (device, hwid)]
+    """
+    import serial.tools.list_ports
+    return [(p.device, p.hwid if p.vid is not None else '') for p in serial.tools.list_ports.comports()]
+
+
+def _load(cache):
+    if not cache or not os.path.isfile(cache):
+        return {}
+    try:
+        with open(cache) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        print("Warning: port cache {} not valid, ignored".format(cache))
+        return {}
+
+
+def _save(cache, entries):
+    folder = os.path.dirname(cache)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp = cache + '.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(entries, fh, indent=1)
+    os.replace(tmp, cache)
+
+
+def discover(ports=None, baud=115200, timeout=3.0, cache=CACHE, refresh=False, opener=None):
+    """
+    Probe the ports concurrently (the cached ones whose device didn't change are not probed).
+
+    :param ports:   [list of str] Ports [default: all the serial ports of the host]
+    :param baud:    [int] Baud rate
+    :param timeout: [float] Seconds of the probes (all of them at the same time)
+    :param cache:   [str] Cache file (None: no cache)
+    :param refresh: [bool] Probe the cached ports too
+    :param opener:  [function] See probe
+    :return: dict port -> result of probe (cached: True if it comes from the cache)
+    """
+    hwids = dict(list_ports())
+    if ports is None:
+        ports = sorted(hwids)
+    entries = _load(cache)
+
+    results, todo = {}, []
+    for port in ports:
+        hwid = hwids.get(port, '')
+        entry = entries.get(port)
+        if not refresh and hwid and entry and entry.get('hwid') == hwid and entry.get('baud') == baud:
+            results[port] = dict(entry, cached=True)
+        else:
+            todo.append(port)
+
+    if todo:
+        with ThreadPoolExecutor(max_workers=len(todo)) as executor:
+            for result in executor.map(lambda port: probe(port, baud, timeout, opener), todo):
+                results[result['port']] = dict(result, cached=False)
+
+    if cache:
+        changed = False
+        for port in todo:
+            result, hwid = results[port], hwids.get(port, '')
+            # NOTE: only the answers of identified devices, a busy port is probed again next time
+            if hwid and result['error'] is None:
+                entries[port] = {k: v for k, v in result.items() if k != 'cached'}
+                entries[port].update(hwid=hwid, time=time.time())
+                changed = True
+        if changed:
+            _save(cache, entries)
+
+    return {port: results[port] for port in ports}
+
+
+def find_ublox(ports=None, baud=115200, timeout=3.0, cache=CACHE, refresh=False):
+    """
+    First port with a u-blox receiver (the ones with a model first).
+
+    :return: (port, model) or (None, None)
+    """
+    found = [r for r in discover(ports, baud, timeout, cache, refresh).values() if r['ublox']]
+    if not found:
+        return None, None
+    found.sort(key=lambda r: r['model'] is None)
+    return found[0]['port'], found[0]['model']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Find the u-blox receivers connected to the serial ports.')
+    parser.add_argument('ports', type=str, nargs='*', help='Ports to probe. [default: all]')
+    parser.add_argument('-baud', '--baud', type=int, default=115200, help='Baud rate. [default: %(default)s]')
+    parser.add_argument('-timeout', '--timeout', type=float, default=3.0, help='Seconds of the probes. [default: %(default)s]')
+    parser.add_argument('-refresh', '--refresh', action='store_true', help='Probe the cached ports too.')
+    parser.add_argument('-nocache', '--nocache', action='store_true', help="Don't use the port cache.")
+    args = parser.parse_args(argv)
+
+    t0 = time.monotonic()
+    results = discover(args.ports or None, args.baud, args.timeout, None if args.nocache else CACHE, args.refresh)
+    for port, r in results.items():
+        if r['error']:
+            state = 'error: {}'.format(r['error'])
+        elif r['ublox']:
+            state = 'u-blox {} {} {}'.format(r['model'] or '?', r['sw'] or '', '(cached)' if r['cached'] else '')
+        else:
+            state = 'no u-blox'
+        print("{:<16} {}".format(port, state))
+    print("{} ports in {:.2f} s".format(len(results), time.monotonic() - t0))
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Module to index the broadcast ephemeris by satellite (replacement of cssrlib findeph)
+
+cssrlib.ephemeris.findeph scans the whole nav.eph list at every call. EphIndex groups the
+records of each satellite (and mode) sorted by toe:
+    - lookup of the closest toe by bisection, O(log n)
+    - memo of the current ephemeris of each satellite with the time interval where it is the
+      closest one, the lookup is O(1) until t crosses the middle point to the next toe
+The result is the same as findeph (closest toe within MAXDTOE, the later record of the list on ties).
+"""
+
+from bisect import bisect_left
+
+from cssrlib.ephemeris import MAXDTOE_t
+from cssrlib.gnss import sat2prn
+
+
+def _sec(t):
+    return t.time + t.sec
+
+
+class EphIndex():
+    """
+    Broadcast ephemeris indexed by satellite and toe.
+
+    :param ephs: [list of Eph] Ephemeris (nav.eph or nav.geph)
+    """
+    def __init__(self, ephs=None):
+        self.toe = {}       # (sat, mode) -> sorted toe [s]
+        self.eph = {}       # (sat, mode) -> records sorted by toe
+        self.order = {}     # (sat, mode) -> position of the records in the list
+        self.memo = {}      # (sat, mode) -> (tmin, tmax, eph)
+        self.n = 0
+        if ephs is not None:
+            self.build(ephs)
+
+    def build(self, ephs):
+        """
+        Index the records (the order of the list is kept for the same toe).
+        """
+        groups = {}
+        for k, eph in enumerate(ephs):
+            groups.setdefault((eph.sat, eph.mode), []).append((_sec(eph.toe), k, eph))
+        self.toe, self.eph, self.order, self.memo = {}, {}, {}, {}
+        for key, group in groups.items():
+            group.sort(key=lambda rec: rec[0]) # NOTE: stable, list order for the same toe
+            self.toe[key] = [rec[0] for rec in group]
+            self.order[key] = [rec[1] for rec in group]
+            self.eph[key] = [rec[2] for rec in group]
+        self.n = len(ephs)
+        return self
+
+    def update(self, ephs):
+        """
+        Rebuild the index if records were added to the list (e.g. real-time decoding).
+        """
+        if len(ephs) != self.n:
+            self.build(ephs)
+        return self
+
+    def find(self, t, sat, iode=-1, mode=0):
+        """
+        Ephemeris of a satellite at t (same as cssrlib findeph).
+
+        :param t:    [gtime_t] Time
+        :param sat:  [int] Satellite
+        :param iode: [int] Issue of data (-1: closest toe)
+        :param mode: [int] Ephemeris type (e.g. LNAV/CNAV)
+        :return: Eph, None if there isn't an ephemeris within MAXDTOE
+        """
+        key = (sat, mode)
+        ts = _sec(t)
+
+        if iode < 0:
+            memo = self.memo.get(key)
+            if memo is not None and memo[0] < ts < memo[1]:
+                return memo[2]
+
+        toes = self.toe.get(key)
+        if toes is None:
+            return None
+        sys, _ = sat2prn(sat)
+        dtmax = MAXDTOE_t[sys]
+        ephs = self.eph[key]
+
+        if iode >= 0: # NOTE: first record of the list with the same iode
+            found = [(k, eph) for toe, k, eph in zip(toes, self.order[key], ephs)
+                     if eph.iode == iode and abs(ts - toe) <= dtmax]
+            return min(found, key=lambda rec: rec[0])[1] if found else None
+
+        k = bisect_left(toes, ts)
+        # NOTE: closest toe (last record of the same toe), on ties the later one in the list
+        j = k
+        while j + 1 < len(toes) and toes[j + 1] == toes[k]:
+            j += 1
+        if k == len(toes) or (k > 0 and (ts - toes[k - 1] < toes[k] - ts or
+                (ts - toes[k - 1] == toes[k] - ts and self.order[key][k - 1] > self.order[key][j]))):
+            j = k - 1
+
+        # NOTE: interval of t where ephs[j] is the closest (middle points to the neighbours)
+        i = bisect_left(toes, toes[j]) # NOTE: first record of the same toe
+        lo = 0.5 * (toes[j] + toes[i - 1]) if i > 0 else float('-inf')
+        hi = 0.5 * (toes[j] + toes[j + 1]) if j + 1 < len(toes) else float('inf')
+        lo = max(lo, toes[j] - dtmax)
+        hi = min(hi, toes[j] + dtmax)
+        if not lo <= ts <= hi:
+            return None
+        self.memo[key] = (lo, hi, ephs[j])
+        return ephs[j]
@@ -1,24 +1,10 @@
 import os
-
-import serial
-from pyubx2 import UBXReader, UBXMessage, POLL
 import time
 
-
-import matplotlib.pyplot as plt
-import matplotlib.dates as md
 import numpy as np
-import pandas as pd
-
-import simplekml # Create .kml files 
-import pymap3d as pm
 
-import folium
-from IPython.display import display
-
-import folium
-import webbrowser
-import tempfile
+# NOTE: serial/pyubx2, pandas, simplekml, pymap3d and folium are imported by the functions that use
+#       them, importing this module (Commands.py -printhelp, the engines) doesn't load them
 
 
 # Borrar 
@@ -53,6 +39,8 @@ def createKML(llh_coordinates, name):
             # Assuming ecef2lla is a defined function that converts from ECEF to LLA
             llh_coordinates[i, :] = ecef2lla(llh_coordinates[i, :])
     
+    import simplekml # Create .kml files
+
     # KML obj
     kml = simplekml.Kml()
 
@@ -76,6 +64,10 @@ def delete_nan(sol_):
     return sol
 
 def show_kml(sol_):
+    import folium
+    import tempfile
+    import webbrowser
+
     delete_nan(sol_)
 
     # Check if any latitude or longitude coordinate is out of valid ranges
@@ -109,6 +101,8 @@ def ecef2lla(vector):
     :return: Tuple (latitude, longitude, altitude)
     """
 
+    import pymap3d as pm
+
     # Converts ECEF to LLA
     lat, lon, alt = pm.ecef2geodetic(vector[0], vector[1], vector[2])
     return lat, lon, alt
@@ -172,6 +166,8 @@ def saveTest(archivo, nav, system_freq, sol_, enu, ztd, smode, nep, file_path):
         file.write("\n")
 
 
+    import pandas as pd
+
     # Crear el DataFrame
     df = pd.DataFrame({
         "sol_x": sol_[:, 0],
@@ -190,30 +186,14 @@ def saveTest(archivo, nav, system_freq, sol_, enu, ztd, smode, nep, file_path):
 
 def getUBXModel(PORT, BAUD_RATE, ser):
     """
-    Get u-blox model. 
+    Get u-blox model (MON-VER answer, see src.discover). 
     """
-    #TODO: el mensaje no es el de MON-VER
-    msg = UBXMessage('MON', 'MON-VER', POLL)
-
-    ser.write(msg.serialize())
+    from src.discover import query
 
-    ubr = UBXReader(ser)
-
-    ublox_models ={
-        'M8': ['T', 'N', 'U', 'C', 'F', 'L'],  
-        'F9': ['P', 'T'], 
-        'M10':['1', '1C']
-    }
-
-    (raw_data, _) = ubr.read()
-
-    for model, variants in ublox_models.items():
-        for variant in variants:
-            model_variant = model + variant
-            if model_variant in str(raw_data):
-                print(f"Model: {model_variant} detected!")
-                return model_variant
-    return None
+    model = query(ser)['model']
+    if model:
+        print(f"Model: {model} detected!")
+    return model
 
 
 def checkUBX(PORT: str, BAUD_RATE: int, UBX: bool):
@@ -225,38 +205,19 @@ def checkUBX(PORT: str, BAUD_RATE: int, UBX: bool):
     :param UBX:       [bool] 
 
     :return: (str or None, bool) Tuple containing the model detected and a boolean indicating if u-blox hardware is detected.
-    if isinstance(parsed_data, pyubx2.UBXMessage)
     """
-    try:
-        hw = False 
-        model = None
-        
-        with serial.Serial(PORT, BAUD_RATE, timeout=3) as ser:
-            ubr = UBXReader(ser)
-
-            for _ in range(10):  
-                (raw_data, parsed_data) = ubr.read()
-                if 'u-blox' in str(raw_data) or 'UBX' in str(parsed_data):  # Assuming 'u-blox' can be searched in the string-converted raw_data
-                    print("U-BLOX detected!")
-                    hw = True
-                    break
-            if not hw:
-                return (model, hw) # U-blox not detected
-                
-            for _ in range(10):
-                model = getUBXModel(PORT, BAUD_RATE, ser)
-                if model:
-                    return (model, hw)  # Return model and True if a u-blox model is detected
-
-        return (model, hw)  
-    
-    except serial.SerialException as e:
-        print(f"Error opening serial port: {e}")
-        return (None, False)
-    
-    except Exception as e:
-        print(f"Error: {e}")
+    from src.discover import discover
+
+    # NOTE: one MON-VER probe (3 s at most), cached by USB device in data/ports.json
+    result = discover([PORT], BAUD_RATE)[PORT]
+    if result['error']:
+        print(f"Error opening serial port: {result['error']}")
         return (None, False)
+    if result['ublox']:
+        print("U-BLOX detected!")
+        if result['model']:
+            print(f"Model: {result['model']} detected!")
+    return (result['model'], result['ublox'])
     
 
 def freqModel(model):
@@ -314,6 +275,8 @@ def getDataFromCSV(csv_path):
     """
     Get data from .csv file.
     """
+    import pandas as pd
+
     # Leer el archivo CSV
     df = pd.read_csv(csv_path)
     
@@ -0,0 +1,244 @@
+"""
+Module to read IONEX global ionosphere maps (GIM) and compute slant ionospheric delays
+
+The TEC maps are parsed once into a 3-D grid (map x lat x lon, TECU). The delays of all the
+satellites of an epoch are computed with one vectorized interpolation:
+    - ionospheric pierce point (single layer model, height of the file)
+    - bilinear interpolation in lat/lon of the two maps around t, rotated with the Sun (IONEX 1.0, eq. 3)
+    - linear interpolation in time
+"""
+
+import numpy as np
+
+from cssrlib.ephemeris import findeph, eph2pos
+from cssrlib.gnss import epoch2time, timediff, geodist, satazel, ecef2pos, uTYP, sat2prn, uGNSS
+
+from src.streams import open_text
+
+
+K_IONO = 40.3e16    # delay [m] = K_IONO * STEC [TECU] / f^2
+
+
+class Ionex():
+    """
+    IONEX file (TEC maps only, RMS and height maps are skipped).
+
+    :param path: [str] IONEX file (.INX, .YYi, also .gz/.Z)
+    """
+    def __init__(self, path=None):
+        self.t0 = None          # epoch of the first map (gtime_t)
+        self.times = None       # time of each map from t0 [s]
+        self.lats = None        # [deg]
+        self.lons = None        # [deg]
+        self.tec = None         # (nmap, nlat, nlon) [TECU]
+        self.re = 6371.0e3      # base radius [m]
+        self.hion = 450.0e3     # height of the layer [m]
+
+        if path is not None:
+            self.read(path)
+
+    def read(self, path):
+        """
+        Parse the file.
+        """
+        exponent = -1
+        epochs, maps = [], []
+        lat1 = lat2 = dlat = lon1 = lon2 = dlon = None
+        tecmap = None
+        row = None
+        lat_k = 0
+
+        with open_text(path) as fh:
+            for line in fh:
+                label = line[60:].strip()
+                if tecmap is None:
+                    if label == 'BASE RADIUS':
+                        self.re = float(line[:20]) * 1e3
+                    elif label == 'HGT1 / HGT2 / DHGT':
+                        self.hion = float(line[2:8]) * 1e3
+                    elif label == 'LAT1 / LAT2 / DLAT':
+                        lat1, lat2, dlat = float(line[2:8]), float(line[8:14]), float(line[14:20])
+                    elif label == 'LON1 / LON2 / DLON':
+                        lon1, lon2, dlon = float(line[2:8]), float(line[8:14]), float(line[14:20])
+                    elif label == 'EXPONENT':
+                        exponent = int(line[:6])
+                    elif label == 'START OF TEC MAP':
+                        if lat1 is None or lon1 is None:
+                            raise ValueError("IONEX header without grid definition!")
+                        nlat = int(round((lat2 - lat1) / dlat)) + 1
+                        nlon = int(round((lon2 - lon1) / dlon)) + 1
+                        tecmap = np.full((nlat, nlon), np.nan, dtype=np.float32)
+                    elif label == 'START OF RMS MAP' or label == 'START OF HEIGHT MAP':
+                        break # NOTE: TEC maps come first
+                    continue
+
+                if label == 'EPOCH OF CURRENT MAP':
+                    epochs.append([int(v) for v in line[:36].split()])
+                elif label == 'LAT/LON1/LON2/DLON/H':
+                    lat_k = int(round((float(line[2:8]) - lat1) / dlat))
+                    row = []
+                elif label == 'END OF TEC MAP':
+                    maps.append(tecmap)
+                    tecmap = None
+                    row = None
+                elif row is not None:
+                    row += [float(v) for v in line.split()]
+                    if len(row) >= tecmap.shape[1]:
+                        tecmap[lat_k, :] = row[:tecmap.shape[1]]
+                        row = None
+
+        if not maps:
+            raise ValueError("IONEX file without TEC maps!")
+
+        tec = np.array(maps, dtype=np.float32)
+        tec[tec >= 9999] = np.nan
+        tec *= 10.0 ** exponent
+
+        # NOTE: grid in increasing lat/lon for the interpolation
+        lats = lat1 + dlat * np.arange(tec.shape[1])
+        lons = lon1 + dlon * np.arange(tec.shape[2])
+        if dlat < 0:
+            lats, tec = lats[::-1], tec[:, ::-1, :]
+        if dlon < 0:
+            lons, tec = lons[::-1], tec[:, :, ::-1]
+
+        self.lats = lats
+        self.lons = lons
+        self.tec = np.ascontiguousarray(tec)
+        self.t0 = epoch2time(epochs[0])
+        self.times = np.array([timediff(epoch2time(ep), self.t0) for ep in epochs])
+        return self
+
+    def _grid(self, k, lat, lon):
+        """
+        Bilinear interpolation of map k (vectorized), lon is wrapped.
+        """
+        lats, lons = self.lats, self.lons
+        dlat = lats[1] - lats[0]
+        dlon = lons[1] - lons[0]
+        span = lons[-1] - lons[0]
+
+        lon = (lon - lons[0]) % 360.0
+        x = np.clip(lon / dlon, 0.0, span / dlon)
+        y = np.clip((lat - lats[0]) / dlat, 0.0, len(lats) - 1.0)
+
+        i = np.minimum(x.astype(int), len(lons) - 2)
+        j = np.minimum(y.astype(int), len(lats) - 2)
+        a = x - i
+        b = y - j
+
+        tec = self.tec[k]
+        return (1 - a) * (1 - b) * tec[j, i] + a * (1 - b) * tec[j, i + 1] + \
+            (1 - a) * b * tec[j + 1, i] + a * b * tec[j + 1, i + 1]
+
+    def vtec(self, t, lat, lon):
+        """
+        Vertical TEC [TECU].
+
+        :param t:   [gtime_t] Time
+        :param lat: [array] Latitude [deg]
+        :param lon: [array] Longitude [deg]
+        :return: [array] VTEC, nan out of the time span of the file
+        """
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        dt = timediff(t, self.t0)
+        if dt < self.times[0] or dt > self.times[-1]:
+            return np.full(lat.shape, np.nan)
+
+        k = min(int(np.searchsorted(self.times, dt, side='right')) - 1, len(self.times) - 2)
+        t1, t2 = self.times[k], self.times[k + 1]
+        w = (dt - t1) / (t2 - t1)
+
+        # NOTE: maps rotated with the Sun, lon' = lon + 360 * (t - Ti) / 86400
+        e1 = self._grid(k, lat, lon + 360.0 * (dt - t1) / 86400.0)
+        e2 = self._grid(k + 1, lat, lon + 360.0 * (dt - t2) / 86400.0)
+        return (1 - w) * e1 + w * e2
+
+    def stec(self, t, pos, az, el):
+        """
+        Slant TEC along the line of sight (single layer model).
+
+        :param t:   [gtime_t] Time
+        :param pos: [array] Receiver geodetic position [lat, lon, h] [rad, m]
+        :param az:  [array] Azimuth [rad]
+        :param el:  [array] Elevation [rad]
+        :return: [array] STEC [TECU]
+        """
+        az = np.asarray(az, dtype=float)
+        el = np.asarray(el, dtype=float)
+
+        rp = self.re / (self.re + self.hion) * np.cos(el)
+        ap = np.pi / 2.0 - el - np.arcsin(rp)
+        sinap = np.sin(ap)
+        tanap = np.tan(ap)
+        cosaz = np.cos(az)
+        posp0 = np.arcsin(np.sin(pos[0]) * np.cos(ap) + np.cos(pos[0]) * sinap * cosaz)
+
+        # NOTE: pierce points beyond the pole
+        north = (pos[0] > 70.0 * np.pi / 180.0) & (tanap * cosaz > np.tan(np.pi / 2.0 - pos[0]))
+        south = (pos[0] < -70.0 * np.pi / 180.0) & (-tanap * cosaz > np.tan(np.pi / 2.0 + pos[0]))
+        dlon = np.arcsin(sinap * np.sin(az) / np.cos(posp0))
+        posp1 = pos[1] + np.where(north | south, np.pi - dlon, dlon)
+
+        mapf = 1.0 / np.sqrt(1.0 - rp * rp)     # 1/cos(z') of the pierce point
+        return mapf * self.vtec(t, np.rad2deg(posp0), np.rad2deg(posp1))
+
+    def delay(self, t, pos, az, el, freq):
+        """
+        Slant ionospheric delay [m] at frequency freq [Hz].
+        """
+        return K_IONO * self.stec(t, pos, az, el) / (np.asarray(freq, dtype=float) ** 2)
+
+    def correct(self, obs, pos, sat, az, el):
+        """
+        Remove the GIM ionospheric delay from the observations (code -I, phase +I).
+
+        :param obs: [Obs] Observations (modified)
+        :param pos: [array] Receiver geodetic position [lat, lon, h] [rad, m]
+        :param sat: [array] Satellites with az/el (others are not corrected)
+        :param az:  [array] Azimuth [rad]
+        :param el:  [array] Elevation [rad]
+        :return: [array] STEC of each satellite in sat [TECU]
+        """
+        stec = self.stec(obs.t, pos, az, el)
+        row = {s: k for k, s in enumerate(obs.sat)}
+        for s, tec in zip(sat, stec):
+            if np.isnan(tec) or s not in row:
+                continue
+            sys, _ = sat2prn(s)
+            if sys == uGNSS.GLO or sys not in obs.sig:
+                continue # NOTE: FDMA frequencies not handled
+            k = row[s]
+            for j, sig in enumerate(obs.sig[sys].get(uTYP.C, [])):
+                if obs.P[k, j] != 0.0:
+                    obs.P[k, j] -= K_IONO * tec / sig.frequency() ** 2
+            for j, sig in enumerate(obs.sig[sys].get(uTYP.L, [])):
+                if obs.L[k, j] != 0.0: # NOTE: phase in cycles
+                    obs.L[k, j] += K_IONO * tec / sig.frequency() ** 2 * sig.frequency() / 299792458.0
+        return stec
+
+
+def obs_azel(obs, nav, rr, ephidx=None):
+    """
+    Azimuth/elevation of the satellites of an epoch with the broadcast ephemeris.
+
+    :param obs:    [Obs] Observations
+    :param nav:    [Nav] Navigation data
+    :param rr:     [array] Receiver position [ECEF]
+    :param ephidx: [EphIndex] Ephemeris index of nav.eph [default: findeph]
+    :return: (sat, az, el)
+    """
+    pos = ecef2pos(rr)
+    sats, azs, els = [], [], []
+    for sat in obs.sat:
+        eph = ephidx.find(obs.t, sat) if ephidx is not None else findeph(nav.eph, obs.t, sat)
+        if eph is None:
+            continue
+        rs, _ = eph2pos(obs.t, eph)
+        _, e = geodist(rs, rr)
+        az, el = satazel(pos, e)
+        sats.append(sat)
+        azs.append(az)
+        els.append(el)
+    return np.array(sats, dtype=int), np.array(azs), np.array(els)
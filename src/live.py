@@ -0,0 +1,254 @@
+"""
+Module to follow the engines while they run: result ring, live web dashboard and console summary
+
+The engines publish every epoch into a ResultRing, a preallocated array written by one thread
+without locks (the row of the epoch and a counter, ~1 us). The readers never block the engine:
+    Dashboard       local web page (server-sent events) with the EN scatter, the solution mode, the
+                    number of satellites and the ZTD. A thread reads the ring at a fixed refresh rate
+                    and sends at most maxpoints rows per update (downsampled), whatever the epoch rate.
+    ConsoleSummary  one line every interval seconds instead of one line per epoch.
+
+Kinematic runs have no ENU (nan), the dashboard shows them from the first position.
+"""
+
+import json
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+from cssrlib.gnss import time2str
+
+from src.trajectory import ecef2latlon, ecef2enu_vec
+
+
+FIELDS = ['t', 'x', 'y', 'z', 'e', 'n', 'u', 'smode', 'nsat', 'ztd']
+DEFAULT_PORT = 8760
+
+
+class ResultRing():
+    """
+    Ring of the last epoch results, one writer (the engine) and any number of readers.
+
+    :param size: [int] Epochs kept
+    """
+    def __init__(self, size=4096):
+        self.size = size
+        self.buf = np.full((size, len(FIELDS)), np.nan)
+        self.seq = 0            # epochs published
+
+    def publish(self, t, sol, enu, smode, nsat, ztd=np.nan):
+        """
+        Add the result of an epoch (never blocks).
+
+        :param t:     [float] Epoch [s] (gtime_t.time + sec)
+        :param sol:   [array] Position ECEF [m]
+        :param enu:   [array] ENU error [m] (nan in kinematic mode)
+        :param smode: [int] Solution mode (4: fix, 5: float, ...)
+        :param nsat:  [int] Satellites of the epoch
+        :param ztd:   [float] Troposphere state [m]
+        """
+        self.buf[self.seq % self.size] = (t, sol[0], sol[1], sol[2], enu[0], enu[1], enu[2], smode, nsat, ztd)
+        self.seq += 1
+
+    def since(self, seq, maxrows=None):
+        """
+        Rows published after seq, the oldest ones are lost if the reader is more than size - 1 epochs behind.
+
+        :param seq:     [int] Epochs already read
+        :param maxrows: [int] Downsample to this number of rows (the last one is always kept)
+        :return: (seq, rows (N, len(FIELDS)))
+        """
+        end = self.seq
+        seqs = np.arange(max(seq, end - self.size + 1), end)
+        if maxrows is not None and len(seqs) > maxrows:
+            seqs = seqs[np.linspace(0, len(seqs) - 1, maxrows).round().astype(np.int64)]
+        rows = self.buf[seqs % self.size]
+        # NOTE: the rows written by the engine during the copy are dropped (the row being written too)
+        return end, rows[seqs > self.seq - self.size]
+
+
+class ConsoleSummary():
+    """
+    Rate-limited console output of the engines.
+
+    :param interval: [float] Seconds between two lines
+    :param stream:   [file] Output [default: sys.stdout]
+    """
+    def __init__(self, interval=1.0, stream=None):
+        self.interval = interval
+        self.stream = stream if stream is not None else sys.stdout
+        self.n = 0
+        self.nfix = 0
+        self.t0 = time.monotonic()
+        self.next = self.t0
+
+    def update(self, t, enu, smode, nsat):
+        """
+        Count an epoch, write the summary if interval seconds have passed since the last one.
+
+        :param t: [gtime_t] Epoch
+        """
+        self.n += 1
+        self.nfix += smode == 4
+        now = time.monotonic()
+        if now < self.next:
+            return
+        self.next = now + self.interval
+        self.stream.write(' {} epochs {} ({:.1f}/s) ENU: {:7.3f} {:7.3f} {:7.3f}, 2D {:6.3f}, mode {:1d}, fix {:5.1f}%, nsat {}\n'
+                          .format(time2str(t), self.n, self.n / max(now - self.t0, 1e-9), enu[0], enu[1], enu[2],
+                                  np.sqrt(enu[0]**2 + enu[1]**2), int(smode), 100.0 * self.nfix / self.n, int(nsat)))
+        self.stream.flush()
+
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>GNSS live</title>
+<style>body{font-family:monospace;margin:1em}canvas{border:1px solid #999;margin-right:1em}</style></head>
+<body><div id="status">waiting for the engine ...</div>
+<canvas id="en" width="480" height="480"></canvas><canvas id="ztd" width="480" height="200"></canvas>
+<script>
+const MAX = 5000, COLORS = {4: 'green', 5: 'orange'};
+let pts = [], ztd = [];
+function scatter() {
+  const c = document.getElementById('en').getContext('2d'), w = c.canvas.width, h = c.canvas.height;
+  c.clearRect(0, 0, w, h);
+  let r = 0.01;
+  for (const p of pts) r = Math.max(r, Math.abs(p[0]), Math.abs(p[1]));
+  c.strokeStyle = '#ccc'; c.beginPath(); c.moveTo(w/2, 0); c.lineTo(w/2, h); c.moveTo(0, h/2); c.lineTo(w, h/2); c.stroke();
+  for (const p of pts) { c.fillStyle = COLORS[p[2]] || 'red'; c.fillRect(w/2 + p[0]/r*w*0.45 - 1, h/2 - p[1]/r*h*0.45 - 1, 3, 3); }
+  c.fillStyle = 'black'; c.fillText('EN, scale ' + r.toFixed(3) + ' m', 5, 12);
+}
+function series() {
+  const c = document.getElementById('ztd').getContext('2d'), w = c.canvas.width, h = c.canvas.height;
+  c.clearRect(0, 0, w, h);
+  if (ztd.length < 2) return;
+  let lo = Math.min(...ztd), hi = Math.max(...ztd); if (hi - lo < 1e-3) { lo -= 5e-4; hi += 5e-4; }
+  c.beginPath();
+  ztd.forEach((v, i) => { const x = i / (ztd.length - 1) * w, y = h - (v - lo) / (hi - lo) * (h - 20) - 10; i ? c.lineTo(x, y) : c.moveTo(x, y); });
+  c.stroke(); c.fillText('ZTD ' + lo.toFixed(4) + ' .. ' + hi.toFixed(4) + ' m', 5, 12);
+}
+const src = new EventSource('/events');
+src.onmessage = (ev) => {
+  const m = JSON.parse(ev.data);
+  for (let i = 0; i < m.e.length; i++) {
+    if (m.e[i] !== null) pts.push([m.e[i], m.n[i], m.smode[i]]);
+    if (m.ztd[i] !== null) ztd.push(m.ztd[i]);
+  }
+  pts = pts.slice(-MAX); ztd = ztd.slice(-MAX);
+  const k = m.e.length - 1;
+  document.getElementById('status').textContent = m.time + '  epochs ' + m.seq + '  mode ' + m.smode[k] + '  nsat ' + m.nsat[k] +
+    '  ENU ' + [m.e[k], m.n[k], m.u[k]].map(v => v === null ? 'nan' : v.toFixed(3)).join(' ');
+  scatter(); series();
+};
+</script></body></html>
+"""
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        dash = self.server.dashboard
+        if self.path == '/':
+            body = PAGE.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == '/events':
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            seq = max(0, dash.ring.seq - dash.ring.size)
+            idle = 0.0
+            try:
+                while not dash.closed.is_set():
+                    seq, rows = dash.ring.since(seq, dash.maxpoints)
+                    if len(rows):
+                        self.wfile.write(b'data: ' + json.dumps(dash.message(rows, seq)).encode() + b'\n\n')
+                        idle = 0.0
+                    elif idle >= 10.0:
+                        self.wfile.write(b': ping\n\n')
+                        idle = 0.0
+                    self.wfile.flush()
+                    dash.closed.wait(1.0 / dash.rate)
+                    idle += 1.0 / dash.rate
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        else:
+            self.send_error(404)
+
+
+class Dashboard():
+    """
+    Local web page with the results of a ResultRing (server-sent events).
+
+    :param ring:      [ResultRing] Results of the engine
+    :param host:      [str] Address to listen on
+    :param port:      [int] Port (0: any free port)
+    :param rate:      [float] Updates per second sent to the page
+    :param maxpoints: [int] Maximum rows per update (downsampled)
+    :param xyz_ref:   [array] Origin of the ENU of the kinematic runs [default: first position]
+    """
+    def __init__(self, ring, host='127.0.0.1', port=DEFAULT_PORT, rate=2.0, maxpoints=200, xyz_ref=None):
+        self.ring = ring
+        self.rate = rate
+        self.maxpoints = maxpoints
+        self.origin = None
+        if xyz_ref is not None:
+            self._set_origin(np.asarray(xyz_ref, dtype=np.float64))
+        self.closed = threading.Event()
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.dashboard = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[0:2]
+        return 'http://{}:{}/'.format(host, port)
+
+    def start(self):
+        """
+        Serve the page in a background thread.
+
+        :return: [str] URL of the page
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def close(self):
+        self.closed.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _set_origin(self, xyz):
+        lat, lon = ecef2latlon(xyz)
+        self.origin = (xyz, lat, lon)
+
+    def message(self, rows, seq):
+        """
+        Update of the page from rows of the ring (ENU from the origin where the engine has none).
+        """
+        enu = rows[:, 4:7].copy()
+        kin = np.isnan(enu[:, 0]) & np.isfinite(rows[:, 1]) & (np.abs(rows[:, 1:4]).sum(axis=1) > 0)
+        if kin.any():
+            if self.origin is None:
+                self._set_origin(rows[np.argmax(kin), 1:4])
+            xyz, lat, lon = self.origin
+            enu[kin] = ecef2enu_vec(np.repeat(lat, kin.sum()), np.repeat(lon, kin.sum()), rows[kin, 1:4] - xyz)
+
+        def col(v, nd=4):
+            return [round(float(x), nd) if np.isfinite(x) else None for x in v]
+
+        t = rows[-1, 0]
+        return {'seq': seq, 'time': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t)) if np.isfinite(t) else '',
+                'e': col(enu[:, 0]), 'n': col(enu[:, 1]), 'u': col(enu[:, 2]),
+                'smode': [int(v) if np.isfinite(v) else 0 for v in rows[:, 7]],
+                'nsat': [int(v) if np.isfinite(v) else 0 for v in rows[:, 8]], 'ztd': col(rows[:, 9], 7)}
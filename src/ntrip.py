@@ -0,0 +1,619 @@
+"""
+Module for the NTRIP client (asyncio) and the RTCM3 decoding for real-time RTK
+
+    NtripClient     connection to the caster (NTRIP 1.0/2.0), reconnect with backoff
+    RtcmFramer      incremental RTCM3 framing (preamble, length, CRC-24Q)
+    RtcmDecoder     MSM observations -> base Obs epochs, station position (1005/1006), ephemeris
+    rtk_realtime    feed a rtkpos instance with the rover and the base epochs of the stream
+"""
+
+import asyncio
+import base64
+import time
+from collections import deque
+
+import numpy as np
+
+from cssrlib.rtcm import rtcm, sRTCM
+from cssrlib.gnss import Obs, uTYP, sat2prn, timeadd, timediff, time2gpst, gpst2utc, utc2gpst, timeget
+
+
+RTCM3_PREAMBLE = 0xD3
+RTCM3_MAXLEN = 1023
+
+def _crc24q_table():
+    table = np.zeros(256, dtype=np.uint32)
+    for i in range(256):
+        crc = i << 16
+        for _ in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= 0x1864CFB
+        table[i] = crc & 0xFFFFFF
+    return [int(v) for v in table]
+
+CRC24Q = _crc24q_table()
+
+def crc24q(data):
+    """
+    CRC-24Q of the RTCM3 frames.
+
+    :param data: [bytes] Data
+    :return: [int] CRC
+    """
+    crc = 0
+    for b in data:
+        crc = ((crc << 8) & 0xFFFFFF) ^ CRC24Q[(crc >> 16) ^ b]
+    return crc
+
+def rtcm_frame(payload):
+    """
+    Build a RTCM3 frame (preamble + length + payload + CRC).
+
+    :param payload: [bytes] Message
+    :return: [bytes] Frame
+    """
+    if len(payload) > RTCM3_MAXLEN:
+        raise ValueError("RTCM3 payload too long!")
+    frame = bytes([RTCM3_PREAMBLE, len(payload) >> 8, len(payload) & 0xFF]) + bytes(payload)
+    return frame + crc24q(frame).to_bytes(3, 'big')
+
+def gtime2unix(t):
+    """
+    GPST -> UNIX time [s] (for the latency metrics).
+    """
+    tu = gpst2utc(t)
+    return tu.time + tu.sec
+
+
+class RtcmFramer():
+    """
+    Split a byte stream in RTCM3 frames. Data can arrive in chunks of any size.
+    """
+    def __init__(self):
+        self.buff = bytearray()
+        self.nbytes = 0
+        self.nframe = 0
+        self.nerr = 0       # CRC errors
+
+    def feed(self, data):
+        """
+        Add data to the buffer.
+
+        :param data: [bytes] Data received
+        :return: [list of bytes] Complete frames
+        """
+        self.buff += data
+        self.nbytes += len(data)
+        frames = []
+        i = 0
+        n = len(self.buff)
+        while True:
+            i = self.buff.find(RTCM3_PREAMBLE, i)
+            if i < 0:
+                i = n
+                break
+            if n - i < 3:
+                break
+            if self.buff[i + 1] & 0xFC: # NOTE: reserved bits must be 0, false preamble
+                i += 1
+                continue
+            len_ = ((self.buff[i + 1] & 0x03) << 8) | self.buff[i + 2]
+            if n - i < len_ + 6:
+                break
+            frame = bytes(self.buff[i:i + len_ + 6])
+            if crc24q(frame) == 0:
+                frames.append(frame)
+                self.nframe += 1
+                i += len_ + 6
+            else: # NOTE: false preamble or corrupted frame, resync on the next byte
+                self.nerr += 1
+                i += 1
+        del self.buff[:i]
+        return frames
+
+    def reset(self):
+        """
+        Drop the partial frame (after a reconnection).
+        """
+        self.buff.clear()
+
+
+class NtripStats():
+    """
+    Metrics of the NTRIP stream.
+    """
+    def __init__(self):
+        self.nbytes = 0
+        self.nframe = 0
+        self.nerr = 0
+        self.nepoch = 0
+        self.reconnect = 0
+        self.connected = False
+        self.msgtype = {}       # number of messages by type
+        self.latency = np.nan   # arrival - epoch time of the last base epoch [s]
+        self.age = np.nan       # age of the corrections used in the last rover epoch [s]
+        self.latencies = deque(maxlen=3600)
+        self.ages = deque(maxlen=3600)
+
+    def summary(self):
+        """
+        Text with the metrics.
+        """
+        lat = np.array(self.latencies) if self.latencies else np.array([np.nan])
+        age = np.array(self.ages) if self.ages else np.array([np.nan])
+        return ("bytes {} frames {} crc-err {} epochs {} reconnect {} "
+                "latency {:.3f}s (mean {:.3f}s, max {:.3f}s) age {:.3f}s (mean {:.3f}s)"
+                .format(self.nbytes, self.nframe, self.nerr, self.nepoch, self.reconnect,
+                        self.latency, np.mean(lat), np.max(lat), self.age, np.mean(age)))
+
+
+class RtcmDecoder():
+    """
+    Decode RTCM3 frames into base observation epochs.
+
+    :param sig_tab: [dict] Signal table of the base, as rnxdec.sig_tab {sys: {typ: [rSigRnx]}}
+                    [default: the signals of the MSM messages, added as they arrive]
+    :param nav:     [Nav] If given, the broadcast ephemeris of the stream are added to nav.eph
+    :param tref:    [gtime_t] Reference time for the GPS week (replay of recorded files) [default: now]
+    :param maxepoch:[int] Number of base epochs kept in the buffer
+    """
+    def __init__(self, sig_tab=None, nav=None, tref=None, maxepoch=120):
+        self.rtcm = rtcm()
+        self.rtcm.monlevel = 0
+        self.auto = sig_tab is None
+        self.sig_tab = {} if sig_tab is None else sig_tab
+        self.nsig = {typ: 0 for typ in (uTYP.C, uTYP.L, uTYP.D, uTYP.S)}
+        self._count()
+        self.nav = nav
+        self.tref = tref
+
+        self.pos = None         # station ARP (1005/1006) [ECEF]
+        self.refid = None
+        self.msm = []           # MSM messages of the current epoch
+        self.epochs = deque(maxlen=maxepoch)    # (Obs, arrival unix time)
+        self.event = asyncio.Event()
+
+    def _count(self):
+        for sigs in self.sig_tab.values():
+            for typ, sig in sigs.items():
+                self.nsig[typ] = max(self.nsig[typ], len(sig))
+
+    def _learn(self, msm):
+        """
+        Add the systems and signals of the MSM messages to the signal table (sig_tab by default).
+        """
+        changed = False
+        for ob in msm:
+            sigs = self.sig_tab.setdefault(ob.sys, {})
+            for typ, new in ob.sig.get(ob.sys, {}).items():
+                old = sigs.setdefault(typ, [])
+                strs = [s.str() for s in old]
+                for sig in new:
+                    if sig.str() not in strs:
+                        old.append(sig)
+                        strs.append(sig.str())
+                        changed = True
+        if changed:
+            self._count()
+
+    def _week(self):
+        tref = self.tref if self.tref is not None else utc2gpst(timeget())
+        week, _ = time2gpst(tref)
+        return week, tref
+
+    def decode(self, frame, arrival=None):
+        """
+        Decode one frame.
+
+        :param frame:   [bytes] RTCM3 frame
+        :param arrival: [float] UNIX time of arrival [default: now]
+        :return: Obs if the frame completes an epoch, else None
+        """
+        arrival = time.time() if arrival is None else arrival
+        dec = self.rtcm
+        dec.len = len(frame) - 6
+        dec.dlen = len(frame)
+        dec.week, tref = self._week()
+        if dec.time.time == 0: # NOTE: ephemeris before the first MSM
+            dec.time = tref
+
+        _, obs, eph, geph, seph = dec.decode(frame)
+
+        if dec.subtype == sRTCM.ANT_POS:
+            self.pos = dec.pos_arp
+            self.refid = dec.refid
+        elif eph is not None and self.nav is not None:
+            self.nav.eph.append(eph)
+        elif geph is not None and self.nav is not None:
+            self.nav.geph.append(geph)
+
+        if obs is None:
+            return None
+
+        # NOTE: week rollover between the reference and the message
+        t = dec.time
+        dt = timediff(t, tref)
+        if dt > 302400.0:
+            t = timeadd(t, -604800.0)
+        elif dt < -302400.0:
+            t = timeadd(t, 604800.0)
+        obs.t = t
+        obs.sys = dec.msmtype(dec.msgtype)[0]
+
+        if self.msm and timediff(obs.t, self.msm[0].t) != 0.0: # NOTE: multiple message bit lost
+            self._close_epoch(arrival)
+        self.msm.append(obs)
+
+        if dec.mi == 0: # NOTE: last MSM of the epoch
+            return self._close_epoch(arrival)
+        return None
+
+    def _close_epoch(self, arrival):
+        obs = self.merge(self.msm)
+        self.msm = []
+        if obs is None:
+            return None
+        self.epochs.append((obs, arrival))
+        self.event.set()
+        return obs
+
+    def merge(self, msm):
+        """
+        Merge the MSM messages of one epoch into one Obs with the columns of sig_tab.
+
+        :param msm: [list of Obs] MSM observations (one system each)
+        :return: Obs
+        """
+        if not msm:
+            return None
+        if self.auto:
+            self._learn(msm)
+        sat, rows = [], {typ: [] for typ in self.nsig}
+        for ob in msm:
+            sys = ob.sys
+            if sys not in self.sig_tab:
+                continue
+            for typ, attr in ((uTYP.C, 'P'), (uTYP.L, 'L'), (uTYP.S, 'S')):
+                col = np.zeros((len(ob.sat), self.nsig[typ]))
+                for j, sig in enumerate(self.sig_tab[sys].get(typ, [])):
+                    k = self._sigindex(ob.sig[sys].get(typ, []), sig)
+                    if k >= 0:
+                        col[:, j] = getattr(ob, attr)[:, k]
+                rows[typ].append(col)
+            lli = np.zeros((len(ob.sat), self.nsig[uTYP.L]), dtype=np.int32)
+            for j, sig in enumerate(self.sig_tab[sys].get(uTYP.L, [])):
+                k = self._sigindex(ob.sig[sys].get(uTYP.L, []), sig)
+                if k >= 0:
+                    lli[:, j] = ob.lli[:, k]
+            rows['lli'] = rows.get('lli', []) + [lli]
+            sat.append(ob.sat)
+
+        obs = Obs()
+        obs.t = msm[0].t
+        # NOTE: snapshot, the default table grows with new signals
+        obs.sig = {sys: {typ: list(v) for typ, v in sigs.items()} for sys, sigs in self.sig_tab.items()} \
+            if self.auto else self.sig_tab
+        if not sat:
+            return None
+        obs.sat = np.concatenate(sat).astype(np.int32)
+        n = len(obs.sat)
+        obs.P = np.nan_to_num(np.vstack(rows[uTYP.C]))
+        obs.L = np.nan_to_num(np.vstack(rows[uTYP.L]))
+        obs.S = np.vstack(rows[uTYP.S])
+        obs.D = np.zeros((n, self.nsig[uTYP.D]))
+        obs.lli = np.vstack(rows['lli'])
+        return obs
+
+    @staticmethod
+    def _sigindex(sigs, sig):
+        """
+        Index of sig in the MSM signals, same band with other tracking attribute if not found.
+        """
+        strs = [s.str() for s in sigs]
+        if sig.str() in strs:
+            return strs.index(sig.str())
+        for k, s in enumerate(strs):
+            if s[:2] == sig.str()[:2]:
+                return k
+        return -1
+
+    @staticmethod
+    def conform(obs, sig_tab):
+        """
+        Observations with the columns of another signal table (the rover one), the signals not in obs
+        are zero and the satellites of systems not in sig_tab are dropped.
+
+        :param obs:     [Obs] Base epoch
+        :param sig_tab: [dict] Signal table {sys: {typ: [rSigRnx]}}
+        :return: Obs (obs itself if the tables are the same)
+        """
+        def strs(tab):
+            return {sys: {typ: [s.str() for s in sigs] for typ, sigs in tabs.items()} for sys, tabs in tab.items()}
+        if obs.sig is sig_tab or strs(obs.sig) == strs(sig_tab):
+            return obs
+
+        nsig = {typ: max([len(tabs.get(typ, [])) for tabs in sig_tab.values()] + [0])
+                for typ in (uTYP.C, uTYP.L, uTYP.D, uTYP.S)}
+        gnss = np.array([sat2prn(sat)[0] for sat in obs.sat])
+        keep = np.isin(gnss, list(sig_tab))
+        out = Obs()
+        out.t = obs.t
+        out.sig = sig_tab
+        out.sat = np.asarray(obs.sat)[keep]
+        n = len(out.sat)
+        cols = {}
+        for typ, attr in ((uTYP.C, 'P'), (uTYP.L, 'L'), (uTYP.D, 'D'), (uTYP.S, 'S')):
+            cols[attr] = (typ, getattr(obs, attr), np.zeros((n, nsig[typ])))
+        cols['lli'] = (uTYP.L, obs.lli, np.zeros((n, nsig[uTYP.L]), dtype=np.int32))
+        for sys in sig_tab:
+            rows = np.nonzero(gnss[keep] == sys)[0]
+            if not len(rows):
+                continue
+            src = np.nonzero(keep)[0][rows]
+            for typ, old, new in cols.values():
+                for j, sig in enumerate(sig_tab[sys].get(typ, [])):
+                    k = RtcmDecoder._sigindex(obs.sig.get(sys, {}).get(typ, []), sig)
+                    if k >= 0 and k < old.shape[1]:
+                        new[rows, j] = old[src, k]
+        out.P, out.L, out.D, out.S = (cols[a][2] for a in ('P', 'L', 'D', 'S'))
+        out.lli = cols['lli'][2]
+        return out
+
+    def find(self, t, dt_th=0.1):
+        """
+        Base epoch of the buffer at time t.
+
+        :return: (Obs, arrival) or (None, None)
+        """
+        for obs, arrival in reversed(self.epochs):
+            if abs(timediff(obs.t, t)) <= dt_th:
+                return obs, arrival
+        return None, None
+
+
+class NtripClient():
+    """
+    NTRIP client (asyncio).
+
+    :param host:       [str] Caster
+    :param port:       [int] Port [default: 2101]
+    :param mountpoint: [str] Mountpoint
+    :param user:       [str] User
+    :param password:   [str] Password
+    :param gga:        [str] NMEA GGA sentence sent after the connection (VRS/nearest mountpoints)
+    :param timeout:    [float] Timeout without data before reconnecting [s]
+    :param backoff:    [float] First wait before reconnecting, doubled on each failure [s]
+    :param maxbackoff: [float] Maximum wait before reconnecting [s]
+    :param maxretry:   [int] Maximum consecutive reconnections (-1: no limit)
+    """
+    def __init__(self, host, port=2101, mountpoint='', user=None, password=None, gga=None,
+                 timeout=10.0, backoff=1.0, maxbackoff=60.0, maxretry=-1):
+        self.host = host
+        self.port = port
+        self.mountpoint = mountpoint.lstrip('/')
+        self.user = user
+        self.password = password
+        self.gga = gga
+        self.timeout = timeout
+        self.backoff = backoff
+        self.maxbackoff = maxbackoff
+        self.maxretry = maxretry
+
+        self.stats = NtripStats()
+        self.framer = RtcmFramer()
+        self.stop = asyncio.Event()
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """
+        Client from 'user:password@host:port/MOUNTPOINT'.
+        """
+        user = password = None
+        if '@' in url:
+            auth, url = url.rsplit('@', 1)
+            user, _, password = auth.partition(':')
+        host, _, mountpoint = url.partition('/')
+        host, _, port = host.partition(':')
+        return cls(host, int(port) if port else 2101, mountpoint, user, password, **kwargs)
+
+    def request(self):
+        """
+        HTTP request of the mountpoint (NTRIP 2.0, casters 1.0 answer ICY 200 OK).
+        """
+        req = ("GET /{} HTTP/1.1\r\n"
+               "Host: {}:{}\r\n"
+               "Ntrip-Version: Ntrip/2.0\r\n"
+               "User-Agent: NTRIP TFG/1.0\r\n"
+               "Connection: close\r\n").format(self.mountpoint, self.host, self.port)
+        if self.user is not None:
+            auth = base64.b64encode("{}:{}".format(self.user, self.password or '').encode()).decode()
+            req += "Authorization: Basic {}\r\n".format(auth)
+        return (req + "\r\n").encode()
+
+    async def _connect(self):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+        writer.write(self.request())
+        if self.gga:
+            writer.write(self.gga.strip().encode() + b"\r\n")
+        await writer.drain()
+
+        status = await asyncio.wait_for(reader.readline(), self.timeout)
+        if b'200' not in status:
+            writer.close()
+            raise ConnectionError("Caster answered: {}".format(status.decode(errors='ignore').strip()))
+
+        chunked = False
+        if status.startswith(b'HTTP'):
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.timeout)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                if line.lower().startswith(b'transfer-encoding') and b'chunked' in line.lower():
+                    chunked = True
+        return reader, writer, chunked
+
+    async def _read(self, reader, chunked):
+        if not chunked:
+            return await asyncio.wait_for(reader.read(4096), self.timeout)
+        size = await asyncio.wait_for(reader.readline(), self.timeout)
+        if size == b'':
+            return b''
+        size = int(size.split(b';')[0].strip() or b'0', 16)
+        if size == 0:
+            return b''
+        data = await asyncio.wait_for(reader.readexactly(size + 2), self.timeout)
+        return data[:-2]
+
+    async def frames(self):
+        """
+        Async generator of RTCM3 frames, reconnects with exponential backoff.
+
+        :return: (frame, arrival unix time)
+        """
+        wait = self.backoff
+        retry = 0
+        while not self.stop.is_set():
+            writer = None
+            try:
+                reader, writer, chunked = await self._connect()
+                self.stats.connected = True
+                self.framer.reset()
+                while not self.stop.is_set():
+                    data = await self._read(reader, chunked)
+                    if not data:
+                        raise ConnectionError("Caster closed the connection")
+                    arrival = time.time()
+                    self.stats.nbytes += len(data)
+                    wait, retry = self.backoff, 0 # NOTE: data received, reset backoff
+                    for frame in self.framer.feed(data):
+                        yield frame, arrival
+                    self.stats.nframe = self.framer.nframe
+                    self.stats.nerr = self.framer.nerr
+            except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as error:
+                self.stats.connected = False
+                if self.stop.is_set():
+                    break
+                retry += 1
+                if 0 <= self.maxretry < retry:
+                    raise ConnectionError("NTRIP: too many reconnections ({})".format(error))
+                print("NTRIP: {}, reconnecting in {:.1f}s".format(error, wait))
+                self.stats.reconnect += 1
+                try:
+                    await asyncio.wait_for(self.stop.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                wait = min(2 * wait, self.maxbackoff)
+            finally:
+                if writer is not None:
+                    writer.close()
+
+    async def run(self, decoder, out=None):
+        """
+        Decode the stream until stop is set.
+
+        :param decoder: [RtcmDecoder] Decoder of the base epochs
+        :param out:     [file] If given, the frames are saved (binary)
+        """
+        async for frame, arrival in self.frames():
+            if out is not None:
+                out.write(frame)
+            msgtype = ((frame[3] << 4) | (frame[4] >> 4)) if len(frame) > 5 else 0
+            self.stats.msgtype[msgtype] = self.stats.msgtype.get(msgtype, 0) + 1
+            obs = decoder.decode(frame, arrival)
+            if obs is not None:
+                self.stats.nepoch += 1
+                self.stats.latency = arrival - gtime2unix(obs.t)
+                self.stats.latencies.append(self.stats.latency)
+
+
+async def rtk_realtime(rtkPosition, nav, rover, decoder, stats=None, dt_th=0.1, maxwait=2.0, callback=None):
+    """
+    Process the rover epochs with the base epochs of the NTRIP stream.
+
+    :param rtkPosition: [rtkpos] RTK filter already configured
+    :param nav:         [Nav] Navigation data of the filter
+    :param rover:       Async iterator of rover Obs (the base epochs get the columns of its obs.sig)
+    :param decoder:     [RtcmDecoder] Decoder fed by NtripClient.run
+    :param stats:       [NtripStats] Metrics (age of corrections)
+    :param dt_th:       [float] Maximum time difference rover/base [s]
+    :param maxwait:     [float] Maximum wait for the base epoch [s]
+    :param callback:    Function called after each epoch callback(obs, nav)
+    :return: [int] Number of epochs processed
+    """
+    ne = 0
+    async for obs in rover:
+        base_obs, arrival = decoder.find(obs.t, dt_th)
+        t_wait = time.time() + maxwait
+        while base_obs is None and time.time() < t_wait:
+            decoder.event.clear()
+            try:
+                await asyncio.wait_for(decoder.event.wait(), t_wait - time.time())
+            except asyncio.TimeoutError:
+                break
+            base_obs, arrival = decoder.find(obs.t, dt_th)
+        if base_obs is None:
+            continue # NOTE: no corrections for this epoch
+        if obs.sig:
+            base_obs = decoder.conform(base_obs, obs.sig) # NOTE: columns of the rover signals
+
+        if decoder.pos is not None:
+            nav.rb = decoder.pos
+        if stats is not None:
+            stats.age = time.time() - gtime2unix(base_obs.t)
+            stats.ages.append(stats.age)
+
+        rtkPosition.process(obs, obsb=base_obs)
+        ne += 1
+        if callback is not None:
+            callback(obs, nav)
+    return ne
+
+
+async def rinex_rover(dec, realtime=False):
+    """
+    Rover epochs from a rnxdec (replay), paced at the data rate if realtime.
+    """
+    obs = dec.decode_obs()
+    t_prev = None
+    while obs.t.time != 0:
+        if realtime and t_prev is not None:
+            await asyncio.sleep(max(0.0, timediff(obs.t, t_prev)))
+        else:
+            await asyncio.sleep(0)
+        t_prev = obs.t
+        yield obs
+        obs = dec.decode_obs()
+
+
+async def ntrip_monitor(url, duration=60.0, outfile=None, sig_tab=None, every=10.0):
+    """
+    Connect to a mountpoint, print the metrics of the stream and save the RTCM (optional).
+
+    :param url:      [str] 'user:password@host:port/MOUNTPOINT'
+    :param duration: [float] Duration [s]
+    :param outfile:  [str] RTCM3 output file
+    :param sig_tab:  [dict] Signal table for the base epochs [default: the signals of the MSM messages]
+    :param every:    [float] Print the metrics every N seconds
+    """
+    client = NtripClient.from_url(url)
+    decoder = RtcmDecoder(sig_tab)
+    out = open(outfile, 'wb') if outfile else None
+
+    task = asyncio.create_task(client.run(decoder, out))
+    try:
+        t_end = time.time() + duration
+        while time.time() < t_end and not task.done():
+            await asyncio.sleep(min(every, max(0.0, t_end - time.time())))
+            print("NTRIP {}: {}".format(client.mountpoint, client.stats.summary()))
+    finally:
+        client.stop.set()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        if out is not None:
+            out.close()
+    return client.stats
@@ -1,9 +1,6 @@
 import subprocess
 import os
 import sys
-
-import serial
-from pyubx2 import UBXReader
 import time
 
 
@@ -12,9 +9,6 @@ import matplotlib.dates as md
 import numpy as np
 import pandas as pd
 
-import simplekml # Create .kml files 
-import pymap3d as pm
-
 from typing import List
 
 # TODO: hacer una funcion que haga una nube de puntos, por ejemplo:
@@ -137,6 +131,47 @@ def plt_NorthEastUp(t, enu, ztd, smode):
     
     #plt.show()
 
+def plt_skyplot(sky, elmask=0):
+    """
+    Skyplot from the compact az/el storage of the PPP/RTK modules (src.sparse.SatTrack).
+
+    :sky: SatTrack with 'azm' and 'elv' fields [rad]
+    :elmask: elevation mask [deg]
+
+    :return: number of satellites plotted
+    """
+    from cssrlib.gnss import sat2prn, sat2id
+
+    fig = plt.figure('skyplot')
+    ax = fig.add_subplot(projection='polar')
+    ax.set_theta_zero_location('N')
+    ax.set_theta_direction(-1)
+    ax.set_ylim([0, 90])
+    ax.set_rgrids(radii=[15, 30, 45, 60, 75], labels=['75', '60', '45', '30', '15'], fmt='%d')
+    col_tbl = 'bygmkrc'
+
+    sat = sky.sat[:sky.n]
+    azm = sky.values['azm'][:sky.n]
+    elv = np.rad2deg(sky.values['elv'][:sky.n])
+
+    # NOTE: group the rows by satellite once (stable sort keeps the epoch order)
+    idx = np.argsort(sat, kind='stable')
+    sats, first = np.unique(sat[idx], return_index=True)
+
+    nsat = 0
+    for sat_, rows in zip(sats, np.split(idx, first[1:])):
+        rows = rows[elv[rows] > elmask]
+        if len(rows) == 0:
+            continue
+        gnss, _ = sat2prn(int(sat_))
+        z = 90 - elv[rows]
+        theta = azm[rows]
+        ax.scatter(theta, z, s=5, c=col_tbl[gnss % len(col_tbl)])
+        ax.text(theta[0], z[0], sat2id(int(sat_)), fontsize=8)
+        nsat += 1
+    plt.show()
+    return nsat
+
 def plt_3D(vector):
     """
     3D plot of a Mx3 vector. 
@@ -281,10 +316,9 @@ def horizontal_error_over_time(enu_list: List[np.ndarray], labels: List[str], fi
 
     return fig
 
-import seaborn as sns
-from typing import List
-
 def histogram_horizontal_error(enu_list: List[np.ndarray], labels: List[str], bins: int = 30, filepath: str = None):
+    import seaborn as sns # NOTE: only this plot uses it
+
     fig, ax = plt.subplots(figsize=(12, 6))
     
     # Create a secondary axis for the density plot
@@ -0,0 +1,212 @@
+"""
+Module to evaluate precise orbits (SP3) and clocks (Clock-RINEX) with precomputed polynomials
+
+cssrlib.peph interpolates the SP3 with Neville's algorithm (NMAX+1 points, Earth rotation
+corrected to the requested time) at every call. The same polynomial is fitted here once per
+window of NMAX+1 epochs, after the files are loaded:
+    - nodes rotated to the center of the window tc: q_j = Rz(OMGE * (T_j - tc)) pos_j
+    - coefficients of q(tau) in the normalized time tau = (t - tc) / h, tau in [-1, 1]
+    - position at t: Rz(OMGE * (tc - t)) q(tau), same result as peph.pephpos
+The windows of each interval between epochs are the ones peph.pephpos selects. The clocks
+(SP3 and Clock-RINEX) are linear between the two closest epochs, as in cssrlib.
+"""
+
+import numpy as np
+
+from cssrlib.gnss import rCST, uGNSS, timediff, gtime_t
+from cssrlib.peph import peph, NMAX, MAXDTE
+
+
+class PephPoly(peph):
+    """
+    cssrlib peph with the interpolation polynomials precomputed (drop-in replacement for
+    pppos/rtkpos, orb=PephPoly()).
+
+    The tables are built by fit(nav) after parse_sp3/decode_clk, they are rebuilt if the
+    number of epochs in nav changes. The variances (var=True) use the original code.
+    """
+    def __init__(self):
+        super().__init__()
+        self.key = None         # (nav, ne, nc) of the tables
+        self.t0 = None          # reference time of the tables (gtime_t)
+        self.tn = None          # SP3 epochs [s] from t0
+        self.tw = None          # center of each window [s] from t0
+        self.hw = None          # half span of each window [s]
+        self.row = None         # sat-1 -> row of coef (-1: not in the SP3)
+        self.coef = None        # (nwin, nsat, 3, NMAX+1) coefficients of q(tau)
+        self.valid = None       # (nwin, nsat) all the nodes of the window are available
+        self.clk = None         # (ne, MAXSAT) SP3 clocks [s]
+        self.tc = None          # Clock-RINEX epochs [s] from t0
+        self.pclk = None        # (nc, MAXSAT) Clock-RINEX clocks [s]
+
+    def fit(self, nav):
+        """
+        Precompute the coefficients of all the satellites and windows.
+
+        :param nav: [Nav] Navigation data with the precise ephemeris (nav.peph, nav.pclk)
+        """
+        nc = getattr(nav, 'nc', 0)
+        self.key = (id(nav), nav.ne, nc)
+        self.coef = None
+        if nav.ne < NMAX + 1:
+            return self
+
+        D = NMAX + 1
+        self.t0 = gtime_t(nav.peph[0].time.time, 0.0)
+        self.tn = np.array([timediff(p.time, self.t0) for p in nav.peph])
+        pos = np.array([p.pos for p in nav.peph[:nav.ne]])     # (ne, MAXSAT, 4)
+        self.clk = pos[:, :, 3]
+
+        sats = np.where(np.isfinite(pos[:, :, 0]).any(axis=0))[0]
+        self.row = np.full(uGNSS.MAXSAT, -1, dtype=int)
+        self.row[sats] = np.arange(len(sats))
+        pos = pos[:, sats, 0:3]
+
+        # NOTE: window w has the epochs w..w+NMAX
+        nwin = nav.ne - NMAX
+        idx = np.arange(nwin)[:, None] + np.arange(D)
+        t = self.tn[idx]                                        # (nwin, D)
+        self.tw = 0.5 * (t[:, 0] + t[:, -1])
+        self.hw = 0.5 * (t[:, -1] - t[:, 0])
+        tau = (t - self.tw[:, None]) / self.hw[:, None]
+        V = tau[:, :, None] ** np.arange(D)                    # (nwin, D, D)
+
+        p = pos[idx]                                            # (nwin, D, nsat, 3)
+        ang = rCST.OMGE * (t - self.tw[:, None])
+        c, s = np.cos(ang)[:, :, None], np.sin(ang)[:, :, None]
+        q = np.stack((c * p[..., 0] - s * p[..., 1], s * p[..., 0] + c * p[..., 1], p[..., 2]), axis=-1)
+
+        self.valid = np.isfinite(q).all(axis=(1, 3)) & (np.linalg.norm(p, axis=3) > 0.0).all(axis=1)
+        q = np.where(np.isfinite(q), q, 0.0).reshape(nwin, D, -1)
+        coef = np.linalg.solve(V, q)                            # (nwin, D, nsat*3)
+        self.coef = np.ascontiguousarray(coef.reshape(nwin, D, len(sats), 3).transpose(0, 2, 3, 1))
+
+        if nc >= 2:
+            self.tc = np.array([timediff(p.time, self.t0) for p in nav.pclk[:nc]])
+            self.pclk = np.array([p.clk for p in nav.pclk[:nc]])
+        else:
+            self.tc = self.pclk = None
+        return self
+
+    def _check(self, nav):
+        if self.key != (id(nav), nav.ne, getattr(nav, 'nc', 0)):
+            self.fit(nav)
+        return self.coef is not None
+
+    def _window(self, dt):
+        """
+        Interval (epoch before dt) and window of peph.pephpos, vectorized.
+        """
+        index = np.maximum(np.searchsorted(self.tn, dt, side='left') - 1, 0)
+        w = np.clip(index - (NMAX + 1) // 2, 0, len(self.tn) - NMAX - 1)
+        return index, w
+
+    def _pos(self, w, row, dt, vel=False):
+        """
+        Position (and velocity) of the rows at dt, vectorized.
+        """
+        x = (dt - self.tw[w]) / self.hw[w]
+        powers = x[..., None] ** np.arange(NMAX + 1)
+        q = np.einsum('...kd,...d->...k', self.coef[w, row], powers)
+        a = rCST.OMGE * (self.tw[w] - dt)
+        c, s = np.cos(a), np.sin(a)
+        rs = np.stack((c * q[..., 0] - s * q[..., 1], s * q[..., 0] + c * q[..., 1], q[..., 2]), axis=-1)
+        if not vel:
+            return rs
+
+        dpowers = np.zeros_like(powers)
+        dpowers[..., 1:] = np.arange(1, NMAX + 1) * powers[..., :-1]
+        dq = np.einsum('...kd,...d->...k', self.coef[w, row], dpowers) / self.hw[w][..., None]
+        vs = np.stack((c * dq[..., 0] - s * dq[..., 1] + rCST.OMGE * (s * q[..., 0] + c * q[..., 1]),
+                       s * dq[..., 0] + c * dq[..., 1] - rCST.OMGE * (c * q[..., 0] - s * q[..., 1]),
+                       dq[..., 2]), axis=-1)
+        return rs, vs
+
+    @staticmethod
+    def _linear(tk, ck, dt, index, col):
+        """
+        Clock of the columns col between the epochs index and index+1 (the closest one out
+        of the interval), vectorized.
+        """
+        i1 = np.minimum(index + 1, len(tk) - 1)
+        t0, t1 = dt - tk[index], dt - tk[i1]
+        c0, c1 = ck[index, col], ck[i1, col]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            lin = (c1 * t0 - c0 * t1) / (t0 - t1)
+        return np.where(t0 <= 0.0, c0, np.where(t1 >= 0.0, c1, lin))
+
+    def pephpos(self, time, sat, nav, vare=False, varc=False):
+        if vare or varc or not self._check(nav):
+            return super().pephpos(time, sat, nav, vare, varc)
+
+        dt = timediff(time, self.t0)
+        row = self.row[sat - 1]
+        if row < 0 or dt < self.tn[0] - MAXDTE or dt > self.tn[-1] + MAXDTE:
+            return None, None, False, False
+        index, w = self._window(dt)
+        if not self.valid[w, row]:
+            return None, None, False, False
+
+        rs = self._pos(w, row, dt)
+        dts = np.zeros(2)
+        dts[0] = self._linear(self.tn, self.clk, dt, index, sat - 1)
+        return rs, dts, False, False
+
+    def pephclk(self, time, sat, nav, varc=False):
+        if varc or not self._check(nav) or self.tc is None:
+            return super().pephclk(time, sat, nav, varc)
+
+        dt = timediff(time, self.t0)
+        if dt < self.tc[0] - MAXDTE or dt > self.tc[-1] + MAXDTE:
+            return None, False
+        index = max(int(np.searchsorted(self.tc, dt, side='left')) - 1, 0)
+        i1 = min(index + 1, len(self.tc) - 1)
+        c0, c1 = self.pclk[index, sat - 1], self.pclk[i1, sat - 1]
+        t0, t1 = dt - self.tc[index], dt - self.tc[i1]
+        if (t0 <= 0.0 and c0 == 0.0) or (t0 > 0.0 and t1 >= 0.0 and c1 == 0.0) or \
+                (t0 > 0.0 and t1 < 0.0 and (c0 == 0.0 or c1 == 0.0)):
+            return None, False
+
+        dts = np.zeros(2)
+        dts[0] = self._linear(self.tc, self.pclk, dt, index, sat - 1)
+        return dts, False
+
+    def satpos(self, t, sats, nav):
+        """
+        Position, velocity and clock of several satellites in one evaluation.
+
+        :param t:    [gtime_t or list of gtime_t] Time (one for all or one per satellite)
+        :param sats: [array] Satellites
+        :param nav:  [Nav] Navigation data
+        :return: rs (n, 6) [m, m/s], dts (n,) [s] (with the relativistic correction, as peph2pos),
+                 ok (n,) [bool]
+        """
+        sats = np.asarray(sats, dtype=int)
+        n = len(sats)
+        rs = np.full((n, 6), np.nan)
+        dts = np.full(n, np.nan)
+        if n == 0 or not self._check(nav):
+            return rs, dts, np.zeros(n, dtype=bool)
+
+        if isinstance(t, gtime_t):
+            dt = np.full(n, timediff(t, self.t0))
+        else:
+            dt = np.array([timediff(t_, self.t0) for t_ in t])
+        row = self.row[sats - 1]
+        ok = (row >= 0) & (dt >= self.tn[0] - MAXDTE) & (dt <= self.tn[-1] + MAXDTE)
+        index, w = self._window(dt)
+        ok &= self.valid[w, np.maximum(row, 0)]
+
+        r, v = self._pos(w[ok], row[ok], dt[ok], vel=True)
+        rs[ok, 0:3] = r
+        rs[ok, 3:6] = v
+
+        if self.tc is not None:
+            idx = np.maximum(np.searchsorted(self.tc, dt, side='left') - 1, 0)
+            clk = self._linear(self.tc, self.pclk, dt, idx, sats - 1)
+            clk = np.where(clk == 0.0, np.nan, clk)
+        else:
+            clk = self._linear(self.tn, self.clk, dt, index, sats - 1)
+        dts[:] = clk - 2.0 * np.sum(rs[:, 0:3] * rs[:, 3:6], axis=1) / rCST.CLIGHT**2
+        ok &= np.isfinite(dts)
+        return rs, dts, ok
@@ -0,0 +1,468 @@
+"""
+Module to download the products of a set of sessions into a local mirror (asyncio)
+
+    products_for    names and archive paths of the daily products of a time span (CDDIS layout)
+    HttpBackend     HTTP/1.1 client (asyncio streams), keep-alive connections reused between
+                    downloads, Range requests to resume, redirects with cookies, basic
+                    authentication (arguments or ~/.netrc)
+    LocalBackend    same interface over a directory (archive copy, offline tests)
+    Mirror          content-addressed store: objects/<sha256[:2]>/<sha256><.gz|.Z> and an index
+                    name -> sha256, the partial downloads are kept in tmp/<name>.part
+    Prefetcher      downloads the missing products with bounded parallelism, resumes the
+                    partial files and retries the transient errors
+
+The products already in the mirror are not requested again, the same content under several
+names is stored once.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import netrc
+import os
+import shutil
+import ssl
+from contextlib import aclosing
+from urllib.parse import urljoin, urlsplit
+
+from cssrlib.gnss import gtime_t, time2epoch, time2gpst, epoch2time
+
+from src.streams import strip_compression
+
+
+CDDIS = 'https://cddis.nasa.gov/archive/'
+EARTHDATA = 'urs.earthdata.nasa.gov'
+CHUNK = 1 << 16
+MAXREDIRECT = 5
+
+# NOTE: type -> (name, folder of the archive)
+PRODUCTS = {
+    'orb':   ('{ac}0{proj}{sol}_{yyyy}{doy:03d}0000_01D_05M_ORB.SP3.gz', 'gnss/products/{week}'),
+    'clk':   ('{ac}0{proj}{sol}_{yyyy}{doy:03d}0000_01D_30S_CLK.CLK.gz', 'gnss/products/{week}'),
+    'bsx':   ('{ac}0{proj}{sol}_{yyyy}{doy:03d}0000_01D_01D_OSB.BIA.gz', 'gnss/products/{week}'),
+    'ionex': ('{ac}0OPS{sol}_{yyyy}{doy:03d}0000_01D_01H_GIM.INX.gz', 'gnss/products/ionex/{yyyy}/{doy:03d}'),
+}
+
+
+def products_for(ts, te, types=('orb', 'clk', 'bsx'), center='COD', project='MGX', solution='FIN', margin=0.0):
+    """
+    Daily products needed for a time span.
+
+    :param ts:       [float] Start of the span [s] (gtime_t.time)
+    :param te:       [float] End of the span [s]
+    :param types:    [list of str] Product types (see PRODUCTS)
+    :param center:   [str] Analysis center
+    :param project:  [str] Project (MGX, OPS)
+    :param solution: [str] Solution (FIN, RAP, ULT)
+    :param margin:   [float] Extra time at both ends (e.g. interpolation of the orbits) [s]
+    :return: list of (name, archive path)
+    """
+    ep = time2epoch(gtime_t(int(ts - margin)))
+    day = epoch2time([ep[0], ep[1], ep[2], 0, 0, 0]).time
+    names = []
+    while day <= te + margin:
+        ep = time2epoch(gtime_t(day))
+        doy = (day - epoch2time([ep[0], 1, 1, 0, 0, 0]).time) // 86400 + 1
+        week, _ = time2gpst(gtime_t(day))
+        fields = {'ac': center, 'proj': project, 'sol': solution, 'yyyy': int(ep[0]), 'doy': int(doy), 'week': week}
+        for typ in types:
+            name, folder = PRODUCTS[typ]
+            name = name.format(**fields)
+            names.append((name, folder.format(**fields) + '/' + name))
+        day += 86400
+    return names
+
+
+class LocalBackend():
+    """
+    Products from a directory with the archive layout (or all the files in the root).
+
+    :param root: [str] Directory
+    """
+    def __init__(self, root):
+        self.root = root
+        self.nrequest = 0
+
+    async def get(self, path, offset=0):
+        """
+        Data of a product from offset.
+
+        :return: (start, async generator of chunks), start is the offset of the first chunk
+        """
+        self.nrequest += 1
+        full = os.path.join(self.root, *path.split('/'))
+        if not os.path.isfile(full):
+            full = os.path.join(self.root, os.path.basename(path))
+        if not os.path.isfile(full):
+            raise FileNotFoundError(path)
+
+        async def chunks():
+            with open(full, 'rb') as fh:
+                fh.seek(offset)
+                while True:
+                    data = fh.read(CHUNK)
+                    if not data:
+                        break
+                    yield data
+                    await asyncio.sleep(0)
+        return offset, chunks()
+
+    async def close(self):
+        pass
+
+
+class HttpBackend():
+    """
+    Products from a HTTP(S) server, the connections are kept open and reused (HTTP/1.1).
+
+    The credentials are sent to the server of base, and to the login host only after it asks for
+    them (401), never to the other hosts of a redirection. CDDIS redirects to the Earthdata login,
+    which sends back to CDDIS with a session cookie: the cookies are kept between requests.
+
+    :param base:     [str] URL of the archive [default: CDDIS]
+    :param user:     [str] User (basic authentication) [default: ~/.netrc entry of the host]
+    :param password: [str] Password
+    :param login:    [str] Login host of the archive [default: Earthdata]
+    :param maxconn:  [int] Maximum idle connections kept per host
+    :param timeout:  [float] Timeout of the connection and of each read [s]
+    """
+    def __init__(self, base=CDDIS, user=None, password=None, login=EARTHDATA, maxconn=4, timeout=30.0):
+        self.base = base if base.endswith('/') else base + '/'
+        self.user = user
+        self.password = password
+        self.login = login
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.idle = {}          # (scheme, host, port) -> [(reader, writer)]
+        self.challenged = set() # (scheme, host, port) of the login host that asked for the credentials
+        self.cookies = {}       # domain -> {name: value}
+        self.netrc = {}         # host -> base64 credentials of ~/.netrc (None: no entry)
+        self.nconnect = 0
+        self.nrequest = 0
+
+    @staticmethod
+    def _key(parts):
+        return (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+
+    def _auth(self, host):
+        """
+        Basic authentication of a host (arguments, else ~/.netrc), None without credentials.
+        """
+        if self.user is not None:
+            return base64.b64encode("{}:{}".format(self.user, self.password or '').encode()).decode()
+        if host not in self.netrc:
+            try:
+                entry = netrc.netrc().authenticators(host)
+            except (OSError, netrc.NetrcParseError):
+                entry = None
+            self.netrc[host] = None if entry is None else \
+                base64.b64encode("{}:{}".format(entry[0], entry[2] or '').encode()).decode()
+        return self.netrc[host]
+
+    def _cookie(self, host):
+        # NOTE: domain match only, the path and the expiry are ignored (one session of downloads)
+        jar = {}
+        for domain, cookies in self.cookies.items():
+            if host == domain or host.endswith('.' + domain):
+                jar.update(cookies)
+        return '; '.join('{}={}'.format(name, value) for name, value in jar.items())
+
+    def _store(self, host, headers):
+        for cookie in headers.get('set-cookie', []):
+            fields = [f.strip() for f in cookie.split(';')]
+            name, _, value = fields[0].partition('=')
+            domain = host
+            for field in fields[1:]:
+                attr, _, val = field.partition('=')
+                val = val.strip().lstrip('.').lower()
+                if attr.strip().lower() == 'domain' and val and (host == val or host.endswith('.' + val)):
+                    domain = val
+            self.cookies.setdefault(domain, {})[name.strip()] = value.strip()
+
+    async def _acquire(self, key):
+        pool = self.idle.setdefault(key, [])
+        while pool:
+            reader, writer = pool.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        scheme, host, port = key
+        self.nconnect += 1
+        return await asyncio.wait_for(asyncio.open_connection(
+            host, port, ssl=ssl.create_default_context() if scheme == 'https' else None), self.timeout)
+
+    def _release(self, key, conn, reuse):
+        pool = self.idle.setdefault(key, [])
+        if reuse and len(pool) < self.maxconn:
+            pool.append(conn)
+        else:
+            conn[1].close()
+
+    async def _head(self, reader):
+        status = await asyncio.wait_for(reader.readline(), self.timeout)
+        if not status:
+            raise ConnectionError("Server closed the connection")
+        code = int(status.split()[1])
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.timeout)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode(errors='ignore').partition(':')
+            name = name.strip().lower()
+            if name == 'set-cookie':
+                headers.setdefault(name, []).append(value.strip())
+            else:
+                headers[name] = value.strip()
+        return code, headers
+
+    async def _body(self, reader, headers):
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = await asyncio.wait_for(reader.readline(), self.timeout)
+                size = int(size.split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    await asyncio.wait_for(reader.readline(), self.timeout)
+                    return
+                data = await asyncio.wait_for(reader.readexactly(size + 2), self.timeout)
+                yield data[:-2]
+        elif 'content-length' in headers:
+            left = int(headers['content-length'])
+            while left > 0:
+                data = await asyncio.wait_for(reader.read(min(CHUNK, left)), self.timeout)
+                if not data:
+                    raise ConnectionError("Server closed the connection")
+                left -= len(data)
+                yield data
+        else:
+            while True:
+                data = await asyncio.wait_for(reader.read(CHUNK), self.timeout)
+                if not data:
+                    return
+                yield data
+
+    async def get(self, path, offset=0):
+        """
+        Data of a product from offset (Range request, servers without Range start at 0).
+
+        :return: (start, async generator of chunks), start is the offset of the first chunk
+        """
+        url = urljoin(self.base, path)
+        origin = self._key(urlsplit(self.base))
+        nredirect = 0
+        while True:
+            parts = urlsplit(url)
+            key = self._key(parts)
+            conn = await self._acquire(key)
+            reader, writer = conn
+            req = ("GET {} HTTP/1.1\r\n"
+                   "Host: {}\r\n"
+                   "User-Agent: TFG-prefetch/1.0\r\n"
+                   "Connection: keep-alive\r\n").format(parts.path + ('?' + parts.query if parts.query else ''), parts.netloc)
+            if offset > 0:
+                req += "Range: bytes={}-\r\n".format(offset)
+            auth = self._auth(parts.hostname) if key == origin or key in self.challenged else None
+            if auth is not None:
+                req += "Authorization: Basic {}\r\n".format(auth)
+            cookie = self._cookie(parts.hostname)
+            if cookie:
+                req += "Cookie: {}\r\n".format(cookie)
+            try:
+                writer.write((req + "\r\n").encode())
+                await writer.drain()
+                code, headers = await self._head(reader)
+            except (OSError, ConnectionError, asyncio.TimeoutError, ValueError, IndexError):
+                writer.close()
+                raise
+            self.nrequest += 1
+            self._store(parts.hostname, headers)
+            reuse = headers.get('connection', '').lower() != 'close' and \
+                ('content-length' in headers or 'transfer-encoding' in headers)
+
+            if code in (200, 206):
+                return (offset if code == 206 else 0), self._stream(key, conn, headers, reuse)
+
+            async for _ in self._body(reader, headers): # NOTE: drain the body to reuse the connection
+                pass
+            self._release(key, conn, reuse)
+            if code == 401 and parts.hostname == self.login and key not in self.challenged \
+                    and 'www-authenticate' in headers and self._auth(parts.hostname) is not None:
+                self.challenged.add(key)    # NOTE: same request again with the credentials
+                continue
+            if code in (301, 302, 303, 307, 308) and 'location' in headers:
+                nredirect += 1
+                if nredirect > MAXREDIRECT:
+                    raise ConnectionError("Too many redirections {}".format(url))
+                url = urljoin(url, headers['location'])
+                continue
+            if code == 404:
+                raise FileNotFoundError(path)
+            if code == 416:     # NOTE: range not satisfiable, the partial file is complete or wrong
+                raise EOFError(path)
+            raise ConnectionError("HTTP {} {}".format(code, url))
+
+    async def _stream(self, key, conn, headers, reuse):
+        done = False
+        try:
+            async for data in self._body(conn[0], headers):
+                yield data
+            done = True
+        finally:
+            self._release(key, conn, reuse and done)
+
+    async def close(self):
+        for pool in self.idle.values():
+            for _, writer in pool:
+                writer.close()
+        self.idle = {}
+
+
+class Mirror():
+    """
+    Content-addressed store of products.
+
+    :param root: [str] Mirror directory
+    """
+    def __init__(self, root):
+        self.root = root
+        self.indexfile = os.path.join(root, 'index.json')
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+        self.index = {}
+        if os.path.isfile(self.indexfile):
+            with open(self.indexfile) as fh:
+                self.index = json.load(fh)
+
+    def _object(self, digest, name):
+        ext = name[len(strip_compression(name)):] # NOTE: keep .gz/.Z, the readers decompress by extension
+        return os.path.join(self.root, 'objects', digest[:2], digest + ext)
+
+    def path(self, name):
+        """
+        Path of a product of the mirror, None if it is not there.
+        """
+        digest = self.index.get(name)
+        if digest is None:
+            return None
+        path = self._object(digest, name)
+        return path if os.path.isfile(path) else None
+
+    def partial(self, name):
+        return os.path.join(self.root, 'tmp', name + '.part')
+
+    def commit(self, name):
+        """
+        Move a complete download to the store (once per content) and add it to the index.
+        """
+        part = self.partial(name)
+        sha = hashlib.sha256()
+        with open(part, 'rb') as fh:
+            for data in iter(lambda: fh.read(CHUNK), b''):
+                sha.update(data)
+        digest = sha.hexdigest()
+        path = self._object(digest, name)
+        if os.path.isfile(path):
+            os.remove(part)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.move(part, path)
+        self.index[name] = digest
+        tmp = self.indexfile + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(self.index, fh, indent=1, sort_keys=True)
+        os.replace(tmp, self.indexfile)
+        return path
+
+
+class Prefetcher():
+    """
+    Concurrent download of products into a mirror.
+
+    :param backend: [HttpBackend or LocalBackend] Source of the products
+    :param mirror:  [Mirror] Local store
+    :param jobs:    [int] Maximum simultaneous downloads
+    :param retries: [int] Retries of a download after a transient error (resumed)
+    """
+    def __init__(self, backend, mirror, jobs=4, retries=3):
+        self.backend = backend
+        self.mirror = mirror
+        self.jobs = jobs
+        self.retries = retries
+        self.stats = {'present': 0, 'downloaded': 0, 'missing': 0, 'failed': 0, 'bytes': 0}
+
+    async def fetch(self, name, path, sem):
+        """
+        Download a product (resumed from the partial file), None if it is not in the archive.
+        """
+        found = self.mirror.path(name)
+        if found is not None:
+            self.stats['present'] += 1
+            return found
+
+        async with sem:
+            part = self.mirror.partial(name)
+            for attempt in range(self.retries + 1):
+                offset = os.path.getsize(part) if os.path.isfile(part) else 0
+                try:
+                    start, chunks = await self.backend.get(path, offset)
+                    async with aclosing(chunks):
+                        with open(part, 'r+b' if start > 0 else 'wb') as fh:
+                            fh.seek(start)
+                            async for data in chunks:
+                                fh.write(data)
+                                self.stats['bytes'] += len(data)
+                            fh.truncate()
+                    break
+                except FileNotFoundError:
+                    self.stats['missing'] += 1
+                    return None
+                except EOFError:
+                    if os.path.isfile(part):
+                        os.remove(part) # NOTE: the server refuses to resume it, start again
+                except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError) as error:
+                    if attempt == self.retries:
+                        print("Warning: {} not downloaded ({})".format(name, error))
+                        self.stats['failed'] += 1
+                        return None
+                    await asyncio.sleep(min(2 ** attempt, 30))
+            else:
+                # NOTE: the last attempt was refused too (HTTP 416), nothing to commit
+                print("Warning: {} not downloaded (resume refused)".format(name))
+                self.stats['failed'] += 1
+                return None
+            self.stats['downloaded'] += 1
+            return self.mirror.commit(name)
+
+    async def run(self, products):
+        """
+        Download the products that are not in the mirror.
+
+        :param products: [list of (name, archive path)] Products (see products_for)
+        :return: dict name -> path in the mirror (None if not available)
+        """
+        sem = asyncio.Semaphore(self.jobs)
+        products = list(dict(products).items()) # NOTE: same product of several sessions once
+        try:
+            paths = await asyncio.gather(*[self.fetch(name, path, sem) for name, path in products])
+        finally:
+            await self.backend.close()
+        return {name: path for (name, _), path in zip(products, paths)}
+
+
+def prefetch(sessions, mirror, backend=None, jobs=4, **kwargs):
+    """
+    Download the products of several sessions.
+
+    :param sessions: [list of (ts, te)] Time spans [s] (gtime_t.time)
+    :param mirror:   [str or Mirror] Mirror directory
+    :param backend:  [HttpBackend or LocalBackend] Source [default: CDDIS]
+    :param jobs:     [int] Maximum simultaneous downloads
+    :param kwargs:   Options of products_for (types, center, project, solution, margin)
+    :return: dict name -> path, Prefetcher (stats)
+    """
+    mirror = Mirror(mirror) if isinstance(mirror, str) else mirror
+    backend = HttpBackend(maxconn=jobs) if backend is None else backend
+    products = [p for ts, te in sessions for p in products_for(ts, te, **kwargs)]
+    fetcher = Prefetcher(backend, mirror, jobs=jobs)
+    return asyncio.run(fetcher.run(products)), fetcher
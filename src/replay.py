@@ -0,0 +1,226 @@
+"""
+Module to replay a UBX capture through a virtual serial port (pseudo-terminal)
+
+The capture is served at real time or N times faster with the timing of the receiver: the bytes of
+each epoch (frames with the same GPS time of src.ubxindex, with the NMEA between them) are written
+when the epoch is due, (t - t_first) / speed seconds after the start. Speed 0 sends everything as fast
+as the reader takes it.
+
+The replay also answers the commands written to the port, so capture and detection work as with the
+receiver (rawData2ubx, checkUBX, -configure):
+    MON-VER poll    the MON-VER of the capture (or one of model)
+    CFG-*           ACK-ACK
+
+Like a UART without flow control, the bytes the reader doesn't take in time are dropped (counted in
+dropped), block=True waits for the reader instead. Linux/macOS only (pty), com0com on Windows.
+"""
+
+import argparse
+import os
+import select
+import threading
+import time
+
+import numpy as np
+
+from src.discover import frame, MON_VER_POLL
+from src.ubxfilter import Framer
+from src.ubxindex import UbxIndex
+
+
+class Replay():
+    """
+    Replay of a UBX capture in a pseudo-terminal.
+
+    :param path:  [str] UBX file
+    :param speed: [float] Times real time (0: as fast as possible)
+    :param link:  [str] Symbolic link to the port (e.g. /tmp/ttyUBX) [default: none]
+    :param block: [bool] Wait for the reader instead of dropping bytes
+    :param loop:  [bool] Start again at the end of the capture
+    :param model: [str] Model of the MON-VER answer when the capture has none
+    """
+    def __init__(self, path, speed=1.0, link=None, block=False, loop=False, model='F9P'):
+        try:
+            import pty
+            import tty
+        except ImportError:
+            raise ValueError("Replay needs pseudo-terminals (Linux/macOS), use com0com on Windows!")
+        self.path = path
+        self.speed = speed
+        self.link = link
+        self.block = block
+        self.loop = loop
+
+        with UbxIndex.load(path) as idx:
+            t = idx.times()
+            offset, end = idx.offset.copy(), idx.end
+            monver = idx.select(['MON-VER'])
+            self.monver = idx.raw(monver[-1]) if len(monver) else None
+        if self.monver is None:
+            self.monver = frame(0x0A, 0x04, b'ROM CORE'.ljust(30, b'\x00') + b'00190000'.ljust(10, b'\x00')
+                                + 'MOD={}'.format(model).encode().ljust(30, b'\x00'))
+
+        # NOTE: one write per epoch, the bytes before the first frame go with it
+        t = np.where(np.isnan(t), np.nanmin(t) if np.isfinite(t).any() else 0.0, t)
+        cut = np.nonzero(np.diff(t) != 0)[0] + 1
+        self.starts = np.concatenate(([0], offset[cut])) if len(offset) else np.array([0])
+        self.stops = np.concatenate((self.starts[1:], [end]))
+        self.times = (t[np.concatenate(([0], cut))] - t[0]) if len(t) else np.array([0.0])
+
+        self.master, slave = pty.openpty()
+        tty.setraw(slave)
+        self.device = os.ttyname(slave)
+        self.slave = slave
+        if not block:
+            os.set_blocking(self.master, False)
+        if link:
+            if os.path.islink(link):
+                os.remove(link)
+            os.symlink(self.device, link)
+
+        self.stop = threading.Event()
+        self.done = threading.Event()
+        self.thread = None
+        self.stats = {'epochs': 0, 'bytes': 0, 'dropped': 0, 'commands': 0, 'lag': 0.0}
+
+    @property
+    def duration(self):
+        """
+        Seconds of the replay (one pass).
+        """
+        return self.times[-1] / self.speed if self.speed else 0.0
+
+    def start(self):
+        """
+        Replay in a background thread.
+
+        NOTE: pyserial flushes the input when it opens the port, with speed 0 the reader opens it
+              (device or link) before the start or the first epochs are lost
+
+        :return: [str] Port to open (the link if any)
+        """
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.link or self.device
+
+    def wait(self, timeout=None):
+        """
+        Wait for the end of the replay (the port keeps answering until closed).
+
+        :return: [bool] True if the replay is done
+        """
+        return self.done.wait(timeout)
+
+    def close(self):
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join(2.0)
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        if self.link and os.path.islink(self.link):
+            os.remove(self.link)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _answer(self, framer):
+        """
+        Answer the commands written by the reader.
+        """
+        while select.select([self.master], [], [], 0)[0]:
+            try:
+                data = os.read(self.master, 4096)
+            except (BlockingIOError, OSError):
+                return
+            if not data:
+                return
+            buf, offs, lens, cls, mid = framer.feed(data)
+            for o, n, c, m in zip(offs, lens, cls, mid):
+                self.stats['commands'] += 1
+                if buf[o:o + 8 + n] == MON_VER_POLL:
+                    self._write(self.monver)
+                elif c == 0x06:
+                    self._write(frame(0x05, 0x01, bytes([c, m])))
+
+    def _write(self, data):
+        view = memoryview(data)
+        while len(view) and not self.stop.is_set():
+            try:
+                n = os.write(self.master, view)
+            except BlockingIOError:
+                # NOTE: the reader is not taking the data, lost as in a UART overrun
+                self.stats['dropped'] += len(view)
+                return
+            self.stats['bytes'] += n
+            view = view[n:]
+
+    def run(self):
+        """
+        Replay (blocks until the end, or forever with loop).
+        """
+        framer = Framer()
+        with open(self.path, 'rb') as fh:
+            data = fh.read()
+        while not self.stop.is_set():
+            t0 = time.monotonic()
+            for a, b, t in zip(self.starts, self.stops, self.times):
+                if self.speed:
+                    due = t0 + t / self.speed
+                    while not self.stop.is_set():
+                        self._answer(framer)
+                        wait = due - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self.stop.wait(min(wait, 0.01))
+                    self.stats['lag'] = max(self.stats['lag'], float(time.monotonic() - due))
+                else:
+                    self._answer(framer)
+                if self.stop.is_set():
+                    self.done.set()
+                    return
+                self._write(data[int(a):int(b)])
+                self.stats['epochs'] += 1
+            if not self.loop:
+                break
+        self.done.set()
+        # NOTE: still answering the commands until closed
+        while not self.stop.is_set() and self.speed:
+            self._answer(framer)
+            self.stop.wait(0.01)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a UBX capture through a virtual serial port.')
+    parser.add_argument('ubxfile', type=str, help='UBX file.')
+    parser.add_argument('-speed', '--speed', type=float, default=1.0, help='Times real time (0: as fast as possible). [default: %(default)s]')
+    parser.add_argument('-link', '--link', type=str, default=None, help='Symbolic link to the port (e.g. /tmp/ttyUBX).')
+    parser.add_argument('-block', '--block', action='store_true', help="Wait for the reader instead of dropping bytes.")
+    parser.add_argument('-loop', '--loop', action='store_true', help='Start again at the end of the capture.')
+    args = parser.parse_args(argv)
+
+    with Replay(args.ubxfile, args.speed, args.link, args.block, args.loop) as replay:
+        port = replay.start()
+        print("Replaying {} ({} epochs, {:.1f} s) on {}".format(args.ubxfile, len(replay.times), replay.duration, port))
+        try:
+            while not replay.wait(1.0):
+                pass
+            if args.speed:
+                print("Replay done, still answering on {} (Ctrl+C to stop)".format(port))
+                while True:
+                    time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass
+        s = replay.stats
+        print("{} epochs, {} bytes, {} dropped, {} commands, max lag {:.3f} s".format(
+            s['epochs'], s['bytes'], s['dropped'], s['commands'], s['lag']))
+    return 0
+
+
+if __name__ == '__main__':
+    main()
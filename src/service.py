@@ -0,0 +1,393 @@
+"""
+Module for the processing service: a local daemon with warm workers that runs PPP/RTK jobs
+
+Every `python Commands.py` run imports matplotlib, pandas, cssrlib... and loads the products
+again. The service keeps a pool of worker processes with the engines imported and the
+product tables (ANTEX, Bias-SINEX) kept in memory between jobs, and accepts jobs through a
+small JSON API over HTTP (TCP or Unix socket):
+
+    POST /jobs          {"mode": "ppp" | "rtk", "params": {ParametrosPPP/RTK attributes}}
+                        -> {"id": ...}
+    GET  /jobs          status of all the jobs
+    GET  /jobs/<id>     {"status": queued | running | done | failed, "result", "log", "error"}
+    GET  /health        workers and number of jobs by status
+    POST /shutdown      stop the service
+
+The results of each job are saved in <outdir>/<id>.npz (t, enu, sol, ztd, smode, xyz_ref)
+with the log in <outdir>/<mode>-<id>.log. ServiceClient (and `python -m src.service`) is
+the thin client, it only imports the standard library.
+"""
+
+import argparse
+import http.client
+import importlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+
+DEFAULT_URL = 'http://127.0.0.1:8750'
+
+
+def _warmup(atxfile=None):
+    """
+    Initializer of the workers: import the engines and keep the product tables in memory.
+    """
+    from src import antex, biastable
+
+    # NOTE: the imports are the warm-up (cssrlib, numpy, the engines), nothing is used here
+    for module in ('src.PPPsolution', 'src.RTKsolution'):
+        importlib.import_module(module)
+
+    antex.keep_loaded()
+    biastable.keep_loaded()
+    if atxfile is not None and os.path.isfile(atxfile):
+        antex.AntexTable.load(atxfile)
+
+
+def _ping():
+    return os.getpid()
+
+
+def run_job(jobid, mode, params, outdir):
+    """
+    Run a PPP/RTK job (in a worker process).
+
+    :param jobid:  [str] Job identifier
+    :param mode:   [str] ppp or rtk
+    :param params: [dict] Attributes of ParametrosPPP/ParametrosRTK
+    :param outdir: [str] Folder of the results and logs
+    :return: dict with the result and log paths
+    """
+    import numpy as np
+
+    params = dict(params)
+    if params.get('logfile') is None:
+        params['logfile'] = os.path.join(outdir, '{}-{}.log'.format(mode, jobid))
+    if params.get('ckptfile') is None:
+        params['ckptfile'] = os.path.join(outdir, '{}-{}.ckpt.npz'.format(mode, jobid))
+    if mode == 'ppp':
+        from src.PPPsolution import ParametrosPPP, pppModule
+        parameters = ParametrosPPP()
+        parameters.setParametersPPP(**params)
+        t, enu, sol_, ztd, smode, _, xyz_ref = pppModule(parameters)
+    else:
+        from src.RTKsolution import ParametrosRTK, rtkModule
+        parameters = ParametrosRTK()
+        parameters.setParametersRTK(**params)
+        t, enu, sol_, ztd, smode, _, xyz_ref = rtkModule(parameters)
+
+    result = os.path.join(outdir, '{}.npz'.format(jobid))
+    with open(result, 'wb') as fh: # NOTE: np.savez adds .npz to names without it
+        np.savez(fh, t=np.asarray(t, dtype=np.float64), enu=np.asarray(enu), sol=np.asarray(sol_),
+                 ztd=np.asarray(ztd), smode=np.asarray(smode), xyz_ref=np.asarray(xyz_ref, dtype=np.float64))
+    return {'result': result, 'log': params['logfile'], 'epochs': int(len(t))}
+
+
+class Service():
+    """
+    Job queue over a pool of warm worker processes.
+
+    :param workers: [int] Number of processes [default: number of CPUs]
+    :param outdir:  [str] Folder of the results and logs
+    :param atxfile: [str] ANTEX file loaded by the workers at start
+    """
+    def __init__(self, workers=None, outdir='data/jobs', atxfile=None):
+        self.outdir = os.path.abspath(outdir)
+        os.makedirs(self.outdir, exist_ok=True)
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_warmup, initargs=(atxfile,))
+        self.jobs = {}          # id -> job (mode, submitted, future, finished, info)
+        self.lock = threading.Lock()
+
+    def warm(self):
+        """
+        Start all the workers now (imports, products) instead of with the first jobs.
+        """
+        return sorted(set(f.result() for f in [self.executor.submit(_ping) for _ in range(self.workers)]))
+
+    def submit(self, mode, params):
+        """
+        Queue a job.
+
+        :param mode:   [str] ppp or rtk
+        :param params: [dict] Attributes of ParametrosPPP/ParametrosRTK
+        :return: [str] Job identifier
+        """
+        if mode not in ('ppp', 'rtk'):
+            raise ValueError("Unknown job mode {}!".format(mode))
+        if not isinstance(params, dict):
+            raise ValueError("Job params must be a dict!")
+        jobid = uuid.uuid4().hex[:12]
+        job = {'mode': mode, 'submitted': time.time(), 'finished': None, 'info': None, 'error': None}
+        with self.lock:
+            self.jobs[jobid] = job
+        job['future'] = self.executor.submit(run_job, jobid, mode, params, self.outdir)
+        job['future'].add_done_callback(lambda f, job=job: self._done(job, f))
+        return jobid
+
+    def _done(self, job, future):
+        info, error = None, None
+        if future.cancelled():
+            error = 'cancelled'
+        elif future.exception() is not None:
+            error = '{}: {}'.format(type(future.exception()).__name__, future.exception())
+        else:
+            info = future.result()
+        # NOTE: all at once, a job is never seen finished without its result or error
+        with self.lock:
+            job['info'], job['error'] = info, error
+            job['finished'] = time.time()
+
+    def status(self, jobid):
+        """
+        Status of a job, None if it doesn't exist.
+        """
+        with self.lock:
+            job = self.jobs.get(jobid)
+            if job is None:
+                return None
+            job = dict(job)
+        future = job.get('future')
+        if job['finished'] is not None:
+            status = 'failed' if job['error'] is not None else 'done'
+        elif future is not None and future.running():
+            status = 'running'
+        else:
+            status = 'queued'
+        ret = {'id': jobid, 'mode': job['mode'], 'status': status, 'submitted': job['submitted'],
+               'finished': job['finished'], 'error': job['error']}
+        if job['info'] is not None:
+            ret.update(job['info'])
+        return ret
+
+    def health(self):
+        with self.lock:
+            ids = list(self.jobs)
+        count = {}
+        for jobid in ids:
+            status = self.status(jobid)['status']
+            count[status] = count.get(status, 0) + 1
+        return {'workers': self.workers, 'outdir': self.outdir, 'jobs': count}
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    JSON API of the service (see the module docstring).
+    """
+    server_version = 'TFG-service/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        service = self.server.service
+        path = self.path.rstrip('/')
+        if path == '/health':
+            self._send(200, service.health())
+        elif path == '/jobs':
+            with service.lock:
+                ids = list(service.jobs)
+            self._send(200, [service.status(jobid) for jobid in ids])
+        elif path.startswith('/jobs/'):
+            status = service.status(path[len('/jobs/'):])
+            self._send(200 if status is not None else 404, status or {'error': 'unknown job'})
+        else:
+            self._send(404, {'error': 'unknown path'})
+
+    def do_POST(self):
+        service = self.server.service
+        size = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(size) or b'{}')
+        except ValueError:
+            self._send(400, {'error': 'invalid JSON'})
+            return
+        if not isinstance(body, dict):
+            self._send(400, {'error': 'the body must be a JSON object'})
+            return
+        path = self.path.rstrip('/')
+        if path == '/jobs':
+            try:
+                self._send(202, {'id': service.submit(body.get('mode'), body.get('params', {}))})
+            except ValueError as error:
+                self._send(400, {'error': str(error)})
+        elif path == '/shutdown':
+            self._send(200, {'status': 'stopping'})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+        else:
+            self._send(404, {'error': 'unknown path'})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _UnixHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address) # NOTE: socket of a previous run
+        super().server_bind()
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+
+def serve(service, url=DEFAULT_URL, ready=None):
+    """
+    Serve the API until POST /shutdown (or Ctrl-C).
+
+    :param service: [Service] Job queue
+    :param url:     [str] 'http://host:port' or 'unix:///path/to/socket'
+    :param ready:   [threading.Event] Set when the server is listening
+    """
+    parts = urlsplit(url)
+    if parts.scheme == 'unix':
+        server = _UnixHTTPServer(parts.path, _Handler)
+    else:
+        server = ThreadingHTTPServer((parts.hostname or '127.0.0.1', parts.port or 8750), _Handler)
+    server.daemon_threads = True
+    server.service = service
+    if ready is not None:
+        ready.url = url if parts.scheme == 'unix' else 'http://{}:{}'.format(*server.server_address[0:2])
+        ready.set()
+    try:
+        server.serve_forever(poll_interval=0.2)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if parts.scheme == 'unix' and os.path.exists(parts.path):
+            os.remove(parts.path)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=30.0):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class ServiceClient():
+    """
+    Thin client of the service.
+
+    :param url:     [str] 'http://host:port' or 'unix:///path/to/socket'
+    :param timeout: [float] Timeout of the requests [s]
+    """
+    def __init__(self, url=DEFAULT_URL, timeout=30.0):
+        self.url = url
+        self.timeout = timeout
+
+    def request(self, method, path, body=None):
+        parts = urlsplit(self.url)
+        if parts.scheme == 'unix':
+            conn = _UnixHTTPConnection(parts.path, self.timeout)
+        else:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 8750, timeout=self.timeout)
+        try:
+            data = json.dumps(body).encode() if body is not None else None
+            conn.request(method, path, body=data, headers={'Content-Type': 'application/json'} if data else {})
+            resp = conn.getresponse()
+            ret = json.loads(resp.read() or b'null')
+        finally:
+            conn.close()
+        if resp.status >= 400:
+            raise ValueError("Service answered {}: {}".format(resp.status, ret.get('error') if isinstance(ret, dict) else ret))
+        return ret
+
+    def submit(self, mode, params):
+        """
+        Submit a job, the file paths of params are sent as absolute paths.
+
+        :return: [str] Job identifier
+        """
+        params = {k: (os.path.abspath(v) if isinstance(v, str) and os.path.isfile(v) else v)
+                  for k, v in params.items()}
+        return self.request('POST', '/jobs', {'mode': mode, 'params': params})['id']
+
+    def status(self, jobid):
+        return self.request('GET', '/jobs/{}'.format(jobid))
+
+    def jobs(self):
+        return self.request('GET', '/jobs')
+
+    def health(self):
+        return self.request('GET', '/health')
+
+    def shutdown(self):
+        return self.request('POST', '/shutdown')
+
+    def wait(self, jobid, poll=0.5, timeout=None):
+        """
+        Wait until a job is done or failed.
+
+        :return: dict with the status of the job
+        """
+        t0 = time.time()
+        while True:
+            status = self.status(jobid)
+            if status['status'] in ('done', 'failed'):
+                return status
+            if timeout is not None and time.time() - t0 > timeout:
+                return status
+            time.sleep(poll)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='PPP/RTK processing service.')
+    parser.add_argument('command', choices=['serve', 'submit', 'status', 'wait', 'jobs', 'health', 'shutdown'])
+    parser.add_argument('jobid', nargs='?', default=None, help='Job identifier (status, wait).')
+    parser.add_argument('-url', '--url', type=str, default=DEFAULT_URL, help="Service URL ('http://host:port' or 'unix:///path').")
+    parser.add_argument('-workers', '--workers', type=int, default=None, help='Worker processes (serve).')
+    parser.add_argument('-outdir', '--outdir', type=str, default='data/jobs', help='Folder of the results (serve).')
+    parser.add_argument('-atx', '--atxfile', type=str, default=None, help='ANTEX file loaded at start (serve).')
+    parser.add_argument('-mode', '--mode', type=str, default='ppp', help='Job mode, ppp or rtk (submit).')
+    parser.add_argument('-params', '--params', type=str, default='{}', help='Job parameters, JSON or @file.json (submit).')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        service = Service(args.workers, args.outdir, args.atxfile)
+        print("Service: {} workers ready, listening on {}".format(len(service.warm()), args.url))
+        serve(service, args.url)
+        return 0
+
+    client = ServiceClient(args.url)
+    if args.command == 'submit':
+        text = open(args.params[1:]).read() if args.params.startswith('@') else args.params
+        ret = client.submit(args.mode, json.loads(text))
+    elif args.command in ('status', 'wait'):
+        if args.jobid is None:
+            parser.error("{} needs a job identifier".format(args.command))
+        ret = client.status(args.jobid) if args.command == 'status' else client.wait(args.jobid)
+    else:
+        ret = getattr(client, args.command)()
+    print(json.dumps(ret, indent=1))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
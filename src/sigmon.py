@@ -0,0 +1,319 @@
+"""
+Module to monitor the quality of the tracked signals during a capture or a real-time run
+
+The monitor keeps, for every satellite/signal, the C/N0, the lock time and the cycle slips of the last
+history epochs in fixed-size rings (history x slots arrays, allocated once): the memory doesn't grow
+with the session and an epoch costs a row write. The aggregates are computed only when they are
+published (every interval seconds):
+    per signal      (G1C, E5Q ...) signals tracked, mean/min C/N0 of the window, slips of the window
+    per satellite   C/N0 of the window and last, lock time, slips
+    alerts          mean C/N0 of a signal interval dB under its baseline (antenna, interference),
+                    many slips per tracked signal, no signals
+
+Sources:
+    feed(data)      UBX bytes (capture), RXM-RAWX: cno, locktime (slip when it goes back)
+    update_obs(obs) cssrlib Obs (engines): obs.S, slip from obs.lli
+
+The signals are named as in RINEX (system + band + attribute: G1C, G2L, E7Q ...).
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from cssrlib.gnss import sat2id, sat2prn, uTYP
+
+from src.ubxfilter import Framer
+from src.ubxindex import T_GPST0
+
+
+GNSS = {0: 'G', 1: 'S', 2: 'E', 3: 'C', 5: 'J', 6: 'R', 7: 'I'}
+SIGNALS = {(0, 0): '1C', (0, 3): '2L', (0, 4): '2S', (0, 6): '5I', (0, 7): '5Q',
+           (1, 0): '1C',
+           (2, 0): '1C', (2, 1): '1B', (2, 3): '5I', (2, 4): '5Q', (2, 5): '7I', (2, 6): '7Q',
+           (3, 0): '2I', (3, 1): '2I', (3, 2): '7I', (3, 3): '7I', (3, 5): '1P', (3, 6): '1D', (3, 7): '5P', (3, 8): '5D',
+           (5, 0): '1C', (5, 1): '1Z', (5, 4): '2S', (5, 5): '2L', (5, 8): '5I', (5, 9): '5Q',
+           (6, 0): '1C', (6, 2): '2C',
+           (7, 0): '5A'}
+RAWX_MEAS = np.dtype([('pr', '<f8'), ('cp', '<f8'), ('do', '<f4'), ('gnss', 'u1'), ('sv', 'u1'), ('sig', 'u1'),
+                      ('freq', 'u1'), ('lock', '<u2'), ('cno', 'u1'), ('prstd', 'u1'), ('cpstd', 'u1'),
+                      ('dostd', 'u1'), ('trk', 'u1'), ('res', 'u1')])
+
+
+class SignalMonitor():
+    """
+    C/N0, lock time and cycle slips of the tracked signals, constant memory.
+
+    :param history:  [int] Epochs of the rolling window
+    :param slots:    [int] Satellite/signals kept (the ones not seen for longer are reused)
+    :param interval: [float] Seconds between two published summaries (0: never)
+    :param stream:   [file] Output of the summaries [default: sys.stdout]
+    :param drop:     [float] C/N0 drop under the baseline of a signal that raises an alert [dB-Hz]
+    :param callback: [function] callback(monitor) at every published summary
+    """
+    def __init__(self, history=600, slots=256, interval=5.0, stream=None, drop=6.0, callback=None):
+        self.history = history
+        self.slots = slots
+        self.interval = interval
+        self.stream = stream
+        self.drop = drop
+        self.callback = callback
+
+        self.cno = np.full((history, slots), np.nan, dtype=np.float32)     # ring of C/N0 [dB-Hz]
+        self.slip = np.zeros((history, slots), dtype=np.uint8)             # ring of slips
+        self.ring_t = np.full(history, np.nan)                              # epoch of every row
+        self.lock = np.zeros(slots)                                          # lock time [s]
+        self.slips = np.zeros(slots, dtype=np.int64)                         # slips of the session
+        self.seen = np.full(slots, -1, dtype=np.int64)                       # last epoch tracked
+        self.label = np.full(slots, -1, dtype=np.int64)                      # index in labels
+        self.names = [''] * slots
+        self.baseline = {}          # mean C/N0 of every signal (slow average)
+
+        self.slot = {}              # key -> slot
+        self.labels = []
+        self.n = 0                  # epochs
+        self.t = np.nan
+        self.framer = Framer()
+        self.next = time.monotonic() + interval
+
+    def _slots(self, keys, describe):
+        out = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            s = self.slot.get(key)
+            if s is None:
+                if len(self.slot) < self.slots:
+                    s = len(self.slot)
+                else:
+                    # NOTE: reuse the slot not seen for longer (and not in this epoch)
+                    s = int(np.argmin(np.where(np.isin(np.arange(self.slots), out[:i]), np.iinfo(np.int64).max, self.seen)))
+                    del self.slot[next(k for k, v in self.slot.items() if v == s)]
+                    self.cno[:, s] = np.nan
+                    self.slip[:, s] = 0
+                    self.slips[s] = 0
+                    self.lock[s] = 0.0
+                self.slot[key] = s
+                self.names[s], label = describe(i)
+                if label not in self.labels:
+                    self.labels.append(label)
+                self.label[s] = self.labels.index(label)
+            out[i] = s
+        return out
+
+    def update(self, t, keys, describe, cno, lock=None, slip=None):
+        """
+        Signals of an epoch.
+
+        :param t:        [float] Epoch [s]
+        :param keys:     [list] Unique key of every satellite/signal
+        :param describe: [function] describe(i) -> (satellite, signal) of the key i (G05, G1C), only for new keys
+        :param cno:      [array] C/N0 [dB-Hz]
+        :param lock:     [array] Lock time [s] (a slip when it goes back)
+        :param slip:     [array of bool] Slips flagged by the source
+        """
+        s = self._slots(keys, describe)
+        row = self.n % self.history
+        self.cno[row] = np.nan
+        self.cno[row, s] = cno
+        slipped = np.zeros(len(s), dtype=bool) if slip is None else np.asarray(slip, dtype=bool)
+        if lock is not None:
+            lock = np.asarray(lock, dtype=np.float64)
+            # NOTE: only if tracked in the last epoch, a new signal has no slip
+            slipped |= (self.seen[s] == self.n - 1) & (lock < self.lock[s])
+            self.lock[s] = lock
+        self.slip[row] = 0
+        self.slip[row, s] = slipped
+        self.slips[s] += slipped
+        self.seen[s] = self.n
+        self.ring_t[row] = t
+        self.t = t
+        self.n += 1
+
+        if self.interval and time.monotonic() >= self.next:
+            self.next = time.monotonic() + self.interval
+            self.publish()
+
+    def update_rawx(self, payload):
+        """
+        Epoch of a RXM-RAWX payload.
+        """
+        if len(payload) < 16:
+            return
+        tow, week = np.frombuffer(payload[0:10], dtype=[('tow', '<f8'), ('week', '<u2')])[0]
+        n = min(payload[11], (len(payload) - 16) // 32)
+        meas = np.frombuffer(payload, dtype=RAWX_MEAS, count=n, offset=16)
+        meas = meas[np.isin(meas['gnss'], list(GNSS))]
+        keys = (meas['gnss'].astype(np.int64) << 16 | meas['sv'].astype(np.int64) << 8 | meas['sig']).tolist()
+
+        def describe(i):
+            g, q = int(meas['gnss'][i]), int(meas['sig'][i])
+            return '{}{:02d}'.format(GNSS[g], meas['sv'][i]), GNSS[g] + SIGNALS.get((g, q), str(q))
+        # NOTE: the receiver resets the lock time at every slip/loss of lock of the carrier
+        self.update(T_GPST0 + week * 604800.0 + tow, keys, describe, meas['cno'].astype(np.float32),
+                    lock=meas['lock'] * 1e-3)
+
+    def feed(self, data):
+        """
+        UBX bytes (any chunk of the stream), the RXM-RAWX epochs are monitored.
+        """
+        buf, offs, lens, cls, mid = self.framer.feed(data)
+        for k in np.nonzero((cls == 0x02) & (mid == 0x15))[0]:
+            o, n = int(offs[k]), int(lens[k])
+            self.update_rawx(buf[o + 6:o + 6 + n])
+
+    def update_obs(self, obs):
+        """
+        Epoch of a cssrlib Obs (engines): C/N0 of obs.S, slips of obs.lli.
+        """
+        S = np.asarray(obs.S, dtype=np.float64)
+        if S.ndim != 2 or S.size == 0:
+            return
+        lli = np.asarray(obs.lli)
+        keys, names, labels, cno, slip = [], [], [], [], []
+        for k, sat in enumerate(obs.sat):
+            sid = sat2id(sat)
+            sigs = obs.sig.get(sat2prn(sat)[0], {}) if isinstance(obs.sig, dict) else {}  # NOTE: keyed by uGNSS
+            for j in range(S.shape[1]):
+                if not S[k, j] > 0:
+                    continue
+                try:
+                    code = str(sigs[uTYP.S][j])[2:]
+                except (KeyError, IndexError, TypeError):
+                    code = str(j + 1)
+                keys.append(1 << 24 | sat << 8 | j)
+                names.append(sid)
+                labels.append(sid[0] + code)
+                cno.append(S[k, j])
+                slip.append(lli.ndim == 2 and j < lli.shape[1] and (int(lli[k, j]) & 1) == 1)
+        self.update(obs.t.time + obs.t.sec, keys, lambda i: (names[i], labels[i]), np.array(cno), slip=slip)
+
+    def _window(self):
+        return min(self.n, self.history)
+
+    def signals(self):
+        """
+        Aggregates of the window per signal.
+
+        :return: dict label -> dict with tracked (last epoch), cno (mean), min, slips (window)
+        """
+        cno = self.cno
+        now = (self.n - 1) % self.history
+        label = np.where(self.label >= 0, self.label, len(self.labels))
+        valid = np.isfinite(cno)
+        sums = np.bincount(np.repeat(label[None, :], self.history, 0)[valid], weights=cno[valid],
+                           minlength=len(self.labels) + 1)
+        counts = np.bincount(np.repeat(label[None, :], self.history, 0)[valid], minlength=len(self.labels) + 1)
+        slips = np.bincount(label, weights=self.slip.sum(axis=0), minlength=len(self.labels) + 1)
+        tracked = np.bincount(label, weights=valid[now], minlength=len(self.labels) + 1)
+        out = {}
+        for i, name in enumerate(self.labels):
+            cols = label == i
+            low = np.nanmin(cno[:, cols]) if counts[i] else np.nan
+            out[name] = {'tracked': int(tracked[i]), 'cno': sums[i] / counts[i] if counts[i] else np.nan,
+                         'min': float(low), 'slips': int(slips[i])}
+        return out
+
+    def satellites(self):
+        """
+        Aggregates of the window per satellite/signal.
+
+        :return: list of dict with sat, signal, cno (mean), last, lock, slips (session)
+        """
+        now = (self.n - 1) % self.history
+        out = []
+        for key, s in sorted(self.slot.items(), key=lambda item: (self.names[item[1]], item[0])):
+            col = self.cno[:, s]
+            out.append({'sat': self.names[s], 'signal': self.labels[self.label[s]],
+                        'cno': float(np.nanmean(col)) if np.isfinite(col).any() else np.nan,
+                        'last': float(col[now]), 'lock': float(self.lock[s]), 'slips': int(self.slips[s])})
+        return out
+
+    def alerts(self, signals=None):
+        """
+        Problems of the window (C/N0 drops, slips, no signals), the baselines are updated.
+
+        :return: list of str
+        """
+        signals = self.signals() if signals is None else signals
+        out = []
+        if self.n and not any(v['tracked'] for v in signals.values()):
+            out.append("no signals tracked")
+        for name, v in signals.items():
+            if not np.isfinite(v['cno']):
+                continue
+            base = self.baseline.get(name)
+            if base is None:
+                self.baseline[name] = v['cno']
+                continue
+            if v['cno'] < base - self.drop:
+                out.append("{} C/N0 {:.1f} dB-Hz, {:.1f} dB under its baseline".format(name, v['cno'], base - v['cno']))
+            else:
+                # NOTE: slow baseline, a drop doesn't move it
+                self.baseline[name] = 0.9 * base + 0.1 * v['cno']
+            if v['tracked'] and v['slips'] > 0.5 * v['tracked'] * self._window() / 60.0:
+                out.append("{} {} slips in {} epochs".format(name, v['slips'], self._window()))
+        return out
+
+    def report(self):
+        """
+        One line with the signals of the window.
+        """
+        signals = self.signals()
+        alerts = self.alerts(signals)
+        sats = len({self.names[s] for s in np.nonzero(self.seen == self.n - 1)[0]})
+        t = time.strftime('%H:%M:%S', time.gmtime(self.t)) if np.isfinite(self.t) else '--:--:--'
+        parts = ['{} {:d}x{:.1f}'.format(name, v['tracked'], v['cno']) for name, v in signals.items() if v['tracked']]
+        line = ' {} sats {:2d} C/N0 {} slips {}'.format(t, sats, ' '.join(parts) or '-',
+                                                        sum(v['slips'] for v in signals.values()))
+        if alerts:
+            line += '  ALERT: ' + '; '.join(alerts)
+        return line
+
+    def publish(self):
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write(self.report() + '\n')
+        stream.flush()
+        if self.callback is not None:
+            self.callback(self)
+
+    def table(self):
+        """
+        Summary of the signals (end of a session).
+        """
+        lines = ['{:<6} {:>7} {:>9} {:>7} {:>7}'.format('signal', 'tracked', 'C/N0 avg', 'min', 'slips')]
+        for name, v in sorted(self.signals().items()):
+            lines.append('{:<6} {:>7d} {:>9.1f} {:>7.1f} {:>7d}'.format(name, v['tracked'], v['cno'], v['min'], v['slips']))
+        return '\n'.join(lines)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='C/N0, lock time and cycle slips of a UBX capture or serial port.')
+    parser.add_argument('source', type=str, help='UBX file or serial port.')
+    parser.add_argument('-baud', '--baud', type=int, default=115200, help='Baud rate of the port. [default: %(default)s]')
+    parser.add_argument('-interval', '--interval', type=float, default=5.0, help='Seconds between summaries. [default: %(default)s]')
+    parser.add_argument('-history', '--history', type=int, default=600, help='Epochs of the window. [default: %(default)s]')
+    args = parser.parse_args(argv)
+
+    import os
+    if os.path.isfile(args.source):
+        monitor = SignalMonitor(args.history, interval=0)
+        with open(args.source, 'rb') as fh:
+            for data in iter(lambda: fh.read(1 << 20), b''):
+                monitor.feed(data)
+    else:
+        import serial
+        monitor = SignalMonitor(args.history, interval=args.interval)
+        try:
+            with serial.Serial(args.source, args.baud, timeout=0.1) as ser:
+                while True:
+                    monitor.feed(ser.read(4096))
+        except KeyboardInterrupt:
+            pass
+    print(monitor.report())
+    print(monitor.table())
+    return 0
+
+
+if __name__ == '__main__':
+    main()
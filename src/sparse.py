@@ -0,0 +1,128 @@
+"""
+Module to store per-epoch, per-satellite outputs (az/el, SNR, ionosphere...) in compact form
+
+Only the tracked satellites of each epoch are stored (CSR layout):
+    offsets[ne]:offsets[ne+1]   rows of epoch ne
+    sat[row]                    satellite number (cssrlib sat, 1..MAXSAT)
+    values[field][row]          value of each field
+"""
+
+import numpy as np
+
+from cssrlib.gnss import uGNSS
+
+
+class SatTrack():
+    """
+    Compact per-epoch/per-satellite storage.
+
+    :param nep:    [int] Maximum number of epochs
+    :param fields: [tuple of str] Names of the stored values (e.g. ('azm', 'elv'))
+    :param dtype:  Data type of the values (float32 by default)
+    """
+    def __init__(self, nep, fields, dtype=np.float32, capacity=1024):
+        self.nep = nep
+        self.fields = tuple(fields)
+        self.offsets = np.zeros(nep + 1, dtype=np.int64)
+        self.sat = np.zeros(capacity, dtype=np.uint16)
+        self.values = {field: np.zeros(capacity, dtype=dtype) for field in self.fields}
+
+        self.n = 0          # number of rows stored
+        self.last = -1      # last epoch stored
+
+    def _grow(self, size):
+        capacity = len(self.sat)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        self.sat = np.resize(self.sat, capacity)
+        for field in self.fields:
+            self.values[field] = np.resize(self.values[field], capacity)
+
+    def append(self, ne, sat, **values):
+        """
+        Store the satellites of epoch ne. Epochs must be appended in increasing order,
+        skipped epochs are stored as empty.
+
+        :param ne:     [int] Epoch index
+        :param sat:    [array of int] Satellites of the epoch
+        :param values: [array] Values of each field for the satellites
+        """
+        if ne <= self.last:
+            raise ValueError(f"Epoch {ne} already stored (last epoch: {self.last})")
+        if ne >= self.nep:
+            raise ValueError(f"Epoch {ne} out of range (nep: {self.nep})")
+
+        k = len(sat)
+        self.offsets[self.last + 1:ne + 1] = self.n
+        self._grow(self.n + k)
+        self.sat[self.n:self.n + k] = sat
+        for field in self.fields:
+            self.values[field][self.n:self.n + k] = values[field]
+        self.n += k
+        self.offsets[ne + 1:] = self.n
+        self.last = ne
+
+    def trim(self, nep=None):
+        """
+        Release the unused capacity (and epochs after nep).
+
+        :param nep: [int] Number of epochs to keep [default: all]
+        """
+        if nep is not None and nep < self.nep:
+            self.nep = nep
+            self.offsets = self.offsets[:nep + 1].copy()
+            self.n = int(self.offsets[-1])
+            self.last = min(self.last, nep - 1)
+        self.sat = self.sat[:self.n].copy()
+        for field in self.fields:
+            self.values[field] = self.values[field][:self.n].copy()
+        return self
+
+    def epoch(self, ne):
+        """
+        Get the satellites and values of epoch ne.
+
+        :return: (sat, {field: values})
+        """
+        i, j = self.offsets[ne], self.offsets[ne + 1]
+        return self.sat[i:j], {field: self.values[field][i:j] for field in self.fields}
+
+    def epochs(self):
+        """
+        Epoch index of each stored row.
+        """
+        return np.repeat(np.arange(self.nep), np.diff(self.offsets))
+
+    def track(self, sat):
+        """
+        Get the track of one satellite.
+
+        :param sat: [int] Satellite number
+        :return: (epoch index array, {field: values})
+        """
+        idx = np.flatnonzero(self.sat[:self.n] == sat)
+        return self.epochs()[idx], {field: self.values[field][idx] for field in self.fields}
+
+    def satellites(self):
+        """
+        Satellites stored at least once.
+        """
+        return np.unique(self.sat[:self.n])
+
+    def to_dense(self, field, fill=np.nan):
+        """
+        Expand a field to the dense nep x MAXSAT layout (e.g. for cssrlib.plot.skyplot).
+        NOTE: only for short sessions, this is the layout this class avoids.
+        """
+        dense = np.full((self.nep, uGNSS.MAXSAT), fill)
+        dense[self.epochs(), self.sat[:self.n].astype(int) - 1] = self.values[field][:self.n]
+        return dense
+
+    def nbytes(self):
+        """
+        Memory used by the stored rows [bytes].
+        """
+        return self.offsets.nbytes + self.sat[:self.n].nbytes + \
+            sum(self.values[field][:self.n].nbytes for field in self.fields)
@@ -0,0 +1,242 @@
+"""
+Module to decode SSR corrections (RTCM3 SSR / IGS SSR) incrementally into a time-indexed cache for PPP
+
+The corrections of each type (orbit, clock, code bias, phase bias) are stored by reference
+time t0 [s]. For an epoch t the cache returns a cssrlib decoder (cs) with the latest
+corrections of each type with t0 <= t that are not expired, ready for pppos.process(obs, cs=cs).
+
+    SsrCache    time-indexed corrections, fed frame by frame (file or NTRIP stream)
+    SsrReader   RTCM3 SSR file (.rtcm3, also .gz/.Z) read on demand up to the requested epoch
+
+Out of scope: compact SSR (CSSR: QZSS CLAS, Galileo HAS) and the atmospheric corrections
+(troposphere and ionosphere grids of PPP-RTK). Only the RTCM3/IGS SSR orbit, clock and bias
+messages are decoded, so the engines keep the troposphere and ionosphere models
+(trop_opt = iono_opt = 0).
+"""
+
+from bisect import bisect_right
+
+from cssrlib.rtcm import rtcm
+from cssrlib.cssrlib import sCType, sCSSR, sCSSRTYPE
+from cssrlib.gnss import gtime_t, time2gpst, timediff
+
+from src.ntrip import RtcmFramer
+from src.streams import open_binary
+
+
+# NOTE: validity of each correction type [s] (IGS real-time service update intervals: 5s clock, 60s orbit/bias)
+VALIDITY = {
+    sCType.ORBIT: 180.0,
+    sCType.CLOCK: 30.0,
+    sCType.CBIAS: 600.0,
+    sCType.PBIAS: 600.0,
+}
+
+SSR_SUBTYPES = (sCSSR.ORBIT, sCSSR.CLOCK, sCSSR.COMBINED, sCSSR.CBIAS, sCSSR.PBIAS)
+
+def _key(t):
+    return t.time + int(round(t.sec))
+
+
+class SsrCache():
+    """
+    Time-indexed cache of SSR corrections.
+
+    :param cssrmode: [sCSSRTYPE] RTCM3_SSR or IGS_SSR
+    :param validity: [dict] Validity of each correction type [s] (default: VALIDITY)
+    :param tref:     [gtime_t] Reference time for the GPS week [default: first epoch requested]
+    """
+    def __init__(self, cssrmode=sCSSRTYPE.RTCM3_SSR, validity=None, tref=None):
+        self.dec = rtcm()       # decoder (its state is only used while decoding)
+        self.dec.monlevel = 0
+        self.dec.cssrmode = cssrmode
+        if tref is not None:
+            self.dec.week, _ = time2gpst(tref)
+
+        self.cs = rtcm()        # corrections returned to pppos
+        self.cs.monlevel = 0
+        self.cs.cssrmode = cssrmode
+
+        self.validity = dict(VALIDITY)
+        if validity is not None:
+            self.validity.update(validity)
+
+        self.keys = {ctype: [] for ctype in VALIDITY}   # sorted t0 [s]
+        self.data = {ctype: {} for ctype in VALIDITY}   # t0 [s] -> snapshot
+        self.cursor = {ctype: -1 for ctype in VALIDITY}
+        self.time = None        # time of the last message decoded
+        self.nmsg = 0
+
+    def _snapshot(self, ctype):
+        dec = self.dec
+        lc = dec.lc[0]
+        if ctype == sCType.ORBIT:
+            snap = {'iode': dict(lc.iode), 'dorb': dict(lc.dorb), 'sat_n': list(dec.sat_n),
+                    'iodssr': dec.iodssr}
+        elif ctype == sCType.CLOCK:
+            snap = {'dclk': dict(lc.dclk)}
+        elif ctype == sCType.CBIAS:
+            snap = {'cbias': {sat: dict(v) for sat, v in lc.cbias.items()}}
+        else:
+            snap = {'pbias': {sat: dict(v) for sat, v in lc.pbias.items()}}
+        snap['iodssr_c'] = int(dec.iodssr_c[ctype])
+
+        key = _key(dec.time)
+        keys = self.keys[ctype]
+        if key not in self.data[ctype]:
+            if keys and key < keys[-1]:
+                return # NOTE: older than the cache, dropped
+            keys.append(key)
+        self.data[ctype][key] = snap
+
+    def decode(self, frame):
+        """
+        Decode one RTCM3 frame and store its corrections.
+
+        :param frame: [bytes] RTCM3 frame (preamble + length + message + CRC)
+        :return: [gtime_t] Time of the message, None if it isn't a SSR message
+        """
+        dec = self.dec
+        dec.len = len(frame) - 6
+        dec.dlen = len(frame)
+        dec.decode(frame)
+        if self.time is not None and dec.subtype in SSR_SUBTYPES and \
+                timediff(dec.time, self.time) < -302400.0: # NOTE: week rollover
+            dec.week += 1
+            dec.decode(frame)
+
+        if dec.subtype == sCSSR.ORBIT:
+            ctypes = (sCType.ORBIT,)
+        elif dec.subtype == sCSSR.CLOCK:
+            ctypes = (sCType.CLOCK,)
+        elif dec.subtype == sCSSR.COMBINED:
+            ctypes = (sCType.ORBIT, sCType.CLOCK)
+        elif dec.subtype == sCSSR.CBIAS:
+            ctypes = (sCType.CBIAS,)
+        elif dec.subtype == sCSSR.PBIAS:
+            ctypes = (sCType.PBIAS,)
+        else:
+            return None
+
+        for ctype in ctypes:
+            self._snapshot(ctype)
+        self.time = dec.time
+        self.nmsg += 1
+        return dec.time
+
+    def lookup(self, ctype, t):
+        """
+        Latest correction of a type with t0 <= t (O(1) for increasing epochs).
+
+        :return: (t0 [s], snapshot) or (None, None)
+        """
+        keys = self.keys[ctype]
+        ts = _key(t)
+        k = self.cursor[ctype]
+        if k >= len(keys) or (k >= 0 and keys[k] > ts): # NOTE: epoch back in time
+            k = bisect_right(keys, ts) - 1
+        else:
+            while k + 1 < len(keys) and keys[k + 1] <= ts:
+                k += 1
+        self.cursor[ctype] = k
+        if k < 0 or ts - keys[k] > self.validity[ctype]:
+            return None, None
+        return keys[k], self.data[ctype][keys[k]]
+
+    def evict(self, t):
+        """
+        Remove the corrections that can't be used anymore at t (the latest one before t is kept).
+        """
+        ts = _key(t)
+        for ctype, keys in self.keys.items():
+            n = bisect_right(keys, ts) - 1  # latest <= t
+            n = min(n, bisect_right(keys, ts - self.validity[ctype]))
+            if n <= 0:
+                continue
+            for key in keys[:n]:
+                del self.data[ctype][key]
+            del keys[:n]
+            self.cursor[ctype] = max(self.cursor[ctype] - n, -1)
+
+    def at(self, t):
+        """
+        Corrections valid at epoch t.
+
+        :param t: [gtime_t] Epoch
+        :return: cs (cssrlib rtcm) for pppos.process, None if there aren't orbit and clock corrections
+        """
+        cs = self.cs
+        lc = cs.lc[0]
+        lc.cstat = 0
+        lc.iode, lc.dorb, lc.dclk, lc.cbias, lc.pbias, lc.t0 = {}, {}, {}, {}, {}, {}
+        cs.sat_n = []
+        cs.iodssr = -1
+        cs.iodssr_c[:] = -1
+
+        for ctype in VALIDITY:
+            t0, snap = self.lookup(ctype, t)
+            if snap is None:
+                continue
+            tc = gtime_t(t0, 0.0)
+            for name, value in snap.items():
+                if name == 'iodssr_c':
+                    cs.iodssr_c[ctype] = value
+                elif name in ('sat_n', 'iodssr'):
+                    setattr(cs, name, value)
+                else:
+                    setattr(lc, name, value)
+            lc.cstat |= (1 << ctype)
+            lc.t0s[ctype] = tc
+            for sat in snap.get('dorb', snap.get('dclk', snap.get('cbias', snap.get('pbias', {})))):
+                cs.set_t0(0, sat, ctype, tc)
+
+        if not (lc.cstat & (1 << sCType.ORBIT)) or not (lc.cstat & (1 << sCType.CLOCK)):
+            return None
+        return cs
+
+    def __len__(self):
+        return sum(len(keys) for keys in self.keys.values())
+
+
+class SsrReader():
+    """
+    Read a RTCM3 SSR file on demand.
+
+    :param path:     [str] RTCM3 file (.gz/.Z too)
+    :param cssrmode: [sCSSRTYPE] RTCM3_SSR or IGS_SSR
+    :param validity: [dict] Validity of each correction type [s]
+    """
+    CHUNK = 4096
+
+    def __init__(self, path, cssrmode=sCSSRTYPE.RTCM3_SSR, validity=None):
+        self.fh = open_binary(path)
+        self.framer = RtcmFramer()
+        self.cache = SsrCache(cssrmode, validity)
+        self.eof = False
+
+    def advance(self, t):
+        """
+        Decode the file until the first message after t (all the corrections <= t are loaded).
+        """
+        dec = self.cache.dec
+        if dec.week < 0:
+            dec.week, _ = time2gpst(t)
+        while not self.eof and (self.cache.time is None or _key(self.cache.time) <= _key(t)):
+            data = self.fh.read(self.CHUNK)
+            if not data:
+                self.eof = True
+                break
+            for frame in self.framer.feed(data):
+                self.cache.decode(frame)
+
+    def at(self, t):
+        """
+        Corrections valid at epoch t (see SsrCache.at).
+        """
+        self.advance(t)
+        cs = self.cache.at(t)
+        self.cache.evict(t)
+        return cs
+
+    def close(self):
+        self.fh.close()
@@ -0,0 +1,455 @@
+"""
+Module to read compressed RINEX files and products as streams
+
+Supported inputs (decoded in-process, without temporary files):
+    - gzip (.gz)
+    - Unix compress / LZW (.Z)
+    - Hatanaka compact RINEX 3 (.crx, .YYd), also compressed (.crx.gz, .crx.Z, .YYd.Z ...)
+"""
+
+import gzip
+import io
+import os
+import re
+import threading
+from collections import deque
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+LZW_MAGIC = b'\x1f\x9d'
+
+COMPRESSED_EXT = ('.gz', '.z')
+
+pattern_crx = re.compile(r'.*(\.crx|\.\d{2}d)$', re.IGNORECASE)
+
+CHUNK = 1 << 16
+
+
+def strip_compression(name):
+    """
+    Remove the compression extension (.gz, .Z) from a file name.
+
+    :param name: [str] File name
+    :return: [str] File name without compression extension
+    """
+    root, ext = os.path.splitext(name)
+    if ext.lower() in COMPRESSED_EXT:
+        return root
+    return name
+
+
+def is_compressed(name):
+    """
+    Check if a file must be decompressed before reading it (gzip, LZW or Hatanaka).
+
+    :param name: [str] File name
+    """
+    return strip_compression(name) != name or is_crx(name)
+
+
+def is_crx(name):
+    """
+    Check if a file name is a Hatanaka compact RINEX (.crx, .YYd).
+
+    :param name: [str] File name
+    """
+    return pattern_crx.match(strip_compression(str(name))) is not None
+
+
+def lzw_decompress(fh):
+    """
+    Decompress a Unix compress (.Z) stream (LZW, as ncompress 4.2).
+
+    :param fh: Binary file object positioned at the start of the .Z data
+    :return: Generator of decompressed chunks [bytes]
+    """
+    header = fh.read(3)
+    if len(header) < 3 or header[0:2] != LZW_MAGIC:
+        raise ValueError("Not a Unix compress (.Z) stream!")
+
+    maxbits = header[2] & 0x1f
+    block_mode = header[2] & 0x80
+    if maxbits < 9 or maxbits > 16:
+        raise ValueError(f"Invalid LZW maximum code size: {maxbits}")
+    maxmaxcode = 1 << maxbits
+
+    table = [bytes([i]) for i in range(256)]
+    if block_mode:
+        table.append(b'')  # NOTE: code 256 == CLEAR, never referenced
+
+    n_bits = 9
+    maxcode = (1 << n_bits) - 1
+    bitmask = maxcode
+    free_ent = len(table)
+    prev = None
+
+    buf = b''
+    buf_start = 0       # bits consumed before buf[0]
+    posbits = 0         # absolute bit position of the next code
+    group = 0           # absolute bit position where the current code size started
+    eof = False
+
+    while True:
+        # NOTE: keep at least one full code in the buffer
+        while not eof and posbits + n_bits > buf_start + len(buf) * 8:
+            data = fh.read(CHUNK)
+            if not data:
+                eof = True
+                break
+            drop = (posbits - buf_start) >> 3
+            buf = buf[drop:] + data
+            buf_start += drop * 8
+
+        out = []
+        while True:
+            if free_ent > maxcode:
+                # NOTE: codes are written in groups of n_bits bytes, skip the rest of the group
+                nbits8 = n_bits << 3
+                posbits = group + -(-(posbits - group) // nbits8) * nbits8
+                group = posbits
+                n_bits += 1
+                maxcode = maxmaxcode if n_bits == maxbits else (1 << n_bits) - 1
+                bitmask = (1 << n_bits) - 1
+
+            if posbits + n_bits > buf_start + len(buf) * 8:
+                break
+
+            p = (posbits - buf_start) >> 3
+            code = (int.from_bytes(buf[p:p + 3], 'little') >> (posbits & 7)) & bitmask
+            posbits += n_bits
+
+            if prev is None:
+                if code >= 256:
+                    raise ValueError("Corrupt LZW stream!")
+                out.append(table[code])
+                prev = code
+                continue
+
+            if code == 256 and block_mode:
+                del table[257:]
+                free_ent = 257
+                nbits8 = n_bits << 3
+                posbits = group + -(-(posbits - group) // nbits8) * nbits8
+                group = posbits
+                n_bits = 9
+                maxcode = (1 << n_bits) - 1
+                bitmask = maxcode
+                prev = None
+                continue
+
+            if code < free_ent:
+                entry = table[code]
+            elif code == free_ent:  # KwKwK case
+                entry = table[prev] + table[prev][:1]
+            else:
+                raise ValueError("Corrupt LZW stream!")
+
+            out.append(entry)
+            if free_ent < maxmaxcode:
+                table.append(table[prev] + entry[:1])
+                free_ent += 1
+            prev = code
+
+        if out:
+            yield b''.join(out)
+        if eof:
+            return
+
+
+class LZWReader(io.RawIOBase):
+    """
+    Raw binary reader over a Unix compress (.Z) file object.
+    """
+    def __init__(self, fh):
+        self.fh = fh
+        self._chunks = lzw_decompress(fh)
+        self._buf = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buf:
+            try:
+                self._buf = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.fh.close()
+        super().close()
+
+
+def _crx_int(value, decimals):
+    """ Format an integer with implicit decimals (e.g. 130321269801, 3 --> 130321269.801) """
+    sign = '-' if value < 0 else ''
+    ip, fp = divmod(abs(value), 10 ** decimals)
+    return "{}{}.{:0{}d}".format(sign, ip if ip else '', fp, decimals)  # NOTE: as crx2rnx, 0.5 --> .500
+
+
+def _crx_text(old, diff):
+    """ Recover a text field differenced by character (' ': unchanged, '&': space) """
+    new = list(old.ljust(len(diff)))
+    for i, c in enumerate(diff):
+        if c == '&':
+            new[i] = ' '
+        elif c != ' ':
+            new[i] = c
+    return ''.join(new)
+
+
+class _arc():
+    """ Difference table of an observable arc in compact RINEX """
+    def __init__(self, order, value):
+        self.order = order
+        self.n = 0
+        self.u = [value] + [0] * order
+
+    def update(self, d):
+        if self.n < self.order:
+            self.n += 1
+        self.u[self.n] = d
+        for k in range(self.n, 0, -1):
+            self.u[k - 1] += self.u[k]
+        return self.u[0]
+
+
+def _crx_field(arc, field):
+    """
+    Decode one field of compact RINEX (empty: missing, 'k&v': new arc, 'd': difference).
+
+    :return: (arc, value) with value None if missing
+    """
+    if field == '':
+        return None, None
+    if len(field) > 1 and field[1] == '&':
+        arc = _arc(int(field[0]), int(field[2:]))
+        return arc, arc.u[0]
+    if arc is None:
+        raise ValueError("Compact RINEX: difference without initialized arc!")
+    return arc, arc.update(int(field))
+
+
+class CRXReader(io.TextIOBase):
+    """
+    Text reader that converts a Hatanaka compact RINEX 3 stream into RINEX 3 lines on the fly.
+
+    :param fh: Text file object of the compact RINEX
+    """
+    def __init__(self, fh):
+        self.fh = fh
+        self._lines = deque()
+        self._ntype = {}
+        self._epoch = ''
+        self._clk = None
+        self._arcs = {}     # sat --> [arc of each observable]
+        self._flags = {}    # sat --> LLI/SSI string
+        self._header()
+
+    def readable(self):
+        return True
+
+    def _header(self):
+        line = self.fh.readline()
+        if 'CRINEX VERS' not in line[60:]:
+            raise ValueError("Not a compact RINEX (Hatanaka) file!")
+        if not line[0:20].strip().startswith('3'):
+            raise ValueError("Compact RINEX version {} not supported (only 3.x)".format(line[0:20].strip()))
+        self.fh.readline()  # CRINEX PROG / DATE
+
+        sys_ = None
+        for line in self.fh:
+            self._lines.append(line)
+            if line[60:79] == 'SYS / # / OBS TYPES':
+                if line[0] != ' ':
+                    sys_ = line[0]
+                    self._ntype[sys_] = int(line[3:6])
+            elif line[60:73] == 'END OF HEADER':
+                break
+
+    def _decode_epoch(self):
+        line = self.fh.readline()
+        if not line:
+            return False
+        line = line.rstrip('\r\n')
+
+        if line.startswith('>'):
+            # Initialization of the epoch record
+            self._epoch = line
+            self._arcs = {}
+            self._flags = {}
+            self._clk = None
+        else:
+            self._epoch = _crx_text(self._epoch, line)
+
+        epoch = self._epoch
+        flag = epoch[31:32]
+        nsat = int(epoch[32:35])
+
+        if flag not in ('0', '1', '6'):
+            # Special event, records are not compressed
+            self._lines.append(epoch[:35].rstrip() + '\n')
+            for _ in range(nsat):
+                self._lines.append(self.fh.readline())
+            return True
+
+        # Receiver clock offset
+        clk = self.fh.readline().rstrip('\r\n')
+        if clk:
+            arc, value = _crx_field(self._clk, clk)
+            self._clk = arc
+            self._lines.append("{:41s}{:>15s}\n".format(epoch[:35], _crx_int(value, 12)))
+        else:
+            self._clk = None
+            self._lines.append(epoch[:35] + '\n')
+
+        sats = [epoch[41 + 3 * k:44 + 3 * k] for k in range(nsat)]
+        arcs, flags = {}, {}
+        for sat in sats:
+            line = self.fh.readline().rstrip('\r\n')
+            ntype = self._ntype.get(sat[0], 0)
+            arc_sat = self._arcs.get(sat, [None] * ntype)
+
+            values = []
+            p = 0
+            for j in range(ntype):
+                if p is None:
+                    field = ''
+                else:
+                    q = line.find(' ', p)
+                    field = line[p:] if q < 0 else line[p:q]
+                    p = None if q < 0 else q + 1
+                arc_sat[j], value = _crx_field(arc_sat[j], field)
+                values.append(value)
+
+            flag_sat = _crx_text(self._flags.get(sat, ''), line[p:] if p is not None else '')
+            arcs[sat] = arc_sat
+            flags[sat] = flag_sat
+
+            txt = sat
+            flag_sat = flag_sat.ljust(2 * ntype)
+            for j, value in enumerate(values):
+                obs = '' if value is None else _crx_int(value, 3)
+                txt += "{:>14s}{}".format(obs, flag_sat[2 * j:2 * j + 2])
+            self._lines.append(txt.rstrip() + '\n')
+
+        self._arcs = arcs
+        self._flags = flags
+        return True
+
+    def readline(self, size=-1):
+        while not self._lines:
+            if not self._decode_epoch():
+                return ''
+        return self._lines.popleft()
+
+    def read(self, size=-1):
+        lines = []
+        line = self.readline()
+        while line:
+            lines.append(line)
+            line = self.readline()
+        return ''.join(lines)
+
+    def close(self):
+        if not self.closed:
+            self.fh.close()
+        super().close()
+
+
+def open_binary(path):
+    """
+    Open a file as a binary stream, decompressing gzip and Unix compress (.Z) on the fly.
+
+    NOTE: the compression is detected by the magic bytes, not by the extension.
+
+    :param path: [str] File path
+    :return: Binary file object
+    """
+    fh = open(path, 'rb')
+    fh = io.BufferedReader(fh) if not isinstance(fh, io.BufferedReader) else fh
+    magic = fh.peek(2)[:2]
+    if magic == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=fh, mode='rb')
+    if magic == LZW_MAGIC:
+        return io.BufferedReader(LZWReader(fh), CHUNK)
+    return fh
+
+
+def open_text(path):
+    """
+    Open a RINEX/product file as a text stream. Compressed (.gz, .Z) and Hatanaka (.crx, .YYd)
+    files are decoded on the fly.
+
+    :param path: [str] File path
+    :return: Text file object (iteration and readline() supported)
+    """
+    fh = io.TextIOWrapper(open_binary(path), encoding='utf-8', errors='ignore')
+    if is_crx(path):
+        return CRXReader(fh)
+    return fh
+
+
+def open_product(path):
+    """
+    Get an argument for the cssrlib loaders that only accept a file name (parse_sp3, decode_clk,
+    biasdec.parse, atxdec.readpcv, ...).
+
+    Uncompressed files return the same path. Compressed files return the file descriptor of a pipe
+    that is fed with the decompressed data by a background thread (open() accepts file descriptors).
+
+    :param path: [str] File path
+    :return: [str or int] Path or file descriptor
+    """
+    if path is None or not is_compressed(str(path)):
+        return path
+
+    src = open_text(path) if is_crx(path) else open_binary(path)
+    r, w = os.pipe()
+
+    def feed():
+        try:
+            with src, open(w, 'wb') as dst:
+                while True:
+                    data = src.read(CHUNK)
+                    if not data:
+                        break
+                    dst.write(data.encode('utf-8') if isinstance(data, str) else data)
+        except (BrokenPipeError, OSError):
+            pass  # NOTE: the reader stopped before the end of the file
+
+    threading.Thread(target=feed, daemon=True).start()
+    return r
+
+
+def decode_nav(rnx, navfile, nav):
+    """
+    Decode a RINEX NAV file (compressed or not) with a cssrlib rnxdec.
+
+    :param rnx:     [rnxdec] RINEX decoder
+    :param navfile: [str] Navigation file
+    :param nav:     [Nav] Navigation object
+    :return: [Nav]
+    """
+    with open_text(navfile) as fnav:
+        return rnx._decode_nav(fnav, nav)
+
+
+def decode_obsh(rnx, obsfile):
+    """
+    Open a RINEX OBS file (compressed, Hatanaka or not) and decode its header with a cssrlib rnxdec.
+    The observations are then read with rnx.decode_obs().
+
+    :param rnx:     [rnxdec] RINEX decoder
+    :param obsfile: [str] Observation file
+    :return: [int] Status of rnxdec (< 0: error)
+    """
+    if rnx.fobs is not None:
+        rnx.fobs.close()
+    rnx.fobs = open_text(obsfile)
+    return rnx._decode_obsh()
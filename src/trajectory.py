@@ -0,0 +1,352 @@
+"""
+Module to evaluate a kinematic solution against a reference trajectory
+
+The engines only compute the ENU error of static runs (nav.pmode == 0, fixed xyz_ref). Here the
+solution and the reference are arrays of epochs [s] (gtime_t.time + sec) and ECEF positions [m]:
+    align       every solution epoch is placed between two reference epochs (searchsorted) and the
+                reference position and velocity are interpolated, over gaps longer than maxgap nan
+    evaluate    ENU error at the interpolated reference, horizontal/3D error and the along/cross-track
+                errors in the direction of the reference velocity (nan when it is stopped)
+    stats       n, mean, std, rms, percentiles and max of every error column in one pass
+Nothing is done epoch by epoch, a drive test of millions of epochs is evaluated in seconds.
+
+The solution is read from the log of the engines (ppp-igs.log, rtk-igs.log) and the reference from a
+RTKLIB .pos file (GPST date/time or week/seconds, ECEF or latitude/longitude/height in degrees)
+or from another engine log.
+"""
+
+import argparse
+import re
+import warnings
+
+import numpy as np
+
+from cssrlib.gnss import gpst2time, rCST, time2str, gtime_t
+
+from src.streams import open_text
+
+
+T_GPST0 = gpst2time(0, 0.0).time        # GPS week 0 [s] (gtime_t.time)
+PERCENTILES = [50, 68, 95]
+COLUMNS = ['e', 'n', 'u', 'hor', '3d', 'along', 'cross']
+
+pattern_log = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d+)?) Sol: \[\s*(\S+),\s*(\S+),\s*(\S+)\].*?mode \[(\d+)\]',
+                         re.MULTILINE)
+
+
+def log_time(t):
+    """
+    Epoch of the engine logs, 'YYYY-MM-DD HH:MM:SS.sss' (time2str drops the fraction, all the epochs
+    of a second at 10 Hz would have the same time).
+
+    :param t: [gtime_t] Epoch
+    """
+    ms = int(round(t.sec * 1000.0))
+    return "{}.{:03d}".format(time2str(gtime_t(t.time + ms // 1000, 0.0)), ms % 1000)
+
+
+def _seconds(dates):
+    """
+    'YYYY-MM-DD HH:MM:SS[.sss]' (or YYYY/MM/DD) to seconds (gtime_t.time + sec), vectorized.
+    """
+    dates = np.char.replace(np.asarray(dates, dtype=str), '/', '-')
+    return (dates.astype('datetime64[ms]') - np.datetime64('1970-01-01T00:00:00', 'ms')).astype(np.float64) * 1e-3
+
+
+def llh2ecef(llh):
+    """
+    Geodetic latitude, longitude [rad] and height [m] to ECEF (WGS84), vectorized.
+
+    :param llh: [array] (N, 3)
+    :return: [array] (N, 3) ECEF [m]
+    """
+    llh = np.atleast_2d(llh)
+    e2 = rCST.FE_WGS84 * (2.0 - rCST.FE_WGS84)
+    sinp, cosp = np.sin(llh[:, 0]), np.cos(llh[:, 0])
+    v = rCST.RE_WGS84 / np.sqrt(1.0 - e2 * sinp**2)
+    return np.column_stack(((v + llh[:, 2]) * cosp * np.cos(llh[:, 1]),
+                            (v + llh[:, 2]) * cosp * np.sin(llh[:, 1]),
+                            (v * (1.0 - e2) + llh[:, 2]) * sinp))
+
+
+def ecef2latlon(xyz, niter=5):
+    """
+    Geodetic latitude and longitude [rad] of ECEF positions (WGS84), vectorized.
+
+    :param xyz: [array] (N, 3) ECEF [m]
+    :return: (lat, lon) [rad]
+    """
+    xyz = np.atleast_2d(xyz)
+    e2 = rCST.FE_WGS84 * (2.0 - rCST.FE_WGS84)
+    r = np.hypot(xyz[:, 0], xyz[:, 1])
+    z = xyz[:, 2].copy()
+    # NOTE: fixed iterations of ecef2pos, converged to < 1e-12 rad from the first one on Earth
+    for _ in range(niter):
+        sinp = z / np.sqrt(r**2 + z**2)
+        z = xyz[:, 2] + rCST.RE_WGS84 / np.sqrt(1.0 - e2 * sinp**2) * e2 * sinp
+    return np.arctan2(z, r), np.arctan2(xyz[:, 1], xyz[:, 0])
+
+
+def ecef2enu_vec(lat, lon, d):
+    """
+    ECEF vectors to local ENU at (lat, lon), one rotation per row.
+
+    :param lat, lon: [array] (N,) [rad]
+    :param d:        [array] (N, 3) ECEF vectors
+    :return: [array] (N, 3) ENU
+    """
+    sinp, cosp, sinl, cosl = np.sin(lat), np.cos(lat), np.sin(lon), np.cos(lon)
+    return np.column_stack((-sinl * d[:, 0] + cosl * d[:, 1],
+                            -sinp * cosl * d[:, 0] - sinp * sinl * d[:, 1] + cosp * d[:, 2],
+                            cosp * cosl * d[:, 0] + cosp * sinl * d[:, 1] + sinp * d[:, 2]))
+
+
+def read_log(path):
+    """
+    Solution of an engine log (lines '<epoch> Sol: [x, y, z] ... mode [m]').
+
+    :param path: [str] Log file (ppp-igs.log, rtk-igs.log, ...)
+    :return: (t [s], xyz (N, 3) [m], smode)
+    """
+    with open_text(path) as fh:
+        rows = pattern_log.findall(fh.read())
+    if not rows:
+        raise ValueError("No solutions in the log {}!".format(path))
+    cols = list(zip(*rows))
+    t = _seconds(cols[0])
+    xyz = np.column_stack([np.array(c, dtype=np.float64) for c in cols[1:4]])
+    return t, xyz, np.array(cols[4], dtype=np.int64)
+
+
+def read_pos(path):
+    """
+    Trajectory of a RTKLIB .pos file.
+
+    :param path: [str] .pos file, GPST as date/time or week/seconds, ECEF or latitude/longitude [deg]/height
+    :return: (t [s], xyz (N, 3) [m], Q of the solution)
+    """
+    import pandas as pd # NOTE: C parser, the reference of a drive test can have millions of lines
+
+    llh = False
+    with open_text(path) as fh:
+        for line in fh:
+            if not line.startswith('%'):
+                break
+            if 'latitude(d\'' in line:
+                raise ValueError("Reference in deg/min/sec, use decimal degrees!")
+            if 'latitude(deg)' in line:
+                llh = True
+
+    with open_text(path) as fh:
+        df = pd.read_csv(fh, sep=r'\s+', comment='%', header=None, usecols=[0, 1, 2, 3, 4, 5],
+                         dtype={0: str, 1: str})
+    if df.empty:
+        raise ValueError("No solutions in the reference {}!".format(path))
+
+    c0, c1 = df[0].to_numpy(dtype=str), df[1].to_numpy(dtype=str)
+    if '/' in c0[0] or '-' in c0[0]:
+        t = _seconds(np.char.add(np.char.add(c0, ' '), c1))
+    else:
+        t = T_GPST0 + c0.astype(np.float64) * 604800.0 + c1.astype(np.float64)
+
+    pos = df[[2, 3, 4]].to_numpy(dtype=np.float64)
+    if llh:
+        pos = llh2ecef(np.column_stack((np.deg2rad(pos[:, 0]), np.deg2rad(pos[:, 1]), pos[:, 2])))
+    return t, pos, df[5].to_numpy(dtype=np.int64)
+
+
+def read_trajectory(path):
+    """
+    Trajectory of an engine log or a RTKLIB .pos file (by content).
+
+    :return: (t [s], xyz (N, 3) [m], mode) sorted by time, duplicated epochs removed
+    """
+    with open_text(path) as fh:
+        head = fh.read(4096)
+    t, xyz, mode = read_log(path) if pattern_log.search(head) else read_pos(path)
+
+    order = np.argsort(t, kind='stable')
+    t, xyz, mode = t[order], xyz[order], mode[order]
+    keep = np.ones(len(t), dtype=bool)
+    keep[1:] = np.diff(t) > 0
+    return t[keep], xyz[keep], mode[keep]
+
+
+def align(t, tref, xyzref, maxgap=1.0, tol=1e-3):
+    """
+    Reference position and velocity at the solution epochs (linear interpolation).
+
+    :param t:      [array] Solution epochs [s]
+    :param tref:   [array] Reference epochs [s], increasing
+    :param xyzref: [array] (M, 3) Reference positions ECEF [m]
+    :param maxgap: [float] Maximum interval between two reference epochs to interpolate [s]
+    :param tol:    [float] Tolerance of the epochs at the ends of the reference [s]
+    :return: (xyz (N, 3), vel (N, 3) [m/s]), nan where the reference doesn't cover the epoch
+    """
+    t = np.asarray(t, dtype=np.float64)
+    tref = np.asarray(tref, dtype=np.float64)
+    xyz = np.full((len(t), 3), np.nan)
+    vel = np.full((len(t), 3), np.nan)
+    if len(tref) < 2:
+        return xyz, vel
+
+    k = np.clip(np.searchsorted(tref, t, side='left'), 1, len(tref) - 1)
+    t0, t1 = tref[k - 1], tref[k]
+    ok = (t >= t0 - tol) & (t <= t1 + tol) & (t1 - t0 <= maxgap)
+    w = ((t - t0) / (t1 - t0))[ok, None]
+    p0, p1 = xyzref[k[ok] - 1], xyzref[k[ok]]
+    xyz[ok] = p0 + w * (p1 - p0)
+    vel[ok] = (p1 - p0) / (t1 - t0)[ok, None]
+    return xyz, vel
+
+
+def stats(err):
+    """
+    Statistics of the error columns (nan ignored).
+
+    :param err: [array] (N, C) errors
+    :return: dict name -> array (C,): n, mean, std, rms, p50, p68, p95, max (of the absolute value)
+    """
+    err = np.atleast_2d(np.asarray(err, dtype=np.float64))
+    ok = np.isfinite(err)
+    n = ok.sum(axis=0)
+    res = {'n': n}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        s = np.where(ok, err, 0.0)
+        res['mean'] = s.sum(axis=0) / n
+        res['rms'] = np.sqrt((s**2).sum(axis=0) / n)
+        res['std'] = np.sqrt(np.maximum(res['rms']**2 - res['mean']**2, 0.0))
+        a = np.where(ok, np.abs(err), np.nan)
+        if err.shape[0] > 0 and n.any():
+            with warnings.catch_warnings(): # NOTE: all-nan columns (along/cross of a static run)
+                warnings.simplefilter('ignore', RuntimeWarning)
+                pct = np.nanpercentile(a, PERCENTILES, axis=0)
+                res['max'] = np.nanmax(a, axis=0)
+        else:
+            pct = np.full((len(PERCENTILES), err.shape[1]), np.nan)
+            res['max'] = np.full(err.shape[1], np.nan)
+    for p, v in zip(PERCENTILES, pct):
+        res['p{}'.format(p)] = v
+    return res
+
+
+class Evaluation():
+    """
+    Errors of a solution against a reference trajectory.
+
+    :param t:        [array] Solution epochs [s] (gtime_t.time + sec)
+    :param xyz:      [array] (N, 3) Solution ECEF [m]
+    :param tref:     [array] Reference epochs [s]
+    :param xyzref:   [array] (M, 3) Reference ECEF [m]
+    :param smode:    [array] Solution mode of every epoch (4: fix, 5: float, ...), optional
+    :param maxgap:   [float] Maximum reference gap to interpolate [s]
+    :param minspeed: [float] Minimum horizontal speed of the reference for along/cross-track [m/s]
+    """
+    def __init__(self, t, xyz, tref, xyzref, smode=None, maxgap=1.0, minspeed=0.5):
+        self.t = np.asarray(t, dtype=np.float64)
+        xyz = np.asarray(xyz, dtype=np.float64)
+        tref = np.asarray(tref, dtype=np.float64)
+        xyzref = np.asarray(xyzref, dtype=np.float64)
+        if not np.all(np.diff(tref) > 0):
+            order = np.argsort(tref, kind='stable')
+            tref, xyzref = tref[order], xyzref[order]
+        self.smode = np.zeros(len(self.t), dtype=np.int64) if smode is None else np.asarray(smode)
+
+        self.ref, vel = align(self.t, tref, xyzref, maxgap)
+        # NOTE: epochs without solution (nan or 0 before the first fix) are not evaluated
+        self.valid = np.isfinite(self.ref[:, 0]) & np.isfinite(xyz).all(axis=1) & (np.abs(xyz).sum(axis=1) > 0)
+
+        lat, lon = ecef2latlon(np.where(self.valid[:, None], self.ref, [rCST.RE_WGS84, 0.0, 0.0]))
+        self.enu = ecef2enu_vec(lat, lon, xyz - self.ref)
+        self.enu[~self.valid] = np.nan
+        venu = ecef2enu_vec(lat, lon, vel)
+        speed = np.hypot(venu[:, 0], venu[:, 1])
+        moving = self.valid & (speed >= minspeed)
+
+        self.hor = np.hypot(self.enu[:, 0], self.enu[:, 1])
+        self.err3d = np.linalg.norm(self.enu, axis=1)
+        # NOTE: along positive ahead, cross positive to the left of the direction of travel
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.along = np.where(moving, (self.enu[:, 0] * venu[:, 0] + self.enu[:, 1] * venu[:, 1]) / speed, np.nan)
+            self.cross = np.where(moving, (self.enu[:, 1] * venu[:, 0] - self.enu[:, 0] * venu[:, 1]) / speed, np.nan)
+        self.speed = np.where(self.valid, speed, np.nan)
+
+    def errors(self):
+        """
+        Error columns (N, 7): e, n, u, hor, 3d, along, cross [m].
+        """
+        return np.column_stack((self.enu, self.hor, self.err3d, self.along, self.cross))
+
+    def stats(self, mode=None):
+        """
+        Statistics of the errors, all epochs or the epochs of a solution mode.
+
+        :param mode: [int] Solution mode (4: fix, 5: float, ...), None for all
+        :return: dict column -> dict (n, mean, std, rms, p50, p68, p95, max)
+        """
+        err = self.errors()
+        if mode is not None:
+            err = err[self.smode == mode]
+        res = stats(err)
+        return {col: {k: (int(v[i]) if k == 'n' else float(v[i])) for k, v in res.items()}
+                for i, col in enumerate(COLUMNS)}
+
+    def summary(self, modes=True):
+        """
+        Table of the statistics (all epochs and per solution mode).
+        """
+        lines = ["Epochs {} evaluated {} ({:.1f}%)".format(len(self.t), int(self.valid.sum()),
+                                                          100.0 * self.valid.mean() if len(self.t) else 0.0)]
+        groups = [('all', None)]
+        if modes:
+            groups += [('mode {}'.format(m), int(m)) for m in np.unique(self.smode[self.valid])]
+        for name, mode in groups:
+            res = self.stats(mode)
+            lines.append("{:8s} {:>8s} {:>8s} {:>8s} {:>8s} {:>8s} {:>8s} {:>8s} {:>8s}".format(
+                name, 'n', 'mean', 'std', 'rms', 'p50', 'p68', 'p95', 'max'))
+            for col in COLUMNS:
+                r = res[col]
+                lines.append("{:>8s} {:8d} {:8.3f} {:8.3f} {:8.3f} {:8.3f} {:8.3f} {:8.3f} {:8.3f}".format(
+                    col, r['n'], r['mean'], r['std'], r['rms'], r['p50'], r['p68'], r['p95'], r['max']))
+        return "\n".join(lines)
+
+    def save(self, path):
+        """
+        Save the epochs and errors (.npz).
+        """
+        with open(path, 'wb') as fh: # NOTE: np.savez adds .npz to names without it
+            np.savez(fh, t=self.t, enu=self.enu, along=self.along, cross=self.cross, speed=self.speed,
+                     smode=self.smode, valid=self.valid)
+
+
+def evaluate(solution, reference, maxgap=1.0, minspeed=0.5):
+    """
+    Evaluate a solution file against a reference file.
+
+    :param solution:  [str] Engine log or .pos file of the solution
+    :param reference: [str] Engine log or .pos file of the reference trajectory
+    :return: Evaluation
+    """
+    t, xyz, smode = read_trajectory(solution)
+    tref, xyzref, _ = read_trajectory(reference)
+    return Evaluation(t, xyz, tref, xyzref, smode=smode, maxgap=maxgap, minspeed=minspeed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate a kinematic solution against a reference trajectory.')
+    parser.add_argument('solution', type=str, help='Solution (engine log or RTKLIB .pos).')
+    parser.add_argument('reference', type=str, help='Reference trajectory (RTKLIB .pos or engine log).')
+    parser.add_argument('-maxgap', '--maxgap', type=float, default=1.0, help='Maximum reference gap to interpolate [s].')
+    parser.add_argument('-minspeed', '--minspeed', type=float, default=0.5, help='Minimum speed for along/cross-track [m/s].')
+    parser.add_argument('-out', '--out', type=str, default=None, help='Save the errors of every epoch (.npz).')
+    args = parser.parse_args(argv)
+
+    ev = evaluate(args.solution, args.reference, args.maxgap, args.minspeed)
+    print(ev.summary())
+    if args.out:
+        ev.save(args.out)
+    return 0
+
+
+if __name__ == '__main__':
+    main()
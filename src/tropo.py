@@ -0,0 +1,220 @@
+"""
+Module to read troposphere SINEX (TRO) files and interpolate the zenith total delay (ZTD)
+
+The TROP/SOLUTION blocks of one or several files (stations, days) are parsed with pandas and
+stored in flat arrays sorted by (station, time). Each station is a slice of these arrays:
+    index[site] = (i, j)        rows of the station
+    t[i:j]                      epoch [s] (gtime_t.time + sec)
+    ztd[i:j], std[i:j]          ZTD and its sigma [m]
+
+The ZTD at any array of epochs is a np.interp of the station slice, used as a prior of the
+PPP troposphere state and to validate the estimated ZTD against the IGS solution.
+"""
+
+import io
+
+import numpy as np
+
+from cssrlib.gnss import epoch2time, tropmodel
+
+from src.streams import open_text
+
+
+def sinex_epoch(yy, doy, sod):
+    """
+    SINEX epoch YY:DOY:SSSSS to seconds (gtime_t.time), vectorized.
+    """
+    yy = np.asarray(yy, dtype=np.int64)
+    year = np.where(yy < 50, 2000 + yy, 1900 + yy)
+    t = np.zeros(year.shape, dtype=np.float64)
+    for y in np.unique(year):
+        t[year == y] = epoch2time([int(y), 1, 1, 0, 0, 0]).time
+    return t + (np.asarray(doy, dtype=np.float64) - 1.0) * 86400.0 + np.asarray(sod, dtype=np.float64)
+
+
+class TroSinex():
+    """
+    Troposphere SINEX files (TROTOT solutions).
+
+    :param paths:  [str or list of str] TRO files (.TRO, .YYzpd, also .gz/.Z)
+    :param maxgap: [float] Maximum interval between two solutions to interpolate [s]
+    """
+    def __init__(self, paths=None, maxgap=900.0):
+        self.maxgap = maxgap
+        self.sites = np.array([], dtype='U4')
+        self.t = np.array([], dtype=np.float64)
+        self.ztd = np.array([], dtype=np.float32)
+        self.std = np.array([], dtype=np.float32)
+        self.index = {}         # site -> (i, j)
+        self.coords = {}        # site -> ECEF [m]
+
+        if paths is not None:
+            for path in ([paths] if isinstance(paths, str) else paths):
+                self.read(path)
+
+    def read(self, path):
+        """
+        Add the solutions of a file to the index.
+        """
+        fields = None
+        block = None
+        lines = []
+
+        with open_text(path) as fh:
+            for line in fh:
+                if line.startswith('+'):
+                    block = line[1:].strip()
+                    continue
+                if line.startswith('-'):
+                    block = None
+                    continue
+                if line.startswith('*') or line.startswith('%'):
+                    continue
+                if block == 'TROP/SOLUTION':
+                    lines.append(line)
+                elif block == 'TROP/DESCRIPTION' and line[1:30].strip() == 'SOLUTION_FIELDS_1':
+                    fields = line[31:].split()
+                elif block == 'TROP/STA_COORDINATES':
+                    v = line.split()
+                    self.coords[v[0]] = np.array([float(v[4]), float(v[5]), float(v[6])])
+
+        if not lines:
+            print("Warning: {} has no TROP/SOLUTION records".format(path))
+            return self
+        if fields is None:
+            fields = ['TROTOT', 'STDDEV']
+        if 'TROTOT' not in fields:
+            raise ValueError("TRO file without TROTOT solutions!")
+        k = fields.index('TROTOT')
+
+        import pandas as pd # NOTE: only the TRO reader needs it (~0.2 s to import)
+        df = pd.read_csv(io.StringIO(''.join(lines)), sep=r'\s+', header=None,
+                         usecols=[0, 1, 2 + k, 3 + k], names=['site', 'epoch', 'ztd', 'std'],
+                         dtype={'site': str, 'epoch': str})
+        epoch = df['epoch'].str.split(':', expand=True).astype(np.int64)
+        t = sinex_epoch(epoch[0].to_numpy(), epoch[1].to_numpy(), epoch[2].to_numpy())
+
+        self._merge(df['site'].to_numpy(dtype='U4'), t,
+                    df['ztd'].to_numpy(dtype=np.float32) * 1e-3,
+                    df['std'].to_numpy(dtype=np.float32) * 1e-3)
+        return self
+
+    def _merge(self, sites, t, ztd, std):
+        sites = np.concatenate((self.sites, sites))
+        t = np.concatenate((self.t, t))
+        ztd = np.concatenate((self.ztd, ztd))
+        std = np.concatenate((self.std, std))
+
+        # NOTE: sorted by (site, time), the last record of a duplicated epoch is kept (next day file)
+        order = np.lexsort((np.arange(len(t)), t, sites))
+        sites, t, ztd, std = sites[order], t[order], ztd[order], std[order]
+        keep = np.ones(len(t), dtype=bool)
+        keep[:-1] = (sites[1:] != sites[:-1]) | (t[1:] != t[:-1])
+        self.sites, self.t, self.ztd, self.std = sites[keep], t[keep], ztd[keep], std[keep]
+
+        names, first = np.unique(self.sites, return_index=True)
+        last = np.append(first[1:], len(self.sites))
+        self.index = {str(s): (int(i), int(j)) for s, i, j in zip(names, first, last)}
+
+    def stations(self):
+        return list(self.index.keys())
+
+    def span(self, site):
+        """
+        First and last epoch of a station [s].
+        """
+        i, j = self.index[site]
+        return self.t[i], self.t[j - 1]
+
+    def nearest(self, xyz, maxdist=20e3):
+        """
+        Station of the file closest to a position.
+
+        :param xyz:     [array] Position [ECEF]
+        :param maxdist: [float] Maximum distance [m]
+        :return: site, None if there isn't a station within maxdist
+        """
+        best, dmin = None, maxdist
+        for site, pos in self.coords.items():
+            d = np.linalg.norm(pos - np.asarray(xyz))
+            if site in self.index and d <= dmin:
+                best, dmin = site, d
+        return best
+
+    def interp(self, site, t):
+        """
+        ZTD of a station at an array of epochs (linear interpolation).
+
+        :param site: [str] Station (4 characters)
+        :param t:    [array] Epochs [s] (gtime_t.time + sec)
+        :return: (ztd, std) [m], nan out of the solutions or over gaps longer than maxgap
+        """
+        t = np.atleast_1d(np.asarray(t, dtype=np.float64))
+        if site not in self.index:
+            return np.full(t.shape, np.nan), np.full(t.shape, np.nan)
+        i, j = self.index[site]
+        ts, zs, ss = self.t[i:j], self.ztd[i:j], self.std[i:j]
+
+        ztd = np.interp(t, ts, zs, left=np.nan, right=np.nan)
+        std = np.interp(t, ts, ss, left=np.nan, right=np.nan)
+
+        if len(ts) > 1:
+            k = np.clip(np.searchsorted(ts, t, side='right'), 1, len(ts) - 1)
+            gap = (ts[k] - ts[k - 1] > self.maxgap) & (t != ts[k - 1]) & (t != ts[k])
+            ztd[gap] = np.nan
+            std[gap] = np.nan
+        return ztd, std
+
+    def at(self, site, t):
+        """
+        ZTD of a station at one epoch.
+
+        :param t: [gtime_t] Epoch
+        :return: (ztd, std) [m]
+        """
+        ztd, std = self.interp(site, t.time + t.sec)
+        return float(ztd[0]), float(std[0])
+
+    def validate(self, site, t, ztd):
+        """
+        Compare an estimated ZTD with the station solution.
+
+        :param site: [str] Station
+        :param t:    [array] Epochs [s] (gtime_t.time + sec)
+        :param ztd:  [array] Estimated ZTD [m]
+        :return: dict with n, bias, std, rms [m] and the differences (nan where not compared)
+        """
+        ref, _ = self.interp(site, t)
+        diff = np.asarray(ztd, dtype=np.float64) - ref
+        ok = np.isfinite(diff)
+        if not ok.any():
+            return {'n': 0, 'bias': np.nan, 'std': np.nan, 'rms': np.nan, 'diff': diff}
+        return {'n': int(ok.sum()), 'bias': float(np.mean(diff[ok])), 'std': float(np.std(diff[ok])),
+                'rms': float(np.sqrt(np.mean(diff[ok]**2))), 'diff': diff}
+
+
+def ztd_prior(ppp, tro, site, t, pos):
+    """
+    Initialize the troposphere state of pppos with the ZTD of the station.
+
+    The state is the residual zenith wet delay over the model (tropmodel), so the prior is
+    ZTD - (hydrostatic + wet model) with the sigma of the solution.
+
+    :param ppp:  [pppos] PPP filter
+    :param tro:  [TroSinex] Troposphere solutions
+    :param site: [str] Station
+    :param t:    [gtime_t] Epoch
+    :param pos:  [array] Geodetic position [lat, lon, h] [rad, m]
+    :return: ZTD [m], nan if there isn't a solution at t
+    """
+    nav = ppp.nav
+    ztd, std = tro.at(site, t)
+    if nav.ntrop == 0 or np.isnan(ztd):
+        return np.nan
+    trop_hs, trop_wet, _ = tropmodel(t, pos, model=nav.trpModel)
+    k = ppp.IT(nav.na)
+    nav.x[k] = ztd - trop_hs - trop_wet
+    nav.P[k, :] = 0.0
+    nav.P[:, k] = 0.0
+    nav.P[k, k] = max(std, 1e-3)**2
+    return ztd
@@ -66,7 +66,7 @@ def runconvbin(name: str, model=None, bforce=True):
             print(f"\n{out_path} exists")
 
 
-def rawData2ubx(duration: int, PORT='COM3', BAUD_RATE = 115200, UBX=True):
+def rawData2ubx(duration: int, PORT='COM3', BAUD_RATE = 115200, UBX=True, keep=None, monitor=None):
 
     """
     Get raw data from u-blox reciever and converts to .ubx binary format. 
@@ -74,6 +74,8 @@ def rawData2ubx(duration: int, PORT='COM3', BAUD_RATE = 115200, UBX=True):
     :duration:  [int] Duration in minutes
     :PORT:      [str] Port
     :BAUD_RATE: [int] Baud rate
+    :keep:      [list of str] Save only these messages (RXM-RAWX, RXM-SFRBX, see src.ubxfilter) [default: all]
+    :monitor:   [SignalMonitor] C/N0, lock and cycle slips of the RXM-RAWX during the capture (src/sigmon.py)
 
     :return --> name [str]
     """
@@ -99,10 +101,17 @@ def rawData2ubx(duration: int, PORT='COM3', BAUD_RATE = 115200, UBX=True):
     final_time = time.time() + duration * 60
 
     path = 'data\\ublox\\'
-    name = PORT + '___' + str(BAUD_RATE) + '_' + str(h.tm_year) + str(h.tm_mon) +str(h.tm_mday) + '_' + str(h.tm_hour) + str(h.tm_min) + str(h.tm_sec)
+    # NOTE: /dev/ttyACM0, /dev/pts/3 (replay) -> ttyACM0, 3
+    name = os.path.basename(PORT) + '___' + str(BAUD_RATE) + '_' + str(h.tm_year) + str(h.tm_mon) +str(h.tm_mday) + '_' + str(h.tm_hour) + str(h.tm_min) + str(h.tm_sec)
 
     fpath = path + name + '.ubx'
     
+    # NOTE: same framing as src/ubxfilter.py, NMEA and the messages not kept are not saved
+    framer, kept = None, None
+    if keep:
+        from src.ubxfilter import Framer, keys
+        framer, kept = Framer(), keys(keep)
+
     # Save UBX file
     with open(fpath, 'wb') as file:
         ubr = UBXReader(ser)
@@ -110,6 +119,10 @@ def rawData2ubx(duration: int, PORT='COM3', BAUD_RATE = 115200, UBX=True):
         try:
             while time.time() < final_time:
                 (raw_data, parsed_data) = ubr.read()
+                if raw_data and monitor is not None:
+                    monitor.feed(raw_data)
+                if raw_data and framer is not None:
+                    raw_data = framer.filter(raw_data, kept)
                 if raw_data:
                     file.write(raw_data)
                     file.flush()    
@@ -123,5 +136,7 @@ def rawData2ubx(duration: int, PORT='COM3', BAUD_RATE = 115200, UBX=True):
             ser.close()  
     
     print("\t Data collected!\n\n")
+    if monitor is not None:
+        print(monitor.table() + "\n")
     
     return name, model
\ No newline at end of file
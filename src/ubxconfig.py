@@ -0,0 +1,284 @@
+"""
+Module to configure the u-blox receivers for raw data capture
+
+The capture needs only RXM-RAWX and RXM-SFRBX, at 10 Hz with two frequencies that is ~20 kB/s, more
+than a 115200 baud UART carries (11.5 kB/s). The configuration:
+    1. disables the NMEA output and the usual UBX messages of the port
+    2. sets the measurement rate and enables RXM-RAWX/RXM-SFRBX every epoch
+    3. steps the UART baud rate up to the first one with room for that traffic (one standard rate at
+       a time, checking the receiver answers at the new rate, back to the last one if it doesn't)
+
+The commands depend on the generation of the receiver (model of src.discover, as the table of getUBXModel):
+    F9, M10     CFG-VALSET (configuration keys, up to 64 per message)
+    M8          CFG-MSG, CFG-RATE and CFG-PRT
+
+They are pipelined: up to window commands are sent before the first ACK, every ACK/NAK is matched with
+the oldest command of its class/id (the receiver answers in order) and the commands without answer are
+sent again after timeout seconds.
+"""
+
+import struct
+import time
+from collections import deque
+
+import numpy as np
+
+from src.discover import frame, query
+from src.ubxfilter import Framer, KEEP_RAW
+from src.ubxindex import msgkey
+
+
+BAUDS = [9600, 38400, 115200, 230400, 460800, 921600]
+MAXRATE = {'M8': 10.0, 'F9': 20.0, 'M10': 10.0}        # RXM-RAWX [Hz]
+MAXKEYS = 64                                            # key/values per CFG-VALSET
+PORTS = {'I2C': 0, 'UART1': 1, 'UART2': 2, 'USB': 3, 'SPI': 4}
+DISABLE = ['NAV-PVT', 'NAV-SAT', 'NAV-STATUS', 'NAV-POSLLH', 'NAV-TIMEGPS', 'NAV-DOP', 'NAV-VELNED',
+           'NAV-CLOCK', 'NAV-SIG', 'NAV-EOE', 'NAV-ODO', 'NAV-TIMEUTC', 'MON-RF', 'MON-HW']
+DISABLE_F9 = ['NAV-HPPOSLLH', 'NAV-HPPOSECEF', 'NAV-RELPOSNED']
+
+LAYER_RAM, LAYER_BBR, LAYER_FLASH = 0x01, 0x02, 0x04
+
+
+def generation(model):
+    """
+    Generation of a u-blox model (F9P -> F9, M8T -> M8, M10S -> M10).
+    """
+    for gen in ['M10', 'F9', 'M8']:
+        if model and gen in model:
+            return gen
+    raise ValueError("Unknown u-blox model {}, only M8, F9 and M10 can be configured!".format(model))
+
+
+def bandwidth(rate, nmeas=60):
+    """
+    Traffic of the raw data capture [bytes/s].
+
+    :param rate:  [float] Epochs per second
+    :param nmeas: [int] Measurements per epoch (satellites x signals)
+    """
+    rawx = 8 + 16 + 32 * nmeas
+    # NOTE: SFRBX, one subframe/page (~56 bytes) every 2 s per signal
+    return rate * rawx + 28.0 * nmeas
+
+
+def required_baud(rate, nmeas=60, margin=1.3):
+    """
+    Lowest standard baud rate with room for the capture (10 bits per byte on the UART).
+    """
+    need = margin * bandwidth(rate, nmeas) * 10
+    for baud in BAUDS:
+        if baud >= need:
+            return baud
+    raise ValueError("{:.0f} bytes/s of raw data don't fit in the UART, lower the rate!".format(need / 10))
+
+
+def _valset(items, layers):
+    from pyubx2 import UBXMessage
+    frames = []
+    for k in range(0, len(items), MAXKEYS):
+        frames.append(UBXMessage.config_set(layers, 0, items[k:k + MAXKEYS]).serialize())
+    return frames
+
+
+def _cfgkey(name, port):
+    from pyubx2 import UBX_CONFIG_DATABASE
+    key = 'CFG_MSGOUT_UBX_{}_{}'.format(name.replace('-', '_'), port)
+    if key not in UBX_CONFIG_DATABASE:
+        raise ValueError("No configuration key for {} in port {}!".format(name, port))
+    return key
+
+
+def _cfg_prt(port, baud, inproto=0x07, outproto=0x01):
+    # NOTE: UART 8N1, USB has no mode/baud rate
+    uart = port.startswith('UART')
+    payload = struct.pack('<BBHIIHHHH', PORTS[port], 0, 0, 0x08D0 if uart else 0, baud if uart else 0,
+                          inproto, outproto, 0, 0)
+    return frame(0x06, 0x00, payload)
+
+
+def _cfg_msg(name, rate):
+    # NOTE: short form, rate in the port the command comes from (the other ports keep theirs)
+    cls, mid = msgkey(name)
+    return frame(0x06, 0x01, bytes([cls, mid, rate]))
+
+
+def plan(model, rate=1.0, port='USB', keep=KEEP_RAW, baud=115200, layers=LAYER_RAM):
+    """
+    Commands to configure a receiver for the capture.
+
+    :param model:  [str] Model (F9P, M8T, M10S ...)
+    :param rate:   [float] Measurement rate [Hz]
+    :param port:   [str] Port of the receiver where the computer is connected (USB, UART1, UART2)
+    :param keep:   [list of str] Messages enabled every epoch
+    :param baud:   [int] Baud rate of the UART ports (M8: CFG-PRT sets it with the protocols)
+    :param layers: [int] Layers of CFG-VALSET (LAYER_RAM | LAYER_BBR | LAYER_FLASH)
+    :return: [list of bytes] Frames, in order
+    """
+    gen = generation(model)
+    if port not in PORTS:
+        raise ValueError("Unknown port {}, must be one of {}!".format(port, list(PORTS)))
+    if not 0 < rate <= MAXRATE[gen]:
+        raise ValueError("Rate of {} must be between 0 and {} Hz!".format(gen, MAXRATE[gen]))
+    meas = int(round(1000.0 / rate))
+
+    if gen == 'M8':
+        frames = [_cfg_prt(port, baud)]                 # NOTE: output UBX only (no NMEA)
+        frames += [_cfg_msg(name, 0) for name in DISABLE if name not in keep]
+        frames.append(frame(0x06, 0x08, struct.pack('<HHH', meas, 1, 1)))     # CFG-RATE, GPS time
+        frames += [_cfg_msg(name, 1) for name in keep]
+        return frames
+
+    # NOTE: the receiver rejects the whole CFG-VALSET with a key it doesn't know, the messages that
+    # are disabled go apart so a NAK there doesn't lose the rate and the raw messages
+    disable = DISABLE + (DISABLE_F9 if gen == 'F9' else [])
+    frames = _valset([('CFG_{}OUTPROT_NMEA'.format(port), 0)], layers)
+    frames += _valset([(_cfgkey(name, port), 0) for name in disable if name not in keep], layers)
+    frames += _valset([('CFG_RATE_MEAS', meas), ('CFG_RATE_NAV', 1)]
+                      + [(_cfgkey(name, port), 1) for name in keep], layers)
+    return frames
+
+
+class Pipeline():
+    """
+    Send configuration commands without waiting for each ACK.
+
+    :param ser:     [serial.Serial] Port (short read timeout)
+    :param window:  [int] Commands sent and not answered yet
+    :param timeout: [float] Seconds to wait for the ACK/NAK of a command before sending it again
+    :param retries: [int] Times a command is sent again
+    """
+    def __init__(self, ser, window=8, timeout=1.0, retries=2):
+        self.ser = ser
+        self.window = window
+        self.timeout = timeout
+        self.retries = retries
+
+    def send(self, frames):
+        """
+        :param frames: [list of bytes] Commands
+        :return: [list of str] ACK, NAK or TIMEOUT for every command
+        """
+        results = [None] * len(frames)
+        pending = deque()           # [index, (cls, id), time sent, tries]
+        framer = Framer()
+        k = 0
+        while k < len(frames) or pending:
+            while k < len(frames) and len(pending) < self.window:
+                self.ser.write(frames[k])
+                pending.append([k, (frames[k][2], frames[k][3]), time.monotonic(), 0])
+                k += 1
+
+            data = self.ser.read(4096)
+            if data:
+                buf, offs, lens, cls, mid = framer.feed(data)
+                for i in np.nonzero((cls == 0x05) & (mid <= 0x01) & (lens >= 2))[0]:
+                    o = int(offs[i])
+                    key = (buf[o + 6], buf[o + 7])
+                    for p in pending:
+                        if p[1] == key:
+                            results[p[0]] = 'ACK' if mid[i] == 0x01 else 'NAK'
+                            pending.remove(p)
+                            break
+
+            now = time.monotonic()
+            for p in list(pending):
+                if now - p[2] < self.timeout:
+                    continue
+                if p[3] < self.retries:
+                    self.ser.write(frames[p[0]])
+                    p[2], p[3] = now, p[3] + 1
+                else:
+                    results[p[0]] = 'TIMEOUT'
+                    pending.remove(p)
+        return results
+
+
+def baud_command(model, port, baud, layers=LAYER_RAM):
+    """
+    Command to change the baud rate of a UART port of the receiver.
+    """
+    if generation(model) == 'M8':
+        return _cfg_prt(port, baud)
+    return _valset([('CFG_{}_BAUDRATE'.format(port), baud)], layers)[0]
+
+
+def set_baud(ser, model, port, baud, timeout=1.0):
+    """
+    Change the baud rate of the receiver and of the computer, back to the old one if the receiver
+    doesn't answer at the new rate.
+
+    :return: [bool] True if the receiver answers at the new rate
+    """
+    old = ser.baudrate
+    ser.write(baud_command(model, port, baud))
+    ser.flush()
+    # NOTE: the receiver sends the ACK at the old rate before changing, not waited for
+    time.sleep(0.1)
+    ser.baudrate = baud
+    ser.reset_input_buffer()
+    if query(ser, timeout, poll=timeout / 3)['ublox']:
+        return True
+    ser.baudrate = old
+    ser.reset_input_buffer()
+    if not query(ser, timeout, poll=timeout / 3)['ublox']:
+        print("Warning: the receiver doesn't answer at {} nor {} baud".format(baud, old))
+    return False
+
+
+def step_baud(ser, model, port, target, timeout=1.0):
+    """
+    Step the baud rate up to target, one standard rate at a time.
+
+    :return: [int] Baud rate in use
+    """
+    for baud in BAUDS:
+        if ser.baudrate < baud <= target:
+            if not set_baud(ser, model, port, baud, timeout):
+                print("Warning: receiver kept at {} baud ({} failed)".format(ser.baudrate, baud))
+                break
+    return ser.baudrate
+
+
+def configure(ser, model, rate=1.0, port='USB', keep=KEEP_RAW, baud=None, nmeas=60, persist=False,
+              window=8, timeout=1.0):
+    """
+    Configure a receiver for the raw data capture (see plan) and step the baud rate up.
+
+    :param ser:     [serial.Serial] Open port (short read timeout)
+    :param baud:    [int] Baud rate of the UART [default: required_baud(rate, nmeas)]
+    :param persist: [bool] Save the configuration in BBR and flash (default only RAM, lost at power off)
+    :return: dict with results (ACK/NAK/TIMEOUT per command), baud and ok
+    """
+    layers = LAYER_RAM | (LAYER_BBR | LAYER_FLASH if persist else 0)
+    frames = plan(model, rate, port, keep, ser.baudrate, layers)
+    results = Pipeline(ser, window, timeout).send(frames)
+    print("Configuration {} {} Hz: {} commands, {} ACK, {} NAK, {} timeouts".format(
+        model, rate, len(results), results.count('ACK'), results.count('NAK'), results.count('TIMEOUT')))
+
+    if port.startswith('UART'):
+        target = baud or required_baud(rate, nmeas)
+        step_baud(ser, model, port, target, timeout)
+    return {'results': results, 'baud': ser.baudrate, 'ok': all(r == 'ACK' for r in results)}
+
+
+def configure_port(device, model, rate=1.0, baud=115200, target=None, port=None, persist=False):
+    """
+    Open a serial port and configure the receiver (see configure).
+
+    :param device: [str] Serial port of the computer (COM4, /dev/ttyACM0)
+    :param baud:   [int] Current baud rate
+    :param target: [int] Baud rate wanted [default: the one needed for the rate]
+    :param port:   [str] Port of the receiver [default: USB for u-blox USB devices, UART1 otherwise]
+    :return: [int] Baud rate to capture with
+    """
+    import serial
+    from src.discover import list_ports
+
+    if port is None:
+        hwid = dict(list_ports()).get(device, '')
+        port = 'USB' if '1546:' in hwid.upper() else 'UART1'
+    with serial.Serial(device, baud, timeout=0.05, write_timeout=1.0) as ser:
+        result = configure(ser, model, rate, port, baud=target, persist=persist)
+    if not result['ok']:
+        print("Warning: some configuration commands of {} were not acknowledged".format(device))
+    return result['baud']
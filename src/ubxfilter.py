@@ -0,0 +1,303 @@
+"""
+Module to filter and split UBX captures as a stream
+
+A capture is read in chunks (bounded memory) and framed with the same scan as the capture index
+(src.ubxindex): only the UBX frames of the selected messages are written (RXM-RAWX, RXM-SFRBX for
+convbin/PPP), NMEA and the other bytes are dropped. The output can be split:
+    window      by GPS time (files of window seconds, named by their start time)
+    maxsize     by size (files of at most maxsize bytes, numbered)
+The time of a message is the last time seen in the stream (NAV iTOW, RXM-RAWX rcvTow/week).
+The outputs are written to a temporary name and renamed when they are closed.
+
+filter_files processes several captures in parallel (one process per file).
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cssrlib.gnss import time2epoch, gtime_t
+
+from src.ubxindex import scan, frame_times, msgkey, msgname, T_GPST0
+
+
+CHUNK = 1 << 22
+KEEP_RAW = ['RXM-RAWX', 'RXM-SFRBX']       # NOTE: the messages used by convbin for RINEX obs/nav
+
+
+def keys(names):
+    """
+    Keys (cls << 8 | id) of message names, None for all the messages.
+
+    :param names: [list of str] Messages (RXM-RAWX, ...)
+    """
+    if names is None:
+        return None
+    return np.array([c << 8 | i for c, i in (msgkey(name) for name in names)], dtype=np.int32)
+
+
+class Framer():
+    """
+    Streaming UBX framer, the bytes of an incomplete frame are kept for the next chunk.
+    """
+    def __init__(self):
+        self.buf = b''
+        self.skipped = 0        # bytes that were not UBX frames
+
+    def feed(self, data):
+        """
+        Frames of a chunk (and of the bytes kept from the last one).
+
+        :param data: [bytes] Chunk
+        :return: (buf, offsets, lengths, cls, id) frames at buf[offset:offset + 8 + length]
+        """
+        buf = self.buf + data if self.buf else bytes(data)
+        offs, lens, pos = scan(buf)
+        self.skipped += pos - int((lens + 8).sum())
+        self.buf = buf[pos:]
+        b = np.frombuffer(buf, dtype=np.uint8)
+        return buf, offs, lens, b[offs + 2], b[offs + 3]
+
+    def filter(self, data, keys=None):
+        """
+        Bytes of the frames of a chunk that are kept.
+
+        :param data: [bytes] Chunk
+        :param keys: [array] Messages kept, cls << 8 | id (see keys()) [default: all the UBX frames]
+        :return: [bytes]
+        """
+        buf, offs, lens, cls, mid = self.feed(data)
+        if keys is not None:
+            sel = np.isin(cls.astype(np.int32) << 8 | mid, keys)
+            offs, lens = offs[sel], lens[sel]
+        return b''.join(buf[int(o):int(o) + 8 + int(n)] for o, n in zip(offs, lens))
+
+    def close(self):
+        """
+        Bytes left at the end of the stream (incomplete frame).
+
+        NOTE: no valid frame is dropped here, scan() already skips a false sync whose length runs
+              past the data when valid frames follow it (they were returned by feed)
+        """
+        self.skipped += len(self.buf)
+        self.buf = b''
+        return self.skipped
+
+
+class Splitter():
+    """
+    Output files of a filtered stream.
+
+    :param outdir:  [str] Output folder
+    :param stem:    [str] Name of the outputs
+    :param window:  [float] Split by GPS time every window seconds (None: no split)
+    :param maxsize: [int] Split when a file would exceed maxsize bytes (None: no split)
+    """
+    def __init__(self, outdir, stem, window=None, maxsize=None):
+        self.outdir = outdir
+        self.stem = stem
+        self.window = window
+        self.maxsize = maxsize
+        self.fh = None
+        self.size = 0
+        self.part = 0           # number of the file in the window (size split)
+        self.win = None         # window of the current file
+        self.files = []
+
+    def _name(self):
+        name = self.stem
+        if self.window and self.win is not None:
+            ep = time2epoch(gtime_t(int(self.win * self.window), 0.0))
+            name += '_{:04d}{:02d}{:02d}_{:02d}{:02d}{:02d}'.format(*[int(v) for v in ep])
+        if self.maxsize:
+            name += '_{:03d}'.format(self.part)
+        return os.path.join(self.outdir, name + '.ubx')
+
+    def _open(self):
+        self.fh = open(os.path.join(self.outdir, '.{}.{}.part'.format(self.stem, os.getpid())), 'wb')
+        self.size = 0
+
+    def close(self, discard=False):
+        """
+        Close the current file and give it its name (discard: delete it, e.g. after an error).
+        """
+        if self.fh is None:
+            return
+        self.fh.close()
+        if discard:
+            os.remove(self.fh.name)
+            self.fh = None
+            return
+        name = self._name()
+        os.replace(self.fh.name, name)
+        self.files.append(name)
+        self.fh = None
+
+    def write(self, buf, start, stop, win):
+        """
+        Write consecutive frames of a window.
+
+        :param buf:   [bytes] Buffer
+        :param start: [array] Offsets of the frames
+        :param stop:  [array] End of the frames
+        :param win:   [int] Window of the frames (None: unknown, the current one)
+        """
+        if win is not None and self.window and win != self.win:
+            if self.fh is not None and self.win is not None:
+                self.close()
+                self.part = 0
+            self.win = win
+        if self.fh is None:
+            self._open()
+
+        size = np.cumsum(stop - start)
+        i = 0
+        while i < len(start):
+            done = size[i - 1] if i > 0 else 0
+            n = len(start) - i
+            if self.maxsize:
+                # NOTE: frames that fit in the file, a new part starts with the first one that doesn't
+                n = int(np.searchsorted(size[i:] - done, self.maxsize - self.size, side='right'))
+                if n == 0 and self.size > 0:
+                    self.close()
+                    self.part += 1
+                    self._open()
+                    continue
+                n = max(n, 1)       # NOTE: a frame larger than maxsize goes alone in its file
+            # NOTE: runs of frames contiguous in the buffer are written at once
+            s, e = start[i:i + n], stop[i:i + n]
+            cut = np.nonzero(s[1:] != e[:-1])[0] + 1
+            for a, b in zip(np.concatenate(([0], cut)), np.concatenate((cut, [n]))):
+                self.fh.write(buf[int(s[a]):int(e[b - 1])])
+            self.size += int(size[i + n - 1] - done)
+            i += n
+
+
+def filter_file(path, outdir, keep=KEEP_RAW, window=None, maxsize=None, chunk=CHUNK):
+    """
+    Filter (and split) a UBX capture.
+
+    :param path:    [str] UBX file
+    :param outdir:  [str] Output folder
+    :param keep:    [list of str] Messages kept (RXM-RAWX, ...), None for all the UBX messages
+    :param window:  [float] Split by GPS time every window seconds
+    :param maxsize: [int] Split by size [bytes]
+    :param chunk:   [int] Bytes read at a time
+    :return: dict with the output files, messages read/kept, bytes read/written/skipped and counts per message
+    """
+    os.makedirs(outdir, exist_ok=True)
+    kept = keys(keep)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    framer = Framer()
+    out = Splitter(outdir, stem, window, maxsize)
+    stats = {'read': 0, 'kept': 0, 'bytes': 0, 'written': 0}
+    counts = {}
+    last_tow, last_week = np.nan, -1
+
+    try:
+        with open(path, 'rb') as fh:
+            while True:
+                data = fh.read(chunk)
+                if not data:
+                    break
+                stats['bytes'] += len(data)
+                buf, offs, lens, cls, mid = framer.feed(data)
+                if len(offs) == 0:
+                    continue
+                stats['read'] += len(offs)
+                key = cls.astype(np.int32) << 8 | mid
+                sel = np.ones(len(offs), dtype=bool) if kept is None else np.isin(key, kept)
+
+                win = None
+                if window:
+                    # NOTE: time of every frame, the last time seen (also from the frames that are dropped)
+                    tow, week = frame_times(buf, offs, cls, mid, lens)
+                    tow = np.concatenate(([last_tow], tow))
+                    week = np.concatenate(([last_week], week)).astype(np.int64)
+                    k = np.maximum.accumulate(np.where(np.isfinite(tow), np.arange(len(tow)), 0))
+                    w = np.maximum.accumulate(np.where(week >= 0, np.arange(len(week)), 0))
+                    tow, week = tow[k], week[w]
+                    last_tow, last_week = tow[-1], week[-1]
+                    t = T_GPST0 + np.maximum(week[1:], 0) * 604800.0 + tow[1:]
+                    win = np.where(np.isfinite(t) & (week[1:] >= 0), np.floor(t / window), -1).astype(np.int64)
+
+                idx = np.nonzero(sel)[0]
+                if len(idx) == 0:
+                    continue
+                start = offs[idx]
+                stop = start + 8 + lens[idx]
+                if win is None:
+                    out.write(buf, start, stop, None)
+                else:
+                    wk = win[idx]
+                    brk = np.nonzero(wk[1:] != wk[:-1])[0] + 1
+                    for a, b in zip(np.concatenate(([0], brk)), np.concatenate((brk, [len(idx)]))):
+                        out.write(buf, start[a:b], stop[a:b], None if wk[a] < 0 else int(wk[a]))
+
+                stats['kept'] += len(idx)
+                stats['written'] += int((stop - start).sum())
+                for k_, n in zip(*np.unique(key[idx], return_counts=True)):
+                    name = msgname(int(k_) >> 8, int(k_) & 0xFF)
+                    counts[name] = counts.get(name, 0) + int(n)
+    except BaseException:
+        out.close(discard=True)
+        raise
+    out.close()
+    stats['skipped'] = framer.close()
+    stats['files'] = out.files
+    stats['counts'] = counts
+    return stats
+
+
+def _filter(args):
+    path, outdir, kw = args
+    return filter_file(path, outdir, **kw)
+
+
+def filter_files(paths, outdir, jobs=None, **kw):
+    """
+    Filter several captures in parallel, one process per file (see filter_file).
+
+    :param paths:  [list of str] UBX files
+    :param outdir: [str] Output folder
+    :param jobs:   [int] Number of processes [default: number of CPUs]
+    :return: dict path -> stats of filter_file
+    """
+    if len(paths) == 1 or jobs == 1:
+        return {path: filter_file(path, outdir, **kw) for path in paths}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return dict(zip(paths, executor.map(_filter, [(path, outdir, kw) for path in paths])))
+
+
+def _size(value):
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    value = value.strip().upper()
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Filter UBX captures (keep some messages) and split them by time or size.')
+    parser.add_argument('ubxfiles', type=str, nargs='+', help='UBX files.')
+    parser.add_argument('-outdir', '--outdir', type=str, required=True, help='Output folder.')
+    parser.add_argument('-types', '--types', type=str, nargs='+', default=KEEP_RAW, help='Messages kept. [default: %(default)s]')
+    parser.add_argument('-all', '--all', action='store_true', help='Keep all the UBX messages (drop only NMEA and other bytes).')
+    parser.add_argument('-window', '--window', type=float, default=None, help='Split by GPS time every N seconds.')
+    parser.add_argument('-maxsize', '--maxsize', type=str, default=None, help='Split by size (bytes, or 100M, 2G ...).')
+    parser.add_argument('-jobs', '--jobs', type=int, default=None, help='Files processed in parallel. [default: number of CPUs]')
+    args = parser.parse_args(argv)
+
+    results = filter_files(args.ubxfiles, args.outdir, jobs=args.jobs, keep=None if args.all else args.types,
+                           window=args.window, maxsize=_size(args.maxsize) if args.maxsize else None)
+    for path, stats in results.items():
+        print("{}: {} of {} messages kept, {} -> {} bytes ({:.1f}%), {} files".format(
+            path, stats['kept'], stats['read'], stats['bytes'], stats['written'],
+            100.0 * stats['written'] / max(stats['bytes'], 1), len(stats['files'])))
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,450 @@
+"""
+Module to index the messages of a UBX capture (memory-mapped, random access)
+
+The capture is scanned once through mmap and every valid UBX frame is recorded in flat arrays:
+    offset      position of the frame (sync 0xB5 0x62) in the file
+    cls, id     message class and id
+    length      payload length
+    tow         GPS time of week [s] of the messages that carry it (NAV-* iTOW, RXM-RAWX rcvTow), else nan
+    week        GPS week of RXM-RAWX and NAV-TIMEGPS, else -1
+The frames are walked with the length field and the checksums of a whole block are verified at once
+(prefix sums mod 256), a wrong checksum restarts the search at the next byte (so does a length running
+past the end of the data when valid frames follow). Bytes that are not UBX (NMEA, RTCM, noise) are skipped.
+
+The index is saved next to the capture (<file>.idx.npz, 22 bytes per message) and reused while the
+file doesn't change, a capture that grows is only scanned from the last indexed frame. Queries (message
+counts, time windows, extraction) work on the arrays and the file is only read for the selected messages.
+"""
+
+import argparse
+import hashlib
+import mmap
+import os
+
+import numpy as np
+
+from cssrlib.gnss import gpst2time, epoch2time, time2str, gtime_t
+
+
+CACHE_EXT = '.idx.npz'
+CACHE_VERSION = 1
+SYNC = b'\xb5\x62'
+BLOCK = 1 << 22             # bytes walked before the checksums are verified
+HEADSIZE = 1 << 16          # bytes of the file hashed to know if a bigger file is the same capture
+T_GPST0 = gpst2time(0, 0.0).time        # GPS week 0 [s] (gtime_t.time)
+
+CLASSES = {0x01: 'NAV', 0x02: 'RXM', 0x04: 'INF', 0x05: 'ACK', 0x06: 'CFG', 0x09: 'UPD', 0x0A: 'MON',
+           0x0B: 'AID', 0x0D: 'TIM', 0x10: 'ESF', 0x13: 'MGA', 0x21: 'LOG', 0x27: 'SEC', 0x28: 'HNR'}
+
+
+def _walk(buf, pos, end):
+    """
+    Frames from pos by their length field (checksums not verified).
+
+    :return: (offsets, lengths, pos) pos is the first byte not consumed (incomplete frame or end)
+    """
+    offs, lens = [], []
+    find = buf.find
+    while True:
+        i = find(SYNC, pos, end)
+        if i < 0:
+            # NOTE: a 0xB5 at the end can be the first byte of the next sync
+            return offs, lens, end - 1 if end > pos and buf[end - 1] == 0xB5 else max(pos, end)
+        if i + 8 > end:
+            return offs, lens, i
+        n = buf[i + 4] | buf[i + 5] << 8
+        if i + 8 + n > end:
+            return offs, lens, i
+        offs.append(i)
+        lens.append(n)
+        pos = i + 8 + n
+
+
+def _checksums(buf, offs, lens):
+    """
+    Verify the Fletcher-8 checksums of consecutive frames in one pass.
+
+    A = sum(b[s:e]), B = sum((e - i) * b[i]) = e*A - sum(i * b[i]) over class..payload [s, e),
+    all mod 256 (uint8 prefix sums).
+
+    :return: [array of bool] checksum ok
+    """
+    s0 = offs[0]
+    n = offs[-1] + 8 + lens[-1] - s0
+    b = np.frombuffer(buf, dtype=np.uint8, count=n, offset=s0)
+    k = (np.arange(n) & 0xFF).astype(np.uint8)
+    p1 = np.zeros(n + 1, dtype=np.uint8)
+    p2 = np.zeros(n + 1, dtype=np.uint8)
+    np.cumsum(b, dtype=np.uint8, out=p1[1:])
+    np.cumsum(b * k, dtype=np.uint8, out=p2[1:])
+    s = offs - s0 + 2
+    e = s + 4 + lens
+    a = p1[e] - p1[s]
+    c = (e & 0xFF).astype(np.uint8) * a - (p2[e] - p2[s])
+    ok = (a == b[e]) & (c == b[e + 1])
+    del b
+    return ok
+
+
+def scan(buf, start=0, end=None, block=BLOCK):
+    """
+    Valid UBX frames of a buffer (mmap, bytes, bytearray).
+
+    :param buf:   Buffer
+    :param start: [int] First byte
+    :param end:   [int] Last byte (exclusive) [default: len(buf)]
+    :param block: [int] Bytes walked before verifying the checksums
+    :return: (offsets, lengths, pos) int64 arrays of the frames, pos is the first byte not consumed
+             (an incomplete frame at the end, streaming readers keep buf[pos:] for the next read,
+             unless valid frames follow it)
+    """
+    end = len(buf) if end is None else end
+    block = max(block, 1 << 17)     # NOTE: bigger than any frame (65535 + 8 bytes)
+    out_o, out_l = [], []
+    pos = start
+    while pos < end:
+        stop = min(end, pos + block)
+        offs, lens, nxt = _walk(buf, pos, stop)
+        if offs:
+            offs = np.array(offs, dtype=np.int64)
+            lens = np.array(lens, dtype=np.int64)
+            ok = _checksums(buf, offs, lens)
+            if not ok.all():
+                # NOTE: false sync or corrupted frame, the search restarts after its first byte
+                k = int(np.argmin(ok))
+                out_o.append(offs[:k])
+                out_l.append(lens[:k])
+                pos = int(offs[k]) + 1
+                continue
+            out_o.append(offs)
+            out_l.append(lens)
+        pos = nxt
+        if stop == end:
+            if pos < end - 1:
+                # NOTE: a sync whose length runs past the end is a false sync if valid frames follow it
+                offs, lens, nxt = scan(buf, pos + 1, end, block)
+                if len(offs):
+                    out_o.append(offs)
+                    out_l.append(lens)
+                    pos = nxt
+            break
+    if not out_o:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), pos
+    return np.concatenate(out_o), np.concatenate(out_l), pos
+
+
+def _gather(b, idx, size):
+    """
+    Little-endian fields of `size` bytes at the positions idx of a uint8 array.
+    """
+    return np.stack([b[idx + k] for k in range(size)], axis=1)
+
+
+def frame_times(buf, offs, cls, mid, lens):
+    """
+    GPS time of week and week of the frames that carry them.
+
+    :return: (tow [s] nan if none, week -1 if none)
+    """
+    b = np.frombuffer(buf, dtype=np.uint8)
+    tow = np.full(len(offs), np.nan)
+    week = np.full(len(offs), -1, dtype=np.int16)
+
+    nav = (cls == 0x01) & (lens >= 4)
+    tow[nav] = _gather(b, offs[nav] + 6, 4).copy().view('<u4')[:, 0] * 1e-3
+
+    raw = (cls == 0x02) & (mid == 0x15) & (lens >= 16)      # RXM-RAWX rcvTow R8, week U2
+    tow[raw] = _gather(b, offs[raw] + 6, 8).copy().view('<f8')[:, 0]
+    week[raw] = _gather(b, offs[raw] + 14, 2).copy().view('<u2')[:, 0]
+
+    tgps = (cls == 0x01) & (mid == 0x20) & (lens >= 16)     # NAV-TIMEGPS week I2
+    week[tgps] = _gather(b, offs[tgps] + 14, 2).copy().view('<i2')[:, 0]
+    del b
+    return tow, week
+
+
+def msgname(cls, mid):
+    """
+    Name of a message (RXM-RAWX), from pyubx2 when it knows it.
+    """
+    try:
+        from pyubx2 import UBX_MSGIDS
+        name = UBX_MSGIDS.get(bytes([cls, mid]))
+        if name:
+            return name
+    except ImportError:
+        pass
+    return '{}-{:02X}'.format(CLASSES.get(cls, '{:02X}'.format(cls)), mid)
+
+
+def msgkey(name):
+    """
+    Class and id of a message name (RXM-RAWX, or hex 02-15).
+    """
+    try:
+        from pyubx2 import UBX_MSGIDS
+        for key, value in UBX_MSGIDS.items():
+            if value == name:
+                return key[0], key[1]
+    except ImportError:
+        pass
+    clsname, _, mid = name.partition('-')
+    for cls, value in CLASSES.items():
+        if value == clsname:
+            return cls, int(mid, 16)
+    try:
+        return int(clsname, 16), int(mid, 16)
+    except ValueError:
+        raise ValueError("Unknown UBX message {}!".format(name))
+
+
+def _head(path, size):
+    with open(path, 'rb') as fh:
+        return np.frombuffer(hashlib.sha1(fh.read(min(size, HEADSIZE))).digest(), dtype=np.uint8)
+
+
+class UbxIndex():
+    """
+    Index of the messages of a UBX capture.
+
+    :param path: [str] UBX file
+    """
+    def __init__(self, path):
+        self.path = path
+        self.offset = np.zeros(0, dtype=np.int64)
+        self.cls = np.zeros(0, dtype=np.uint8)
+        self.id = np.zeros(0, dtype=np.uint8)
+        self.length = np.zeros(0, dtype=np.uint16)
+        self.tow = np.zeros(0, dtype=np.float64)
+        self.week = np.zeros(0, dtype=np.int16)
+        self.end = 0            # bytes of the file indexed
+        self._fh = None
+        self._mm = None
+
+    @classmethod
+    def load(cls, path, cache=True):
+        """
+        Index of a capture, from the cache next to it if it is up to date (only the new bytes of a
+        capture that grows are scanned).
+
+        :param path:  [str] UBX file
+        :param cache: [bool] Use/write the cache file
+        :return: UbxIndex
+        """
+        idx = cls(path)
+        st = os.stat(path)
+        cachefile = str(path) + CACHE_EXT
+        if cache and os.path.isfile(cachefile):
+            try:
+                with np.load(cachefile) as npz:
+                    version, size, mtime = npz['stamp']
+                    if version == CACHE_VERSION and size <= st.st_size and np.array_equal(npz['head'], _head(path, size)):
+                        idx._restore(npz)
+                        if size == st.st_size and mtime == st.st_mtime_ns:
+                            return idx
+            except (OSError, KeyError, ValueError) as error:
+                print("Warning: ignoring the UBX index {} ({})".format(cachefile, error))
+                idx = cls(path)
+
+        idx.update()
+        if cache:
+            try:
+                idx.save(cachefile)
+            except OSError as error:
+                print("Warning: UBX index not saved {} ({})".format(cachefile, error))
+        return idx
+
+    def update(self):
+        """
+        Index the bytes of the file after the last indexed frame.
+
+        :return: [int] Number of new messages
+        """
+        self.close()
+        size = os.path.getsize(self.path)
+        if size <= self.end:
+            return 0
+        with open(self.path, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offs, lens, pos = scan(mm, self.end)
+            cls = np.frombuffer(mm, dtype=np.uint8)[offs + 2].copy()
+            mid = np.frombuffer(mm, dtype=np.uint8)[offs + 3].copy()
+            tow, week = frame_times(mm, offs, cls, mid, lens)
+
+        self.offset = np.concatenate((self.offset, offs))
+        self.cls = np.concatenate((self.cls, cls))
+        self.id = np.concatenate((self.id, mid))
+        self.length = np.concatenate((self.length, lens.astype(np.uint16)))
+        self.tow = np.concatenate((self.tow, tow))
+        self.week = np.concatenate((self.week, week))
+        self.end = pos
+        return len(offs)
+
+    def save(self, path):
+        st = os.stat(self.path)
+        # NOTE: the stamp is of the bytes indexed, a bigger file with the same head is extended
+        stamp = np.array([CACHE_VERSION, self.end, st.st_mtime_ns if self.end == st.st_size else 0], dtype=np.int64)
+        with open(path, 'wb') as fh: # NOTE: np.savez adds .npz to names without it
+            np.savez(fh, stamp=stamp, head=_head(self.path, self.end), offset=self.offset, cls=self.cls,
+                     id=self.id, length=self.length, tow=self.tow, week=self.week)
+
+    def _restore(self, npz):
+        self.offset, self.cls, self.id = npz['offset'], npz['cls'], npz['id']
+        self.length, self.tow, self.week = npz['length'], npz['tow'], npz['week']
+        self.end = int(npz['stamp'][1])
+        return self
+
+    def __len__(self):
+        return len(self.offset)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._fh.close()
+            self._mm = self._fh = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def keys(self):
+        """
+        Message key cls << 8 | id of every message.
+        """
+        return self.cls.astype(np.int32) << 8 | self.id
+
+    def counts(self):
+        """
+        Number of messages of every type.
+
+        :return: dict name -> count
+        """
+        keys, n = np.unique(self.keys(), return_counts=True)
+        return {msgname(int(k) >> 8, int(k) & 0xFF): int(c) for k, c in zip(keys, n)}
+
+    def times(self):
+        """
+        Time of every message [s] (GPST, gtime_t.time + sec), the messages without time get the time of
+        the last message that has it. A capture without week (no RXM-RAWX, NAV-TIMEGPS) gives the time of
+        week, with its rollovers unwrapped.
+
+        :return: [array] nan before the first message with time
+        """
+        n = len(self)
+        k = np.where(np.isfinite(self.tow), np.arange(n), -1)
+        k = np.maximum.accumulate(k) if n else k
+        tow = np.where(k >= 0, self.tow[np.maximum(k, 0)], np.nan)
+
+        w = np.where(self.week >= 0, np.arange(n), -1)
+        w = np.maximum.accumulate(w) if n else w
+        if n and (w >= 0).any():
+            week = np.where(w >= 0, self.week[np.maximum(w, 0)], self.week[np.argmax(w >= 0)]).astype(np.float64)
+            t = T_GPST0 + week * 604800.0 + tow
+            # NOTE: at a rollover the NAV messages of the new week can come before the RXM-RAWX with the week
+            return t + np.where(t - np.fmax.accumulate(t) < -302400.0, 604800.0, 0.0)
+        jumps = np.concatenate(([0.0], np.where(np.diff(tow) < -302400.0, 604800.0, 0.0)))
+        return tow + np.cumsum(np.nan_to_num(jumps))
+
+    def select(self, names=None, t0=None, t1=None):
+        """
+        Messages of some types in a time window.
+
+        :param names: [list of str] Message names (RXM-RAWX, ...) [default: all]
+        :param t0, t1: [float] Time window [s] (as times()), t1 exclusive
+        :return: [array] Indices of the messages
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if names:
+            keys = [c << 8 | i for c, i in (msgkey(name) for name in names)]
+            mask &= np.isin(self.keys(), keys)
+        if t0 is not None or t1 is not None:
+            t = self.times()
+            if t0 is not None:
+                mask &= t >= t0
+            if t1 is not None:
+                mask &= t < t1
+        return np.nonzero(mask)[0]
+
+    def seek(self, t):
+        """
+        Index of the first message at or after a time.
+        """
+        t_ = np.fmax.accumulate(self.times()) if len(self) else self.times()
+        return int(np.searchsorted(np.nan_to_num(t_, nan=-np.inf), t, side='left'))
+
+    def _map(self):
+        if self._mm is None:
+            self._fh = open(self.path, 'rb')
+            self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm
+
+    def raw(self, i):
+        """
+        Frame of a message (bytes, sync to checksum).
+        """
+        o = int(self.offset[i])
+        return self._map()[o:o + 8 + int(self.length[i])]
+
+    def parse(self, i):
+        """
+        Message parsed by pyubx2.
+        """
+        from pyubx2 import UBXReader
+        return UBXReader.parse(self.raw(i))
+
+    def extract(self, indices, out):
+        """
+        Write the frames of some messages to a file (a valid UBX file, in file order).
+
+        :param indices: [array] Indices of the messages (select)
+        :param out:     [str] Output file
+        :return: [int] Bytes written
+        """
+        mm = self._map()
+        indices = np.sort(np.asarray(indices, dtype=np.int64))
+        start, stop = self.offset[indices], self.offset[indices] + 8 + self.length[indices].astype(np.int64)
+        # NOTE: consecutive frames are copied in one slice
+        brk = np.nonzero(start[1:] != stop[:-1])[0] + 1
+        first = np.concatenate(([0], brk))
+        last = np.concatenate((brk, [len(indices)])) - 1
+        nbytes = 0
+        with open(out, 'wb') as fh:
+            for a, b in zip(start[first], stop[last]):
+                fh.write(mm[a:b])
+                nbytes += int(b - a)
+        return nbytes
+
+
+def _seconds(value):
+    try:
+        return float(value)
+    except ValueError:
+        return epoch2time([float(v) for v in value.replace('-', ' ').replace(':', ' ').split()]).time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Index a UBX capture and query it.')
+    parser.add_argument('ubxfile', type=str, help='UBX file.')
+    parser.add_argument('-types', '--types', type=str, nargs='+', default=None, help='Messages to select (RXM-RAWX RXM-SFRBX ...).')
+    parser.add_argument('-window', '--window', type=str, nargs=2, default=None, help="Time window, GPST 'YYYY-MM-DD HH:MM:SS' or seconds (gtime_t.time).")
+    parser.add_argument('-out', '--out', type=str, default=None, help='Write the selected messages to this UBX file.')
+    parser.add_argument('-nocache', '--nocache', action='store_false', help="Don't read/write the index file.")
+    args = parser.parse_args(argv)
+
+    with UbxIndex.load(args.ubxfile, cache=args.nocache) as idx:
+        sel = idx.select(args.types, *([_seconds(v) for v in args.window] if args.window else (None, None)))
+        t = idx.times()
+        print("{}: {} messages, {} selected".format(args.ubxfile, len(idx), len(sel)))
+        if len(sel) and np.isfinite(t[sel]).any():
+            print("Time: {} - {}".format(time2str(gtime_t(int(np.nanmin(t[sel])), 0.0)), time2str(gtime_t(int(np.nanmax(t[sel])), 0.0))))
+        keys, n = np.unique(idx.keys()[sel], return_counts=True)
+        for k, c in zip(keys, n):
+            print("  {:16s} {}".format(msgname(int(k) >> 8, int(k) & 0xFF), c))
+        if args.out:
+            print("{} bytes written to {}".format(idx.extract(sel, args.out), args.out))
+    return 0
+
+
+if __name__ == '__main__':
+    main()
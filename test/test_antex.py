@@ -0,0 +1,104 @@
+"""
+Test to check the session antenna tables against cssrlib atxdec (synthetic ANTEX file).
+
+"""
+import numpy as np
+
+from cssrlib.gnss import epoch2time, rSigRnx, prn2sat, uGNSS, Nav
+from cssrlib.peph import atxdec, searchpcv, antModelRx
+
+from src.antex import AntexTable, rx_correction
+
+
+T0 = epoch2time([2023, 8, 11, 0, 0, 0])
+ZEN = [0.0 + 5.0 * k for k in range(19)]
+
+
+def _label(text, label):
+    return "{:<60}{}\n".format(text, label)
+
+
+def _antenna(typ, code, dazi, freqs, valid=None):
+    lines = [_label("", "START OF ANTENNA"), _label("{:<20}{:<20}".format(typ, code), "TYPE / SERIAL NO"),
+             _label("  {:6.1f}".format(dazi), "DAZI"), _label("     0.0  90.0   5.0", "ZEN1 / ZEN2 / DZEN")]
+    if valid is not None:
+        lines.append(_label("  {:4d} {:5d} {:5d} {:5d} {:5d} {:10.7f}".format(*valid, 0.0), "VALID FROM"))
+    for f, (neu, scale) in freqs.items():
+        lines.append(_label("   {}".format(f), "START OF FREQUENCY"))
+        lines.append(_label("{:10.2f}{:10.2f}{:10.2f}".format(*neu), "NORTH / EAST / UP"))
+        lines.append("   NOAZI" + "".join("{:8.2f}".format(-scale * z / 10.0) for z in ZEN) + "\n")
+        if dazi > 0:
+            for az in np.arange(0.0, 360.0 + dazi, dazi):
+                lines.append("{:8.1f}".format(az) +
+                             "".join("{:8.2f}".format(-scale * z / 10.0 + np.cos(np.deg2rad(az))) for z in ZEN) + "\n")
+        lines.append(_label("   {}".format(f), "END OF FREQUENCY"))
+    lines.append(_label("", "END OF ANTENNA"))
+    return lines
+
+
+def _atx(path, version="1.4"):
+    lines = [_label("     {}            M".format(version), "ANTEX VERSION / SYST"),
+             _label("A                                       IGS20", "PCV TYPE / REFANT"),
+             _label("", "END OF HEADER")]
+    lines += _antenna("BLOCK IIF", "G01", 0.0, {"G01": ([394.0, 0.0, 1500.0], 1.0)}, (2010, 5, 28, 0, 0))
+    lines += _antenna("BLOCK IIA", "G32", 0.0, {"G01": ([279.0, 0.0, 2319.0], 1.0)}, (1990, 1, 1, 0, 0))
+    lines += _antenna("TRM59800.00     NONE", "", 30.0, {"G01": ([1.0, 2.0, 66.0], 1.0), "G02": ([0.5, 1.5, 57.0], 2.0)})
+    lines += _antenna("LEIAR25.R4      LEIT", "", 0.0, {"G01": ([0.0, 0.0, 160.0], 1.0)})
+    with open(path, 'w') as fh:
+        fh.writelines(lines)
+    return str(path)
+
+
+def test_session(tmp_path):
+    path = _atx(tmp_path / 'test.atx')
+    ref = atxdec()
+    ref.readpcv(path)
+    atx = AntexTable.load(path, ["TRM59800.00     NONE"], T0, cache=False)
+
+    assert len(atx.pcvr) == 1 and len(atx.pcvs) == 2
+    ant, ant_ref = atx.searchpcv("TRM59800.00     NONE", T0), searchpcv(ref.pcvr, "TRM59800.00     NONE", T0)
+    for sig in ant_ref.var:
+        np.testing.assert_array_equal(ant.off[sig], ant_ref.off[sig])
+        np.testing.assert_array_equal(ant.var[sig], ant_ref.var[sig])
+    assert ant.grid[rSigRnx("GL1")].shape == (13, 19)
+    sat = prn2sat(uGNSS.GPS, 1)
+    np.testing.assert_array_equal(atx.searchpcv(sat, T0).off[rSigRnx("GL1")], [394.0, 0.0, 1500.0])
+
+    # NOTE: grid nodes and the azimuth term of the synthetic pattern
+    sig = rSigRnx("GL2")
+    np.testing.assert_allclose(ant.interp(sig, [0.0, 90.0, 180.0, 360.0], [10.0, 10.0, 10.0, 10.0]),
+                               [-1.0, -2.0, -3.0, -1.0], atol=1e-2)
+
+    # NOTE: without azimuth grid the correction is the one of cssrlib antModelRx
+    pos = np.array([np.deg2rad(40.4), np.deg2rad(-3.7), 650.0])
+    nav = Nav()
+    nav.rcv_ant = AntexTable.load(path, ["LEIAR25.R4      LEIT"], T0, cache=False).pcvr[0]
+    e = np.array([[0.3, 0.4, 0.866], [-0.5, 0.1, 0.86], [0.0, -0.9, 0.43]])
+    e /= np.linalg.norm(e, axis=1)[:, None]
+    sigs = [rSigRnx("GL1C")]
+    dant = rx_correction(nav.rcv_ant, pos, e, sigs)
+    for k in range(len(e)):
+        np.testing.assert_allclose(dant[k], antModelRx(nav, pos, e[k], sigs), atol=1e-12)
+
+
+def test_cache(tmp_path):
+    path = _atx(tmp_path / 'test.atx')
+    atx = AntexTable.load(path, ["TRM59800.00     NONE"], T0)
+    assert not atx.cached
+
+    again = AntexTable.load(path, ["TRM59800.00     NONE"], T0)
+    assert again.cached
+    sig = rSigRnx("GL1")
+    ant, ant0 = again.pcvr[0], atx.pcvr[0]
+    assert ant.type == ant0.type
+    np.testing.assert_array_equal(ant.grid[sig], ant0.grid[sig])
+    np.testing.assert_array_equal(ant.var[sig], ant0.var[sig])
+
+    # NOTE: another antenna is parsed and added to the cache, a new release invalidates it
+    other = AntexTable.load(path, ["LEIAR25.R4      LEIT"], T0)
+    assert not other.cached and len(other.pcvr) == 1
+    both = AntexTable.load(path, ["LEIAR25.R4      LEIT", "TRM59800.00     NONE"], T0)
+    assert both.cached and len(both.pcvr) == 2
+
+    _atx(tmp_path / 'test.atx', version="1.5")
+    assert not AntexTable.load(path, ["TRM59800.00     NONE"], T0).cached
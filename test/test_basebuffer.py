@@ -0,0 +1,82 @@
+"""
+Test to check the shared base observations buffer (multi-rover RTK).
+
+"""
+import pickle
+
+import numpy as np
+
+from cssrlib.gnss import rSigRnx, timeadd, timediff
+from cssrlib.rinex import rnxdec
+
+from src.basebuffer import BaseBuffer, sync_base
+
+
+HEADER = "".join("{:60s}{}\n".format(*rec) for rec in (
+    ("     3.04           OBSERVATION DATA    M (MIXED)", "RINEX VERSION / TYPE"),
+    ("G    3 C1C L1C S1C", "SYS / # / OBS TYPES"),
+    ("  2010     3     5     0     0   30.0000000      GPS", "TIME OF FIRST OBS"),
+    ("", "END OF HEADER"),
+))
+
+EPOCHS = """\
+> 2010 03 05 00 00 30.0000000  0 2
+G13  24799318.768 7 130321269.80108        62.000
+G32  25334766.309 7 133135049.38708        75.000
+> 2010 03 05 00 01 00.0000000  0 3
+G13  24799418.768 7 130321769.80108        61.000
+G32  25334866.309 7 133135549.38708        74.000
+G 7  25342359.370 7 133174968.81808        65.000
+"""
+
+
+def make_decoder(path):
+    dec = rnxdec()
+    dec.setSignals([rSigRnx(sig) for sig in ("GC1C", "GL1C", "GS1C")])
+    dec.decode_obsh(str(path))
+    dec.autoSubstituteSignals()
+    return dec
+
+
+def test_buffer(tmp_path):
+    path = tmp_path / 'base.10O'
+    path.write_text(HEADER + EPOCHS)
+
+    buf = BaseBuffer.decode(make_decoder(path))
+    assert len(buf) == 2
+
+    dec = make_decoder(path)
+    obs = dec.decode_obs()
+    ne = buf.find(timeadd(obs.t, 0.05))
+    assert ne == 0
+    assert buf.find(timeadd(obs.t, 10.0)) == -1
+
+    ob = buf.epoch(ne)
+    assert len(ob.sat) == 2
+    np.testing.assert_array_equal(ob.sat, obs.sat)
+    np.testing.assert_array_equal(ob.P, obs.P)
+    np.testing.assert_array_equal(ob.L, obs.L)
+    np.testing.assert_array_equal(ob.S, obs.S)
+
+    obs, ob = sync_base(dec, buf)
+    assert timediff(obs.t, ob.t) == 0.0 and len(ob.sat) == 3
+    obs, ob = sync_base(dec, buf)
+    assert obs.t.time == 0
+    dec.fobs.close()
+
+
+def test_shared(tmp_path):
+    path = tmp_path / 'base.10O'
+    path.write_text(HEADER + EPOCHS)
+
+    buf = BaseBuffer.decode(make_decoder(path)).share()
+    try:
+        state = pickle.dumps(buf)
+        assert len(state) < 2048 # NOTE: only the names of the blocks are sent
+        other = pickle.loads(state)
+        ob = other.epoch(1)
+        assert len(ob.sat) == 3
+        assert ob.t.time == buf.epoch(1).t.time
+        other.close()
+    finally:
+        buf.unlink()
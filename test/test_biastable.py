@@ -0,0 +1,54 @@
+"""
+Test to check the dense OSB table against cssrlib biasdec (CODE MGEX OSB of 2023-08-11).
+
+"""
+import os
+import shutil
+
+import numpy as np
+
+from cssrlib.gnss import timeadd
+from cssrlib.peph import biasdec
+
+from src.biastable import BiasTable, CACHE_EXT
+
+
+BIA = 'data/rinex/file_creator/COD0MGXFIN_20232230000_01D_01D_OSB.BIA'
+
+
+def same(a, b):
+    return a == b or (np.isnan(a) and np.isnan(b))
+
+
+def test_osb(tmp_path):
+    path = str(tmp_path / os.path.basename(BIA))
+    shutil.copy(BIA, path)
+
+    ref = biasdec()
+    ref.parse(BIA)
+    tab = BiasTable.load(path)
+    assert os.path.isfile(path + CACHE_EXT)
+    cached = BiasTable.load(path)
+    assert cached.osb == [] # NOTE: from the cache, the text file isn't parsed
+
+    for osb in ref.osb[::5]:
+        for t in (osb.tst, timeadd(osb.tst, 43200.0), timeadd(osb.ted, 1.0)):
+            for bsx in (tab, cached):
+                assert same(bsx.getosb(osb.sat, t, osb.sig1), ref.getosb(osb.sat, t, osb.sig1))
+                assert same(bsx.getosbstd(osb.sat, t, osb.sig1), ref.getosbstd(osb.sat, t, osb.sig1))
+
+
+def test_stale(tmp_path):
+    path = str(tmp_path / 'osb.BIA')
+    shutil.copy(BIA, path)
+    BiasTable.load(path)
+
+    # NOTE: product replaced (another size), the cache is rebuilt
+    with open(BIA, encoding='latin-1') as fh:
+        lines = fh.readlines()
+    with open(path, 'w', encoding='latin-1') as fh:
+        fh.writelines(line for line in lines if ' G01 ' not in line)
+    tab = BiasTable.load(path)
+    assert len(tab.osb) > 0
+    osb = tab.osb[0]
+    assert np.isnan(tab.getosb(1, osb.tst, osb.sig1))
@@ -0,0 +1,68 @@
+"""
+Test to check the product catalog (names of a synthetic archive).
+
+"""
+import os
+
+from cssrlib.gnss import epoch2time
+
+from src.catalog import Catalog, classify
+
+
+T0 = epoch2time([2023, 8, 11, 0, 0, 0]).time
+
+FILES = ['COD/COD0MGXFIN_20232230000_01D_05M_ORB.SP3.gz', 'COD/COD0MGXFIN_20232230000_01D_30S_CLK.CLK',
+         'IGS/IGS0OPSRAP_20232230000_01D_15M_ORB.SP3', 'IGS/IGS0OPSFIN_20232230000_01D_15M_ORB.SP3',
+         'IGS/IGS0OPSFIN_20232240000_01D_15M_ORB.SP3', 'COD/COD0MGXFIN_20232230000_01D_01D_OSB.BIA',
+         'COD/COD0OPSFIN_20232230000_01D_01H_GIM.INX', 'igs22750.sp3', 'codg2230.23i', 'I20.ATX',
+         'IGS/IGS0OPSFIN_20232230000_01D_05M_AIRA00JPN_TRO.TRO', 'notes.txt']
+
+
+def _archive(root):
+    for name in FILES:
+        path = os.path.join(root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fh:
+            fh.write(name)
+    return str(root)
+
+
+def test_classify():
+    info = classify('COD0MGXFIN_20232230000_01D_05M_ORB.SP3.gz')
+    assert info == {'type': 'orb', 'center': 'COD', 'solution': 'FIN', 'ts': T0, 'te': T0 + 86400, 'sampling': 300}
+    assert classify('IGS0OPSFIN_20232230000_01D_05M_AIRA00JPN_TRO.TRO')['type'] == 'tro'
+    assert classify('BRDC00IGS_R_20232230000_01D_MN.rnx.gz')['type'] == 'nav'
+    assert classify('igs22750.sp3')['ts'] == epoch2time([2023, 8, 13, 0, 0, 0]).time
+    assert classify('codg2230.23i')['ts'] == T0
+    assert classify('notes.txt') is None
+
+
+def test_best(tmp_path):
+    root = _archive(tmp_path / 'archive')
+    cat = Catalog(str(tmp_path / 'catalog.db'))
+    assert cat.scan(root) == len(FILES) - 1
+
+    # NOTE: final before rapid, finer sampling first, preferred centers first
+    ts, te = T0 + 3600, T0 + 7200
+    assert os.path.basename(cat.best('orb', ts, te)) == 'COD0MGXFIN_20232230000_01D_05M_ORB.SP3.gz'
+    assert os.path.basename(cat.best('orb', ts, te, centers=['IGS'])) == 'IGS0OPSFIN_20232230000_01D_15M_ORB.SP3'
+    assert os.path.basename(cat.best('orb', T0 + 86400 + 60, T0 + 86400 + 600)) == 'IGS0OPSFIN_20232240000_01D_15M_ORB.SP3'
+    assert cat.best('orb', T0 + 3600, T0 + 86400 + 3600) is None # NOTE: no single product covers it
+    products = cat.session(ts, te)
+    assert os.path.basename(products['atx']) == 'I20.ATX'
+    assert os.path.basename(products['ionex']) == 'COD0OPSFIN_20232230000_01D_01H_GIM.INX'
+    cat.close()
+
+
+def test_rescan(tmp_path):
+    root = _archive(tmp_path / 'archive')
+    cat = Catalog(str(tmp_path / 'catalog.db'))
+    cat.scan(root)
+    assert cat.scan(root) == 0
+
+    os.remove(os.path.join(root, 'IGS/IGS0OPSFIN_20232230000_01D_15M_ORB.SP3'))
+    with open(os.path.join(root, 'IGS/IGS0OPSRAP_20232230000_01D_15M_ORB.SP3'), 'a') as fh:
+        fh.write('more')
+    assert cat.scan(root) == 1
+    assert len(cat.find('orb', T0, T0 + 600, centers=['IGS'])) == 2
+    cat.close()
@@ -0,0 +1,53 @@
+"""
+Test to check the checkpoint/resume of the filter state.
+
+"""
+import numpy as np
+
+from cssrlib.gnss import Nav, gtime_t
+
+from src.checkpoint import save_checkpoint, load_checkpoint
+
+
+def make_nav():
+    nav = Nav()
+    nav.x = np.arange(10, dtype=float)
+    nav.P = np.eye(10) * 2.0
+    nav.xa = np.arange(3, dtype=float)
+    nav.smode = 4
+    nav.t = gtime_t(1691712000, 0.5)
+    nav.fix[5, 0] = 2
+    return nav
+
+
+def test_resume_same_file(tmp_path):
+    path = str(tmp_path / 'ppp.ckpt.npz')
+    nav = make_nav()
+    enu = np.arange(30, dtype=float).reshape(10, 3)
+    save_checkpoint(path, nav, 4, gtime_t(1691711990, 0.0), 'data/obs.23O', {'enu': enu})
+
+    nav2 = Nav()
+    enu2 = np.ones((10, 3)) * np.nan
+    ne, t, t0 = load_checkpoint(path, nav2, 'other/folder/obs.23O', {'enu': enu2})
+
+    assert ne == 4
+    assert (t.time, t.sec) == (1691712000, 0.5)
+    assert t0.time == 1691711990
+    assert nav2.smode == 4
+    assert nav2.fix[5, 0] == 2
+    np.testing.assert_array_equal(nav2.x, nav.x)
+    np.testing.assert_array_equal(nav2.P, nav.P)
+    np.testing.assert_array_equal(enu2[:5], enu[:5])
+    assert np.all(np.isnan(enu2[5:]))
+
+
+def test_resume_other_file(tmp_path):
+    path = str(tmp_path / 'ppp.ckpt.npz')
+    save_checkpoint(path, make_nav(), 4, gtime_t(), 'day1.23O', {})
+
+    nav2 = Nav()
+    ne, _, t0 = load_checkpoint(path, nav2, 'day2.23O', {})
+
+    assert ne == -1 and t0 is None
+    np.testing.assert_array_equal(nav2.x, np.arange(10, dtype=float))
+    assert np.all(nav2.outc > nav2.maxout)
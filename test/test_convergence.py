@@ -0,0 +1,65 @@
+"""
+Test to check the convergence detector of the static sessions (criteria, dwell time and converged coordinate).
+
+"""
+import numpy as np
+import pytest
+
+from cssrlib.gnss import ecef2pos, xyz2enu
+
+from src.convergence import ConvergenceMonitor
+
+
+XYZ = np.array([-3962108.6726, 3381309.4719, 3668678.6264])
+T0 = 1691787600.0
+
+
+def session(n, seed=1):
+    """
+    Static session at 1 Hz: error and formal sigma decaying from metres to millimetres in ~10 minutes.
+    """
+    rng = np.random.default_rng(seed)
+    E = xyz2enu(ecef2pos(XYZ))
+    for k in range(n):
+        s = 2.0 * np.exp(-k / 90.0) + 0.004
+        enu = rng.normal(0.0, s, 3)
+        P = E.T @ np.diag([s**2, s**2, (1.5 * s)**2]) @ E
+        yield T0 + k, XYZ + E.T @ enu, P
+
+
+def test_converged():
+    monitor = ConvergenceMonitor(sigma=0.05, spread=0.03, window=120, dwell=60)
+    stop = None
+    for k, (t, xyz, P) in enumerate(session(3600)):
+        if monitor.update(t, xyz, P, 5):
+            stop = k
+            break
+    # NOTE: sigma under 5 cm at ~6.5 min, then the window must be clean (2 min) and the dwell (1 min)
+    assert stop is not None and 500 < stop < 900 and monitor.converged
+    r = monitor.result
+    assert r['epochs'] == stop + 1 and r['elapsed'] == stop
+    assert np.linalg.norm(r['xyz'] - XYZ) < 0.02 and np.all(r['sigma'] < 0.05) and r['spread'] <= 0.03
+    assert 'Converged at 2023-08-11' in monitor.report()
+    assert monitor.update(t + 1, xyz, P, 5)
+
+
+def test_criteria_and_dwell():
+    # NOTE: fix required, a float epoch in the dwell starts it again
+    monitor = ConvergenceMonitor(sigma=0.05, spread=0.03, window=10, dwell=20, fix=True)
+    P = np.eye(3) * 1e-4
+    stop = None
+    for k in range(100):
+        smode = 5 if k < 30 or k == 40 else 4
+        xyz = XYZ * np.nan if k == 45 else XYZ + 1e-3 * (k % 2)
+        if monitor.update(T0 + k, xyz, P, smode):
+            stop = k
+            break
+    assert stop == 46 + 20
+
+    # NOTE: a walking solution never converges, however small its sigma
+    monitor = ConvergenceMonitor(sigma=0.05, spread=0.03, window=10, dwell=5)
+    for k in range(100):
+        assert not monitor.update(T0 + k, XYZ + [0.01 * k, 0.0, 0.0], P, 4)
+    assert 'Not converged after 100 epochs' in monitor.report()
+    with pytest.raises(ValueError):
+        ConvergenceMonitor(sigma=0)
@@ -0,0 +1,90 @@
+"""
+Test to check the concurrent discovery of u-blox receivers (MON-VER probe and port cache), with fake ports.
+
+"""
+import time
+
+import src.discover as discover_mod
+from src.discover import discover, frame, parse_monver, probe, MON_VER_POLL
+
+
+def monver(model='ZED-F9P'):
+    def text(s, n):
+        return s.encode().ljust(n, b'\x00')
+    payload = text('EXT CORE 1.00 (61b2dd)', 30) + text('00190000', 10)
+    for ext in ['ROM BASE 0x118B2060', 'FWVER=HPG 1.32', 'PROTVER=27.31', 'MOD=' + model]:
+        payload += text(ext, 30)
+    return frame(0x0A, 0x04, payload)
+
+
+class FakePort():
+    """
+    u-blox F9P (answers the MON-VER poll between NMEA), NMEA only device, silent or busy port.
+    """
+    opened = []
+
+    def __init__(self, port, baud):
+        FakePort.opened.append(port)
+        if port == 'busy':
+            raise OSError('Port busy')
+        self.port = port
+        self.queue = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def write(self, data):
+        if self.port == 'f9p' and data == MON_VER_POLL:
+            self.queue += b'$GNGGA,,,,,,0,00,99.99,,,,,,*56\r\n' + frame(0x01, 0x07, bytes(92)) + monver()
+        elif self.port == 'nmea':
+            self.queue += b'$GPGSV,1,1,00*79\r\n'
+
+    def read(self, n):
+        if not self.queue:
+            time.sleep(0.02)
+        data, self.queue = self.queue[:n], self.queue[n:]
+        return data
+
+
+def test_probe():
+    assert frame(0x0A, 0x04) == MON_VER_POLL
+    info = parse_monver(monver()[6:-2])
+    assert info['model'] == 'F9P' and info['hw'] == '00190000' and 'PROTVER=27.31' in info['ext']
+    assert parse_monver(monver()[6:-2].replace(b'MOD=', b'XXX='))['model'] == 'F9'
+    # NOTE: the model is the part of the module name with the generation, not the last one
+    assert parse_monver(monver('NEO-M8T-0')[6:-2])['model'] == 'M8T'
+    assert parse_monver(monver('MAX-M10S')[6:-2])['model'] == 'M10S'
+
+    r = probe('f9p', timeout=1.0, opener=FakePort)
+    assert r['ublox'] and r['model'] == 'F9P' and r['error'] is None
+    r = probe('nmea', timeout=0.3, opener=FakePort)
+    assert not r['ublox'] and r['model'] is None
+    assert probe('busy', timeout=0.3, opener=FakePort)['error'] == 'Port busy'
+
+
+def test_discover(tmp_path, monkeypatch):
+    ports = ['silent0', 'silent1', 'nmea', 'f9p', 'busy']
+    monkeypatch.setattr(discover_mod, 'list_ports', lambda: [(p, 'USB VID:PID=1546:01A9 SER=' + p) for p in ports])
+    cache = str(tmp_path / 'ports.json')
+
+    # NOTE: one timeout window for all the ports
+    FakePort.opened = []
+    t0 = time.monotonic()
+    results = discover(ports, timeout=0.5, cache=cache, opener=FakePort)
+    assert time.monotonic() - t0 < 1.2
+    assert [p for p, r in results.items() if r['ublox']] == ['f9p'] and results['f9p']['model'] == 'F9P'
+    assert results['busy']['error'] and not any(r['cached'] for r in results.values())
+
+    # NOTE: cached by device, only the busy port is probed again
+    FakePort.opened = []
+    results = discover(ports, timeout=0.5, cache=cache, opener=FakePort)
+    assert FakePort.opened == ['busy'] and results['f9p']['cached'] and results['f9p']['model'] == 'F9P'
+
+    # NOTE: another device in the same port
+    monkeypatch.setattr(discover_mod, 'list_ports', lambda: [(p, 'USB VID:PID=0403:6001 SER=X') for p in ports])
+    FakePort.opened = []
+    discover(['f9p'], timeout=0.5, cache=cache, opener=FakePort)
+    assert FakePort.opened == ['f9p']
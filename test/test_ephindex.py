@@ -0,0 +1,62 @@
+"""
+Test to check the broadcast ephemeris index against cssrlib findeph.
+
+"""
+import random
+
+from cssrlib.ephemeris import findeph
+from cssrlib.gnss import Eph, gpst2time, timeadd, prn2sat, uGNSS
+
+from src.ephindex import EphIndex
+
+
+T0 = gpst2time(2276, 100000.0)
+
+
+def ephemeris():
+    """
+    GPS every 2 h, Galileo every 10 min (with repeated toe), out of order.
+    """
+    ephs = []
+    for prn in range(1, 6):
+        for k in range(12):
+            eph = Eph(prn2sat(uGNSS.GPS, prn))
+            eph.toe, eph.iode, eph.mode = timeadd(T0, 7200.0 * k), k, 0
+            ephs.append(eph)
+        for k in range(0, 144, 3 if prn % 2 else 1):
+            for mode in (0, 1):
+                eph = Eph(prn2sat(uGNSS.GAL, prn))
+                eph.toe, eph.iode, eph.mode = timeadd(T0, 600.0 * k), k % 4, mode
+                ephs.append(eph)
+                if k % 10 == 0: # NOTE: same toe twice
+                    eph = Eph(prn2sat(uGNSS.GAL, prn))
+                    eph.toe, eph.iode, eph.mode = timeadd(T0, 600.0 * k), k % 4 + 1, mode
+                    ephs.append(eph)
+    random.Random(0).shuffle(ephs)
+    return ephs
+
+
+def test_find():
+    ephs = ephemeris()
+    idx = EphIndex(ephs)
+    sats = sorted(set(eph.sat for eph in ephs))
+    rnd = random.Random(1)
+    times = [timeadd(T0, rnd.uniform(-20000.0, 110000.0)) for _ in range(200)] + \
+        [timeadd(T0, 300.0 * k) for k in range(-20, 300)] # NOTE: middle points between toe
+
+    for t in times:
+        for sat in sats:
+            for mode in (0, 1):
+                assert idx.find(t, sat, mode=mode) is findeph(ephs, t, sat, mode=mode)
+            assert idx.find(t, sat, iode=2) is findeph(ephs, t, sat, iode=2)
+
+
+def test_update():
+    ephs = ephemeris()
+    idx = EphIndex(ephs[:10])
+    sat = ephs[20].sat
+    t = ephs[20].toe
+    idx.update(ephs)
+    assert idx.n == len(ephs)
+    assert idx.find(t, sat, mode=ephs[20].mode) is findeph(ephs, t, sat, mode=ephs[20].mode)
+    assert idx.find(t, prn2sat(uGNSS.BDS, 1)) is None
@@ -0,0 +1,66 @@
+"""
+Test to check the IONEX reader and the slant ionospheric delay (CODE GIM of 2023-08-11).
+
+"""
+import numpy as np
+
+from cssrlib.gnss import epoch2time, timeadd, rSigRnx, Obs, prn2sat, uGNSS
+from cssrlib.rinex import rnxdec
+
+from src.ionex import Ionex, K_IONO
+
+
+INX = 'data/rinex/file_creator/COD0OPSFIN_20232230000_01D_01H_GIM.INX'
+T0 = epoch2time([2023, 8, 11, 0, 0, 0])
+POS = np.array([np.deg2rad(40.4), np.deg2rad(-3.7), 650.0])
+
+
+def test_read():
+    gim = Ionex(INX)
+    assert gim.tec.shape == (25, 71, 73)
+    assert gim.times[-1] == 86400.0
+    assert gim.lats[0] == -87.5 and gim.lons[0] == -180.0
+    assert gim.hion == 450.0e3
+
+    # NOTE: first values of the first map (lat 87.5), at the nodes the map is returned as is
+    np.testing.assert_allclose(gim.vtec(T0, [87.5, 87.5], [-180.0, -170.0]), [16.0, 16.1], atol=1e-5)
+    assert np.isnan(gim.vtec(timeadd(T0, -60.0), [0.0], [0.0])).all()
+
+
+def test_stec_vectorized():
+    gim = Ionex(INX)
+    t = timeadd(T0, 5025.0)
+    az = np.deg2rad([0.0, 45.0, 135.0, 200.0, 300.0])
+    el = np.deg2rad([85.0, 45.0, 20.0, 10.0, 60.0])
+
+    stec = gim.stec(t, POS, az, el)
+    for k in range(len(az)):
+        np.testing.assert_allclose(gim.stec(t, POS, az[k], el[k]), stec[k])
+    assert np.all(stec > 0)
+    assert stec[3] > stec[0] # NOTE: mapping function
+
+    d1 = gim.delay(t, POS, az, el, 1575.42e6)
+    d5 = gim.delay(t, POS, az, el, 1176.45e6)
+    np.testing.assert_allclose(d1, K_IONO * stec / 1575.42e6**2)
+    np.testing.assert_allclose(d5 / d1, (1575.42 / 1176.45)**2)
+
+
+def test_correct():
+    gim = Ionex(INX)
+    dec = rnxdec()
+    dec.setSignals([rSigRnx(sig) for sig in ("GC1C", "GC5X", "GL1C", "GL5X")])
+
+    sat = prn2sat(uGNSS.GPS, 5)
+    obs = Obs()
+    obs.t = timeadd(T0, 3600.0)
+    obs.sat = np.array([sat])
+    obs.sig = dec.sig_tab
+    obs.P = np.array([[22e6, 22e6]])
+    obs.L = np.array([[115e6, 86e6]])
+    P, L = obs.P.copy(), obs.L.copy()
+
+    stec = gim.correct(obs, POS, [sat], [0.5], [np.deg2rad(30.0)])
+    dP = obs.P - P
+    dL = (obs.L - L) * 299792458.0 / np.array([1575.42e6, 1176.45e6])
+    np.testing.assert_allclose(dP[0], -K_IONO * stec[0] / np.array([1575.42e6, 1176.45e6])**2)
+    np.testing.assert_allclose(dL, -dP, rtol=1e-9)
@@ -0,0 +1,67 @@
+"""
+Test to check the result ring, the live dashboard (server-sent events) and the console summary.
+
+"""
+import http.client
+import io
+import json
+
+import numpy as np
+
+from cssrlib.gnss import gtime_t
+
+from src.live import ResultRing, Dashboard, ConsoleSummary
+
+
+XYZ = np.array([-3962108.6726, 3381309.4719, 3668678.6264])
+
+
+def test_ring():
+    ring = ResultRing(size=4)
+    for k in range(10):
+        ring.publish(1691787600.0 + k, XYZ, [k, 0.0, 0.0], 4, 10)
+
+    # NOTE: the oldest row is the next one written by the engine, size - 1 epochs are readable
+    seq, rows = ring.since(0)
+    assert seq == 10 and list(rows[:, 4]) == [7.0, 8.0, 9.0]
+    seq, rows = ring.since(8)
+    assert list(rows[:, 4]) == [8.0, 9.0]
+    assert len(ring.since(10)[1]) == 0
+
+    # NOTE: downsampled, the last epoch is always sent
+    _, rows = ring.since(0, maxrows=2)
+    assert list(rows[:, 4]) == [7.0, 9.0]
+
+
+def test_dashboard():
+    ring = ResultRing()
+    # NOTE: kinematic epochs (ENU nan), 1 m north of the reference
+    ring.publish(1691787600.0, XYZ, [np.nan] * 3, 5, 9, 0.05)
+    dash = Dashboard(ring, port=0, rate=20.0, xyz_ref=XYZ)
+    url = dash.start()
+    try:
+        host, port = url[len('http://'):].strip('/').split(':')
+        conn = http.client.HTTPConnection(host, int(port), timeout=10)
+        conn.request('GET', '/')
+        res = conn.getresponse()
+        assert res.status == 200 and b'EventSource' in res.read()
+
+        conn.request('GET', '/events')
+        res = conn.getresponse()
+        assert res.getheader('Content-Type') == 'text/event-stream'
+        msg = json.loads(res.fp.readline()[len(b'data: '):])
+        assert msg['seq'] == 1 and msg['smode'] == [5] and msg['nsat'] == [9] and msg['ztd'] == [0.05]
+        assert abs(msg['e'][0]) < 1e-3 and abs(msg['n'][0]) < 1e-3
+        conn.close()
+    finally:
+        dash.close()
+
+
+def test_console_rate_limit():
+    out = io.StringIO()
+    console = ConsoleSummary(interval=3600.0, stream=out)
+    for k in range(1000):
+        console.update(gtime_t(1691787600 + k, 0.0), [0.1, 0.2, 0.3], 4 if k % 2 else 5, 12)
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 1 and '2023-08-11 21:00:00' in lines[0]
+    assert console.n == 1000 and console.nfix == 500
@@ -0,0 +1,157 @@
+"""
+Test to check the NTRIP client and the RTCM3 decoding against a local caster stand-in
+that replays a recorded RTCM file.
+
+"""
+import asyncio
+
+import bitstruct as bs
+import numpy as np
+
+from cssrlib.gnss import rSigRnx, gpst2time, timeadd, timediff, Obs, uTYP
+from cssrlib.rinex import rnxdec
+
+from src.ntrip import NtripClient, RtcmDecoder, RtcmFramer, rtcm_frame, rtk_realtime
+
+
+TREF = gpst2time(2276, 100000.0)
+POS = np.array([-3962108.6726, 3381309.4719, 3668678.6264])
+
+
+def msg1005(pos):
+    fmt = 'u12u12u6u1u1u1u1s38u1u1s38u2s38'
+    val = [1005, 1, 0, 1, 0, 1, 0, round(pos[0]*1e4), 0, 0, round(pos[1]*1e4), 0, round(pos[2]*1e4)]
+    return rtcm_frame(bs.pack(fmt, *val))
+
+
+def msm4(tow, prns, rng, mi=0):
+    """
+    GPS MSM4, signal 1C (id 2): rough range [ms] per satellite.
+    """
+    svmask = sum(1 << (64 - prn) for prn in prns)
+    sigmask = 1 << (32 - 2)
+    n = len(prns)
+    fmt = 'u12u12u30u1u3u7u2u2u1u3u64u32' + 'u1'*n + 'u8'*n + 'u10'*n + \
+        's15'*n + 's22'*n + 'u4'*n + 'u1'*n + 'u6'*n
+    val = [1074, 1, int(tow*1000), mi, 0, 0, 0, 0, 0, 0, svmask, sigmask] + [1]*n + \
+        [int(r) for r in rng] + [int((r % 1)*1024) for r in rng] + \
+        [100]*n + [2000]*n + [15]*n + [0]*n + [45]*n
+    return rtcm_frame(bs.pack(fmt, *val))
+
+
+def record(path, nep=5):
+    frames = [msg1005(POS)]
+    for k in range(nep):
+        frames.append(msm4(100000.0 + k, [5, 13, 32], [70.25, 72.5, 75.75]))
+    path.write_bytes(b''.join(frames))
+    return frames
+
+
+def sig_tab(sigs=("GC1C", "GL1C", "GS1C")):
+    dec = rnxdec()
+    dec.setSignals([rSigRnx(sig) for sig in sigs])
+    return dec.sig_tab
+
+
+def test_framer():
+    frames = [msg1005(POS), msm4(100000.0, [5, 13], [70.25, 72.5])]
+    bad = bytearray(frames[1])
+    bad[10] ^= 0xFF
+    data = b'\x00\xd3garbage' + frames[0] + bytes(bad) + frames[1]
+
+    framer = RtcmFramer()
+    out = []
+    for k in range(0, len(data), 7): # NOTE: small chunks
+        out += framer.feed(data[k:k+7])
+    assert out == frames
+    assert framer.nerr >= 1
+
+
+def test_decoder():
+    decoder = RtcmDecoder(sig_tab(), tref=TREF)
+    frames = [msg1005(POS), msm4(100000.0, [5, 13, 32], [70.25, 72.5, 75.75])]
+    assert decoder.decode(frames[0]) is None
+    np.testing.assert_allclose(decoder.pos, POS, atol=1e-4)
+
+    obs = decoder.decode(frames[1])
+    assert obs is not None
+    assert timediff(obs.t, TREF) == 0.0
+    assert list(obs.sat) == [5, 13, 32]
+    assert obs.P.shape == (3, 1)
+    assert abs(obs.P[1, 0] - (72.5e-3 + 100*2**-24*1e-3)*299792458.0) < 1e-3
+    assert np.all(obs.S[:, 0] == 45)
+
+    # NOTE: without a signal table (-ntrip monitor), the signals of the MSM
+    decoder = RtcmDecoder(tref=TREF)
+    obs = decoder.decode(frames[1])
+    assert obs is not None and obs.P.shape == (3, 1) and len(decoder.epochs) == 1
+    assert [s.str() for s in obs.sig[list(obs.sig)[0]][uTYP.L]] == ['L1C']
+
+
+def test_caster_replay(tmp_path):
+    path = tmp_path / 'base.rtcm3'
+    record(path)
+    requests = []
+
+    async def caster(reader, writer):
+        requests.append(await reader.readuntil(b'\r\n\r\n'))
+        writer.write(b'ICY 200 OK\r\n\r\n')
+        data = path.read_bytes()
+        for k in range(0, len(data), 50):
+            writer.write(data[k:k+50])
+            await writer.drain()
+            await asyncio.sleep(0.001)
+        writer.close() # NOTE: the client must reconnect
+
+    async def main():
+        server = await asyncio.start_server(caster, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        client = NtripClient.from_url('user:pass@127.0.0.1:{}/TEST00ESP0'.format(port),
+                                      timeout=2.0, backoff=0.05)
+        # NOTE: table of the MSM signals, the rover one has L2W too
+        decoder = RtcmDecoder(tref=TREF)
+        task = asyncio.create_task(client.run(decoder))
+        rover_tab = sig_tab(("GC1C", "GC2W", "GL1C", "GL2W", "GS1C", "GS2W"))
+
+        async def rover():
+            for k in range(5):
+                obs = Obs()
+                obs.t = timeadd(TREF, k)
+                obs.sig = rover_tab
+                yield obs
+
+        class Filter():
+            n = 0
+            def process(self, obs, obsb=None):
+                assert timediff(obs.t, obsb.t) == 0.0
+                assert obsb.sig is obs.sig and obsb.P.shape == (3, 2) and obsb.L.shape == obsb.lli.shape == (3, 2)
+                assert np.all(obsb.P[:, 0] > 2e7) and np.all(obsb.P[:, 1] == 0.0)
+                self.n += 1
+
+        class Nav():
+            rb = None
+
+        rtk, nav = Filter(), Nav()
+        ne = await rtk_realtime(rtk, nav, rover(), decoder, client.stats, maxwait=2.0)
+        while client.stats.reconnect < 1:
+            await asyncio.sleep(0.01)
+        client.stop.set()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        server.close()
+        await server.wait_closed()
+        return client, ne, rtk, nav
+
+    client, ne, rtk, nav = asyncio.run(main())
+
+    assert b'GET /TEST00ESP0' in requests[0]
+    assert b'Authorization: Basic dXNlcjpwYXNz' in requests[0]
+    assert ne == 5 and rtk.n == 5
+    np.testing.assert_allclose(nav.rb, POS, atol=1e-4)
+    assert client.stats.reconnect >= 1
+    assert client.stats.nepoch >= 5
+    assert client.stats.msgtype[1074] >= 5
+    assert len(client.stats.ages) == 5 and np.isfinite(client.stats.latency)
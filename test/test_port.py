@@ -4,34 +4,24 @@ Test to check serial port availability and find which is connected with the u-bl
 """
 
 import serial
-from pyubx2 import UBXReader
-import pyubx2
 import serial.tools.list_ports
 
+from src.discover import discover
+
 def check_ublox_in_port(num_port):
-    for port_number in num_port:
-        PORT = port_number
-        try:
-            with serial.Serial(PORT, 115200, timeout=3) as ser:
-                print(f"Testing {PORT}...")
-                ubr = UBXReader(ser)
-                no_data_count = 0
-                for _ in range(10):  # Try to read up to 10 times
-                    (raw_data, parsed_data) = ubr.read()
-                    print(parsed_data)
-                    #print(raw_data)
-                    if raw_data:
-                        if 'u-blox' in str(raw_data) or 'UBX' in str(parsed_data):  # Assuming 'u-blox' can be searched in the string-converted raw_data
-                            print(f"'u-blox' found in {PORT}")
-                            return PORT  # Returns the port where it was found
-                        no_data_count = 0  # Reset counter if any data is received
-                    else:
-                        no_data_count += 1
-                        if no_data_count >= 10:
-                            print(f"No useful information in {PORT}, switching to the next port...")
-                            break  # Exits the for loop and tries the next port
-        except serial.SerialException as e:
-            print(f"Error opening serial port {PORT}: {e}")
+    # NOTE: all the ports at the same time (MON-VER polls), 3 s whatever the number of ports
+    results = discover(num_port, 115200, timeout=3.0, refresh=True)
+    for PORT, result in results.items():
+        if result['error']:
+            print(f"Error opening serial port {PORT}: {result['error']}")
+        elif result['ublox']:
+            print(f"'u-blox' found in {PORT} (model: {result['model']}, {result['sw']})")
+        else:
+            print(f"No useful information in {PORT}")
+
+    for PORT, result in results.items():
+        if result['ublox']:
+            return PORT  # Returns the port where it was found
 
     print("No 'u-blox' found in the tested ports.")
     return None
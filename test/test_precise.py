@@ -0,0 +1,72 @@
+"""
+Test to check the precomputed SP3/CLK polynomials against cssrlib.peph (CODE MGEX orbits of 2023-08-11).
+
+"""
+import numpy as np
+
+from cssrlib.gnss import Nav, timeadd, prn2sat, uGNSS
+from cssrlib.peph import peph
+from cssrlib.rinex import pclk_t
+
+from src.precise import PephPoly
+
+
+SP3 = 'data/rinex/file_creator/COD0MGXFIN_20232230000_01D_05M_ORB.SP3'
+SATS = [prn2sat(uGNSS.GPS, prn) for prn in range(1, 33)] + [prn2sat(uGNSS.GAL, prn) for prn in range(1, 37)]
+
+NAV = Nav()
+peph().parse_sp3(SP3, NAV)
+
+
+def test_pephpos():
+    ref, fast = peph(), PephPoly()
+    t0 = NAV.peph[0].time
+    n = 0
+    for dt in (0.0, 17.3, 1000.0, 43210.7, 86100.0, 86399.0, -100.0):
+        t = timeadd(t0, dt)
+        for sat in SATS:
+            rs, dts, _ = ref.peph2pos(t, sat, NAV)
+            rs_, dts_, _ = fast.peph2pos(t, sat, NAV)
+            if rs is None or np.isnan(rs[0]):
+                assert rs_ is None # NOTE: None instead of nan, both are skipped by satposs
+                continue
+            np.testing.assert_allclose(rs_[0:3], rs[0:3], rtol=0, atol=1e-5)
+            np.testing.assert_allclose(dts_[0], dts[0], rtol=0, atol=1e-12)
+            n += 1
+    assert n > 300
+    assert fast.coef.shape[0] == NAV.ne - 10
+
+
+def test_satpos():
+    ref, fast = peph(), PephPoly()
+    t = timeadd(NAV.peph[0].time, 43210.7)
+    rs, dts, ok = fast.satpos(t, SATS, NAV)
+    for k, sat in enumerate(SATS):
+        rs_, dts_, _ = ref.peph2pos(t, sat, NAV)
+        if rs_ is None or np.isnan(rs_[0]):
+            assert not ok[k]
+            continue
+        assert ok[k]
+        np.testing.assert_allclose(rs[k, 0:3], rs_[0:3], rtol=0, atol=1e-5)
+        np.testing.assert_allclose(rs[k, 3:6], rs_[3:6], rtol=0, atol=1e-3) # NOTE: reference by differences (1 ms)
+        np.testing.assert_allclose(dts[k], dts_[0], rtol=0, atol=1e-12)
+
+
+def test_pephclk():
+    nav = Nav()
+    nav.peph, nav.ne = NAV.peph, NAV.ne
+    nav.pclk = []
+    sat = SATS[0]
+    for k in range(10):
+        clk = pclk_t(timeadd(NAV.peph[0].time, 30.0 * k))
+        clk.clk[sat - 1] = 1e-4 + 1e-9 * k
+        nav.pclk.append(clk)
+    nav.nc = len(nav.pclk)
+
+    ref, fast = peph(), PephPoly()
+    for dt in (-10.0, 0.0, 45.0, 100.0, 300.0):
+        t = timeadd(NAV.peph[0].time, dt)
+        dts, _ = ref.pephclk(t, sat, nav)
+        dts_, _ = fast.pephclk(t, sat, nav)
+        np.testing.assert_allclose(dts_[0], dts[0], rtol=0, atol=1e-15)
+    assert fast.pephclk(NAV.peph[0].time, SATS[1], nav)[0] is None
@@ -0,0 +1,228 @@
+"""
+Test to check the product prefetcher offline (local directory and a HTTP stand-in server).
+
+"""
+import asyncio
+import os
+
+from cssrlib.gnss import epoch2time
+
+from src.prefetch import products_for, prefetch, Mirror, Prefetcher, HttpBackend, LocalBackend
+
+
+T0 = epoch2time([2023, 8, 11, 22, 0, 0]).time
+
+
+def _archive(root, products, size=200000):
+    data = {}
+    for k, (name, path) in enumerate(products):
+        full = os.path.join(root, *path.split('/'))
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        data[name] = bytes((k * 7 + i) % 251 for i in range(size))
+        with open(full, 'wb') as fh:
+            fh.write(data[name])
+    return data
+
+
+class StandIn():
+    """
+    HTTP/1.1 server of a directory (Range, keep-alive), the first response of drop is cut.
+    """
+    def __init__(self, root, drop=None):
+        self.root, self.drop = root, drop
+        self.nconnect = 0
+
+    async def handle(self, reader, writer):
+        self.nconnect += 1
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            path = line.split()[1].decode().lstrip('/')
+            offset = 0
+            while True:
+                h = await reader.readline()
+                if h in (b'\r\n', b''):
+                    break
+                if h.lower().startswith(b'range'):
+                    offset = int(h.split(b'=')[1].split(b'-')[0])
+            full = os.path.join(self.root, *path.split('/'))
+            if not os.path.isfile(full):
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+                continue
+            with open(full, 'rb') as fh:
+                body = fh.read()[offset:]
+            status = b"206 Partial Content" if offset else b"200 OK"
+            writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Length: " + str(len(body)).encode() + b"\r\n\r\n")
+            if self.drop is not None and path.endswith(self.drop):
+                self.drop = None
+                writer.write(body[:len(body) // 3])
+                await writer.drain()
+                break
+            writer.write(body)
+            await writer.drain()
+        writer.close()
+
+
+class Login():
+    """
+    Archive (127.0.0.1) behind a login host (localhost): the archive sends to the login, the login
+    asks for the credentials (401) and sends back with a code, the archive sets a session cookie.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.seen = []      # (server, path, authorization, cookie)
+        self.archive_port = self.login_port = None
+
+    async def _request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None, {}
+        headers = {}
+        while True:
+            h = await reader.readline()
+            if h in (b'\r\n', b''):
+                break
+            name, _, value = h.decode().partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return line.split()[1].decode(), headers
+
+    def _reply(self, writer, status, headers=(), body=b''):
+        head = ''.join('{}: {}\r\n'.format(k, v) for k, v in headers)
+        writer.write('HTTP/1.1 {}\r\n{}Content-Length: {}\r\n\r\n'.format(status, head, len(body)).encode() + body)
+
+    async def archive(self, reader, writer):
+        while True:
+            path, headers = await self._request(reader)
+            if path is None:
+                break
+            self.seen.append(('archive', path, headers.get('authorization'), headers.get('cookie')))
+            if path.startswith('/auth?code=ok'):
+                self._reply(writer, '302 Found', [('Set-Cookie', 'session=42; Path=/; HttpOnly'), ('Location', '/file.gz')])
+            elif headers.get('cookie') == 'session=42':
+                with open(os.path.join(self.root, 'file.gz'), 'rb') as fh:
+                    self._reply(writer, '200 OK', body=fh.read())
+            else:
+                self._reply(writer, '302 Found', [('Location', 'http://localhost:{}/oauth'.format(self.login_port))])
+            await writer.drain()
+        writer.close()
+
+    async def login(self, reader, writer):
+        while True:
+            path, headers = await self._request(reader)
+            if path is None:
+                break
+            self.seen.append(('login', path, headers.get('authorization'), headers.get('cookie')))
+            if headers.get('authorization') != 'Basic dXNlcjpzZWNyZXQ=':    # NOTE: user:secret
+                self._reply(writer, '401 Unauthorized', [('WWW-Authenticate', 'Basic realm="login"')])
+            else:
+                self._reply(writer, '302 Found', [('Location', 'http://127.0.0.1:{}/auth?code=ok'.format(self.archive_port))])
+            await writer.drain()
+        writer.close()
+
+
+def test_products_for():
+    products = products_for(T0, T0 + 4 * 3600)
+    assert [name for name, _ in products][0:3] == ['COD0MGXFIN_20232230000_01D_05M_ORB.SP3.gz',
+                                                   'COD0MGXFIN_20232230000_01D_30S_CLK.CLK.gz',
+                                                   'COD0MGXFIN_20232230000_01D_01D_OSB.BIA.gz']
+    assert len(products) == 6 # NOTE: two days
+    assert products[0][1] == 'gnss/products/2274/COD0MGXFIN_20232230000_01D_05M_ORB.SP3.gz'
+    assert products_for(T0, T0, types=['ionex'])[0][1].startswith('gnss/products/ionex/2023/223/')
+
+
+def test_local_mirror(tmp_path):
+    products = products_for(T0, T0 + 3600)
+    data = _archive(str(tmp_path / 'archive'), products)
+    backend = LocalBackend(str(tmp_path / 'archive'))
+
+    paths, fetcher = prefetch([(T0, T0 + 3600), (T0 + 60, T0 + 120)], str(tmp_path / 'mirror'), backend, jobs=2)
+    assert fetcher.stats['downloaded'] == 3 and backend.nrequest == 3
+    for name, path in paths.items():
+        with open(path, 'rb') as fh:
+            assert fh.read() == data[name]
+        assert path.endswith('.gz')
+
+    # NOTE: the second run doesn't request anything
+    paths2, fetcher = prefetch([(T0, T0 + 3600)], str(tmp_path / 'mirror'), backend)
+    assert paths2 == paths and fetcher.stats['present'] == 3 and backend.nrequest == 3
+
+
+def test_http_resume(tmp_path):
+    products = products_for(T0, T0 + 3600) + [('COD0MGXFIN_20200010000_01D_05M_ORB.SP3.gz', 'gnss/products/missing.gz')]
+    data = _archive(str(tmp_path / 'archive'), products[:-1])
+    mirror = Mirror(str(tmp_path / 'mirror'))
+    name = products[0][0]
+    with open(mirror.partial(name), 'wb') as fh:   # NOTE: partial file of a previous run
+        fh.write(data[name][:50000])
+    server = StandIn(str(tmp_path / 'archive'), drop=products[1][0])
+
+    async def run():
+        srv = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        port = srv.sockets[0].getsockname()[1]
+        backend = HttpBackend('http://127.0.0.1:{}/'.format(port), maxconn=2)
+        fetcher = Prefetcher(backend, mirror, jobs=2, retries=2)
+        async with srv:
+            paths = await fetcher.run(products)
+        return paths, fetcher, backend
+
+    paths, fetcher, backend = asyncio.run(run())
+    assert paths[products[-1][0]] is None and fetcher.stats['missing'] == 1
+    for name, _ in products[:-1]:
+        with open(paths[name], 'rb') as fh:
+            assert fh.read() == data[name]
+    # NOTE: resumed from 50000 and from the cut response, the connections are reused
+    assert server.drop is None
+    assert fetcher.stats['bytes'] == 3 * 200000 - 50000 and backend.nconnect <= 3
+
+
+def test_resume_refused(tmp_path):
+    # NOTE: the server refuses every resume (HTTP 416), the product fails without stopping the run
+    class Refuse():
+        async def get(self, path, offset):
+            raise EOFError(path)
+
+        async def close(self):
+            pass
+
+    mirror = Mirror(str(tmp_path / 'mirror'))
+    name, path = products_for(T0, T0 + 3600)[0]
+    with open(mirror.partial(name), 'wb') as fh:
+        fh.write(b'partial')
+    for retries in (0, 1):
+        fetcher = Prefetcher(Refuse(), mirror, retries=retries)
+        paths = asyncio.run(fetcher.run([(name, path)]))
+        assert paths == {name: None} and fetcher.stats['failed'] == 1 and fetcher.stats['downloaded'] == 0
+
+
+def test_http_login(tmp_path):
+    with open(str(tmp_path / 'file.gz'), 'wb') as fh:
+        fh.write(b'product' * 1000)
+    server = Login(str(tmp_path))
+
+    async def run(login):
+        archive = await asyncio.start_server(server.archive, '127.0.0.1', 0)
+        auth = await asyncio.start_server(server.login, '127.0.0.1', 0)
+        server.archive_port = archive.sockets[0].getsockname()[1]
+        server.login_port = auth.sockets[0].getsockname()[1]
+        backend = HttpBackend('http://127.0.0.1:{}/'.format(server.archive_port), user='user', password='secret', login=login)
+        async with archive, auth:
+            try:
+                start, chunks = await backend.get('file.gz')
+                return b''.join([data async for data in chunks])
+            except ConnectionError:
+                return None
+            finally:
+                await backend.close()
+
+    # NOTE: a host of the redirection that is not the login host never gets the credentials
+    assert asyncio.run(run('login.example')) is None
+    assert server.seen[0][2] is not None and server.seen[1][0] == 'login'
+    assert all(auth is None for who, _, auth, _ in server.seen if who == 'login')
+
+    # NOTE: the login host gets them after its 401, the session cookie of the archive is kept
+    server.seen = []
+    assert asyncio.run(run('localhost')) == b'product' * 1000
+    assert [(who, auth is not None) for who, _, auth, _ in server.seen if who == 'login'] == [('login', False), ('login', True)]
+    assert server.seen[-1] == ('archive', '/file.gz', 'Basic dXNlcjpzZWNyZXQ=', 'session=42')
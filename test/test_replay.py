@@ -0,0 +1,57 @@
+"""
+Test to check the replay of a UBX capture through a pseudo-terminal (bytes, timing and answers to the commands).
+
+"""
+import os
+import time
+
+import serial
+
+from src.funciones import checkUBX
+from src.replay import Replay
+
+
+UBXFILE = 'data/ublox/datos_fuera_correctos.ubx'
+
+
+def read_all(ser, replay):
+    got = b''
+    while not replay.wait(0):
+        got += ser.read(65536)
+    return got + ser.read(65536)
+
+
+def test_replay_bytes(tmp_path):
+    with open(UBXFILE, 'rb') as fh:
+        full = fh.read()
+    # NOTE: the port is opened before the start, pyserial flushes the input when it opens it
+    with Replay(UBXFILE, speed=0, block=True, link=str(tmp_path / 'ttyUBX')) as replay:
+        with serial.Serial(str(tmp_path / 'ttyUBX'), 115200, timeout=0.2) as ser:
+            assert replay.start() == str(tmp_path / 'ttyUBX')
+            got = read_all(ser, replay)
+    assert got == full and replay.stats['dropped'] == 0 and replay.stats['epochs'] == len(replay.times)
+
+
+def test_replay_timing():
+    # NOTE: 849 s of capture at 1000x, the MON-VER of the capture answers the detection. Blocking writes,
+    #       a busy test runner would otherwise drop bytes as a UART overrun (covered by test_overrun)
+    with Replay(UBXFILE, speed=1000, block=True) as replay:
+        assert abs(replay.duration - 0.849) < 0.01
+        with serial.Serial(replay.device, 115200, timeout=0.02) as ser:
+            t0 = time.monotonic()
+            replay.start()
+            got = read_all(ser, replay)
+            elapsed = time.monotonic() - t0
+        assert checkUBX(replay.device, 115200, True) == ('M8T', True)
+    assert replay.duration <= elapsed < replay.duration + 0.5
+    assert replay.stats['lag'] < 0.1 and replay.stats['dropped'] == 0 and len(got) == os.path.getsize(UBXFILE)
+    assert replay.stats['commands'] >= 1
+
+
+def test_overrun():
+    # NOTE: nobody reads the port, the bytes that don't fit in the pty are dropped instead of blocking
+    with Replay(UBXFILE, speed=0) as replay:
+        replay.start()
+        assert replay.wait(5.0)
+        s = replay.stats
+    assert s['dropped'] > 0 and s['bytes'] + s['dropped'] == os.path.getsize(UBXFILE)
@@ -0,0 +1,50 @@
+"""
+Test to check the processing service API (TCP and Unix socket), without observation data.
+
+"""
+import threading
+
+import pytest
+
+from src.service import Service, ServiceClient, serve
+
+
+def _start(tmp_path, url):
+    service = Service(workers=1, outdir=str(tmp_path / 'jobs'))
+    ready = threading.Event()
+    thread = threading.Thread(target=serve, args=(service, url, ready), daemon=True)
+    thread.start()
+    assert ready.wait(10)
+    return ServiceClient(ready.url), thread
+
+
+def test_jobs(tmp_path):
+    client, thread = _start(tmp_path, 'http://127.0.0.1:0')
+    assert client.health()['workers'] == 1
+
+    with pytest.raises(ValueError):
+        client.submit('spp', {})
+    with pytest.raises(ValueError, match='400'):     # NOTE: a JSON body that is not an object
+        client.request('POST', '/jobs', ['ppp'])
+
+    # NOTE: the job fails in the worker (missing files), the error is reported
+    jobid = client.submit('ppp', {'navfile': str(tmp_path / 'missing.nav'), 'obsfile': str(tmp_path / 'missing.obs'),
+                                  'atxfile': str(tmp_path / 'missing.atx'), 'nep': 1})
+    status = client.wait(jobid, poll=0.1, timeout=60)
+    assert status['status'] == 'failed' and status['error']
+    assert [job['id'] for job in client.jobs()] == [jobid]
+    assert client.health()['jobs'] == {'failed': 1}
+    with pytest.raises(ValueError):
+        client.status('unknown')
+
+    client.shutdown()
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+def test_unix_socket(tmp_path):
+    client, thread = _start(tmp_path, 'unix://' + str(tmp_path / 'service.sock'))
+    assert client.health()['jobs'] == {}
+    client.shutdown()
+    thread.join(10)
+    assert not (tmp_path / 'service.sock').exists()
@@ -0,0 +1,69 @@
+"""
+Test to check the signal monitor (C/N0 and slips of RXM-RAWX and cssrlib Obs, alerts, constant memory).
+
+"""
+import io
+from types import SimpleNamespace
+
+import numpy as np
+
+from cssrlib.gnss import gtime_t, id2sat, rSigRnx
+from cssrlib.rinex import rnxdec
+
+from src.sigmon import SignalMonitor
+
+
+UBXFILE = 'data/ublox/datos_fuera_correctos.ubx'
+
+
+def test_capture():
+    with open(UBXFILE, 'rb') as fh:
+        data = fh.read()
+    out = io.StringIO()
+    monitor = SignalMonitor(history=120, interval=1e-9, stream=out)
+    shapes = monitor.cno.shape
+    for k in range(0, len(data), 777):
+        monitor.feed(data[k:k + 777])
+
+    assert monitor.n == 850 and monitor.cno.shape == shapes
+    signals = monitor.signals()
+    assert set(signals) == {'G1C', 'E1C', 'R1C'}
+    assert all(20.0 < v['cno'] < 55.0 and v['tracked'] > 0 for v in signals.values())
+    sats = monitor.satellites()
+    assert {s['sat'][0] for s in sats} == {'G', 'E', 'R'} and sum(s['slips'] for s in sats) > 0
+    lines = out.getvalue().splitlines()
+    assert len(lines) > 100 and 'G1C' in lines[-1] and 'signal' in monitor.table()
+
+
+def test_slips_alerts_and_obs():
+    monitor = SignalMonitor(history=60, slots=4, interval=0)
+    describe = lambda i: ('G{:02d}'.format(i + 1), 'G1C')
+    for n in range(200):
+        lock = np.full(3, n * 1.0)
+        if n == 50:
+            lock[1] = 0.0                   # NOTE: lock time reset, a slip
+        cno = np.full(3, 45.0 if n < 150 else 30.0)
+        monitor.update(n, [0, 1, 2], describe, cno, lock=lock)
+        if n % 20 == 0:
+            alerts = monitor.alerts()
+            assert bool(alerts) == (n >= 180)
+    assert monitor.slips[:3].tolist() == [0, 1, 0]
+    assert 'dB under its baseline' in monitor.report()
+
+    # NOTE: new satellites reuse the slots of the ones not seen for longer
+    monitor.update(200, [7, 8], lambda i: ('E0{}'.format(i), 'E1C'), np.array([40.0, 41.0]))
+    assert len(monitor.slot) == 4 and 7 in monitor.slot and 8 in monitor.slot
+
+    # NOTE: observations of the engines (sig_tab of rnxdec, keyed by uGNSS), slips from the LLI
+    dec = rnxdec()
+    dec.setSignals([rSigRnx(s) for s in ('GC1C', 'GC2W', 'GS1C', 'GS2W', 'EC1C', 'EC5Q', 'ES1C', 'ES5Q')])
+    obs = SimpleNamespace(t=gtime_t(1705143300, 0.0), sat=[id2sat('G05'), id2sat('E11')],
+                          S=np.array([[44.0, 38.0], [40.0, 0.0]]), lli=np.array([[0, 1], [0, 0]]), sig=dec.sig_tab)
+    monitor = SignalMonitor(interval=0)
+    monitor.update_obs(obs)
+    assert sorted(monitor.signals()) == ['E1C', 'G1C', 'G2W'] and monitor.slips[:3].tolist() == [0, 1, 0]
+
+    # NOTE: without signal table, the column number
+    monitor = SignalMonitor(interval=0)
+    monitor.update_obs(SimpleNamespace(**dict(vars(obs), sig={})))
+    assert sorted(monitor.signals()) == ['E1', 'G1', 'G2']
@@ -0,0 +1,40 @@
+"""
+Test to check the compact per-satellite storage.
+
+"""
+import numpy as np
+
+from src.sparse import SatTrack
+
+
+def test_sattrack_roundtrip():
+    sky = SatTrack(5, ('azm', 'elv'), capacity=2)
+    sky.append(0, [1, 5], azm=[0.1, 0.2], elv=[0.3, 0.4])
+    sky.append(2, [5, 7, 9], azm=[1.0, 1.1, 1.2], elv=[0.5, 0.6, 0.7])
+    sky.trim()
+
+    sat, values = sky.epoch(1)
+    assert len(sat) == 0
+    sat, values = sky.epoch(2)
+    np.testing.assert_array_equal(sat, [5, 7, 9])
+    np.testing.assert_allclose(values['elv'], [0.5, 0.6, 0.7], rtol=1e-6)
+
+    ep, values = sky.track(5)
+    np.testing.assert_array_equal(ep, [0, 2])
+    np.testing.assert_allclose(values['azm'], [0.2, 1.0], rtol=1e-6)
+
+    dense = sky.to_dense('azm')
+    assert np.isnan(dense[1]).all()
+    assert np.isclose(dense[2, 8], 1.2)
+    np.testing.assert_array_equal(sky.satellites(), [1, 5, 7, 9])
+
+
+def test_sattrack_order():
+    sky = SatTrack(3, ('snr',))
+    sky.append(1, [3], snr=[40.0])
+    try:
+        sky.append(1, [4], snr=[41.0])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Repeated epoch accepted")
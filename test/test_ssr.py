@@ -0,0 +1,71 @@
+"""
+Test to check the SSR correction cache (RTCM3 SSR).
+
+"""
+import gzip
+
+import bitstruct as bs
+import numpy as np
+
+from cssrlib.cssrlib import sCType
+from cssrlib.gnss import gpst2time, timeadd, prn2sat, uGNSS
+
+from src.ntrip import rtcm_frame
+from src.ssr import SsrCache, SsrReader
+
+
+T0 = gpst2time(2276, 100000.0)
+
+
+def msg1060(tow, prns, dclk, iodssr=1):
+    """
+    GPS combined orbit and clock correction, radial correction = clock [m].
+    """
+    n = len(prns)
+    fmt = 'u12u20u4u1u1u4u16u4u6' + 'u6u8s22s20s20s21s19s19s22s21s27'*n
+    val = [1060, int(tow), 2, 0, 0, iodssr, 10, 0, n]
+    for prn in prns:
+        val += [prn, 10, int(dclk/0.1e-3), 0, 0, 0, 0, 0, int(dclk/0.1e-3), 0, 0]
+    return rtcm_frame(bs.pack(fmt, *val))
+
+
+def record(path, nep=12, dt=5):
+    data = b''.join(msg1060(100000 + k*dt, [5, 13], 0.01*k) for k in range(nep))
+    with gzip.open(path, 'wb') as fh:
+        fh.write(data)
+
+
+def test_cache_lookup():
+    cache = SsrCache(tref=T0, validity={sCType.CLOCK: 12.0})
+    for k in range(4):
+        cache.decode(msg1060(100000 + 5*k, [5, 13], 0.01*k))
+
+    sat = prn2sat(uGNSS.GPS, 13)
+    cs = cache.at(timeadd(T0, 7.0)) # NOTE: latest <= t is 100005
+    assert cs is not None
+    assert abs(cs.lc[0].dclk[sat] - 0.01) < 1e-4
+    assert sat in cs.sat_n and cs.iodssr == 1
+
+    cs = cache.at(timeadd(T0, 15.0))
+    assert abs(cs.lc[0].dclk[sat] - 0.03) < 1e-4
+
+    assert cache.at(timeadd(T0, -1.0)) is None      # before the first correction
+    assert cache.at(timeadd(T0, 40.0)) is None      # clock expired
+    cs = cache.at(timeadd(T0, 2.0))                 # back in time
+    assert abs(cs.lc[0].dclk[sat] - 0.0) < 1e-4
+
+
+def test_reader(tmp_path):
+    path = str(tmp_path / 'ssr.rtcm3.gz')
+    record(path)
+    reader = SsrReader(path, validity={sCType.ORBIT: 10.0, sCType.CLOCK: 10.0})
+    reader.CHUNK = 64 # NOTE: the file is read on demand
+    sat = prn2sat(uGNSS.GPS, 5)
+    for k in range(11):
+        cs = reader.at(timeadd(T0, 5*k + 1))
+        assert cs is not None
+        np.testing.assert_allclose(cs.lc[0].dorb[sat][0], 0.01*k, atol=1e-4)
+        if k == 0:
+            assert not reader.eof
+    assert len(reader.cache) <= 2*3 # NOTE: expired corrections evicted
+    reader.close()
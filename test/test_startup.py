@@ -0,0 +1,34 @@
+"""
+Test to check the startup time of the CLI, the heavy dependencies are only imported by the branches that use them.
+
+The budget of a cold `python Commands.py -printhelp` can be changed with STARTUP_BUDGET [s] (slow machines, CI).
+"""
+import os
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET = float(os.environ.get('STARTUP_BUDGET', 1.0))
+HEAVY = ['matplotlib', 'pandas', 'scipy', 'seaborn', 'folium', 'IPython', 'simplekml', 'pymap3d',
+         'serial', 'pyubx2', 'cssrlib.pppssr', 'cssrlib.rtk', 'src.PPPsolution', 'src.RTKsolution']
+
+
+def _run(*args):
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True, text=True, timeout=60)
+    assert out.returncode == 0, out.stderr
+    return time.perf_counter() - t0, out.stdout
+
+
+def test_printhelp_budget():
+    # NOTE: best of 3 runs, the first one can pay the .pyc compilation
+    elapsed = min(_run('Commands.py', '-printhelp')[0] for _ in range(3))
+    assert elapsed < BUDGET, "-printhelp took {:.2f} s (budget {:.2f} s)".format(elapsed, BUDGET)
+
+
+def test_no_heavy_imports():
+    _, out = _run('-c', "import sys, Commands; print(' '.join(sorted(sys.modules)))")
+    loaded = set(out.split())
+    assert [name for name in HEAVY if name in loaded] == []
@@ -0,0 +1,105 @@
+"""
+Test to check the streaming decoders for compressed (.gz, .Z) and Hatanaka (.crx) files.
+
+"""
+import gzip
+
+from src.streams import open_text, open_product, is_crx, strip_compression
+
+
+CRX = """\
+3.0                 COMPACT RINEX FORMAT                    CRINEX VERS   / TYPE
+RNX2CRX ver.4.0.8                       08-Apr-21 06:56     CRINEX PROG / DATE
+     3.01           OBSERVATION DATA    M (MIXED)           RINEX VERSION / TYPE
+G    7 L1C L2P C1P C2P C1C S1P S2P                          SYS / # / OBS TYPES
+R    3 L1C C1C S1C                                          SYS / # / OBS TYPES
+S    3 L1C C1C S1C                                          SYS / # / OBS TYPES
+  2010     3     5     0     0     0.0000000     GPS        TIME OF FIRST OBS
+                                                            END OF HEADER
+> 2010 03 05 00 00 30.0000000  0 8       G13R19G32G 7R23G31G20R11
+
+3&130321269801 3&101549030349 3&24799319672 3&24799319752 3&24799318768 3&62000 3&80000 0808&9&9&7&&&&
+3&129262004577 3&24597748629 3&47000 08&7&&
+3&133135049387 3&103741584182 3&25334766349 3&25334768879 3&25334766309 3&75000 3&83000 0808&9&9&7&&&&
+3&133174968818 3&103772690977 3&25342359815 3&25342359952 3&25342359370 3&65000 3&45000 0808&9&9&7&&&&
+3&119323293479 3&22706470024 3&79000 08&7&&
+3&114311363565 3&92979182851 3&21752728352 3&21752728204 3&21752729338 3&72000 3&63000 0808&9&9&7&&&&
+3&135891004299 3&105889081832 3&25859215981 3&25859207736 3&25859205875 3&44000 3&46000 0808&9&9&7&&&&
+3&131986783861 3&25116253066 3&38000 08&7&&
+"""
+
+RNX = """\
+     3.01           OBSERVATION DATA    M (MIXED)           RINEX VERSION / TYPE
+G    7 L1C L2P C1P C2P C1C S1P S2P                          SYS / # / OBS TYPES
+R    3 L1C C1C S1C                                          SYS / # / OBS TYPES
+S    3 L1C C1C S1C                                          SYS / # / OBS TYPES
+  2010     3     5     0     0     0.0000000     GPS        TIME OF FIRST OBS
+                                                            END OF HEADER
+> 2010 03 05 00 00 30.0000000  0 8
+G13 130321269.80108 101549030.34908  24799319.672 9  24799319.752 9  24799318.768 7        62.000          80.000
+R19 129262004.57708  24597748.629 7        47.000
+G32 133135049.38708 103741584.18208  25334766.349 9  25334768.879 9  25334766.309 7        75.000          83.000
+G 7 133174968.81808 103772690.97708  25342359.815 9  25342359.952 9  25342359.370 7        65.000          45.000
+R23 119323293.47908  22706470.024 7        79.000
+G31 114311363.56508  92979182.85108  21752728.352 9  21752728.204 9  21752729.338 7        72.000          63.000
+G20 135891004.29908 105889081.83208  25859215.981 9  25859207.736 9  25859205.875 7        44.000          46.000
+R11 131986783.86108  25116253.066 7        38.000
+"""
+
+# NOTE: CRX compressed with Unix compress (ncompress 4.2)
+CRX_Z = bytes.fromhex(
+    '1f9d90335cc00041b0a0c18304873c690225c8102a20a4247152040b08234fa434090211a14784432452b468a5889429'
+    '055f80a092054a1105529c609111d2a29d32725cd010e802c7c79f0861e06811048e9c16326280806143470d1b07434e'
+    'ac08028a94274740a824c2f1e5c1803094027d22648a492b1c933c7102822b9520069b8040d1240996224452008d3895'
+    'a4c9296ad9aa64e95241d682374030893144b10c282086c4803ce47164c620a64cce6c79af678253b2a05439422b08b2'
+    '2809179902d3e00cc5982537d6dcf8b36ddba1478328ad12f5ca96ab15a02cf87a7163d99931df5e0e34b769dea7cbfe'
+    '76c99aa08cb0035d1fac71307b41ef0461088441befcc123508623a492a44991d3462e26390911b502e6f8f3232ce284'
+    '087c1048141104112629e00308d7c530100cafc1c01d794b0d348378e555181e083e2174440c334811430e47cc204356'
+    '374821c30c21c670c4751ec6a080023398c0218349c960430e388405428c0ac650030d3930c820903b9a20030d37e490'
+    'c30c1fda70830c451e99e4921fde500394314aa9249338dc60834f31da701d8431e6689e50429990839a26dc60c29b26'
+    'c028a30c39d838260d35dc90589678e6a0270d3888994391489e89439b6fcac9219333d4000390337459a48233dc4083'
+    '8f385c8a039646d630c30c48da6003a88366e929a85ee2d065a99d7e1aeaa830b06aa579654e08219a87aeb9a69b702a'
+    'fa690c96e6f0250e31802923837ada18a49f7bb64ac38935e0e863949e3edba89257520b2ab44bde20a10936384aa609'
+    '781a9aa6ae88f6cae387228ab82492acca2083b736140ac39145266968ba8ac64003931c8efa147731d6e9670ec5ca80'
+    '430d4a6509ec954fe2d028a7495939afc2d7d110e5c3172f1969be637e0bebad39e6ca26af89f2d8280e0893f7ac9293'
+    '3aa86a90c44a4c710d0bd7e9a3b4d4e67c9d9e334065aacf325b49280db4926b83b926ef0a679c2a7f18e80d1207da70'
+    'a731c420a6a74c096d42a4fbf2aa00'
+)
+
+
+def lines(fh):
+    with fh:
+        return [line.rstrip() for line in fh]
+
+
+def test_names():
+    assert strip_compression('COD0MGXFIN_20232230000_01D_05M_ORB.SP3.gz') == 'COD0MGXFIN_20232230000_01D_05M_ORB.SP3'
+    assert strip_compression('brdc2230.23n.Z') == 'brdc2230.23n'
+    assert is_crx('SEPT00ESP_R_20232230000_01D_30S_MO.crx.gz')
+    assert is_crx('sept2230.23d.Z')
+    assert not is_crx('sept2230.23o')
+
+
+def test_crx(tmp_path):
+    path = tmp_path / 'sample.crx'
+    path.write_text(CRX)
+    assert lines(open_text(str(path))) == RNX.splitlines()
+
+
+def test_crx_gz(tmp_path):
+    path = tmp_path / 'sample.crx.gz'
+    path.write_bytes(gzip.compress(CRX.encode()))
+    assert lines(open_text(str(path))) == RNX.splitlines()
+
+
+def test_crx_lzw(tmp_path):
+    path = tmp_path / 'sample.crx.Z'
+    path.write_bytes(CRX_Z)
+    assert lines(open_text(str(path))) == RNX.splitlines()
+
+
+def test_product_pipe(tmp_path):
+    path = tmp_path / 'sample.rnx.Z'
+    path.write_bytes(CRX_Z)  # NOTE: named as RINEX, the CRX text is passed as is
+    with open(open_product(str(path)), 'r') as fh:
+        assert fh.read() == CRX
@@ -0,0 +1,89 @@
+"""
+Test to check the kinematic trajectory evaluation against the per-epoch cssrlib conversions.
+
+"""
+import numpy as np
+
+from cssrlib.gnss import ecef2enu, ecef2pos, xyz2enu, pos2ecef, time2str, gtime_t
+
+from src.trajectory import Evaluation, align, evaluate, llh2ecef, log_time, read_trajectory
+
+
+def _drive(n=600, dt=1.0):
+    """
+    Reference going east at 10 m/s, then north (ECEF), epochs from 2023-08-11 21:00:00.
+    """
+    t = 1691787600.0 + np.arange(n) * dt
+    pos0 = np.array([np.deg2rad(40.4), np.deg2rad(-3.7), 650.0])
+    enu = np.zeros((n, 3))
+    half = n // 2
+    enu[:half, 0] = 10.0 * (t[:half] - t[0])
+    enu[half:, 0] = enu[half - 1, 0]
+    enu[half:, 1] = 10.0 * (t[half:] - t[half - 1])
+    xyz = np.array([pos2ecef(pos0) + xyz2enu(pos0).T @ e for e in enu])
+    return t, xyz
+
+
+def test_errors_against_cssrlib():
+    tref, xyzref = _drive()
+    # NOTE: solution at the middle of the reference epochs, 1 m to the left and 0.5 m ahead, 0.2 m up
+    t = tref[:-1] + 0.5
+    ref, _ = align(t, tref, xyzref)
+    xyz = np.empty_like(ref)
+    for i in range(len(t)):
+        pos = ecef2pos(ref[i])
+        going_east = i < len(t) // 2 - 1
+        off = np.array([0.5, 1.0, 0.2]) if going_east else np.array([-1.0, 0.5, 0.2])
+        xyz[i] = ref[i] + xyz2enu(pos).T @ off
+
+    ev = Evaluation(t, xyz, tref, xyzref, smode=np.where(np.arange(len(t)) % 2 == 0, 4, 5))
+    for i in range(0, len(t), 37):
+        assert np.allclose(ev.enu[i], ecef2enu(ecef2pos(ref[i]), xyz[i] - ref[i]), atol=1e-6)
+
+    turn = len(t) // 2 - 1      # NOTE: the epoch between the two legs is neither east nor north
+    moving = np.ones(len(t), dtype=bool)
+    moving[turn] = False
+    assert np.allclose(ev.along[moving], 0.5, atol=1e-3)
+    assert np.allclose(ev.cross[moving], 1.0, atol=1e-3)
+    assert np.allclose(ev.enu[:, 2], 0.2, atol=1e-3)
+
+    res = ev.stats()
+    assert res['hor']['n'] == len(t)
+    assert abs(res['hor']['rms'] - np.hypot(0.5, 1.0)) < 1e-3
+    assert ev.stats(mode=4)['e']['n'] == (len(t) + 1) // 2
+
+    # NOTE: epochs out of the reference or over a gap are not evaluated
+    ev = Evaluation(np.array([tref[0] - 10.0, tref[5] + 0.5]), xyzref[[0, 5]], np.delete(tref, 6), np.delete(xyzref, 6, axis=0))
+    assert not ev.valid.any()
+    assert ev.stats()['hor']['n'] == 0
+
+
+def test_files(tmp_path):
+    tref, xyzref = _drive(n=120, dt=0.5)
+
+    # NOTE: reference as RTKLIB .pos (latitude/longitude in degrees), solution as an engine log
+    pos = tmp_path / 'ref.pos'
+    with open(pos, 'w') as fh:
+        fh.write("% program   : RTKPOST\n%  GPST                  latitude(deg) longitude(deg)  height(m)   Q  ns\n")
+        for t, xyz in zip(tref, xyzref):
+            llh = ecef2pos(xyz)
+            frac = t - np.floor(t)
+            date = time2str(gtime_t(int(t), 0.0)).replace('-', '/')
+            fh.write("{}.{:03d} {:14.9f} {:14.9f} {:10.4f} 1 10\n".format(date, int(round(frac * 1000)), np.rad2deg(llh[0]), np.rad2deg(llh[1]), llh[2]))
+    assert np.allclose(llh2ecef(np.array([ecef2pos(xyzref[3])])), xyzref[3], atol=1e-6)
+
+    # NOTE: sub-second epochs (2 Hz) written as the engines do, none of them is merged with the previous one
+    log = tmp_path / 'ppp-igs.log'
+    with open(log, 'w') as fh:
+        fh.write("Minimum elevation: 10\n")
+        for t, xyz in zip(tref, xyzref):
+            sol = xyz + [0.3, -0.4, 0.0]
+            fh.write("{} Sol: [{:14.4f}, {:14.4f}, {:14.4f}] ENU: [    nan,     nan,     nan] ZTD: [0.0000000] mode [4]\n"
+                     .format(log_time(gtime_t(int(t), t - int(t))), *sol))
+    assert np.allclose(read_trajectory(str(log))[0], tref)
+    assert log_time(gtime_t(1691787600, 0.9996)) == '2023-08-11 21:00:01.000'
+
+    ev = evaluate(str(log), str(pos))
+    assert ev.valid.all() and len(ev.t) == len(tref)
+    assert np.allclose(ev.err3d, 0.5, atol=1e-3)
+    assert "mode 4" in ev.summary()
@@ -0,0 +1,63 @@
+"""
+Test to check the troposphere SINEX reader (IGS final ZTD of AIRA, 2023-08-11).
+
+"""
+import numpy as np
+
+from cssrlib.gnss import epoch2time
+
+from src.tropo import TroSinex, sinex_epoch
+
+
+TRO = 'data/rinex/file_creator/IGS0OPSFIN_20232230000_01D_05M_AIRA00JPN_TRO.TRO'
+T0 = epoch2time([2023, 8, 11, 0, 0, 0]).time
+
+
+def day2(path):
+    """
+    Same file one day later and with another station name.
+    """
+    with open(TRO) as fh:
+        txt = fh.read()
+    path.write_text(txt.replace(' AIRA 23:223:', ' AIRB 23:224:').replace(' AIRA  A ', ' AIRB  A '))
+    return str(path)
+
+
+def test_epoch():
+    assert sinex_epoch(23, 223, 0)[()] == T0
+    np.testing.assert_array_equal(sinex_epoch([23, 99], [1, 365], [0, 86399]),
+                                  [epoch2time([2023, 1, 1, 0, 0, 0]).time, epoch2time([1999, 12, 31, 23, 59, 59]).time])
+
+
+def test_interp():
+    tro = TroSinex(TRO)
+    assert tro.stations() == ['AIRA']
+    assert tro.span('AIRA') == (T0, T0 + 86100.0)
+
+    ztd, std = tro.interp('AIRA', T0 + np.array([0.0, 150.0, 600.0, -1.0, 20000.0, 86100.0]))
+    np.testing.assert_allclose(ztd[:3], [2.4626, 2.46275, 2.4642], atol=1e-5)
+    assert np.isnan(ztd[3]) and np.isfinite(ztd[4])
+    np.testing.assert_allclose(ztd[5], 2.4387, atol=1e-5)
+    np.testing.assert_allclose(std[0], 0.0034, atol=1e-6)
+
+    tro.maxgap = 200.0 # NOTE: 5 min solutions, only the nodes
+    ztd, _ = tro.interp('AIRA', T0 + np.array([150.0, 300.0]))
+    assert np.isnan(ztd[0]) and np.isfinite(ztd[1])
+
+    stats = tro.validate('AIRA', T0 + np.array([0.0, 300.0, 600.0]), [2.4726, 2.4729, 2.4742])
+    assert stats['n'] == 3
+    np.testing.assert_allclose(stats['bias'], 0.01, atol=1e-5)
+
+
+def test_multi(tmp_path):
+    tro = TroSinex([TRO, day2(tmp_path / 'day2.TRO')])
+    assert tro.stations() == ['AIRA', 'AIRB']
+    i, j = tro.index['AIRB']
+    assert np.all(np.diff(tro.t[i:j]) > 0)
+    assert tro.span('AIRB')[0] == T0 + 86400.0
+    assert tro.nearest([-3530185.974, 4118797.182, 3344036.645]) in ('AIRA', 'AIRB')
+    assert tro.nearest([0.0, 0.0, 6371000.0]) is None
+
+    # NOTE: the same file twice doesn't duplicate the epochs
+    tro.read(TRO)
+    assert tro.index['AIRA'][1] - tro.index['AIRA'][0] == j - i
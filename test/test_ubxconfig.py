@@ -0,0 +1,112 @@
+"""
+Test to check the receiver configuration (commands per generation, pipelined ACK/NAK and baud rate steps),
+with a simulated receiver.
+
+"""
+import struct
+import time
+
+import pytest
+from pyubx2 import UBXReader, SET
+
+from src.discover import frame, MON_VER_POLL
+from src.ubxconfig import plan, required_baud, configure, Pipeline
+from src.ubxfilter import Framer
+
+
+class FakeReceiver():
+    """
+    Answers every command after rtt seconds, one command every proc seconds (in order), as a receiver.
+    Rejects the commands of class/id in reject (NAK), loses the first ACK of lose and doesn't go above maxbaud.
+    """
+    def __init__(self, rtt=0.05, proc=0.002, reject=(), lose=(), maxbaud=460800):
+        self.baudrate = 115200
+        self.rx_baud = 115200
+        self.rtt, self.proc = rtt, proc
+        self.reject, self.lose = set(reject), set(lose)
+        self.maxbaud = maxbaud
+        self.framer = Framer()
+        self.queue = []             # (time, bytes)
+        self.last = 0.0
+        self.received = []
+
+    def _answer(self, data, delay=None):
+        now = time.monotonic()
+        self.last = max(now + (self.rtt if delay is None else delay), self.last + self.proc)
+        self.queue.append((self.last, data))
+
+    def write(self, data):
+        if self.baudrate != self.rx_baud:
+            return
+        buf, offs, lens, cls, mid = self.framer.feed(data)
+        for o, n in zip(offs, lens):
+            f = buf[o:o + 8 + n]
+            if f == MON_VER_POLL:
+                self._answer(frame(0x0A, 0x04, bytes(40)))
+                continue
+            key = (f[2], f[3])
+            self.received.append(key)
+            if key in self.lose:
+                self.lose.discard(key)
+                continue
+            baud = None
+            if key == (0x06, 0x8A) and f[10:14] == struct.pack('<I', 0x40520001):
+                baud = struct.unpack('<I', f[14:18])[0]
+            ack = key not in self.reject and (baud is None or baud <= self.maxbaud)
+            self._answer(frame(0x05, 0x01 if ack else 0x00, bytes(key)))
+            if baud and ack:
+                self.rx_baud = baud
+
+    def read(self, n):
+        if self.baudrate != self.rx_baud:
+            time.sleep(0.005)
+            return b'\xff\x00' * 4
+        now = time.monotonic()
+        out = b''.join(d for t, d in self.queue if t <= now)
+        self.queue = [(t, d) for t, d in self.queue if t > now]
+        if not out:
+            time.sleep(0.002)
+        return out
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.queue = []
+
+
+def test_plan():
+    frames = plan('F9P', 10, 'UART1')
+    msgs = [UBXReader.parse(f, msgmode=SET) for f in frames]
+    assert all(m.identity == 'CFG-VALSET' for m in msgs)
+    assert msgs[0].CFG_UART1OUTPROT_NMEA == 0 and msgs[1].CFG_MSGOUT_UBX_NAV_PVT_UART1 == 0
+    assert msgs[2].CFG_RATE_MEAS == 100 and msgs[2].CFG_MSGOUT_UBX_RXM_RAWX_UART1 == 1
+
+    msgs = [UBXReader.parse(f, msgmode=SET) for f in plan('M8T', 5, 'USB')]
+    assert msgs[0].identity == 'CFG-PRT' and msgs[0].outNMEA == 0 and msgs[0].outUBX == 1
+    assert [m.identity for m in msgs[-3:]] == ['CFG-RATE', 'CFG-MSG', 'CFG-MSG'] and msgs[-3].measRate == 200
+
+    assert required_baud(1) == 115200 and required_baud(10) == 460800
+    with pytest.raises(ValueError):
+        plan('M8T', 20)
+    with pytest.raises(ValueError):
+        plan('LEA-6T')
+
+
+def test_pipeline_and_baud():
+    # NOTE: 17 commands of a M8, one round trip instead of one per command
+    rx = FakeReceiver(rtt=0.05, reject={(0x06, 0x08)}, lose={(0x06, 0x00)})
+    frames = plan('M8T', 10, 'USB')
+    t0 = time.monotonic()
+    results = Pipeline(rx, window=8, timeout=0.3).send(frames)
+    assert time.monotonic() - t0 < 0.3 + 4 * rx.rtt
+    assert results[0] == 'ACK' and rx.received.count((0x06, 0x00)) == 2       # NOTE: lost ACK, sent again
+    assert results[-3] == 'NAK' and results.count('ACK') == len(frames) - 1
+
+    # NOTE: 10 Hz over UART1 needs 460800, the receiver doesn't work at 921600
+    rx = FakeReceiver(rtt=0.01, maxbaud=460800)
+    result = configure(rx, 'F9P', rate=10, port='UART1', timeout=0.2)
+    assert result['ok'] and result['baud'] == 460800 == rx.rx_baud
+    rx = FakeReceiver(rtt=0.01, maxbaud=230400)
+    result = configure(rx, 'F9P', rate=10, port='UART1', baud=921600, timeout=0.2)
+    assert result['baud'] == 230400 == rx.rx_baud
@@ -0,0 +1,83 @@
+"""
+Test to check the streaming UBX filter (framing across chunks, split by time and size).
+
+"""
+import io
+import os
+import shutil
+
+import numpy as np
+from pyubx2 import UBXReader
+
+from src.ubxfilter import Framer, filter_file, filter_files, keys
+from src.ubxindex import UbxIndex, scan
+
+
+UBXFILE = 'data/ublox/datos_fuera_correctos.ubx'
+
+
+def test_stream_frames():
+    with open(UBXFILE, 'rb') as fh:
+        full = fh.read()
+    offs, lens, _ = scan(full)
+    frames = b''.join(full[o:o + 8 + n] for o, n in zip(offs, lens))
+
+    # NOTE: chunks of any size, the frames cut between two chunks are found in the next one
+    rng = np.random.default_rng(1)
+    framer, out, pos = Framer(), [], 0
+    while pos < len(full):
+        n = int(rng.integers(1, 5000))
+        out.append(framer.filter(full[pos:pos + n]))
+        pos += n
+    assert b''.join(out) == frames and framer.close() == len(full) - len(frames)
+
+    framer = Framer()
+    raw = framer.filter(full, keys(['RXM-RAWX']))
+    assert [parsed.identity for _, parsed in UBXReader(io.BytesIO(raw))] == ['RXM-RAWX'] * 850
+
+
+def test_false_sync_at_end(tmp_path):
+    # NOTE: a false sync whose length runs past the end of the capture, the frames after it are kept
+    with open(UBXFILE, 'rb') as fh:
+        full = fh.read()
+    offs, lens, _ = scan(full)
+    raw = [full[o:o + 8 + n] for o, n in zip(offs, lens) if full[o + 2:o + 4] == b'\x02\x15'][-5:]
+    path = tmp_path / 'end.ubx'
+    path.write_bytes(b''.join(raw[:2]) + b'\xb5\x62\x01\x07\xff\xff' + b''.join(raw[2:]))
+    stats = filter_file(str(path), str(tmp_path / 'out'), chunk=1000)
+    assert stats['counts'] == {'RXM-RAWX': 5} and stats['skipped'] == 6
+
+
+def test_split(tmp_path):
+    idx = UbxIndex.load(UBXFILE, cache=False)
+    sel = idx.select(['RXM-RAWX', 'RXM-SFRBX'])
+
+    stats = filter_file(UBXFILE, str(tmp_path / 'time'), window=300, chunk=10000)
+    assert stats['kept'] == len(sel) and stats['counts'] == {'RXM-RAWX': 850, 'RXM-SFRBX': 5899}
+    assert [os.path.basename(f) for f in stats['files']][0] == 'datos_fuera_correctos_20240113_105000.ubx'
+    assert not [f for f in os.listdir(tmp_path / 'time') if f.endswith('.part')]
+
+    # NOTE: every file has the frames of its window, in order, and they are valid UBX
+    n = 0
+    for name in stats['files']:
+        part = UbxIndex.load(name, cache=False)
+        assert set(part.counts()) <= {'RXM-RAWX', 'RXM-SFRBX'}
+        tp = part.times()
+        ok = np.isfinite(tp)
+        assert (np.floor(tp[ok] / 300) == np.floor(np.nanmax(tp) / 300)).all()
+        with open(name, 'rb') as fh:
+            assert fh.read() == b''.join(idx.raw(k) for k in sel[n:n + len(part)])
+        n += len(part)
+        part.close()
+    assert n == len(sel)
+
+    # NOTE: split by size, two captures in parallel
+    copy = str(tmp_path / 'copy.ubx')
+    shutil.copy(UBXFILE, copy)
+    maxsize = 200000
+    results = filter_files([UBXFILE, copy], str(tmp_path / 'size'), jobs=2, keep=None, maxsize=maxsize)
+    for stats in results.values():
+        sizes = [os.path.getsize(f) for f in stats['files']]
+        assert len(sizes) > 1 and max(sizes) <= maxsize and sum(sizes) == stats['written']
+        assert stats['kept'] == len(idx)
+    idx.close()
@@ -0,0 +1,81 @@
+"""
+Test to check the UBX capture index (framing, checksums, times, cache and extraction).
+
+"""
+import shutil
+
+import numpy as np
+from pyubx2 import UBXReader
+
+from src.ubxindex import UbxIndex, scan
+
+
+UBXFILE = 'data/ublox/datos_fuera_correctos.ubx'
+
+
+def test_capture(tmp_path):
+    path = tmp_path / 'capture.ubx'
+    shutil.copy(UBXFILE, path)
+
+    idx = UbxIndex.load(str(path))
+    counts = idx.counts()
+    assert counts['RXM-RAWX'] == 850 and counts['RXM-SFRBX'] == 5899 and counts['NAV-PVT'] == 845
+    assert idx.end == path.stat().st_size
+    assert (tmp_path / 'capture.ubx.idx.npz').is_file()
+
+    # NOTE: the time of the index is the receiver time of pyubx2
+    k = idx.select(['RXM-RAWX'])[10]
+    msg = idx.parse(k)
+    assert msg.identity == 'RXM-RAWX' and idx.tow[k] == msg.rcvTow and idx.week[k] == msg.week
+
+    cached = UbxIndex.load(str(path))
+    assert np.array_equal(cached.offset, idx.offset) and np.array_equal(cached.times(), idx.times(), equal_nan=True)
+
+    # NOTE: one minute of raw data, a valid UBX file with only those messages
+    t0 = idx.times()[k]
+    sel = idx.select(['RXM-RAWX', 'RXM-SFRBX'], t0, t0 + 60.0)
+    out = tmp_path / 'window.ubx'
+    idx.extract(sel, str(out))
+    idx.close()
+    with open(out, 'rb') as fh:
+        names = [parsed.identity for _, parsed in UBXReader(fh)]
+    assert len(names) == len(sel) and names.count('RXM-RAWX') == 60 and set(names) == {'RXM-RAWX', 'RXM-SFRBX'}
+    assert UbxIndex.load(str(out), cache=False).seek(t0 + 30.0) > 0
+
+
+def test_resync_and_growth(tmp_path):
+    with open(UBXFILE, 'rb') as fh:
+        full = fh.read()
+    offs, lens, _ = scan(full)
+    k = 60 + int(np.argmax(lens[60:] > 100))
+    cut = int(offs[k]) + 20
+    data = full[:cut]
+    offs, lens, pos = scan(data)
+    assert offs[0] == 0 and len(offs) == k and pos == cut - 20     # NOTE: the incomplete frame is not consumed
+
+    # NOTE: noise, a NMEA sentence and a corrupted frame are skipped, the next frames are found
+    bad = bytearray(data[:pos])
+    bad[int(offs[2]) + 10] ^= 0xFF
+    buf = b'\xb5\x00noise$GNGGA,,,*00\r\n' + bytes(bad)
+    o, l, p = scan(buf)
+    assert len(o) == len(offs) - 1 and p == len(buf)
+    assert list(np.diff(o[:3])) != list(np.diff(offs[:3]))
+
+    # NOTE: a false sync near the end, its length runs past the data, the frames after it are found
+    good = full[:int(offs[5])]
+    buf = good + b'\xb5\x62\x01\x07\xff\xff' + good
+    o, l, p = scan(buf)
+    assert len(o) == 10 and p == len(buf)
+    o, l, p = scan(good + good[:int(offs[4]) + 3])     # NOTE: a real incomplete frame is still kept
+    assert len(o) == 9 and p == len(good) + int(offs[4])
+
+    # NOTE: a capture that grows is only scanned from the last indexed frame
+    path = tmp_path / 'live.ubx'
+    path.write_bytes(data)
+    idx = UbxIndex.load(str(path))
+    n = len(idx)
+    with open(path, 'ab') as out:
+        out.write(full[cut:cut + 20000])
+    grown = UbxIndex.load(str(path))
+    assert np.array_equal(grown.offset[:n], idx.offset) and len(grown) > n
+    assert np.array_equal(grown.offset, UbxIndex.load(str(path), cache=False).offset)